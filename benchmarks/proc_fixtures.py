@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Синтетическое дерево /proc для бенчмарков сборщиков
+build_proc_tree() создает net/tcp, tcp6, udp, udp6, icmp, snmp, dev, stat и
+каталоги процессов (<pid>/stat, comm, cmdline, status, exe, fd/* -> socket:[inode])
+в форматах ядра Linux. После psutil.PROCFS_PATH = root сборщики (psutil,
+трекеры UDP/ICMP) читают синтетическое дерево вместо настоящего /proc
+"""
+
+import os
+import random
+import socket
+import struct
+from typing import Any, Dict, List
+
+BOOT_TIME = 1700000000
+TCP_HEADER = ("  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt"
+              "   uid  timeout inode\n")
+TCP6_HEADER = ("  sl  local_address                         remote_address                        st"
+               " tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n")
+TCP_ESTABLISHED = '01'
+TCP_LISTEN = '0A'
+UDP_UNCONNECTED = '07'
+UDP_ESTABLISHED = '01'
+PROCESS_NAMES = ('nginx', 'postgres', 'envoy', 'java', 'python3', 'redis-server', 'sshd', 'node')
+
+
+def _hex_v4(address: str, port: int) -> str:
+    # Адрес хранится как 32-битное слово в порядке байт хоста (little-endian)
+    packed = socket.inet_aton(address)
+    return f"{struct.unpack('<I', packed)[0]:08X}:{port:04X}"
+
+
+def _hex_v6(address: str, port: int) -> str:
+    # Четыре 32-битных слова, каждое в порядке байт хоста
+    packed = socket.inet_pton(socket.AF_INET6, address)
+    return ''.join(f"{word:08X}" for word in struct.unpack('<4I', packed)) + f":{port:04X}"
+
+
+def _socket_line(index: int, local: str, remote: str, state: str, inode: int) -> str:
+    return (f"{index:4d}: {local} {remote} {state} 00000000:00000000 00:00000000 00000000"
+            f"  1000        0 {inode} 1 0000000000000000 100 0 0 10 0\n")
+
+
+def _remote_v4(rng: random.Random, index: int) -> str:
+    # Смесь частных подсетей и публичных адресов (облака, CDN)
+    if index % 3 == 0:
+        return f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+    return f"{rng.choice((34, 52, 104, 151, 185))}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+
+
+def build_proc_tree(root: str, sockets: int, processes: int = 50, listen_ports: int = 40,
+                    udp_share: float = 0.2, ipv6_share: float = 0.1, seed: int = 0) -> Dict[str, Any]:
+    """
+    Создает дерево с sockets сокетами, распределенными по processes процессам;
+    возвращает сводку (число сокетов по таблицам, pid процессов)
+    """
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(root, 'net'), exist_ok=True)
+    tables: Dict[str, List[str]] = {'tcp': [], 'tcp6': [], 'udp': [], 'udp6': []}
+    owners: Dict[int, List[int]] = {}
+    pids = [1000 + i for i in range(processes)]
+    inode = 100000
+
+    def add(table: str, local: str, remote: str, state: str, pid: int):
+        nonlocal inode
+        inode += 1
+        tables[table].append(_socket_line(len(tables[table]), local, remote, state, inode))
+        owners.setdefault(pid, []).append(inode)
+
+    any_v4 = '00000000:0000'
+    for port_index in range(listen_ports):
+        pid = pids[port_index % processes]
+        add('tcp', _hex_v4('0.0.0.0', 1000 + port_index * 7), any_v4, TCP_LISTEN, pid)
+
+    for index in range(max(0, sockets - listen_ports)):
+        pid = pids[index % processes]
+        local_port = 32768 + index % 28000
+        if rng.random() < udp_share:
+            if index % 4 == 0:
+                add('udp', _hex_v4('0.0.0.0', 5000 + index % 500), any_v4, UDP_UNCONNECTED, pid)
+            else:
+                add('udp', _hex_v4('10.0.0.5', local_port), _hex_v4(_remote_v4(rng, index), 53 if index % 2 else 123),
+                    UDP_ESTABLISHED, pid)
+        elif rng.random() < ipv6_share:
+            add('tcp6', _hex_v6('2001:db8::5', local_port),
+                _hex_v6(f"2001:db8:{rng.randrange(65536):x}::{rng.randrange(1, 65535):x}", 443), TCP_ESTABLISHED, pid)
+        elif index % 5 == 0:
+            # Входящее соединение на слушающий порт
+            service = 1000 + (index % listen_ports) * 7 if listen_ports else 443
+            add('tcp', _hex_v4('10.0.0.5', service), _hex_v4(_remote_v4(rng, index), local_port), TCP_ESTABLISHED, pid)
+        else:
+            add('tcp', _hex_v4('10.0.0.5', local_port),
+                _hex_v4(_remote_v4(rng, index), rng.choice((443, 443, 80, 5432, 6379, 8080))), TCP_ESTABLISHED, pid)
+
+    for name, lines in tables.items():
+        header = TCP6_HEADER if name.endswith('6') else TCP_HEADER
+        with open(os.path.join(root, 'net', name), 'w') as f:
+            f.write(header)
+            f.writelines(lines)
+
+    with open(os.path.join(root, 'net', 'icmp'), 'w') as f:
+        f.write(TCP_HEADER)
+        for index in range(min(20, sockets // 50 + 1)):
+            f.write(_socket_line(index, _hex_v4('10.0.0.5', 0), _hex_v4(_remote_v4(rng, index), 0), '07', 0))
+    with open(os.path.join(root, 'net', 'snmp'), 'w') as f:
+        f.write("Icmp: InMsgs InErrors InCsumErrors InDestUnreachs InTimeExcds InEchos InEchoReps OutMsgs OutErrors "
+                "OutDestUnreachs OutEchos OutEchoReps\n")
+        f.write(f"Icmp: {sockets} 0 0 12 0 {sockets // 2} {sockets // 2} {sockets} 0 3 {sockets // 2} {sockets // 2}\n")
+    with open(os.path.join(root, 'net', 'dev'), 'w') as f:
+        f.write("Inter-|   Receive                                                |  Transmit\n")
+        f.write(" face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo "
+                "colls carrier compressed\n")
+        for name in ('lo', 'eth0'):
+            f.write(f"{name:>6}: {sockets * 1500} {sockets * 10} 0 0 0 0 0 0 {sockets * 900} {sockets * 8} 0 0 0 0 0 0\n")
+    with open(os.path.join(root, 'stat'), 'w') as f:
+        f.write("cpu  100 0 100 1000 0 0 0 0 0 0\ncpu0 100 0 100 1000 0 0 0 0 0 0\n")
+        f.write(f"btime {BOOT_TIME}\nprocesses {processes}\nprocs_running 1\nprocs_blocked 0\n")
+
+    for number, pid in enumerate(pids):
+        name = PROCESS_NAMES[number % len(PROCESS_NAMES)]
+        directory = os.path.join(root, str(pid))
+        os.makedirs(os.path.join(directory, 'fd'), exist_ok=True)
+        with open(os.path.join(directory, 'stat'), 'w') as f:
+            fields = ['S', '1', str(pid), str(pid), '0', '-1', '4194560'] + ['0'] * 12 + ['20', '0', '1', '0',
+                                                                                          str(100 + number)]
+            fields += ['0'] * 27
+            f.write(f"{pid} ({name}) {' '.join(fields)}\n")
+        with open(os.path.join(directory, 'comm'), 'w') as f:
+            f.write(f"{name}\n")
+        with open(os.path.join(directory, 'cmdline'), 'w') as f:
+            f.write('\0'.join([f"/usr/bin/{name}", '--config', f"/etc/{name}.conf"]) + '\0')
+        with open(os.path.join(directory, 'status'), 'w') as f:
+            f.write(f"Name:\t{name}\nState:\tS (sleeping)\nPid:\t{pid}\nPPid:\t1\n"
+                    f"Uid:\t0\t0\t0\t0\nGid:\t0\t0\t0\t0\nThreads:\t4\n")
+        os.symlink(f"/usr/bin/{name}", os.path.join(directory, 'exe'))
+        for fd, socket_inode in enumerate(owners.get(pid, []), start=3):
+            os.symlink(f"socket:[{socket_inode}]", os.path.join(directory, 'fd', str(fd)))
+
+    return {'root': root, 'pids': pids, 'sockets': {name: len(lines) for name, lines in tables.items()}}
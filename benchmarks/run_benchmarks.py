@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Бенчмарк этапов сбора и формирования отчета на синтетическом /proc
+Для каждого масштаба (число сокетов) строится дерево proc_fixtures, psutil
+переключается на него через PROCFS_PATH, и каждый этап (имена как у
+profiling.span) выполняется repeat раз: время - лучший прогон, пиковая
+память - отдельный прогон под tracemalloc. Результат пишется в JSON и
+сравнивается с сохраненной базой (baseline.json); при регрессии код выхода 1:
+
+    python3 benchmarks/run_benchmarks.py --scales 1000,10000,100000
+    python3 benchmarks/run_benchmarks.py --save-baseline
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psutil
+import yaml
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIR.parent / "src"))
+
+from proc_fixtures import build_proc_tree  # noqa: E402
+
+DEFAULT_SCALES = (1000, 10000)
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 1.25
+DEFAULT_BASELINE = BENCHMARKS_DIR / 'baseline.json'
+# Разница меньше этих порогов считается шумом даже при превышении threshold
+MIN_SECONDS_DELTA = 0.005
+MIN_PEAK_KB_DELTA = 256
+
+Stage = Tuple[str, Callable[[Dict[str, Any]], Any]]
+
+
+def _stages(configuration: Dict[str, Any], workdir: str) -> List[Stage]:
+    """Этапы в порядке измерения; результат этапа доступен следующим как ctx[имя]"""
+    import glacier
+    from cardinality import CardinalityTracker
+    from flow_aggregation import FlowAggregator
+    from history_store import HistoryStore
+    from icmp_tracker import ICMPTracker
+    from metrics_exporter import measurement_families, render
+    from netflow_generator import IPFIXReportSink, LegacyReportSink, NetFlowGenerator, YAMLReportSink
+    from network_info import finalize_result, get_current_connections, select_connections
+    from report_enhancer import ReportEnhancer
+    from rollups import RollupStore
+    from udp_tracker_module import UDPTracker
+
+    # detect_changes и HTML генератор читают глобальную конфигурацию glacier
+    glacier.configuration = configuration
+    # Полный список соединений без усечения и без дорогих сборщиков (DNS, lsof)
+    full_report = {'mode': 'truncate', 'max_connections': None}
+    collectors = {'reverse_dns': False, 'lsof': False}
+    history = HistoryStore(os.path.join(workdir, 'history.db'))
+
+    def finalize(ctx):
+        networks = {'connections': {}, 'remote': {}, 'tcp': [], 'udp': []}
+        return finalize_result(networks, ctx['collect.snapshot'], configuration['outgoing_ports'],
+                               configuration['local_address'], configuration['except_local_connection'],
+                               full_report, False, collectors)
+
+    def udp(ctx):
+        # get_udp_report() разрешает имена удаленных хостов через DNS: в бенчмарке только разбор /proc
+        tracker = UDPTracker(method='proc')
+        tracker.update_udp_data()
+        return {'udp_connections': [dict(data, connection=key) for key, data in tracker.udp_data.items()],
+                'total_connections': len(tracker.udp_data),
+                'total_packets': sum(data['packet_count'] for data in tracker.udp_data.values())}
+
+    def aggregation(ctx):
+        aggregator = FlowAggregator.from_config(configuration)
+        aggregator.add_connections(ctx['collect.finalize']['connections'])
+        return aggregator.result()
+
+    def current_data(ctx):
+        networks = ctx['collect.finalize']
+        return {'connections': networks['connections'], 'remote_addresses': networks['remote'],
+                'tcp_ports': networks['tcp'], 'udp_ports': networks['udp'],
+                'icmp_connections': networks.get('icmp', 0), 'interfaces': {},
+                'udp_traffic': ctx['collect.udp'],
+                'icmp_traffic': {'connections': ctx['collect.icmp'][:50],
+                                 'total_packets': len(ctx['collect.icmp'])},
+                'extended_system_info': {}}
+
+    def detect(ctx):
+        current = ctx['current_data']
+        # Прошлое измерение: каждое второе соединение, т.е. половина соединений новые
+        previous = dict(current, connections={direction: rows[::2]
+                                              for direction, rows in current['connections'].items()})
+        return glacier.detect_changes(previous, current)
+
+    def cumulative_state(ctx):
+        return {'hostname': 'benchmark', 'os': {'name': platform.system(), 'version': platform.release()},
+                'first_run': '2024-01-01 00:00:00', 'last_update': '2024-01-01 00:00:00',
+                'total_measurements': 1, 'current_state': ctx['current_data'],
+                'changes_log': [{'id': 1, 'timestamp': '2024-01-01 00:00:00', 'time': 1.0,
+                                 'changes': ctx['analyze.detect_changes'], 'first_run': True}]}
+
+    def netflow(ctx):
+        legacy_sink = LegacyReportSink()
+        sinks = [YAMLReportSink(os.path.join(workdir, 'report.yaml')),
+                 IPFIXReportSink(os.path.join(workdir, 'report.ipfix')), legacy_sink]
+        NetFlowGenerator(observation_domain_id=1).stream_netflow_report(ctx['cumulative_state'], sinks)
+        return legacy_sink.result
+
+    def serialize_yaml(ctx):
+        with open(os.path.join(workdir, 'legacy.yaml'), 'w', encoding='utf-8') as f:
+            yaml.dump(ctx['cumulative_state'], f, default_flow_style=False, allow_unicode=True, sort_keys=False)
+
+    return [
+        ('collect.net_connections', lambda ctx: psutil.net_connections(kind='inet')),
+        ('collect.snapshot', lambda ctx: get_current_connections(False, use_lsof=False)),
+        ('collect.finalize', finalize),
+        ('collect.topk', lambda ctx: select_connections(ctx['collect.snapshot']['connections_all'],
+                                                        {'mode': 'topk', 'top_k': 50},
+                                                        configuration['outgoing_ports'])),
+        ('collect.udp', udp),
+        ('collect.icmp', lambda ctx: ICMPTracker().get_icmp_connections_proc()),
+        ('collect.aggregation', aggregation),
+        ('current_data', current_data),
+        ('store.cardinality', lambda ctx: CardinalityTracker().add_connections(ctx['current_data']['connections'])),
+        ('store.rollups', lambda ctx: RollupStore().record_measurement(time.time(), ctx['current_data'], 1.0, True)),
+        ('store.history', lambda ctx: history.record_measurement(time.time(), ctx['current_data'], {}, 1.0,
+                                                                 'benchmark')),
+        ('analyze.detect_changes', detect),
+        ('export.metrics', lambda ctx: render(measurement_families(ctx['current_data']))),
+        ('cumulative_state', cumulative_state),
+        ('serialize.netflow', netflow),
+        ('serialize.yaml', serialize_yaml),
+        ('enhance.report', lambda ctx: ReportEnhancer().enhance_report(copy.deepcopy(ctx['serialize.netflow']))),
+        ('render.html', lambda ctx: glacier.generate_compact_html_report(ctx['serialize.netflow'],
+                                                                         os.path.join(workdir, 'report.html'))),
+    ]
+
+
+# Служебные шаги (сборка структур между этапами) не измеряются
+_HELPER_STEPS = ('current_data', 'cumulative_state')
+
+
+def measure_stage(func: Callable[[Dict[str, Any]], Any], ctx: Dict[str, Any], repeat: int) -> Tuple[Any, Dict[str, float]]:
+    """Лучшее время из repeat прогонов и пиковая память отдельного прогона под tracemalloc"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(ctx)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    try:
+        func(ctx)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, {'seconds': round(best, 6), 'peak_kb': round(peak / 1024, 1)}
+
+
+def run_scale(sockets: int, repeat: int = DEFAULT_REPEAT, stages: Optional[List[str]] = None,
+              configuration: Optional[Dict[str, Any]] = None) -> Dict[str, Dict[str, float]]:
+    """Строит дерево на sockets сокетов и измеряет этапы; возвращает {этап: {seconds, peak_kb}}"""
+    from analyzer_config import get_config
+
+    configuration = configuration or get_config()
+    workdir = tempfile.mkdtemp(prefix=f"glacier_bench_{sockets}_")
+    previous_procfs = psutil.PROCFS_PATH
+    results = {}
+    try:
+        build_proc_tree(os.path.join(workdir, 'proc'), sockets)
+        psutil.PROCFS_PATH = os.path.join(workdir, 'proc')
+        ctx: Dict[str, Any] = {}
+        # Этапы печатают диагностику на каждое соединение: в бенчмарке она не нужна
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name, func in _stages(configuration, workdir):
+                if name in _HELPER_STEPS or (stages and name not in stages):
+                    # Результаты невыбранных этапов нужны следующим: они выполняются один раз без замера
+                    ctx[name] = func(ctx)
+                    continue
+                ctx[name], results[name] = measure_stage(func, ctx, repeat)
+    finally:
+        psutil.PROCFS_PATH = previous_procfs
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float = DEFAULT_THRESHOLD) -> List[str]:
+    """Регрессии относительно базы: время или память выросли больше чем в threshold раз"""
+    regressions = []
+    for scale, stages in results.items():
+        for stage, values in stages.items():
+            base = baseline.get(scale, {}).get(stage)
+            if not base:
+                continue
+            for metric, floor in (('seconds', MIN_SECONDS_DELTA), ('peak_kb', MIN_PEAK_KB_DELTA)):
+                if values[metric] > base[metric] * threshold and values[metric] - base[metric] > floor:
+                    regressions.append(f"{scale} sockets {stage}: {metric} {base[metric]} -> {values[metric]} "
+                                       f"(x{values[metric] / max(base[metric], 1e-9):.2f})")
+    return regressions
+
+
+def format_results(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Строки таблицы этапов по масштабам (с отношением к базе, если она есть)"""
+    lines = []
+    for scale, stages in results.items():
+        lines.append(f"📦 {scale} sockets")
+        for stage, values in stages.items():
+            line = f"   {stage:<26} {values['seconds'] * 1000:10.1f} ms  {values['peak_kb']:10.1f} KB"
+            base = (baseline or {}).get(scale, {}).get(stage)
+            if base:
+                line += (f"   x{values['seconds'] / max(base['seconds'], 1e-9):.2f} time"
+                         f"  x{values['peak_kb'] / max(base['peak_kb'], 1e-9):.2f} memory")
+            lines.append(line)
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Glacier collector and report benchmarks on a synthetic /proc')
+    parser.add_argument('--scales', default=','.join(str(scale) for scale in DEFAULT_SCALES),
+                        help='Comma separated socket counts (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Timed runs per stage, best is kept')
+    parser.add_argument('--stages', help='Comma separated stage names to report (default: all)')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='Baseline JSON (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Regression ratio against the baseline (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    scales = [int(scale) for scale in args.scales.split(',') if scale.strip()]
+    stages = [stage.strip() for stage in args.stages.split(',')] if args.stages else None
+    report = {
+        'meta': {'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                 'platform': platform.platform(), 'psutil': psutil.__version__, 'cpu_count': os.cpu_count(),
+                 'repeat': args.repeat},
+        'results': {},
+    }
+    for scale in scales:
+        started = time.perf_counter()
+        report['results'][str(scale)] = run_scale(scale, args.repeat, stages)
+        print(f"⏱️ {scale} sockets: {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f).get('results', {})
+    for line in format_results(report['results'], baseline):
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results: {args.output}")
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f"💾 Baseline saved: {args.baseline}")
+        return 0
+    if baseline is None:
+        return 0
+    regressions = compare(report['results'], baseline, args.threshold)
+    for regression in regressions:
+        print(f"❌ Regression: {regression}")
+    if not regressions:
+        print(f"✅ No regressions against {args.baseline} (threshold x{args.threshold})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Бюджет времени запуска CLI
+Каждая команда запускается в отдельном процессе под python -X importtime:
+время процесса - лучший из repeat прогонов, время импорта и список модулей
+берутся из того же прогона за вычетом модулей, которые интерпретатор
+загружает сам (site, encodings, .pth файлы).
+Тяжелые зависимости из forbidden не должны загружаться командой вовсе;
+при превышении бюджета код выхода 1:
+
+    python3 benchmarks/startup.py
+    python3 benchmarks/startup.py --commands version --repeat 10
+"""
+
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+GLACIER = Path(__file__).resolve().parents[1] / "src" / "glacier.py"
+DEFAULT_REPEAT = 3
+
+# seconds - время всего процесса, imports - время импорта модулей glacier
+BUDGETS: Dict[str, Dict[str, Any]] = {
+    'version': {'args': ['--version'], 'seconds': 0.5, 'imports': 0.2,
+                'forbidden': ('boto3', 'botocore', 'yaml', 'psutil', 'http.server', 'cProfile')},
+    # Одно измерение занимает ~8 с из-за пауз подсчета UDP/ICMP пакетов
+    'no_s3_run': {'args': ['--no-s3', '-t', '1', '-w', '0'], 'seconds': 30.0, 'imports': 0.3,
+                  'forbidden': ('boto3', 'botocore', 'http.server', 'cProfile')},
+}
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, float]]:
+    """Строки 'import time: self | cumulative | name' -> [(модуль, глубина, cumulative секунд)]"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('| imported package'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((name.strip(), depth, int(cumulative) / 1_000_000))
+    return entries
+
+
+def _importtime(args: List[str], cwd: str) -> Tuple[int, float, List[Tuple[str, int, float]]]:
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return result.returncode, time.perf_counter() - started, parse_importtime(result.stderr)
+
+
+def measure_command(args: List[str], repeat: int = DEFAULT_REPEAT, cwd: Optional[str] = None) -> Dict[str, Any]:
+    """{'seconds', 'imports', 'modules', 'returncode'} лучшего из repeat запусков glacier.py с аргументами args"""
+    cwd = cwd or tempfile.mkdtemp(prefix='glacier_startup_')
+    _, _, interpreter = _importtime(['-c', 'pass'], cwd)
+    preloaded: Set[str] = {name for name, _, _ in interpreter}
+
+    best: Dict[str, Any] = {}
+    for _ in range(max(1, repeat)):
+        returncode, seconds, entries = _importtime([str(GLACIER)] + args, cwd)
+        if not best or seconds < best['seconds']:
+            imports = sum(cumulative for name, depth, cumulative in entries if depth == 0 and name not in preloaded)
+            best = {'seconds': seconds, 'imports': imports, 'returncode': returncode,
+                    'modules': {name for name, _, _ in entries} - preloaded}
+    return best
+
+
+def check_budget(name: str, repeat: int = DEFAULT_REPEAT, scale: float = 1.0) -> Tuple[Dict[str, Any], List[str]]:
+    """Замер команды name из BUDGETS; возвращает (замер, список нарушений)"""
+    budget = BUDGETS[name]
+    measured = measure_command(budget['args'], repeat)
+    violations = []
+    if measured['returncode'] != 0:
+        violations.append(f"{name}: exit code {measured['returncode']}")
+    for key in ('seconds', 'imports'):
+        if measured[key] > budget[key] * scale:
+            violations.append(f"{name}: {key} {measured[key]:.3f}s > budget {budget[key] * scale:.3f}s")
+    loaded = sorted(module for module in budget['forbidden'] if module in measured['modules'])
+    if loaded:
+        violations.append(f"{name}: imports {', '.join(loaded)}")
+    return measured, violations
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Glacier CLI startup-time budget')
+    parser.add_argument('--commands', default=','.join(BUDGETS),
+                        help='Comma separated commands to check (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Runs per command, best is kept')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply every time budget (slow CI hosts)')
+    args = parser.parse_args(argv)
+
+    failed = []
+    for name in [command.strip() for command in args.commands.split(',') if command.strip()]:
+        measured, violations = check_budget(name, args.repeat, args.scale)
+        budget = BUDGETS[name]
+        print(f"{name:<12} {measured['seconds'] * 1000:9.1f} ms (budget {budget['seconds'] * args.scale * 1000:.0f})  "
+              f"imports {measured['imports'] * 1000:7.1f} ms (budget {budget['imports'] * args.scale * 1000:.0f})  "
+              f"{len(measured['modules'])} modules")
+        failed += violations
+
+    for violation in failed:
+        print(f"❌ {violation}")
+    if not failed:
+        print("✅ Startup within budget")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Источник отчетов из S3 для YAML процессора
+Агенты выгружают отчеты под ключи <reports_prefix>/<дата>/<hostname>/<run_id>.<расширение>
+(src/S3Client.py). Источник периодически листает только разделы последних дней,
+отбирает объекты новее сохраненной отметки (high-water mark по LastModified),
+скачивает их пулом потоков и передает в обработку по мере готовности каждого файла
+"""
+
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+# Клиент и разметка ключей S3 общие с анализатором (src/S3Client.py копируется в образ)
+try:
+    import S3Client
+except ImportError:
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'src'))
+    try:
+        import S3Client
+    except ImportError:
+        S3Client = None
+
+logger = logging.getLogger(__name__)
+
+# Загружаемые отчеты: основной YAML (NetFlow) и IPFIX архив; legacy копии и HTML пропускаются
+INGEST_EXTENSIONS = ('yaml', 'yml', 'ipfix')
+
+# process(путь к скачанному файлу, сведения о ключе из S3Client.parse_report_key) -> успех
+Processor = Callable[[Path, Dict[str, Any]], bool]
+
+
+def _timestamp(value) -> str:
+    """LastModified (datetime из boto3) как ISO строка UTC для сравнения и сохранения"""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc).isoformat()
+    return str(value)
+
+
+class S3ReportSource:
+    """
+    Инкрементальный листинг отчетов в S3 с состоянием в файле state_path:
+    'mark' - самый новый обработанный LastModified, 'seen' - {ключ: {'etag', 'last_modified'}}
+    в окне overlap до отметки, 'failed' - {ключ: {'etag', 'last_modified', 'attempts'}} для повторов.
+    Окно overlap покрывает объекты, чей LastModified раньше отметки, а в листинге они
+    появились позже (multipart выгрузка получает время начала)
+    """
+
+    def __init__(self, client, bucket: str, reports_prefix: str, state_path: Path, download_dir: Path,
+                 workers: int = 4, page_size: int = 1000, lookback_days: int = 2,
+                 overlap_seconds: int = 300, max_attempts: int = 5, poll_interval: float = 5.0):
+        self.client = client
+        self.bucket = bucket
+        self.reports_prefix = reports_prefix
+        self.state_path = Path(state_path)
+        self.download_dir = Path(download_dir)
+        self.workers = workers
+        self.page_size = page_size
+        self.lookback_days = lookback_days
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.state = self.load_state()
+
+    @classmethod
+    def from_env(cls, processed_dir: Path) -> Optional['S3ReportSource']:
+        """Источник по переменным окружения агента (S3_ENDPOINT_URL и др.); None, если S3 не настроен"""
+        url = os.getenv('S3_ENDPOINT_URL')
+        if not url:
+            return None
+        if S3Client is None:
+            logger.error("S3_ENDPOINT_URL задан, но модуль S3Client недоступен")
+            return None
+        py_version = {'major': sys.version_info[0], 'minor': sys.version_info[1]}
+        workers = int(os.getenv('S3_DOWNLOAD_WORKERS', 4))
+        client = S3Client.get_client_s3(url_s3=url, region=os.getenv('S3_REGION', 'us-east-1'),
+                                        user=os.getenv('S3_ACCESS_KEY_ID'),
+                                        access_key=os.getenv('S3_ACCESS_SECRET_KEY'),
+                                        py_version=py_version, max_pool_connections=max(10, workers * 2))
+        if client is None:
+            return None
+        return cls(client, os.getenv('S3_BUCKET', 'analyzer'), os.getenv('S3_REPORTS_PREFIX', 'reports/'),
+                   Path(os.getenv('S3_STATE_FILE', str(processed_dir / 's3_ingest_state.json'))),
+                   processed_dir / 's3_incoming', workers=workers,
+                   lookback_days=int(os.getenv('S3_LOOKBACK_DAYS', 2)),
+                   poll_interval=float(os.getenv('S3_POLL_INTERVAL', 5)))
+
+    def load_state(self) -> Dict[str, Any]:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        return {'mark': state.get('mark'), 'seen': state.get('seen', {}), 'failed': state.get('failed', {})}
+
+    def save_state(self):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.state_path.with_name(self.state_path.name + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.state_path)
+
+    def list_new(self, today: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """
+        Новые объекты по порядку LastModified: без отметки - весь префикс, иначе разделы
+        от (отметка - lookback_days) до завтра (даты ключей - локальное время агентов)
+        """
+        mark = self.state['mark']
+        if mark is None:
+            reports = S3Client.list_reports(self.client, self.bucket, self.reports_prefix, page_size=self.page_size)
+        else:
+            today = (today or datetime.now(timezone.utc)).date()
+            first = datetime.fromisoformat(mark).date() - timedelta(days=self.lookback_days)
+            reports = S3Client.list_reports(self.client, self.bucket, self.reports_prefix, first,
+                                            today + timedelta(days=1), page_size=self.page_size)
+        threshold = None if mark is None else _timestamp(datetime.fromisoformat(mark) - self.overlap)
+        new = []
+        for item in reports:
+            if item['extension'] not in INGEST_EXTENSIONS:
+                continue
+            item['LastModified'] = _timestamp(item['LastModified'])
+            if threshold is not None and item['LastModified'] < threshold:
+                continue
+            if self.state['seen'].get(item['Key'], {}).get('etag') == item['ETag']:
+                continue
+            new.append(item)
+        # Не прошедшие обработку ранее объекты, которые не изменились и не попали в листинг
+        listed = {item['Key'] for item in new}
+        for key, failed in self.state['failed'].items():
+            if key not in listed and failed['attempts'] < self.max_attempts:
+                parsed = S3Client.parse_report_key(key, self.reports_prefix) or {}
+                new.append(dict(parsed, Key=key, ETag=failed['etag'], LastModified=failed['last_modified']))
+        return sorted(new, key=lambda item: (item['LastModified'], item['Key']))
+
+    def _download(self, item: Dict[str, Any]) -> Path:
+        path = self.download_dir / item['Key']
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.client.download_file(self.bucket, item['Key'], str(path))
+        return path
+
+    def poll(self, process: Processor) -> Dict[str, int]:
+        """
+        Один проход: скачивание новых объектов пулом потоков, обработка каждого файла
+        сразу после его загрузки (в вызывающем потоке), сохранение отметки
+        """
+        items = self.list_new()
+        stats = {'new': len(items), 'processed': 0, 'failed': 0}
+        if not items:
+            return stats
+        logger.info(f"S3: {len(items)} новых отчётов в s3://{self.bucket}/{self.reports_prefix}")
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(items))),
+                                thread_name_prefix='s3-ingest') as pool:
+            futures = {pool.submit(self._download, item): item for item in items}
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    success = process(future.result(), item)
+                except Exception as e:
+                    logger.error(f"S3: ошибка загрузки {item['Key']}: {e}")
+                    success = False
+                self._record(item, success)
+                # Состояние после каждого файла: перезапуск не загружает отчет в БД повторно
+                self.save_state()
+                stats['processed' if success else 'failed'] += 1
+
+        # Отметка - самый новый LastModified прохода; seen хранит только окно перекрытия
+        newest = max(item['LastModified'] for item in items)
+        if self.state['mark'] is None or newest > self.state['mark']:
+            self.state['mark'] = newest
+        threshold = _timestamp(datetime.fromisoformat(self.state['mark']) - self.overlap)
+        self.state['seen'] = {key: seen for key, seen in self.state['seen'].items()
+                              if seen['last_modified'] >= threshold}
+        self.state['failed'] = {key: failed for key, failed in self.state['failed'].items()
+                                if failed['attempts'] < self.max_attempts or failed['last_modified'] >= threshold}
+        self.save_state()
+        return stats
+
+    def _record(self, item: Dict[str, Any], success: bool):
+        """Итог обработки объекта: успешный - в seen, неудачный - в failed для повтора"""
+        key = item['Key']
+        if success:
+            self.state['seen'][key] = {'etag': item['ETag'], 'last_modified': item['LastModified']}
+            self.state['failed'].pop(key, None)
+            return
+        failed = self.state['failed'].get(key)
+        attempts = failed['attempts'] + 1 if failed and failed['etag'] == item['ETag'] else 1
+        self.state['failed'][key] = {'etag': item['ETag'], 'last_modified': item['LastModified'],
+                                     'attempts': attempts}
+        # Объект после max_attempts неудачных попыток больше не запрашивается (до новой версии)
+        self.state['seen'][key] = {'etag': item['ETag'], 'last_modified': item['LastModified']}
+        if attempts >= self.max_attempts:
+            logger.error(f"S3: {key} не обработан после {attempts} попыток, пропускаем")
+
+
+if __name__ == "__main__":
+    # Новые отчеты в S3 без загрузки в БД: S3_ENDPOINT_URL=... python3 s3_source.py
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    source = S3ReportSource.from_env(Path(os.getenv('PROCESSED_DIR', '/data/processed')))
+    if source is None:
+        print("⚠️ S3 не настроен: задайте S3_ENDPOINT_URL, S3_ACCESS_KEY_ID, S3_ACCESS_SECRET_KEY")
+        sys.exit(1)
+    for item in source.list_new():
+        print(f"📄 {item['LastModified']}  {item['Key']}  {item.get('Size', '?')} bytes")
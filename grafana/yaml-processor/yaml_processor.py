@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 """
 YAML Processor для интеграции с Grafana
-Читает YAML отчёты анализатора и загружает данные в PostgreSQL
+Читает YAML отчёты и IPFIX архивы анализатора и загружает данные в PostgreSQL
 """
 
+import io
 import os
+import sys
 import time
 import yaml
 import psycopg2
@@ -16,6 +18,37 @@ import traceback
 import json
 import shutil
 
+# Читатель IPFIX архивов (src/ipfix.py копируется в образ рядом с процессором)
+try:
+    import ipfix
+except ImportError:
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'src'))
+    try:
+        import ipfix
+    except ImportError:
+        ipfix = None
+
+# Скетчи HyperLogLog (src/cardinality.py и src/address_classifier.py копируются в образ)
+try:
+    import cardinality
+except ImportError:
+    cardinality = None
+
+# Сжатые отчеты (gzip/zstd, src/compression.py копируется в образ) читаются прозрачно
+try:
+    from compression import open_report
+except ImportError:
+    open_report = None
+
+# Источник отчетов из S3 (s3_source.py, клиент src/S3Client.py)
+try:
+    from s3_source import S3ReportSource
+except ImportError:
+    S3ReportSource = None
+
+# Буфер COPY FROM STDIN: строки отчёта передаются в БД одним потоком на таблицу
+COPY_BUFFER_SIZE = 1024 * 1024
+
 # Настройка логирвоания
 logging.basicConfig(
     level=logging.INFO,
@@ -23,6 +56,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def copy_value(value: Any) -> str:
+    """Значение в текстовом формате COPY: None - \\N, спецсимволы экранируются"""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_rows(cursor, table: str, columns: List[str], rows: List[tuple]) -> int:
+    """Вставка строк одной командой COPY FROM STDIN (вместо INSERT на строку)"""
+    if not rows:
+        return 0
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer, size=COPY_BUFFER_SIZE)
+    return len(rows)
+
+
 class YAMLProcessor:
     def __init__(self):
         self.db_config = {
@@ -32,6 +86,8 @@ class YAMLProcessor:
             'user': os.getenv('POSTGRES_USER', 'grafana_user'),
             'password': os.getenv('POSTGRES_PASSWORD', 'grafana_pass')
         }
+        # Объединение скетчей всех хостов: уникальные собеседники по парку
+        self.fleet_cardinality = None
         self.watch_dir = Path(os.getenv('YAML_WATCH_DIR', '/data/yaml'))
         self.processed_dir = Path(os.getenv('PROCESSED_DIR', '/data/processed'))
         self.processed_dir.mkdir(parents=True, exist_ok=True)
@@ -43,33 +99,53 @@ class YAMLProcessor:
         logger.info(f"База данных: {self.db_config['host']}:{self.db_config['port']}/{self.db_config['database']}")
         logger.info(f"Папка мониторинга: {self.watch_dir}")
         logger.info(f"Папка обработанных: {self.processed_dir}")
+        
+        # Отчеты агентов из S3 (если задан S3_ENDPOINT_URL) загружаются вместе с папкой мониторинга
+        self.s3_source = S3ReportSource.from_env(self.processed_dir) if S3ReportSource is not None else None
+        if self.s3_source is not None:
+            logger.info(f"Источник S3: s3://{self.s3_source.bucket}/{self.s3_source.reports_prefix} "
+                        f"(опрос каждые {self.s3_source.poll_interval:g} с)")
 
-    def connect_db(self) -> Optional[psycopg2.extensions.connection]:
-        """Подключение к PostgreSQL"""
+    def connect_db(self, autocommit: bool = True) -> Optional[psycopg2.extensions.connection]:
+        """Подключение к PostgreSQL (autocommit=False - явная транзакция, загрузка отчёта)"""
         try:
             conn = psycopg2.connect(**self.db_config)
-            conn.autocommit = True
+            conn.autocommit = autocommit
             return conn
         except Exception as e:
             logger.error(f"Ошибка подключения к БД: {e}")
             return None
 
-    def process_yaml_file(self, file_path: Path) -> bool:
-        """Обработка одного YAML файла"""
+    def load_report(self, file_path: Path) -> Optional[Dict[str, Any]]:
+        """Загружает отчёт: IPFIX архив читается бинарно, остальное - как YAML"""
+        if file_path.suffix == '.ipfix':
+            if ipfix is None:
+                logger.error(f"Модуль ipfix недоступен, пропускаем {file_path}")
+                return None
+            return ipfix.read_ipfix_report(str(file_path))
+        if open_report is not None:
+            with open_report(str(file_path)) as f:
+                return yaml.safe_load(f)
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return yaml.safe_load(f)
+
+    def process_yaml_file(self, file_path: Path, default_hostname: str = 'unknown') -> bool:
+        """Обработка одного файла отчёта (YAML или IPFIX); default_hostname - если в отчёте его нет"""
         try:
             logger.info(f"Обработка файла: {file_path}")
             
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = yaml.safe_load(f)
+            data = self.load_report(file_path)
             
             if not data or 'netflow_message' not in data:
                 logger.warning(f"Файл не содержит NetFlow данных: {file_path}")
                 return False
             
-            conn = self.connect_db()
+            # Весь отчёт - одна транзакция: соединения и статистика загружаются целиком или не загружаются
+            conn = self.connect_db(autocommit=False)
             if not conn:
                 return False
             
+            started = time.perf_counter()
             try:
                 cursor = conn.cursor()
                 
@@ -90,7 +166,7 @@ class YAMLProcessor:
                 elif file_path.name.startswith('MacBook-Pro-Mihail'):
                     hostname = 'MacBook-Pro-Mihail.local'
                 else:
-                    hostname = data.get('hostname', 'unknown')
+                    hostname = data.get('hostname', default_hostname)
                 
                 logger.info(f"Извлечен hostname: {hostname}")
                 
@@ -100,15 +176,17 @@ class YAMLProcessor:
                 
                 logger.info(f"Найдено {len(flows)} NetFlow записей")
                 
-                # Обрабатываем каждый flow
-                for flow in flows:
-                    self.insert_connection(cursor, flow, hostname, report_time)
+                # Все flow одной командой COPY; некорректные записи пропускаются и в статистике
+                rows = self.connection_rows(flows, hostname, report_time)
+                inserted = copy_rows(cursor, 'connections', self.CONNECTION_COLUMNS, rows)
                 
                 # Обновляем статистику
-                self.update_statistics(cursor, flows, hostname, report_time)
+                sketches = self.load_cardinality(data.get('system_information', {}).get('cardinality'), hostname)
+                self.update_statistics(cursor, rows, hostname, report_time, sketches)
                 
                 conn.commit()
-                logger.info(f"Успешно обработано {len(flows)} записей из {file_path}")
+                logger.info(f"Успешно обработано {inserted} из {len(flows)} записей из {file_path} "
+                            f"за {time.perf_counter() - started:.3f} с")
                 return True
                 
             except Exception as e:
@@ -141,18 +219,23 @@ class YAMLProcessor:
         except:
             return None
 
-    def insert_connection(self, cursor, flow: Dict, hostname: str, report_time: datetime):
-        """Вставка соединения в таблицу connections"""
+    CONNECTION_COLUMNS = ['time', 'hostname', 'source_address', 'destination_address',
+                          'source_port', 'destination_port', 'protocol', 'direction',
+                          'packet_count', 'byte_count', 'duration_ms', 'process_name']
+
+    def connection_row(self, flow: Dict, hostname: str, report_time: datetime) -> Optional[tuple]:
+        """Строка таблицы connections для NetFlow записи (None - запись некорректна и пропускается)"""
         try:
             # Извлекаем данные из NetFlow записи
             source_addr = self.normalize_ip_address(flow.get('source_address', ''))
             dest_addr = self.normalize_ip_address(flow.get('destination_address', ''))
-            source_port = flow.get('source_port', 0)
-            dest_port = flow.get('destination_port', 0)
+            # Числа проверяются здесь: одно некорректное значение не должно прерывать COPY всего отчёта
+            source_port = int(flow.get('source_port') or 0)
+            dest_port = int(flow.get('destination_port') or 0)
             protocol = flow.get('protocol_name', 'unknown').lower()
-            packets = flow.get('packet_count', 0)
-            bytes_count = flow.get('byte_count', 0)
-            duration = flow.get('flow_duration', 0)
+            packets = int(flow.get('packet_count') or 0)
+            bytes_count = int(flow.get('byte_count') or 0)
+            duration = int(flow.get('flow_duration') or 0)
             
             # Извлекаем имя процесса из метаданных
             meta = flow.get('meta', {})
@@ -163,42 +246,66 @@ class YAMLProcessor:
             if direction not in ['incoming', 'outgoing']:
                 direction = 'unknown'  # Заменяем 'internal' и другие значения на 'unknown'
             
-            # Вставляем в таблицу connections
-            insert_query = """
-            INSERT INTO connections (
-                time, hostname, source_address, destination_address, 
-                source_port, destination_port, protocol, direction,
-                packet_count, byte_count, duration_ms, process_name
-            ) VALUES (
-                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-            )
-            """
-            
-            cursor.execute(insert_query, (
-                report_time, hostname, source_addr, dest_addr,
-                source_port, dest_port, protocol, direction,
-                packets, bytes_count, duration, process_name
-            ))
+            return (report_time, hostname, source_addr, dest_addr,
+                    source_port, dest_port, protocol, direction,
+                    packets, bytes_count, duration, process_name)
             
         except Exception as e:
-            logger.error(f"Ошибка при вставке соединения: {e}")
+            logger.error(f"Ошибка в записи соединения: {e}")
             logger.error(f"Flow data: {flow}")
+            return None
+
+    def connection_rows(self, flows: List[Dict], hostname: str, report_time: datetime) -> List[tuple]:
+        """Проверенные строки connections для всех NetFlow записей отчёта"""
+        return [row for row in (self.connection_row(flow, hostname, report_time) for flow in flows)
+                if row is not None]
+
+    def insert_connections(self, cursor, flows: List[Dict], hostname: str, report_time: datetime) -> int:
+        """Вставка соединений отчёта в таблицу connections одной командой COPY"""
+        return copy_rows(cursor, 'connections', self.CONNECTION_COLUMNS,
+                         self.connection_rows(flows, hostname, report_time))
+
+    def insert_connection(self, cursor, flow: Dict, hostname: str, report_time: datetime):
+        """Вставка одного соединения в таблицу connections"""
+        self.insert_connections(cursor, [flow], hostname, report_time)
+
+    def load_cardinality(self, state: Optional[Dict[str, Any]], hostname: str):
+        """Читает скетчи уникальных значений отчёта и добавляет их в сводку по парку"""
+        if not state or cardinality is None:
+            return None
+        try:
+            sketches = cardinality.CardinalityTracker.from_dict(state)
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"Повреждённые скетчи уникальных значений {hostname}: {e}")
+            return None
+        # Объединение идемпотентно: повторные отчёты того же хоста не завышают оценку
+        if self.fleet_cardinality is None:
+            self.fleet_cardinality = cardinality.CardinalityTracker.from_dict(state)
+        else:
+            self.fleet_cardinality.merge(sketches)
+        fleet = self.fleet_cardinality.host
+        logger.info(f"Парк: ~{fleet['peers'].count()} уникальных собеседников, ~{fleet['processes'].count()} процессов")
+        return sketches
 
-    def update_statistics(self, cursor, flows: List[Dict], hostname: str, report_time: datetime):
-        """Обновление статистических таблиц"""
+    def update_statistics(self, cursor, rows: List[tuple], hostname: str, report_time: datetime, sketches=None):
+        """
+        Обновление статистических таблиц по проверенным строкам connection_rows
+        (sketches - CardinalityTracker отчёта, если есть): по одной команде COPY
+        на таблицу; ошибка прерывает транзакцию всего отчёта
+        """
         try:
             # Статистика по протоколам
             protocol_stats = {}
             destination_stats = {}
             process_stats = {}
             
-            for flow in flows:
-                protocol = flow.get('protocol_name', 'unknown').lower()
-                dest_addr = flow.get('destination_address', 'unknown')
-                meta = flow.get('meta', {})
-                process = meta.get('process', flow.get('original_process', 'unknown'))
-                packets = flow.get('packet_count', 0)
-                bytes_count = flow.get('byte_count', 0)
+            for row in rows:
+                flow = dict(zip(self.CONNECTION_COLUMNS, row))
+                protocol = flow['protocol']
+                dest_addr = flow['destination_address']
+                process = flow['process_name']
+                packets = flow['packet_count']
+                bytes_count = flow['byte_count']
                 
                 # Статистика протоколов
                 if protocol not in protocol_stats:
@@ -222,36 +329,33 @@ class YAMLProcessor:
                 process_stats[process]['bytes'] += bytes_count
             
             # Вставляем статистику протоколов
-            for protocol, stats in protocol_stats.items():
-                cursor.execute("""
-                INSERT INTO protocol_stats (time, hostname, protocol, connection_count, total_packets, total_bytes)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                """, (report_time, hostname, protocol, stats['connections'], stats['packets'], stats['bytes']))
+            copy_rows(cursor, 'protocol_stats',
+                      ['time', 'hostname', 'protocol', 'connection_count', 'total_packets', 'total_bytes'],
+                      [(report_time, hostname, protocol, stats['connections'], stats['packets'], stats['bytes'])
+                       for protocol, stats in protocol_stats.items()])
             
-            # Вставляем топ назначений (топ 10)
+            # Вставляем топ назначений (топ 10, только валидные адреса)
             top_destinations = sorted(destination_stats.items(), key=lambda x: x[1]['connections'], reverse=True)[:10]
-            for i, (dest_addr, stats) in enumerate(top_destinations, 1):
-                normalized_dest = self.normalize_ip_address(dest_addr)
-                if normalized_dest:  # Только если адрес валидный
-                    cursor.execute("""
-                    INSERT INTO top_destinations (time, hostname, destination_address, connection_count, total_bytes)
-                    VALUES (%s, %s, %s, %s, %s)
-                    """, (report_time, hostname, normalized_dest, stats['connections'], stats['bytes']))
+            copy_rows(cursor, 'top_destinations',
+                      ['time', 'hostname', 'destination_address', 'connection_count', 'total_bytes'],
+                      [(report_time, hostname, dest_addr, stats['connections'], stats['bytes'])
+                       for dest_addr, stats in top_destinations if dest_addr])
             
             # Вставляем статистику процессов (топ 10)
             top_processes = sorted(process_stats.items(), key=lambda x: x[1]['connections'], reverse=True)[:10]
-            for i, (process, stats) in enumerate(top_processes, 1):
-                cursor.execute("""
-                INSERT INTO process_stats (time, hostname, process_name, connection_count, total_bytes)
-                VALUES (%s, %s, %s, %s, %s)
-                """, (report_time, hostname, process, stats['connections'], stats['bytes']))
+            copy_rows(cursor, 'process_stats',
+                      ['time', 'hostname', 'process_name', 'connection_count', 'total_bytes'],
+                      [(report_time, hostname, process, stats['connections'], stats['bytes'])
+                       for process, stats in top_processes])
             
             # Общие системные метрики
-            total_connections = len(flows)
-            total_packets = sum(flow.get('packet_count', 0) for flow in flows)
-            total_bytes = sum(flow.get('byte_count', 0) for flow in flows)
+            total_connections = len(rows)
             unique_destinations = len(destination_stats)
             unique_processes = len(process_stats)
+            if sketches is not None:
+                # Оценки по всем соединениям за время работы, а не по усечённому списку потоков
+                unique_destinations = sketches.host['peers'].count()
+                unique_processes = sketches.host['processes'].count()
             
             cursor.execute("""
             INSERT INTO system_metrics (
@@ -264,11 +368,13 @@ class YAMLProcessor:
         except Exception as e:
             logger.error(f"Ошибка при обновлении статистики: {e}")
             logger.error(traceback.format_exc())
+            # Транзакция после ошибки прервана: отчёт откатывается целиком в process_yaml_file
+            raise
 
     def move_processed_file(self, file_path: Path) -> bool:
         """Перемещает обработанный файл в папку processed"""
         try:
-            processed_file = self.processed_dir / f"{file_path.stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.yaml"
+            processed_file = self.processed_dir / f"{file_path.stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{file_path.suffix}"
             
             # Используем copy + remove для работы между разными файловыми системами
             shutil.copy2(file_path, processed_file)
@@ -280,17 +386,32 @@ class YAMLProcessor:
             logger.error(f"Ошибка при перемещении файла {file_path}: {e}")
             return False
 
+    def process_s3_report(self, file_path: Path, item: Dict[str, Any]) -> bool:
+        """Обработка отчёта, скачанного из S3 (hostname по умолчанию - из ключа)"""
+        if self.process_yaml_file(file_path, item.get('hostname', 'unknown')):
+            return self.move_processed_file(file_path)
+        file_path.unlink(missing_ok=True)
+        return False
+
+    def poll_s3(self):
+        """Один проход по новым объектам S3"""
+        stats = self.s3_source.poll(self.process_s3_report)
+        if stats['new']:
+            logger.info(f"S3: обработано {stats['processed']}, с ошибками {stats['failed']}")
+        return stats
+
     def watch_directory(self):
         """Основной цикл мониторинга директории"""
         logger.info(f"Начат мониторинг директории: {self.watch_dir}")
         
         while True:
             try:
-                # Ищем YAML файлы
-                yaml_files = list(self.watch_dir.glob("*.yaml")) + list(self.watch_dir.glob("*.yml"))
+                # Ищем YAML файлы и IPFIX архивы
+                yaml_files = (list(self.watch_dir.glob("*.yaml")) + list(self.watch_dir.glob("*.yml")) +
+                              list(self.watch_dir.glob("*.ipfix")))
                 
                 if yaml_files:
-                    logger.info(f"Найдено {len(yaml_files)} YAML файлов для обработки")
+                    logger.info(f"Найдено {len(yaml_files)} файлов отчётов для обработки")
                     
                     for file_path in yaml_files:
                         if file_path.is_file():
@@ -301,8 +422,11 @@ class YAMLProcessor:
                 else:
                     logger.debug("YAML файлы не найдены")
                 
-                # Ждём перед следующей проверкой
-                time.sleep(10)
+                if self.s3_source is not None:
+                    self.poll_s3()
+                
+                # Ждём перед следующей проверкой (с S3 - чаще, отчеты появляются в Grafana за секунды)
+                time.sleep(self.s3_source.poll_interval if self.s3_source is not None else 10)
                 
             except KeyboardInterrupt:
                 logger.info("Получен сигнал прерывания, завершение работы...")
@@ -1,7 +1,21 @@
-import boto3
-import botocore
-import certifi
-from botocore.config import Config
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from compression import content_headers
+from profiling import lazy_import
+
+# boto3/botocore импортируются около 0.2 с: загружаются при первом обращении к S3
+boto3 = lazy_import('boto3', 's3')
+botocore = lazy_import('botocore', 's3')
+botocore_config = lazy_import('botocore.config', 's3')
+s3_transfer = lazy_import('boto3.s3.transfer', 's3')
+certifi = lazy_import('certifi', 's3')
 
 # Обработка проблем с configparser на разных системах
 try:
@@ -15,19 +29,22 @@ except ImportError:
         configparser = None
 
 
-def get_client_s3(url_s3, region, user, access_key, py_version, is_cert=True):
+def get_client_s3(url_s3, region, user, access_key, py_version, is_cert=True, max_pool_connections=10, max_attempts=None):
     try:
         if is_cert:
             certificate = certifi.where()
         else:
             certificate = "./cert/s3-msk2.crt"
 
+        # Пул соединений не меньше числа параллельных выгрузок и частей multipart
+        options = {'max_pool_connections': max_pool_connections, 'tcp_keepalive': True}
+        if max_attempts:
+            # Повторы botocore внутри одной попытки; долгие повторы выполняет очередь выгрузки
+            options['retries'] = {'max_attempts': max_attempts, 'mode': 'standard'}
         if py_version['major'] == 3 and py_version['minor'] >= 8:
-            config_s3 = Config(
-                request_checksum_calculation="when_required",
-                response_checksum_validation="when_required")
-        else:
-            config_s3 = None
+            options.update(request_checksum_calculation="when_required",
+                           response_checksum_validation="when_required")
+        config_s3 = botocore_config.Config(**options)
 
         session = boto3.session.Session()
         s3 = session.client(
@@ -46,10 +63,106 @@ def get_client_s3(url_s3, region, user, access_key, py_version, is_cert=True):
         print(f"❌ S3: Client creation failed: {e}")
         return None
 
-def upload_file_s3(s3, bucket, file_path, file_in_s3):
+# Клиенты процесса по (endpoint, region, user, access_key): сессия, разбор
+# моделей botocore и TLS соединения создаются один раз, а не на каждую выгрузку
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_cached_client_s3(s3_config, py_version, is_cert=True):
+    """Клиент S3 для настроек s3_config (раздел 's3' конфигурации), общий для процесса"""
+    key = (s3_config.get('url'), s3_config.get('region', 'endpoint'), s3_config.get('user'),
+           s3_config.get('access_key'), is_cert, s3_config.get('max_attempts'))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = get_client_s3(url_s3=s3_config.get('url'), region=s3_config.get('region', 'endpoint'),
+                                   user=s3_config.get('user'), access_key=s3_config.get('access_key'),
+                                   py_version=py_version, is_cert=is_cert,
+                                   max_pool_connections=s3_config.get('max_pool_connections', 10),
+                                   max_attempts=s3_config.get('max_attempts'))
+            if client is not None:
+                _clients[key] = client
+        return client
+
+def reset_client_cache():
+    """Сбрасывает кэш клиентов (смена учетных данных, тесты)"""
+    with _clients_lock:
+        _clients.clear()
+
+def get_transfer_config(s3_config):
+    """TransferConfig выгрузки: порог и размер частей multipart, потоки на один файл"""
+    megabyte = 1024 * 1024
+    return s3_transfer.TransferConfig(
+        multipart_threshold=int(s3_config.get('multipart_threshold_mb', 8) * megabyte),
+        multipart_chunksize=int(s3_config.get('multipart_chunksize_mb', 8) * megabyte),
+        max_concurrency=s3_config.get('max_concurrency', 4),
+        use_threads=True)
+
+class LocalS3Client:
+    """
+    Заглушка клиента S3 для воспроизведения записи (--replay): объекты
+    копируются в каталог root/<bucket>/<ключ>, сеть не используется
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, key.lstrip('/'))
+
+    def upload_file(self, file_path, bucket, key, ExtraArgs=None, Config=None):
+        target = self._path(bucket, key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(file_path, target)
+
+    def head_object(self, Bucket, Key):
+        # Метаданные не хранятся: хэш считается по содержимому копии
+        md5, sha256 = file_digests(self._path(Bucket, Key))
+        return {'ETag': f'"{md5}"', 'Metadata': {'sha256': sha256}}
+
+    def list_objects(self, Bucket):
+        base = os.path.join(self.root, Bucket)
+        contents = []
+        for directory, _, files in os.walk(base):
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, base).replace(os.sep, '/')
+                contents.append({'Key': key, 'Size': os.path.getsize(path)})
+        return {'Contents': sorted(contents, key=lambda item: item['Key'])} if contents else {}
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None):
+        # Страницы как у S3: токен продолжения - последний выданный ключ
+        contents = [item for item in self.list_objects(Bucket).get('Contents', [])
+                    if item['Key'].startswith(Prefix) and (ContinuationToken is None or item['Key'] > ContinuationToken)]
+        page = contents[:MaxKeys]
+        response = {'KeyCount': len(page), 'IsTruncated': len(contents) > MaxKeys}
+        if page:
+            response['Contents'] = page
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]['Key']
+        return response
+
+    def download_file(self, Bucket, Key, Filename, Config=None):
+        shutil.copyfile(self._path(Bucket, Key), Filename)
+
+    def copy_object(self, Bucket, Key, CopySource):
+        target = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(self._path(CopySource['Bucket'], CopySource['Key']), target)
+
+    def download_fileobj(self, bucket, key, fileobj):
+        with open(self._path(bucket, key), 'rb') as f:
+            shutil.copyfileobj(f, fileobj)
+
+def upload_file_s3(s3, bucket, file_path, file_in_s3, transfer_config=None, extra_args=None):
     success = True
     try:
-        s3.upload_file(file_path, bucket, file_in_s3)
+        options = {}
+        if transfer_config is not None:
+            options['Config'] = transfer_config
+        if extra_args:
+            options['ExtraArgs'] = extra_args
+        s3.upload_file(file_path, bucket, file_in_s3, **options)
     except boto3.exceptions.S3UploadFailedError as err:
         print(f"S3: error upload file: {err}")
         success = False
@@ -59,16 +172,252 @@ def upload_file_s3(s3, bucket, file_path, file_in_s3):
 
     return success
 
-def read_from_s3(s3, bucket):
-    contents = []
-    list_obj = s3.list_objects(Bucket=bucket)
-    if 'Contents' in list_obj:
-        contents = list_obj['Contents']
-    else:
-        print("S3: bucket is empty")
+def file_digests(file_path, chunk_size=1024 * 1024):
+    """(md5, sha256) содержимого файла за один проход: md5 совпадает с ETag обычной выгрузки"""
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+            sha256.update(chunk)
+    return md5.hexdigest(), sha256.hexdigest()
+
+class UploadManifest:
+    """
+    Локальный манифест выгрузок {ключ: {'sha256', 'md5', 'size', 'uploaded'}}:
+    файл, содержимое которого уже выгружено под тем же ключом, повторно не отправляется,
+    а выгруженное прошлым запуском под другим ключом - копируется внутри бакета (find)
+    """
+
+    def __init__(self, path, max_entries=500):
+        self.path = path
+        # Ключи уникальны для запуска (report_key): старые записи вытесняются
+        self.max_entries = max_entries
+        self.entries = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get('objects', {})
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, bucket, key):
+        return self.entries.get(f"{bucket}/{key}")
+
+    def find(self, bucket, sha256, suffix=''):
+        """Последний ключ бакета с тем же содержимым и окончанием имени (расширением) или None"""
+        prefix = f"{bucket}/"
+        with self._lock:
+            matches = [(entry.get('uploaded', ''), name[len(prefix):]) for name, entry in self.entries.items()
+                       if name.startswith(prefix) and entry.get('sha256') == sha256
+                       and key_suffix(name[len(prefix):]) == suffix]
+        return max(matches)[1] if matches else None
+
+    def record(self, bucket, key, md5, sha256, size):
+        with self._lock:
+            self.entries[f"{bucket}/{key}"] = {'md5': md5, 'sha256': sha256, 'size': size,
+                                               'uploaded': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+
+    def save(self):
+        with self._lock:
+            if len(self.entries) > self.max_entries:
+                newest = sorted(self.entries.items(), key=lambda item: item[1].get('uploaded', ''))[-self.max_entries:]
+                self.entries = dict(newest)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'objects': self.entries}, f, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+
+def remote_matches(s3, bucket, key, md5, sha256):
+    """
+    Объект в S3 с тем же содержимым: метаданные sha256 (пишутся при выгрузке)
+    или ETag, равный md5 (только для выгрузки одним запросом)
+    """
+    try:
+        head = s3.head_object(Bucket=bucket, Key=key)
+    except Exception:
+        # Нет объекта (404) или нет доступа к нему: выгружаем
+        return False
+    if head.get('Metadata', {}).get('sha256') == sha256:
+        return True
+    etag = head.get('ETag', '').strip('"')
+    return '-' not in etag and etag == md5
+
+def key_suffix(key):
+    """Окончание имени объекта после первой точки: yaml, yaml.legacy, html"""
+    return key.rsplit('/', 1)[-1].partition('.')[2]
+
+def copy_object_s3(s3, bucket, source_key, key):
+    """Копия объекта внутри бакета (без передачи содержимого); метаданные и заголовки сохраняются"""
+    try:
+        s3.copy_object(Bucket=bucket, Key=key, CopySource={'Bucket': bucket, 'Key': source_key})
+        return True
+    except Exception as err:
+        print(f"S3: copy {source_key} -> {key} failed: {err}")
+        return False
+
+def upload_file_if_changed(s3, bucket, file_path, file_in_s3, manifest, transfer_config=None, verify_remote=True):
+    """
+    Выгрузка с проверкой содержимого: 'unchanged', если хэш совпал с манифестом
+    (и с объектом в S3 при verify_remote); 'copied', если то же содержимое уже
+    выгружено под другим ключом (прошлый запуск) и скопировано в S3; иначе результат upload_file_s3
+    """
+    md5, sha256 = file_digests(file_path)
+    known = manifest.get(bucket, file_in_s3)
+    if known and known.get('sha256') == sha256:
+        if not verify_remote or remote_matches(s3, bucket, file_in_s3, md5, sha256):
+            return 'unchanged'
+    elif verify_remote and remote_matches(s3, bucket, file_in_s3, md5, sha256):
+        # Манифест потерян или новый, а объект уже в S3
+        manifest.record(bucket, file_in_s3, md5, sha256, os.path.getsize(file_path))
+        return 'unchanged'
+    # Ключи запуска новые (report_key): неизменный отчет прошлого запуска копируется на стороне S3
+    source = manifest.find(bucket, sha256, key_suffix(file_in_s3))
+    if (source is not None and source != file_in_s3
+            and (not verify_remote or remote_matches(s3, bucket, source, md5, sha256))
+            and copy_object_s3(s3, bucket, source, file_in_s3)):
+        manifest.record(bucket, file_in_s3, md5, sha256, os.path.getsize(file_path))
+        return 'copied'
+    status = upload_file_s3(s3, bucket, file_path, file_in_s3, transfer_config,
+                            extra_args=dict(content_headers(file_path), Metadata={'sha256': sha256}))
+    if status:
+        manifest.record(bucket, file_in_s3, md5, sha256, os.path.getsize(file_path))
+    return status
+
+def upload_files_s3(s3, bucket, files, transfer_config=None, max_workers=4, manifest=None, verify_remote=True):
+    """
+    Параллельная выгрузка [(путь, ключ), ...]: общее время близко ко времени
+    самого большого файла. Content-Type/Content-Encoding - по файлу (сжатые
+    отчеты открываются браузером прямо из S3). С manifest неизмененные файлы пропускаются.
+    Возвращает {путь: True/False, 'unchanged', 'copied' или исключение}
+    """
+    if not files:
+        return {}
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(files))),
+                            thread_name_prefix='s3-upload') as pool:
+        if manifest is not None:
+            futures = {pool.submit(upload_file_if_changed, s3, bucket, path, key, manifest, transfer_config,
+                                   verify_remote): path for path, key in files}
+        else:
+            futures = {pool.submit(upload_file_s3, s3, bucket, path, key, transfer_config,
+                                   content_headers(path)): path for path, key in files}
+        for future, path in futures.items():
+            try:
+                results[path] = future.result()
+            except Exception as e:
+                results[path] = e
+    if manifest is not None:
+        manifest.save()
+    return results
+
+def new_run_id(started=None):
+    """Идентификатор запуска: время начала и случайный суффикс (запуски в одну секунду различаются)"""
+    started = started or datetime.now()
+    return f"{started.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+def report_run(reports_prefix, hostname, started=None):
+    """Раздел и идентификатор отчетов запуска: все выгрузки запуска идут под одни ключи"""
+    started = started or datetime.now()
+    return {'prefix': reports_prefix or '', 'hostname': hostname, 'date': started.strftime('%Y-%m-%d'),
+            'run_id': new_run_id(started)}
+
+def partition_prefix(reports_prefix, date=None, hostname=None):
+    """
+    Префикс раздела отчетов: reports/, reports/<дата>/ или reports/<дата>/<hostname>/
+    (hostname без даты не сужает префикс: раздел по дате идет первым)
+    """
+    parts = [reports_prefix.strip('/')] if reports_prefix.strip('/') else []
+    if date is not None:
+        parts.append(date if isinstance(date, str) else date.strftime('%Y-%m-%d'))
+        if hostname:
+            parts.append(hostname)
+    return '/'.join(parts) + '/' if parts else ''
+
+def report_key(reports_prefix, hostname, run_id, extension, date):
+    """Ключ файла отчета: <reports_prefix>/<дата>/<hostname>/<run_id>.<расширение>"""
+    return f"{partition_prefix(reports_prefix, date, hostname)}{run_id}.{extension}"
+
+def parse_report_key(key, reports_prefix=''):
+    """{'date', 'hostname', 'run_id', 'extension'} для ключа report_key или None"""
+    prefix = partition_prefix(reports_prefix)
+    if not key.startswith(prefix):
+        return None
+    parts = key[len(prefix):].split('/')
+    if len(parts) != 3 or '.' not in parts[2]:
+        return None
+    run_id, extension = parts[2].split('.', 1)
+    return {'date': parts[0], 'hostname': parts[1], 'run_id': run_id, 'extension': extension}
+
+def iter_objects(s3, bucket, prefix='', page_size=1000):
+    """Объекты бакета с префиксом prefix постранично (list_objects_v2, ContinuationToken)"""
+    options = {'Bucket': bucket, 'Prefix': prefix, 'MaxKeys': page_size}
+    while True:
+        page = s3.list_objects_v2(**options)
+        for item in page.get('Contents', []):
+            yield item
+        if not page.get('IsTruncated'):
+            return
+        options['ContinuationToken'] = page['NextContinuationToken']
+
+def read_from_s3(s3, bucket, prefix='', page_size=1000):
+    contents = list(iter_objects(s3, bucket, prefix, page_size))
+    if not contents:
+        print(f"S3: no objects under '{prefix}'" if prefix else "S3: bucket is empty")
 
     return contents
 
+def list_reports(s3, bucket, reports_prefix, date_from=None, date_to=None, hostname=None, page_size=1000):
+    """
+    Отчеты в разделах reports_prefix: при заданном диапазоне дат листинг идет
+    только по префиксам этих дней (и хоста), без обхода всего бакета.
+    Элементы - объекты list_objects_v2 с полями parse_report_key
+    """
+    if date_from is not None or date_to is not None:
+        day = date_from or date_to
+        last = date_to or date_from
+        prefixes = []
+        while day <= last:
+            prefixes.append(partition_prefix(reports_prefix, day, hostname))
+            day += timedelta(days=1)
+    else:
+        prefixes = [partition_prefix(reports_prefix)]
+
+    reports = []
+    for prefix in prefixes:
+        for item in iter_objects(s3, bucket, prefix, page_size):
+            parsed = parse_report_key(item['Key'], reports_prefix)
+            if parsed is None or (hostname and parsed['hostname'] != hostname):
+                continue
+            reports.append(dict(item, **parsed))
+    return reports
+
+def download_files_s3(s3, bucket, objects, transfer_config=None, max_workers=4):
+    """
+    Параллельная загрузка объектов [(ключ, локальный путь)] из S3;
+    возвращает {ключ: True или исключение}
+    """
+    def download(key, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        options = {'Config': transfer_config} if transfer_config is not None else {}
+        s3.download_file(bucket, key, path, **options)
+        return True
+
+    results = {}
+    if not objects:
+        return results
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(objects))),
+                            thread_name_prefix='s3-download') as pool:
+        futures = {pool.submit(download, key, path): key for key, path in objects}
+        for future, key in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                results[key] = e
+    return results
+
 def get_object(s3, bucket, obj_key):
     with open("test.file", 'wb') as f:
         s3.download_fileobj(bucket, obj_key, f)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CIDR классификатор адресов
+Единая точка принятия решений local/private/external для всех модулей анализатора:
+radix-дерево по префиксам ipaddress сетей со встроенными категориями и
+пользовательскими зонами (prod, office, partners) из конфигурации.
+Результаты кэшируются по IP адресу.
+"""
+
+import ipaddress
+from collections import namedtuple
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Tuple
+
+# Встроенные категории (RFC 1918, RFC 4193, RFC 3927, RFC 6598, RFC 5771 и др.)
+BUILTIN_CATEGORIES = {
+    'loopback': ['127.0.0.0/8', '::1/128'],
+    'link_local': ['169.254.0.0/16', 'fe80::/10'],
+    'private': ['10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16', '100.64.0.0/10', 'fc00::/7'],
+    'multicast': ['224.0.0.0/4', 'ff00::/8'],
+    'reserved': ['0.0.0.0/8', '240.0.0.0/4', '::/128'],
+}
+
+# Категории адресов, которые никогда не считаются внешними системами
+NON_ROUTABLE_CATEGORIES = ('local', 'loopback', 'link_local', 'multicast', 'reserved')
+
+# Результат классификации
+AddressInfo = namedtuple('AddressInfo', ['ip', 'version', 'category', 'zone'])
+
+INVALID_ADDRESS = AddressInfo(None, 0, 'invalid', None)
+
+
+class RadixTree:
+    """
+    Бинарное radix-дерево (patricia) для поиска по наибольшему совпадающему префиксу
+    Каждый узел хранит сжатый отрезок бит, поэтому глубина поиска ограничена
+    количеством префиксов на пути, а не длиной адреса
+    """
+
+    __slots__ = ('width', 'root')
+
+    def __init__(self, width: int):
+        self.width = width
+        # Узел: [bits, length, value, child0, child1]
+        self.root = [0, 0, None, None, None]
+
+    def insert(self, value: int, prefix_len: int, data: Any):
+        """Вставляет префикс value/prefix_len (value - адрес сети как целое)"""
+        width = self.width
+        node = self.root
+        depth = 0
+        while True:
+            if depth == prefix_len:
+                node[2] = data
+                return
+            bit = (value >> (width - depth - 1)) & 1
+            child = node[3 + bit]
+            remaining = prefix_len - depth
+            key = (value >> (width - prefix_len)) & ((1 << remaining) - 1)
+            if child is None:
+                node[3 + bit] = [key, remaining, data, None, None]
+                return
+
+            child_bits, child_len = child[0], child[1]
+            common = min(child_len, remaining)
+            # Длина общего префикса отрезков child и вставляемого ключа
+            a = child_bits >> (child_len - common)
+            b = key >> (remaining - common)
+            diff = a ^ b
+            match = common - diff.bit_length() if diff else common
+
+            if match == child_len:
+                node = child
+                depth += child_len
+                continue
+
+            # Разделяем ребро: создаем промежуточный узел длиной match
+            split = [child_bits >> (child_len - match), match, None, None, None]
+            child_rest_len = child_len - match
+            child[0] = child_bits & ((1 << child_rest_len) - 1)
+            child[1] = child_rest_len
+            split[3 + ((child[0] >> (child_rest_len - 1)) & 1)] = child
+            node[3 + bit] = split
+
+            if match == remaining:
+                split[2] = data
+            else:
+                rest_len = remaining - match
+                rest = key & ((1 << rest_len) - 1)
+                split[3 + ((rest >> (rest_len - 1)) & 1)] = [rest, rest_len, data, None, None]
+            return
+
+    def longest_match(self, value: int) -> Any:
+        """Возвращает данные наиболее специфичного префикса, покрывающего адрес"""
+        width = self.width
+        node = self.root
+        best = node[2]
+        depth = 0
+        while depth < width:
+            child = node[3 + ((value >> (width - depth - 1)) & 1)]
+            if child is None:
+                break
+            length = child[1]
+            if ((value >> (width - depth - length)) & ((1 << length) - 1)) != child[0]:
+                break
+            depth += length
+            node = child
+            if node[2] is not None:
+                best = node[2]
+        return best
+
+
+def split_host_port(address: str) -> Tuple[str, Optional[str]]:
+    """Разделяет адрес вида ip:port, [ipv6]:port или ipv6:port на (ip, port)"""
+    return _split_host_port_cached(address or '')
+
+
+@lru_cache(maxsize=65536)
+def _split_host_port_cached(address: str) -> Tuple[str, Optional[str]]:
+    if address.startswith('[') and ']' in address:
+        host, _, rest = address[1:].partition(']')
+        return host, rest[1:] if rest.startswith(':') else None
+    if address.count(':') == 1:
+        host, port = address.split(':')
+        return host, port
+    if address.count(':') > 1:
+        # IPv6 без скобок: последняя числовая часть считается портом (формат network_info)
+        host, _, port = address.rpartition(':')
+        if port.isdigit() and not host.endswith(':'):
+            return host, port
+    return address, None
+
+
+class AddressClassifier:
+    """Классификатор адресов по категориям и пользовательским зонам"""
+
+    def __init__(self, zones: Optional[Dict[str, List[str]]] = None,
+                 local_addresses: Optional[List[str]] = None,
+                 same_subnet_prefix: Optional[Dict[str, int]] = None,
+                 cache_size: int = 65536):
+        self.trees = {4: RadixTree(32), 6: RadixTree(128)}
+        self.zone_trees = {4: RadixTree(32), 6: RadixTree(128)}
+        self.zones = dict(zones or {})
+        self.same_subnet_prefix = {4: 24, 6: 64}
+        for version, prefix in (same_subnet_prefix or {}).items():
+            self.same_subnet_prefix[int(str(version).lstrip('v'))] = int(prefix)
+
+        for category, networks in BUILTIN_CATEGORIES.items():
+            for network in networks:
+                self._add(self.trees, network, category)
+        for address in local_addresses or []:
+            self._add(self.trees, address, 'local')
+        for zone, networks in self.zones.items():
+            for network in networks or []:
+                self._add(self.zone_trees, network, zone)
+
+        # Мемоизация результатов по строке адреса
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    @staticmethod
+    def _add(trees: Dict[int, RadixTree], network: str, data: str):
+        try:
+            net = ipaddress.ip_network(network, strict=False)
+        except ValueError:
+            print(f"⚠️ Классификатор: некорректная сеть {network}, пропускаем")
+            return
+        trees[net.version].insert(int(net.network_address), net.prefixlen, data)
+
+    def _classify(self, ip: str) -> AddressInfo:
+        try:
+            addr = ipaddress.ip_address(ip.split('%', 1)[0])
+        except (ValueError, AttributeError):
+            return INVALID_ADDRESS
+        if addr.version == 6 and addr.ipv4_mapped:
+            addr = addr.ipv4_mapped
+        value = int(addr)
+        category = self.trees[addr.version].longest_match(value) or 'public'
+        zone = self.zone_trees[addr.version].longest_match(value)
+        return AddressInfo(str(addr), addr.version, category, zone)
+
+    def classify_address(self, address: str) -> AddressInfo:
+        """Классифицирует адрес с портом (ip:port, [ipv6]:port)"""
+        return self.classify(split_host_port(address)[0])
+
+    def is_local(self, ip: str) -> bool:
+        """Адрес принадлежит самому хосту (loopback или адреса из local_address)"""
+        return self.classify(ip).category in ('local', 'loopback')
+
+    def is_private(self, ip: str) -> bool:
+        """Адрес из частных диапазонов (RFC 1918 / RFC 4193 / CGNAT)"""
+        return self.classify(ip).category == 'private'
+
+    def is_external(self, ip: str) -> bool:
+        """Адрес маршрутизируемый и не частный"""
+        return self.classify(ip).category == 'public'
+
+    def same_subnet(self, a: AddressInfo, b: AddressInfo) -> bool:
+        """Проверяет, лежат ли адреса в одной подсети (префикс из same_subnet_prefix)"""
+        if a.version != b.version or not a.version:
+            return False
+        width = 32 if a.version == 4 else 128
+        shift = width - self.same_subnet_prefix[a.version]
+        return (int(ipaddress.ip_address(a.ip)) >> shift) == (int(ipaddress.ip_address(b.ip)) >> shift)
+
+    def is_integration(self, remote_ip: str, local_ip: str = '') -> bool:
+        """
+        Определяет, является ли удаленный адрес внешней интеграцией:
+        - немаршрутизируемые адреса (loopback, link-local, multicast, reserved) - нет
+        - адреса из зон сравниваются по зонам: разные зоны - интеграция
+        - частные адреса без зон - интеграция, если подсети различаются
+        - публичные адреса - интеграция
+        """
+        remote = self.classify(remote_ip)
+        if remote.category in NON_ROUTABLE_CATEGORIES or remote.category == 'invalid':
+            return False
+
+        local = self.classify(local_ip) if local_ip else INVALID_ADDRESS
+        if remote.zone or local.zone:
+            return remote.zone != local.zone
+        if remote.category == 'private':
+            return not self.same_subnet(remote, local)
+        return True
+
+    def cache_info(self):
+        return self.classify.cache_info()
+
+
+_classifier_cache: Dict[Any, AddressClassifier] = {}
+_zones_file_cache: Dict[str, Dict[str, List[str]]] = {}
+
+
+def _load_zones_file(path: str) -> Dict[str, List[str]]:
+    """Загружает зоны из YAML файла вида {zone: [cidr, ...]} (один раз на процесс)"""
+    if path not in _zones_file_cache:
+        zones = {}
+        try:
+            import yaml
+            with open(path, 'r', encoding='utf-8') as f:
+                loaded = yaml.safe_load(f) or {}
+            if isinstance(loaded, dict):
+                zones = {str(name): list(nets or []) for name, nets in loaded.items()}
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Классификатор: не удалось загрузить зоны из {path}: {e}")
+        except Exception as e:
+            print(f"⚠️ Классификатор: ошибка разбора зон {path}: {e}")
+        _zones_file_cache[path] = zones
+    return _zones_file_cache[path]
+
+
+def get_address_classifier(configuration: Optional[Dict[str, Any]] = None,
+                           local_addresses: Optional[List[str]] = None) -> AddressClassifier:
+    """
+    Возвращает классификатор из конфигурации (address_zones, local_address)
+    Классификатор создается один раз на уникальный набор параметров
+    """
+    if configuration is None:
+        from analyzer_config import get_config
+        configuration = get_config()
+    zones = dict(configuration.get('address_zones') or {})
+    zones_file = configuration.get('address_zones_file')
+    if zones_file:
+        zones.update(_load_zones_file(zones_file))
+    if local_addresses is None:
+        local_addresses = configuration.get('local_address', [])
+    subnet_prefix = configuration.get('same_subnet_prefix') or {}
+
+    key = (tuple(sorted((name, tuple(nets or [])) for name, nets in zones.items())),
+           tuple(local_addresses),
+           tuple(sorted(subnet_prefix.items())))
+    classifier = _classifier_cache.get(key)
+    if classifier is None:
+        classifier = AddressClassifier(zones, local_addresses, subnet_prefix)
+        _classifier_cache[key] = classifier
+    return classifier
@@ -3,14 +3,39 @@
 # All configs for execute script
 from os import getenv
 
+
+_reported_env = set()
+
+
+def env_number(name, cast=int, default=0):
+    """Числовая переменная окружения; некорректное значение - предупреждение (один раз) и default"""
+    value = getenv(name)
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        if (name, value) not in _reported_env:
+            _reported_env.add((name, value))
+            print(f"⚠️ {name}={value!r} is not a number, using {default}")
+        return default
+
+
 def get_config():
     return {
         "version": "2.3.0",
         "except_local_connection": True,
         "except_ipv6": False,
         "outgoing_ports": 1024,
-        "local_address": ["127.0.0.1", "::1", "::ffff:127.0.1"],
+        "local_address": ["127.0.0.1", "::1", "::ffff:127.0.0.1"],
         "local_interfaces": ["lo"],
+        # Пользовательские зоны адресов для CIDR классификатора, например:
+        # {"prod": ["10.20.0.0/16"], "office": ["192.168.0.0/16"], "partners": ["203.0.113.0/24"]}
+        "address_zones": {},
+        # YAML файл с дополнительными зонами (тот же формат), дополняет address_zones
+        "address_zones_file": getenv('GLACIER_ADDRESS_ZONES'),
+        # Префикс "одной подсети" для частных адресов вне зон
+        "same_subnet_prefix": {"v4": 24, "v6": 64},
         "file_name": "report_analyzer",
         "supported_formats": ["yaml", "json"],
         "date_format": "%d.%m.%Y %H:%M:%S",
@@ -24,7 +49,136 @@ def get_config():
             "region": "endpoint",
             "bucket": "analyzer",
             "reports_prefix": "reports/",
-            "default_region": "us-east-1"
+            "default_region": "us-east-1",
+            # Клиент создается один раз на процесс; пул соединений на параллельные выгрузки
+            "max_pool_connections": 16,
+            # Файлы отчета выгружаются параллельно; большие - частями (multipart)
+            "upload_workers": 4,
+            "multipart_threshold_mb": 8,
+            "multipart_chunksize_mb": 8,
+            "max_concurrency": 4,
+            # Не отправлять файлы, содержимое которых уже выгружено (манифест <отчет>.s3manifest);
+            # verify_remote - дополнительно сверять sha256/ETag объекта в S3 (HEAD запрос)
+            "skip_unchanged": True,
+            "verify_remote": True,
+            # Попыток запроса в botocore (режим standard); дальнейшие повторы - очередь upload_spool
+            "max_attempts": 3
+        },
+        "upload_spool": {
+            # Очередь выгрузки в S3: снимки отчетов в каталоге dir (по умолчанию
+            # <hostname>_<os>_upload_spool), фоновые повторы с экспоненциальной задержкой
+            # base_delay..max_delay секунд; старые записи сверх max_entries/max_mb удаляются.
+            # В конце запуска очередь выгружается не дольше drain_timeout секунд, остаток - следующим запуском
+            "enabled": True,
+            "dir": getenv('GLACIER_SPOOL_DIR'),
+            "max_mb": 200,
+            "max_entries": 50,
+            "base_delay": 5,
+            "max_delay": 600,
+            "drain_timeout": 60
+        },
+        "ip_database": {
+            # CSV (start,end,country,asn,provider) или бинарный снимок ip_database.py
+            "path": getenv('GLACIER_IP_DB')
+        },
+        "netflow_export": {
+            # Коллектор NetFlow v9 (nfcapd, pmacct) в формате host:port; пусто - экспорт выключен
+            "collector": getenv('GLACIER_NETFLOW_COLLECTOR'),
+            "source_id": 1,
+            "mtu": 1500,
+            # Повтор шаблонов каждые N пакетов или секунд
+            "template_refresh_packets": 20,
+            "template_refresh_seconds": 60
+        },
+        "security_rules": {
+            # Самая широкая сеть, до которой допускается агрегация адресов в правиле
+            "max_prefix": {"v4": 20, "v6": 48},
+            # Целевое количество CIDR в одном правиле
+            "max_cidrs_per_rule": 8,
+            # Максимальная доля не наблюдавшихся адресов среди разрешенных правилом
+            "max_over_permit_ratio": 0.5
+        },
+        "flow_sampling": {
+            # Отбор соединений на больших хостах: truncate (первые max_connections),
+            # sample (детерминированная выборка 1 из interval по хэшу потока, счетчики
+            # масштабируются) или topk (Space-Saving по процессу и удаленному сервису)
+            "mode": getenv('GLACIER_FLOW_SAMPLING', 'truncate'),
+            "max_connections": 100,
+            "interval": 100,
+            "top_k": 50,
+            # Соль хэша выборки: одинаковая на всех хостах - одинаковые решения для общих потоков
+            "seed": 0
+        },
+        "collectors": {
+            # Дорогие сборщики; ограничитель нагрузки (self_monitor) отключает их при превышении бюджета
+            "reverse_dns": True,
+            "lsof": True
+        },
+        "self_monitor": {
+            # Бюджет собственной нагрузки: процент одного ядра за цикл и RSS в МБ (0 - без ограничения)
+            "cpu_percent": env_number('GLACIER_CPU_BUDGET', float),
+            "rss_mb": env_number('GLACIER_RSS_BUDGET', float),
+            # Ограничения по порядку включения: reverse_dns, lsof, sampling, interval
+            "actions": ["reverse_dns", "lsof", "sampling", "interval"],
+            # Снятие последнего ограничения после N измерений ниже headroom доли бюджета
+            "recover_after": 5,
+            "headroom": 0.5,
+            # Выборка 1 из N при ограничении sampling; множитель и предел интервала при ограничении interval
+            "sample_interval": 10,
+            "interval_factor": 2,
+            "max_interval": 600
+        },
+        "flow_aggregation": {
+            # Сворачивание сокетов в строки по ключу сервиса (размер отчета растет с числом сервисов)
+            "enabled": (getenv('GLACIER_FLOW_AGGREGATION') or '').lower() in ('1', 'true', 'yes'),
+            # Поля ключа: process, protocol, local_ip, local_port, remote_ip, remote_port
+            "key": ["process", "protocol", "local_port", "remote_ip", "remote_port"],
+            # Порт клиентской стороны выше этого значения считается эфемерным и заменяется на '*'
+            "ephemeral_port_min": 1024
+        },
+        "cardinality": {
+            # Точность скетчей HyperLogLog: 2^precision байт, ошибка ~1.04/sqrt(2^precision)
+            "precision": 12,
+            # Точность скетчей по процессам и слушающим портам (их много, 1 КБ на ключ)
+            "key_precision": 10
+        },
+        "changes_log": {
+            # Записи, вытесненные из журнала изменений в памяти, дописываются
+            # в {hostname}_{os}_changes_log.jsonl.gz с ротацией по размеру
+            "spill": True,
+            "spill_max_bytes": 1024 * 1024,
+            "spill_backups": 5
+        },
+        "history_store": {
+            # SQLite база истории измерений (пусто - не ведется); поиск: glacier.py query
+            "path": getenv('GLACIER_HISTORY_DB', ''),
+            "retention_days": 30,
+            "vacuum_interval_hours": 24
+        },
+        "metrics_exporter": {
+            # Порт HTTP эндпоинта /metrics (OpenMetrics); 0 или пусто - эндпоинт выключен
+            "port": env_number('GLACIER_METRICS_PORT'),
+            "address": getenv('GLACIER_METRICS_ADDRESS', ''),
+            # Ряды по процессам: самые активные процессы, остальные суммируются в process="other"
+            "max_processes": 20
+        },
+        "report_compression": {
+            # Сжатие YAML/legacy/HTML отчетов при записи: gzip, zstd (пакет zstandard) или пусто;
+            # имена файлов прежние, чтение и выгрузка (Content-Encoding) определяют формат сами
+            "codec": getenv('GLACIER_COMPRESS', ''),
+            "level": None
+        },
+        "profiling": {
+            # Число последних измерений, по которым считаются p50/p95 длительностей этапов
+            "max_samples": 100,
+            # Период выборки стеков в режиме --profile (секунды)
+            "sample_interval": 0.005
+        },
+        "rollups": {
+            # Число ячеек колец временных рядов: 3 часа по минутам, 7 дней по часам, год по суткам
+            "minute": 180,
+            "hour": 168,
+            "day": 366
         },
         "analysis": {
             "max_connections": 50,
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Запись и воспроизведение входных данных измерений
+Источники сырых данных (таблица сокетов, сведения о процессах, обратный DNS,
+трекеры UDP/ICMP, системная информация) помечены декоратором captured():
+в режиме --record FILE их результаты и время каждого измерения пишутся в
+сжатый файл (gzip, строка JSON на измерение). В режиме --replay FILE те же
+вызовы возвращают записанные значения, поэтому весь конвейер (изменения,
+NetFlow, аналитика, HTML, выгрузка) выполняется без root, сети и пауз
+"""
+
+import gzip
+import json
+import platform
+import time
+from collections import Counter, deque
+from datetime import datetime
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, Optional
+
+CAPTURE_FORMAT = 'glacier-capture'
+CAPTURE_VERSION = 1
+
+
+def _call_key(args: tuple, kwargs: Dict[str, Any]) -> str:
+    return json.dumps([args, kwargs], sort_keys=True, default=str) if args or kwargs else ''
+
+
+class CaptureSession:
+    """
+    Режим записи/воспроизведения процесса (mode: None, 'record', 'replay')
+    Значения (JSON текст) хранятся по источнику и аргументам вызова в порядке вызовов:
+    повторный вызов с теми же аргументами в измерении получает следующее значение
+    """
+
+    def __init__(self):
+        self.mode: Optional[str] = None
+        self.header: Dict[str, Any] = {}
+        self.misses: Counter = Counter()
+        self._file = None
+        self._lines: Optional[Iterator[str]] = None
+        self._measurement: Optional[Dict[str, Any]] = None
+        self._queues: Dict[tuple, deque] = {}
+        # Вложенные вызовы источников (сведения о процессе внутри поиска по порту) не записываются
+        self._depth = 0
+
+    def record(self, path: str, **header):
+        """Начинает запись: заголовок (хост, ОС, версии) - первая строка файла"""
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self.header = dict(header, format=CAPTURE_FORMAT, version=CAPTURE_VERSION,
+                           created=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                           python=platform.python_version())
+        self._file.write(json.dumps(self.header, default=str) + '\n')
+        self.mode = 'record'
+
+    def replay(self, path: str) -> Dict[str, Any]:
+        """Открывает запись для воспроизведения; возвращает заголовок"""
+        self._file = gzip.open(path, 'rt', encoding='utf-8')
+        header = json.loads(self._file.readline() or '{}')
+        if header.get('format') != CAPTURE_FORMAT or header.get('version') != CAPTURE_VERSION:
+            self._file.close()
+            raise ValueError(f"{path} is not a glacier capture (version {CAPTURE_VERSION})")
+        self.header = header
+        self.misses = Counter()
+        self._lines = iter(self._file)
+        self.mode = 'replay'
+        return header
+
+    def begin_measurement(self) -> float:
+        """
+        Начало измерения; возвращает его время (при воспроизведении - записанное)
+        EOFError, если записанные измерения закончились
+        """
+        if self.mode == 'replay':
+            line = next(self._lines, None)
+            if line is None:
+                raise EOFError('capture has no more measurements')
+            self._measurement = json.loads(line)
+            self._queues = {}
+            for source, calls in self._measurement['calls'].items():
+                for key, value in calls:
+                    self._queues.setdefault((source, key), deque()).append(value)
+            return self._measurement['ts']
+        timestamp = time.time()
+        if self.mode == 'record':
+            self._measurement = {'ts': timestamp, 'calls': {}}
+        return timestamp
+
+    def end_measurement(self):
+        if self.mode == 'record' and self._measurement is not None:
+            self._file.write(json.dumps(self._measurement) + '\n')
+        self._measurement = None
+
+    def now(self) -> float:
+        """
+        Текущее время для отметок first_seen/last_seen; при записи и воспроизведении -
+        время начала измерения, иначе отметки записи и повтора расходятся на границе секунды
+        """
+        if self._measurement is not None:
+            return self._measurement['ts']
+        return time.time()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self.mode = None
+
+    def captured(self, source: str, encode: Optional[Callable[[Any], Any]] = None,
+                 decode: Optional[Callable[[Any], Any]] = None,
+                 default: Optional[Callable[..., Any]] = None):
+        """
+        Декоратор источника данных: encode/decode переводят результат в JSON и
+        обратно, default(*args) - значение для вызова, которого нет в записи
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if self._measurement is None or self._depth:
+                    return func(*args, **kwargs)
+                key = _call_key(args, kwargs)
+                if self.mode == 'replay':
+                    queue = self._queues.get((source, key))
+                    if not queue:
+                        self.misses[source] += 1
+                        return default(*args, **kwargs) if default else None
+                    value = json.loads(queue.popleft())
+                    return decode(value) if decode else value
+                self._depth += 1
+                try:
+                    result = func(*args, **kwargs)
+                finally:
+                    self._depth -= 1
+                # Сериализуется сразу: вызывающий код может изменить результат до конца измерения
+                self._measurement['calls'].setdefault(source, []).append(
+                    [key, json.dumps(encode(result) if encode else result, default=str)])
+                return result
+            return wrapper
+        return decorator
+
+
+def count_measurements(path: str) -> int:
+    """Число измерений в файле записи (без заголовка)"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return max(0, sum(1 for _ in f) - 1)
+
+
+# Общий сеанс процесса: модули-источники импортируют captured
+CAPTURE = CaptureSession()
+captured = CAPTURE.captured
+
+
+if __name__ == "__main__":
+    import os
+    import random
+    import tempfile
+
+    @captured('demo.lookup', default=lambda name: 'unknown')
+    def lookup(name):
+        return f"{name}-{random.randint(0, 9999)}"
+
+    path = os.path.join(tempfile.mkdtemp(), 'demo.capture.gz')
+    CAPTURE.record(path, hostname='demo')
+    recorded = []
+    for _ in range(3):
+        CAPTURE.begin_measurement()
+        recorded.append([lookup('db'), lookup('db'), lookup('web')])
+        CAPTURE.end_measurement()
+    CAPTURE.close()
+    print(f"💾 Recorded {count_measurements(path)} measurements: {recorded}")
+
+    CAPTURE.replay(path)
+    replayed = []
+    for _ in range(3):
+        CAPTURE.begin_measurement()
+        replayed.append([lookup('db'), lookup('db'), lookup('web')])
+        CAPTURE.end_measurement()
+    print(f"▶️ Replayed: {replayed} (identical: {replayed == recorded})")
+    CAPTURE.close()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Оценка числа уникальных значений (HyperLogLog, Flajolet et al., 2007)
+Вместо точных множеств собеседников, которые растут без ограничений на долгих
+запусках демона, хранятся скетчи фиксированного размера: 2^precision байт
+(4 КБ при precision=12, ошибка ~1.6%). Скетчи объединяются без потерь,
+поэтому счетчики одного хоста накапливаются между запусками, а отчеты разных
+хостов сводятся в оценку по всему парку
+"""
+
+import base64
+import hashlib
+import math
+import zlib
+from typing import Any, Dict, Iterable, Optional
+
+from address_classifier import split_host_port
+
+DEFAULT_PRECISION = 12
+DEFAULT_KEY_PRECISION = 10
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+ENCODING_PREFIX = 'hll1'
+
+# Псевдо-адреса без конкретного собеседника
+_NO_PEER = ('', '*', '0.0.0.0', '::', 'unknown')
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """Скетч HyperLogLog на 2^precision регистров по одному байту"""
+
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision: int = DEFAULT_PRECISION, registers: Optional[bytes] = None):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(f"HyperLogLog precision must be in {MIN_PRECISION}..{MAX_PRECISION}, got {precision}")
+        self.precision = precision
+        size = 1 << precision
+        if registers is not None and len(registers) != size:
+            raise ValueError(f"Expected {size} registers, got {len(registers)}")
+        self.registers = bytearray(registers) if registers is not None else bytearray(size)
+
+    def add(self, value: str):
+        self.add_hash(_hash64(value))
+
+    def add_hash(self, hashed: int):
+        """Добавляет готовый 64-битный хэш (один хэш на несколько скетчей)"""
+        bits = 64 - self.precision
+        index = hashed >> bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Iterable[str]):
+        for value in values:
+            self.add(value)
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        # Поправка для малых значений (linear counting); 64-битному хэшу поправка сверху не нужна
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def folded(self, precision: int) -> 'HyperLogLog':
+        """Скетч меньшей точности с тем же множеством (для объединения со скетчем другой точности)"""
+        if precision > self.precision:
+            raise ValueError(f"Cannot raise HyperLogLog precision {self.precision} to {precision}")
+        if precision == self.precision:
+            return self.copy()
+        shift = self.precision - precision
+        result = HyperLogLog(precision)
+        for index, rank in enumerate(self.registers):
+            if not rank:
+                continue
+            # Младшие биты старого индекса становятся старшими битами остатка хэша
+            low = index & ((1 << shift) - 1)
+            new_rank = shift - low.bit_length() + 1 if low else shift + rank
+            target = index >> shift
+            if new_rank > result.registers[target]:
+                result.registers[target] = new_rank
+        return result
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        """Объединяет other в текущий скетч (при разной точности результат получает меньшую)"""
+        if other.precision < self.precision:
+            folded = self.folded(other.precision)
+            self.precision, self.registers = folded.precision, folded.registers
+        elif other.precision > self.precision:
+            other = other.folded(self.precision)
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def copy(self) -> 'HyperLogLog':
+        return HyperLogLog(self.precision, bytes(self.registers))
+
+    def encode(self) -> str:
+        """Компактная строка для YAML/JSON: пустые регистры хорошо сжимаются"""
+        payload = base64.b64encode(zlib.compress(bytes(self.registers), 9)).decode('ascii')
+        return f"{ENCODING_PREFIX}:{self.precision}:{payload}"
+
+    @classmethod
+    def decode(cls, text: str) -> 'HyperLogLog':
+        prefix, precision, payload = text.split(':', 2)
+        if prefix != ENCODING_PREFIX:
+            raise ValueError(f"Unknown sketch encoding: {prefix}")
+        try:
+            registers = zlib.decompress(base64.b64decode(payload))
+        except zlib.error as e:
+            raise ValueError(f"Corrupted sketch: {e}") from e
+        return cls(int(precision), registers)
+
+    def __len__(self):
+        return self.count()
+
+
+def _peer_host(address: str) -> Optional[str]:
+    host, _ = split_host_port(address or '')
+    return None if host in _NO_PEER else host
+
+
+class CardinalityTracker:
+    """
+    Скетчи уникальных значений по измерениям отчета:
+    - host: собеседники (remote IP) и процессы всего хоста
+    - process_peers: собеседники каждого процесса
+    - port_clients: клиенты каждого слушающего порта ('tcp/443')
+    """
+
+    def __init__(self, precision: int = DEFAULT_PRECISION, key_precision: int = DEFAULT_KEY_PRECISION):
+        self.precision = precision
+        self.key_precision = key_precision
+        self.host = {'peers': HyperLogLog(precision), 'processes': HyperLogLog(precision)}
+        self.process_peers: Dict[str, HyperLogLog] = {}
+        self.port_clients: Dict[str, HyperLogLog] = {}
+
+    @classmethod
+    def from_config(cls, configuration: Dict[str, Any]) -> 'CardinalityTracker':
+        settings = configuration.get('cardinality', {})
+        return cls(settings.get('precision', DEFAULT_PRECISION),
+                   settings.get('key_precision', DEFAULT_KEY_PRECISION))
+
+    def _sketch(self, sketches: Dict[str, HyperLogLog], key: str) -> HyperLogLog:
+        sketch = sketches.get(key)
+        if sketch is None:
+            sketch = sketches[key] = HyperLogLog(self.key_precision)
+        return sketch
+
+    def add_connection(self, direction: str, connection: Dict[str, Any]):
+        process = connection.get('process', 'unknown')
+        if process != 'unknown':
+            self.host['processes'].add(process)
+        remote = connection.get('remote', {})
+        peer = _peer_host(remote.get('address', '') if isinstance(remote, dict) else str(remote))
+        if peer is None:
+            return
+        hashed = _hash64(peer)
+        self.host['peers'].add_hash(hashed)
+        self._sketch(self.process_peers, process).add_hash(hashed)
+        if direction == 'incoming':
+            _, port = split_host_port(connection.get('local', ''))
+            if port and port.isdigit():
+                self._sketch(self.port_clients, f"{connection.get('protocol', 'tcp')}/{port}").add_hash(hashed)
+
+    def add_connections(self, connections: Dict[str, Iterable[Dict[str, Any]]]):
+        for direction in ('incoming', 'outgoing'):
+            for connection in connections.get(direction, []):
+                self.add_connection(direction, connection)
+
+    def merge(self, other: 'CardinalityTracker') -> 'CardinalityTracker':
+        for name, sketch in other.host.items():
+            self.host.setdefault(name, HyperLogLog(self.precision)).merge(sketch)
+        for mine, theirs in ((self.process_peers, other.process_peers), (self.port_clients, other.port_clients)):
+            for key, sketch in theirs.items():
+                self._sketch(mine, key).merge(sketch)
+        return self
+
+    def summary(self, limit: Optional[int] = None) -> Dict[str, Any]:
+        """Оценки уникальных значений; limit ограничивает число ключей в разбивках"""
+        def ranked(sketches: Dict[str, HyperLogLog]) -> Dict[str, int]:
+            counts = sorted(((key, sketch.count()) for key, sketch in sketches.items()), key=lambda x: -x[1])
+            return dict(counts if limit is None else counts[:limit])
+
+        return {
+            'unique_remote_hosts': self.host['peers'].count(),
+            'unique_processes': self.host['processes'].count(),
+            'process_peers': ranked(self.process_peers),
+            'port_clients': ranked(self.port_clients),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'precision': self.precision,
+            'key_precision': self.key_precision,
+            'host': {name: sketch.encode() for name, sketch in self.host.items()},
+            'process_peers': {key: sketch.encode() for key, sketch in self.process_peers.items()},
+            'port_clients': {key: sketch.encode() for key, sketch in self.port_clients.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> 'CardinalityTracker':
+        data = data or {}
+        tracker = cls(data.get('precision', DEFAULT_PRECISION), data.get('key_precision', DEFAULT_KEY_PRECISION))
+        for name, text in data.get('host', {}).items():
+            tracker.host[name] = HyperLogLog.decode(text)
+        for section in ('process_peers', 'port_clients'):
+            sketches = getattr(tracker, section)
+            for key, text in data.get(section, {}).items():
+                sketches[str(key)] = HyperLogLog.decode(text)
+        return tracker
+
+
+def merge_cardinality(states: Iterable[Optional[Dict[str, Any]]]) -> CardinalityTracker:
+    """Сводит сохраненные скетчи (to_dict) нескольких отчетов, например всех хостов парка"""
+    merged = None
+    for state in states:
+        if not state:
+            continue
+        tracker = CardinalityTracker.from_dict(state)
+        merged = tracker if merged is None else merged.merge(tracker)
+    return merged or CardinalityTracker()
+
+
+if __name__ == "__main__":
+    import time
+
+    # Долгий запуск демона: 200k различных собеседников у трех процессов
+    tracker = CardinalityTracker()
+    started = time.perf_counter()
+    for i in range(200000):
+        tracker.add_connection('incoming', {
+            'local': '10.0.0.5:443', 'process': ('nginx', 'envoy', 'sshd')[i % 3], 'protocol': 'tcp',
+            'remote': {'address': f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:{40000 + i % 20000}"}})
+    print(f"⏱️ 200000 connections in {time.perf_counter() - started:.3f}s")
+    print(f"🔢 {tracker.summary()}")
+
+    encoded = tracker.to_dict()
+    size = sum(len(text) for section in ('host', 'process_peers', 'port_clients')
+               for text in encoded[section].values())
+    print(f"💾 Serialized sketches: {size} bytes")
+
+    other = CardinalityTracker()
+    for i in range(100000, 300000):
+        other.add_connection('outgoing', {'process': 'curl', 'remote': {'address': f"172.16.{i >> 8 & 255}.{i & 255}:443"}})
+    fleet = merge_cardinality([encoded, other.to_dict()])
+    print(f"🌐 Fleet peers: {fleet.summary()['unique_remote_hosts']} (exact: {200000 + 65536})")
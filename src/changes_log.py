@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Журнал изменений ограниченного размера
+В памяти (и в каждом промежуточном YAML отчете) хранятся последние max_entries
+записей. Вытесненные записи построчно (JSON) дописываются в сжатый gzip журнал
+с ротацией по размеру. Статистика изменений (по часам, категориям, времени
+измерений) ведется накопительно и не требует повторного прохода по журналу
+"""
+
+import gzip
+import json
+import os
+import zlib
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+DEFAULT_MAX_ENTRIES = 50
+DEFAULT_SPILL_MAX_BYTES = 1024 * 1024
+DEFAULT_SPILL_BACKUPS = 5
+
+
+class ChangeStatistics:
+    """Накопительная статистика записей журнала изменений"""
+
+    def __init__(self):
+        self.total = 0
+        self.by_hour: Dict[str, int] = {}
+        self.by_category: Dict[str, int] = {}
+        self.durations = {'count': 0, 'sum': 0.0, 'min': 0.0, 'max': 0.0}
+
+    def add(self, entry: Dict[str, Any]):
+        self.total += 1
+        timestamp = entry.get('timestamp') or ''
+        if ' ' in timestamp:
+            hour = timestamp.split(' ')[1].split(':')[0]
+            self.by_hour[hour] = self.by_hour.get(hour, 0) + 1
+        for category in (entry.get('changes') or {}):
+            self.by_category[category] = self.by_category.get(category, 0) + 1
+        duration = entry.get('time', 0)
+        if duration > 0:
+            durations = self.durations
+            if not durations['count'] or duration < durations['min']:
+                durations['min'] = duration
+            if not durations['count'] or duration > durations['max']:
+                durations['max'] = duration
+            durations['count'] += 1
+            durations['sum'] += duration
+
+    @property
+    def average_duration(self) -> float:
+        return self.durations['sum'] / self.durations['count'] if self.durations['count'] else 0
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Dict[str, Any]]) -> 'ChangeStatistics':
+        stats = cls()
+        for entry in entries:
+            stats.add(entry)
+        return stats
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'total': self.total, 'by_hour': dict(self.by_hour), 'by_category': dict(self.by_category),
+                'durations': {key: round(value, 3) for key, value in self.durations.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ChangeStatistics':
+        stats = cls()
+        stats.total = int(data.get('total', 0))
+        stats.by_hour = {str(hour): int(count) for hour, count in data.get('by_hour', {}).items()}
+        stats.by_category = {str(name): int(count) for name, count in data.get('by_category', {}).items()}
+        stats.durations.update(data.get('durations', {}))
+        return stats
+
+
+class SpillWriter:
+    """
+    Дописывает записи в gzip журнал JSON строк (path) с ротацией:
+    при превышении max_bytes файл становится path.1, path.1 - path.2 и т.д.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_SPILL_MAX_BYTES,
+                 backups: int = DEFAULT_SPILL_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.written = 0
+        self._raw = None
+        self._gzip = None
+
+    def _open(self):
+        # Файл, оборванный аварийным завершением, уходит в ротацию: член, дописанный
+        # после незавершенного, сделал бы нечитаемым весь хвост файла
+        if self.written == 0 and os.path.exists(self.path) and not _gzip_intact(self.path):
+            self._rotate()
+        # Новый gzip член в конце файла: файлы прошлых запусков остаются читаемыми
+        self._raw = open(self.path, 'ab')
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode='wb')
+
+    def _rotate(self):
+        self.close()
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def write(self, entry: Dict[str, Any]):
+        if self._gzip is None:
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+            self._open()
+        self._gzip.write(json.dumps(entry, ensure_ascii=False, default=str).encode('utf-8') + b'\n')
+        # Синхронизирующий сброс: запись читается даже при аварийном завершении процесса
+        self._gzip.flush()
+        self.written += 1
+        if self._raw.tell() >= self.max_bytes:
+            self._rotate()
+
+    def close(self):
+        if self._gzip is not None:
+            self._gzip.close()
+            self._raw.close()
+            self._gzip = self._raw = None
+
+
+def _gzip_intact(path: str) -> bool:
+    """Все gzip члены файла завершены и читаются"""
+    try:
+        with gzip.open(path, 'rb') as f:
+            while f.read(1024 * 1024):
+                pass
+        return True
+    except (EOFError, OSError, zlib.error):
+        return False
+
+
+def iter_spilled_entries(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Записи из журнала и его ротаций, от старых к новым. Файл, оборванный аварийным
+    завершением, читается до места обрыва
+    """
+    rotated = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        rotated.append(f"{path}.{index}")
+        index += 1
+    for filename in list(reversed(rotated)) + ([path] if os.path.exists(path) else []):
+        with gzip.open(filename, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    if line.endswith('\n'):
+                        yield json.loads(line)
+            except (EOFError, OSError, zlib.error):
+                continue
+
+
+class ChangesLog:
+    """Последние max_entries записей в deque; вытесненные уходят в spill (SpillWriter)"""
+
+    def __init__(self, entries: Iterable[Dict[str, Any]] = (), max_entries: int = DEFAULT_MAX_ENTRIES,
+                 spill: Optional[SpillWriter] = None, statistics: Optional[ChangeStatistics] = None):
+        self.entries = deque(maxlen=max_entries)
+        self.spill = spill
+        self.spilled = 0
+        entries = list(entries)
+        # Статистика восстанавливается из отчета или строится по загруженным записям один раз
+        self.statistics = statistics if statistics is not None else ChangeStatistics.from_entries(entries)
+        for entry in entries:
+            self._push(entry)
+
+    def _push(self, entry: Dict[str, Any]):
+        """Добавляет запись; ошибка spill (OSError) пробрасывается уже после добавления в deque"""
+        try:
+            if len(self.entries) == self.entries.maxlen:
+                evicted = self.entries[0]
+                self.spilled += 1
+                if self.spill is not None:
+                    self.spill.write(evicted)
+        finally:
+            self.entries.append(entry)
+
+    def append(self, entry: Dict[str, Any]):
+        self.statistics.add(entry)
+        self._push(entry)
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return list(self.entries)
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+    import tracemalloc
+
+    # Демон с изменениями на каждом измерении: память ограничена, история - на диске
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'changes.jsonl.gz')
+    tracemalloc.start()
+    log = ChangesLog(max_entries=50, spill=SpillWriter(path, max_bytes=64 * 1024, backups=3))
+    started = time.perf_counter()
+    for i in range(20000):
+        log.append({'id': i, 'timestamp': f"2025-02-01 {i // 60 % 24:02d}:{i % 60:02d}:00", 'time': 1.5,
+                    'changes': {'connections': {'added': [f"10.0.0.{i % 250}:443"]}}, 'first_run': i == 0})
+    log.close()
+    current, peak = tracemalloc.get_traced_memory()
+    print(f"⏱️ 20000 entries in {time.perf_counter() - started:.2f}s, in memory: {len(log)}, spilled: {log.spilled}")
+    print(f"💾 Memory: {current / 1024:.0f} KB (peak {peak / 1024:.0f} KB)")
+    files = sorted(os.listdir(directory))
+    print(f"🗂️ Spill files: {[(name, os.path.getsize(os.path.join(directory, name))) for name in files]}")
+    print(f"📜 Readable spilled entries: {sum(1 for _ in iter_spilled_entries(path))}")
+    print(f"📊 Statistics: total={log.statistics.total}, avg={log.statistics.average_duration}")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Сжатие файлов отчета (YAML, legacy, HTML) при записи
+Файл пишется потоком сразу в сжатом виде (gzip или zstd, если установлен
+пакет zstandard) под прежним именем; формат определяется по сигнатуре, поэтому
+чтение (open_report) одинаково для сжатых и обычных файлов, а выгрузка в S3
+получает Content-Encoding и браузер открывает HTML прямо из бакета.
+Модуль без зависимостей от анализатора: копируется в образ yaml_processor
+"""
+
+import gzip
+import mimetypes
+import os
+from typing import IO, Optional
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+CODECS = ('gzip', 'zstd')
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 10}
+
+# Типы содержимого отчетов для Content-Type при выгрузке
+_CONTENT_TYPES = {'.yaml': 'application/yaml', '.yml': 'application/yaml', '.legacy': 'application/yaml',
+                  '.html': 'text/html; charset=utf-8', '.json': 'application/json'}
+
+
+def _zstandard():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def resolve_codec(name: Optional[str]) -> Optional[str]:
+    """Кодек для записи: None/'none' - без сжатия, zstd без пакета zstandard - gzip"""
+    if not name or name == 'none':
+        return None
+    if name not in CODECS:
+        raise ValueError(f"unknown compression codec: {name} (expected one of {', '.join(CODECS)}, none)")
+    if name == 'zstd' and _zstandard() is None:
+        print("⚠️ zstandard is not installed, using gzip")
+        return 'gzip'
+    return name
+
+
+def detect_codec(path: str) -> Optional[str]:
+    """Кодек файла по сигнатуре: 'gzip', 'zstd' или None для несжатого"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(4)
+    except OSError:
+        return None
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if head == ZSTD_MAGIC:
+        return 'zstd'
+    return None
+
+
+def open_report(path: str, mode: str = 'r', codec: Optional[str] = None, level: Optional[int] = None) -> IO[str]:
+    """
+    Текстовый файл отчета: при записи ('w') сжимается кодеком codec (None - без
+    сжатия), при чтении ('r') кодек определяется по содержимому
+    """
+    if mode not in ('r', 'w'):
+        raise ValueError(f"unsupported mode: {mode}")
+    if mode == 'r':
+        codec = detect_codec(path)
+    if codec is None:
+        return open(path, mode, encoding='utf-8')
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    if codec == 'gzip':
+        return gzip.open(path, f"{mode}t", compresslevel=level, encoding='utf-8')
+    zstandard = _zstandard()
+    if zstandard is None:
+        raise RuntimeError(f"{path} is zstd compressed, install zstandard to read it")
+    if mode == 'w':
+        return zstandard.open(path, 'wt', cctx=zstandard.ZstdCompressor(level=level), encoding='utf-8')
+    return zstandard.open(path, 'rt', encoding='utf-8')
+
+
+def content_headers(path: str) -> dict:
+    """ExtraArgs выгрузки в S3: ContentType по расширению и ContentEncoding по содержимому"""
+    extension = os.path.splitext(path)[1].lower()
+    headers = {'ContentType': _CONTENT_TYPES.get(extension) or mimetypes.guess_type(path)[0]
+               or 'application/octet-stream'}
+    codec = detect_codec(path)
+    if codec is not None:
+        headers['ContentEncoding'] = codec
+    return headers
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    text = ''.join(f"- local: 10.0.0.5:{40000 + i}\n  remote: 52.1.{i % 256}.{i % 200}:443\n  process: nginx\n"
+                   for i in range(20000))
+    directory = tempfile.mkdtemp()
+    plain = os.path.join(directory, 'report.yaml')
+    with open_report(plain, 'w') as f:
+        f.write(text)
+    print(f"📄 plain: {os.path.getsize(plain)} bytes")
+    for codec in ('gzip', 'zstd'):
+        codec = resolve_codec(codec)
+        path = os.path.join(directory, f"report_{codec}.yaml")
+        started = time.perf_counter()
+        with open_report(path, 'w', codec) as f:
+            f.write(text)
+        elapsed = time.perf_counter() - started
+        with open_report(path) as f:
+            assert f.read() == text
+        print(f"🗜️ {codec}: {os.path.getsize(path)} bytes "
+              f"(x{os.path.getsize(plain) / os.path.getsize(path):.1f}) in {elapsed * 1000:.1f} ms, "
+              f"headers {content_headers(path)}")
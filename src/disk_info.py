@@ -1,6 +1,8 @@
 import os
-import psutil
 from analyzer_utils import execute_command
+from profiling import lazy_import
+
+psutil = lazy_import('psutil')
 
 def device_linux_statistics():
     all_devices = {}
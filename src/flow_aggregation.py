@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Агрегация потоков по ключу сервиса
+Тысячи сокетов с эфемерными портами к одному бэкенду сворачиваются в одну
+строку отчета: размер отчета растет с числом сервисов, а не сокетов.
+Свернутая строка сохраняет суммарный счетчик, минимальное first_seen,
+максимальное last_seen, число сокетов (flows) и число различных портов
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from address_classifier import split_host_port
+from netflow_generator import parse_seen_time
+
+# Поля, из которых можно составить ключ агрегации
+KEY_FIELDS = ('process', 'protocol', 'local_ip', 'local_port', 'remote_ip', 'remote_port')
+DEFAULT_KEY = ['process', 'protocol', 'local_port', 'remote_ip', 'remote_port']
+DEFAULT_EPHEMERAL_PORT_MIN = 1024
+
+WILDCARD = '*'
+SEEN_FORMAT = "%d.%m.%Y %H:%M:%S"
+
+
+def _port_number(port: Optional[str]) -> Optional[int]:
+    return int(port) if port is not None and port.isdigit() else None
+
+
+def _join_host_port(host: str, port: Any) -> str:
+    if ':' in host:
+        return f"[{host}]:{port}"
+    return f"{host}:{port}"
+
+
+def _seen(row: Dict[str, Any], key: str) -> Optional[float]:
+    timestamp = row.get(f'{key}_ts')
+    if timestamp is not None:
+        return timestamp
+    value = row.get(key)
+    if isinstance(value, str) and value not in ('', 'unknown'):
+        return parse_seen_time(value)
+    if isinstance(value, (int, float)):
+        return value
+    return None
+
+
+class _Group:
+    __slots__ = ('row', 'count', 'counted', 'flows', 'local_ports', 'remote_ports', 'first_seen', 'last_seen')
+
+    def __init__(self, row: Dict[str, Any]):
+        self.row = row
+        self.count = 0
+        self.counted = set()
+        self.flows = 0
+        self.local_ports = set()
+        self.remote_ports = set()
+        self.first_seen = None
+        self.last_seen = None
+
+
+class FlowAggregator:
+    """
+    Сворачивает строки соединений (формат network_info) по ключу
+    Порт клиентской стороны (локальный у исходящих, удаленный у входящих)
+    больше ephemeral_port_min считается эфемерным и заменяется в ключе на '*'
+    """
+
+    def __init__(self, key_fields: Optional[Iterable[str]] = None,
+                 ephemeral_port_min: int = DEFAULT_EPHEMERAL_PORT_MIN):
+        self.key_fields = list(key_fields or DEFAULT_KEY)
+        unknown = [field for field in self.key_fields if field not in KEY_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown aggregation key fields: {unknown}, expected {KEY_FIELDS}")
+        self.ephemeral_port_min = ephemeral_port_min
+        self.groups: Dict[str, Dict[Tuple, _Group]] = {'incoming': {}, 'outgoing': {}}
+        self.rows_in = 0
+
+    @classmethod
+    def from_config(cls, configuration: Dict[str, Any]) -> 'FlowAggregator':
+        settings = configuration.get('flow_aggregation', {})
+        return cls(settings.get('key'), settings.get('ephemeral_port_min', DEFAULT_EPHEMERAL_PORT_MIN))
+
+    def _client_port(self, port: Optional[int]) -> bool:
+        return port is not None and port > self.ephemeral_port_min
+
+    def add(self, direction: str, row: Dict[str, Any]):
+        """
+        Добавляет строку соединения. Строки с одинаковым _conn_key (сокеты,
+        разделяющие запись в хранилище network_info) учитываются в count один раз
+        """
+        self.rows_in += 1
+        remote = row.get('remote', {})
+        remote_address = remote.get('address', '') if isinstance(remote, dict) else str(remote)
+        local_ip, local_port_str = split_host_port(row.get('local', ''))
+        remote_ip, remote_port_str = split_host_port(remote_address)
+        local_port = _port_number(local_port_str)
+        remote_port = _port_number(remote_port_str)
+
+        values = {
+            'process': row.get('process', 'unknown'),
+            'protocol': row.get('protocol', 'tcp'),
+            'local_ip': local_ip,
+            'local_port': local_port_str,
+            'remote_ip': remote_ip,
+            'remote_port': remote_port_str,
+        }
+        if direction == 'incoming':
+            if self._client_port(remote_port):
+                values['remote_port'] = WILDCARD
+        elif self._client_port(local_port):
+            values['local_port'] = WILDCARD
+        key = tuple(values[field] for field in self.key_fields)
+
+        groups = self.groups.setdefault(direction, {})
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = _Group(row)
+
+        count_key = row.get('_conn_key', id(row))
+        if count_key not in group.counted:
+            group.counted.add(count_key)
+            group.count += row.get('count', 1)
+        group.flows += row.get('flows', 1)
+        if local_port is not None:
+            group.local_ports.add(local_port)
+        if remote_port is not None:
+            group.remote_ports.add(remote_port)
+
+        first_seen = _seen(row, 'first_seen')
+        last_seen = _seen(row, 'last_seen')
+        if first_seen is not None and (group.first_seen is None or first_seen < group.first_seen):
+            group.first_seen = first_seen
+        if last_seen is not None and (group.last_seen is None or last_seen > group.last_seen):
+            group.last_seen = last_seen
+
+    def add_connections(self, connections: Dict[str, List[Dict[str, Any]]]):
+        for direction in ('incoming', 'outgoing'):
+            for row in connections.get(direction, []):
+                self.add(direction, row)
+
+    def _build_row(self, group: _Group) -> Dict[str, Any]:
+        base = group.row
+        local_ip, _ = split_host_port(base.get('local', ''))
+        remote = base.get('remote', {})
+        remote_address = remote.get('address', '') if isinstance(remote, dict) else str(remote)
+        remote_ip, _ = split_host_port(remote_address)
+
+        row = {key: value for key, value in base.items() if not key.startswith('_')}
+        # Разные порты внутри группы показываются как '*'
+        if len(group.local_ports) > 1:
+            row['local'] = _join_host_port(local_ip, WILDCARD)
+        if len(group.remote_ports) > 1:
+            row['remote'] = dict(remote if isinstance(remote, dict) else {},
+                                 address=_join_host_port(remote_ip, WILDCARD))
+        row['count'] = group.count
+        row['flows'] = group.flows
+        row['local_ports'] = len(group.local_ports)
+        row['remote_ports'] = len(group.remote_ports)
+        if group.first_seen is not None:
+            row['first_seen'] = datetime.fromtimestamp(group.first_seen).strftime(SEEN_FORMAT)
+            row['first_seen_ts'] = int(group.first_seen)
+        if group.last_seen is not None:
+            row['last_seen'] = datetime.fromtimestamp(group.last_seen).strftime(SEEN_FORMAT)
+            row['last_seen_ts'] = int(group.last_seen)
+        return row
+
+    def rows(self, direction: str) -> List[Dict[str, Any]]:
+        """Свернутые строки направления, самые активные группы первыми"""
+        groups = sorted(self.groups.get(direction, {}).values(), key=lambda g: (-g.flows, -g.count))
+        return [self._build_row(group) for group in groups]
+
+    def result(self) -> Dict[str, List[Dict[str, Any]]]:
+        return {direction: self.rows(direction) for direction in ('incoming', 'outgoing')}
+
+
+def aggregate_connections(connections: Dict[str, List[Dict[str, Any]]],
+                          configuration: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """Сворачивает connections {'incoming': [...], 'outgoing': [...]} по настройкам flow_aggregation"""
+    aggregator = FlowAggregator.from_config(configuration)
+    aggregator.add_connections(connections)
+    return aggregator.result()
+
+
+if __name__ == "__main__":
+    import time
+
+    # API шлюз: 20k сокетов с эфемерными портами к трем бэкендам и входящие клиенты
+    connections = {'incoming': [], 'outgoing': []}
+    for i in range(20000):
+        backend = ('10.0.1.10', '10.0.1.11', '10.0.1.12')[i % 3]
+        connections['outgoing'].append({
+            'local': f"10.0.0.5:{32768 + i % 28000}", 'remote': {'name': 'backend', 'address': f"{backend}:8080"},
+            'process': 'envoy', 'protocol': 'tcp', 'count': 1,
+            'first_seen_ts': 1700000000 + i % 600, 'last_seen_ts': 1700000600 + i % 600})
+    for i in range(5000):
+        connections['incoming'].append({
+            'local': "10.0.0.5:443", 'remote': {'name': 'unknown', 'address': f"198.51.100.{i % 50}:{40000 + i}"},
+            'process': 'envoy', 'protocol': 'tcp', 'count': 1,
+            'first_seen': '01.02.2025 10:00:00', 'last_seen': '01.02.2025 10:05:00'})
+
+    started = time.perf_counter()
+    result = aggregate_connections(connections, {})
+    print(f"⏱️ {len(connections['outgoing']) + len(connections['incoming'])} rows -> "
+          f"{len(result['outgoing']) + len(result['incoming'])} in {time.perf_counter() - started:.3f}s")
+    for row in result['outgoing']:
+        print(f"   {row['local']} -> {row['remote']['address']}: flows={row['flows']}, "
+              f"local_ports={row['local_ports']}, {row['first_seen']} .. {row['last_seen']}")
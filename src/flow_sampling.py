@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Отбор потоков на больших хостах вместо жесткого усечения списка соединений
+- FlowSampler: детерминированная выборка 1 из N по хэшу ключа потока. Один и тот
+  же поток попадает (или не попадает) в выборку при каждом измерении, счетчики
+  умножаются на интервал выборки
+- SpaceSaving: top-K тяжелых потоков (Metwally et al., 2005) в памяти O(K).
+  Элемент с долей больше 1/K гарантированно остается в сводке, оценка счетчика
+  завышена не более чем на error (0 - счетчик точный)
+"""
+
+import hashlib
+import heapq
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+SAMPLING_MODES = ('truncate', 'sample', 'topk')
+
+
+def flow_hash(key: str, seed: int = 0) -> int:
+    """64-битный хэш ключа потока; не зависит от PYTHONHASHSEED, в отличие от hash()"""
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8,
+                             key=seed.to_bytes(8, 'big')).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class FlowSampler:
+    """Детерминированная выборка 1 из interval потоков по хэшу ключа"""
+
+    def __init__(self, interval: int = 1, seed: int = 0):
+        if interval < 1:
+            raise ValueError(f"Sampling interval must be >= 1, got {interval}")
+        self.interval = interval
+        self.seed = seed
+
+    def keep(self, key: str) -> bool:
+        return self.interval == 1 or flow_hash(key, self.seed) % self.interval == 0
+
+    def scale(self, count: int) -> int:
+        """Оценка исходного счетчика по выборке"""
+        return count * self.interval
+
+
+class SpaceSaving:
+    """
+    Сводка Space-Saving на capacity счетчиков
+    Новый ключ при заполненной сводке вытесняет минимальный счетчик и
+    наследует его значение (оно же - верхняя граница ошибки нового ключа)
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError(f"Space-Saving capacity must be >= 1, got {capacity}")
+        self.capacity = capacity
+        self.total = 0
+        self.counters: Dict[Hashable, List[int]] = {}   # key -> [count, error]
+        self.items: Dict[Hashable, Any] = {}             # key -> представитель (первый элемент ключа)
+        # Ленивая куча минимумов: устаревшие записи пропускаются при извлечении
+        self._heap: List[Tuple[int, int, Hashable]] = []
+        self._pushes = 0
+
+    def _push(self, key: Hashable, count: int):
+        self._pushes += 1
+        heapq.heappush(self._heap, (count, self._pushes, key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c, i, k) for i, (k, (c, _)) in enumerate(self.counters.items())]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self) -> Tuple[Hashable, int]:
+        while True:
+            count, _, key = heapq.heappop(self._heap)
+            counter = self.counters.get(key)
+            if counter is not None and counter[0] == count:
+                return key, count
+
+    def add(self, key: Hashable, weight: int = 1, item: Any = None):
+        self.total += weight
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += weight
+            self._push(key, counter[0])
+            return
+        if len(self.counters) < self.capacity:
+            self.counters[key] = [weight, 0]
+        else:
+            evicted, floor = self._pop_min()
+            del self.counters[evicted]
+            self.items.pop(evicted, None)
+            self.counters[key] = [floor + weight, floor]
+        self.items[key] = item
+        self._push(key, self.counters[key][0])
+
+    def top(self, k: Optional[int] = None) -> List[Tuple[Hashable, int, int]]:
+        """(ключ, оценка, ошибка) по убыванию оценки"""
+        ranked = sorted(((key, c, e) for key, (c, e) in self.counters.items()), key=lambda x: -x[1])
+        return ranked if k is None else ranked[:k]
+
+    def __len__(self):
+        return len(self.counters)
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    random.seed(1)
+    # Балансировщик: 80k сокетов, несколько тяжелых сервисов и длинный хвост клиентов
+    services = [('nginx', '10.0.1.10', 8080)] * 40000 + [('nginx', '10.0.1.11', 8080)] * 20000 + \
+               [('haproxy', '10.0.2.5', 5432)] * 5000
+    services += [('curl', f'198.51.100.{i % 250}', 40000 + i) for i in range(15000)]
+    random.shuffle(services)
+
+    started = time.perf_counter()
+    summary = SpaceSaving(50)
+    for service in services:
+        summary.add(service)
+    print(f"⏱️ Space-Saving: {len(services)} sockets in {time.perf_counter() - started:.3f}s")
+    for key, count, error in summary.top(5):
+        print(f"   {key}: {count} (±{error})")
+
+    sampler = FlowSampler(100)
+    kept = sum(1 for i, s in enumerate(services) if sampler.keep(f"{s}|{i}"))
+    print(f"🎯 Sampling 1:{sampler.interval}: kept {kept}, estimated {sampler.scale(kept)} of {len(services)}")
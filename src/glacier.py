@@ -3,31 +3,63 @@
 
 import argparse
 import time
-import yaml
-import distro
 import random
 import syslog
 import sys
 import platform
-from S3Client import *
-from analyzer_utils import *
-from analyzer_config import *
-from firewall_info import *
-from postgresql_info import *
-from network_info import *
-from disk_info import *
-from other_info import *
-from netflow_generator import NetFlowGenerator  # Поддержка NetFlow v9 стандартов (RFC 3954)
+import sqlite3
+from collections import Counter
 from datetime import datetime as dt
 import os
 import socket
-import psutil
 
-# Импортируем UDP трекер в зависимости от ОС
-if platform.system() == 'Darwin':
-    from udp_tracker_macos import get_udp_information_macos
-else:
-    from udp_tracker_module import get_udp_information
+# Время импорта подсистем учитывается в IMPORTS и выводится в режиме --profile;
+# yaml, psutil и boto3 (S3Client) загружаются при первом обращении
+from profiling import IMPORTS, SPANS, Profiler, format_imports, format_timings, import_span, lazy_import, span, timed
+
+yaml = lazy_import('yaml')
+psutil = lazy_import('psutil')
+
+with import_span('config'):
+    from analyzer_utils import *
+    from analyzer_config import *
+    from capture import CAPTURE, captured, count_measurements
+    from compression import CODECS, open_report, resolve_codec
+
+with import_span('collectors'):
+    from firewall_info import *
+    from postgresql_info import *
+    from network_info import *
+    from disk_info import *
+    from other_info import *
+
+    # Импортируем UDP трекер в зависимости от ОС
+    if platform.system() == 'Darwin':
+        from udp_tracker_macos import get_udp_information_macos
+    else:
+        from udp_tracker_module import get_udp_information
+
+with import_span('reports'):
+    from netflow_generator import NetFlowGenerator, YAMLReportSink, IPFIXReportSink, LegacyReportSink  # Поддержка NetFlow v9 стандартов (RFC 3954)
+    from ip_database import get_ip_database
+    from address_classifier import get_address_classifier, split_host_port
+    from security_rules import RuleSynthesizer
+    from flow_sampling import SAMPLING_MODES
+    from flow_aggregation import FlowAggregator, aggregate_connections
+    from netflow_exporter import get_netflow_exporter
+    from ipfix import read_ipfix_report
+
+with import_span('storage'):
+    from cardinality import CardinalityTracker
+    from rollups import RollupStore, count_connection
+    from changes_log import ChangesLog, ChangeStatistics, SpillWriter
+    from history_store import HistoryStore, query_main
+
+with import_span('runtime'):
+    from metrics_exporter import MetricsExporter
+    from self_monitor import AdaptiveThrottle, SelfMonitor
+    from S3Client import *
+    from upload_spool import UploadSpool
 
 # Константы для ограничения размера данных
 MAX_CONNECTIONS = 50  # Максимум соединений в отчете
@@ -155,6 +187,7 @@ def get_system_users():
     
     return users_info
 
+@captured('extended_system_info', default=lambda: {})
 def collect_extended_system_info():
     """Собирает расширенную информацию о системе для детальных секций"""
     # Собираем информацию об ОС
@@ -230,7 +263,8 @@ def collect_extended_system_info():
     # Собираем информацию о Docker контейнерах
     docker_info = {}
     try:
-        docker_containers = get_docker_information()
+        with span('collect.docker'):
+            docker_containers = get_docker_information()
         docker_info = {
             'available': len(docker_containers) > 0 or check_docker_available(),
             'containers': docker_containers,
@@ -251,7 +285,8 @@ def collect_extended_system_info():
     # Собираем информацию о файрволе
     firewall_info = {}
     try:
-        firewall_info = get_fw_information()
+        with span('collect.firewall'):
+            firewall_info = get_fw_information()
         rules_count = 0
         if 'iptables' in firewall_info:
             for chain, rules in firewall_info['iptables'].items():
@@ -275,7 +310,8 @@ def collect_extended_system_info():
     # Собираем информацию о пользователях
     users_info = {}
     try:
-        users_info = get_system_users()
+        with span('collect.users'):
+            users_info = get_system_users()
         print(f"👥 Пользователи: {len(users_info)} записей")
     except Exception as e:
         users_info = {}
@@ -298,19 +334,44 @@ def check_docker_available():
     except:
         return False
 
-def collect_system_data():
-    """Собирает все данные системы в оптимизированном формате"""
+def collect_system_data(cardinality=None):
+    """
+    Собирает все данные системы в оптимизированном формате
+    cardinality (CardinalityTracker) получает все соединения до усечения списков
+    """
     networks = {'connections': {}, 'remote': {}, 'tcp': [], 'udp': []}
-    
-    # Получаем сетевые данные
-    networks = get_connections(networks,
-                              configuration['outgoing_ports'],
-                              configuration['local_address'],
-                              configuration['except_ipv6'],
-                              configuration['except_local_connection'])
-    
-    # Ограничиваем количество соединений
-    if 'connections' in networks:
+    aggregate = configuration['flow_aggregation']['enabled']
+    # При агрегации соединения трекеров не усекаются: они сворачиваются вместе с остальными
+    tracker_limit = None if aggregate else MAX_UDP_CONNECTIONS
+    
+    # Получаем сетевые данные (длительность каждого сборщика - этапы collect.* в profiling.SPANS)
+    with span('collect.connections'):
+        networks = get_connections(networks,
+                                  configuration['outgoing_ports'],
+                                  configuration['local_address'],
+                                  configuration['except_ipv6'],
+                                  configuration['except_local_connection'],
+                                  configuration['flow_sampling'],
+                                  aggregate,
+                                  configuration['collectors'])
+    
+    # Кардинальность и счетчики - только по соединениям этого измерения (без дополнения из истории)
+    measured_connections = live_connections(networks)
+    for conn_type in ['incoming', 'outgoing']:
+        measured_connections.setdefault(conn_type, [])
+    if cardinality is not None:
+        cardinality.add_connections(measured_connections)
+    
+    # Счетчики для временных рядов (rollups.py) - тоже до усечения списков
+    measurement_totals = Counter()
+    for conn_type in ['incoming', 'outgoing']:
+        for conn in measured_connections.get(conn_type, []):
+            count_connection(measurement_totals, conn_type, conn)
+    measurement_totals['tcp_listen_ports'] = len(networks.get('tcp', []))
+    measurement_totals['udp_listen_ports'] = len(networks.get('udp', []))
+    
+    # Ограничиваем количество соединений (выборка, top-K и агрегация ограничивают набор сами)
+    if 'connections' in networks and configuration['flow_sampling']['mode'] == 'truncate' and not aggregate:
         for conn_type in ['incoming', 'outgoing']:
             if conn_type in networks['connections']:
                 networks['connections'][conn_type] = networks['connections'][conn_type][:MAX_CONNECTIONS//2]
@@ -320,128 +381,157 @@ def collect_system_data():
     networks['udp'] = networks['udp'][:MAX_PORTS//2]
     
     # Получаем ICMP трафик
-    try:
-        from icmp_tracker import get_icmp_information
-        icmp_info = get_icmp_information(False)
+    with span('collect.icmp'):
+        try:
+            from icmp_tracker import get_icmp_information
+            icmp_info = get_icmp_information(False)
         
-        print(f"🔍 ICMP tracker result: {icmp_info.get('total_connections', 0)} connections, {icmp_info.get('total_packets', 0)} packets")
+            print(f"🔍 ICMP tracker result: {icmp_info.get('total_connections', 0)} connections, {icmp_info.get('total_packets', 0)} packets")
         
-        # Интегрируем ICMP соединения в основную структуру соединений
-        if icmp_info and icmp_info.get('connections'):
-            print(f"🔍 Found ICMP connections: {len(icmp_info['connections'])}")
+            # Интегрируем ICMP соединения в основную структуру соединений
+            if icmp_info and icmp_info.get('connections'):
+                print(f"🔍 Found ICMP connections: {len(icmp_info['connections'])}")
             
-            for icmp_conn in icmp_info['connections'][:MAX_UDP_CONNECTIONS]:
-                # Парсим соединение
-                connection_str = icmp_conn.get('connection', '')
-                if ' -> ' in connection_str:
-                    local_part, remote_part = connection_str.split(' -> ', 1)
+                for icmp_conn in icmp_info['connections'][:tracker_limit]:
+                    # Парсим соединение
+                    connection_str = icmp_conn.get('connection', '')
+                    if ' -> ' in connection_str:
+                        local_part, remote_part = connection_str.split(' -> ', 1)
                     
-                    # Создаем структуру соединения в формате анализатора
-                    conn_info = {
-                        "local": local_part,
-                        "remote": {"name": "unknown", "address": remote_part},
-                        "process": icmp_conn.get('process', 'unknown'),
-                        "protocol": "icmp",
-                        "first_seen": 'unknown',
-                        "last_seen": 'unknown',
-                        "count": icmp_conn.get('packet_count', 1)
-                    }
+                        # Создаем структуру соединения в формате анализатора
+                        conn_info = {
+                            "local": local_part,
+                            "remote": {"name": "unknown", "address": remote_part},
+                            "process": icmp_conn.get('process', 'unknown'),
+                            "protocol": "icmp",
+                            "first_seen": 'unknown',
+                            "last_seen": 'unknown',
+                            "count": icmp_conn.get('packet_count', 1)
+                        }
                     
-                    # Определяем направление и добавляем в соответствующий список
-                    direction = icmp_conn.get('direction', 'outgoing')
-                    if direction == 'incoming':
-                        networks['connections']['incoming'].append(conn_info)
-                    else:
-                        networks['connections']['outgoing'].append(conn_info)
+                        # Определяем направление и добавляем в соответствующий список
+                        direction = icmp_conn.get('direction', 'outgoing')
+                        if cardinality is not None:
+                            cardinality.add_connection(direction, conn_info)
+                        count_connection(measurement_totals, direction, conn_info)
+                        if direction == 'incoming':
+                            networks['connections']['incoming'].append(conn_info)
+                            measured_connections['incoming'].append(conn_info)
+                        else:
+                            networks['connections']['outgoing'].append(conn_info)
+                            measured_connections['outgoing'].append(conn_info)
                     
-                    # Добавляем удаленный адрес в список (если это не псевдо-соединение)
-                    if ':' in remote_part and '*' not in remote_part:
-                        remote_ip = remote_part.split(':')[0]
-                        networks['remote'][remote_ip] = {
-                            'name': 'unknown',
-                            'type': direction,
-                            'port': remote_part.split(':')[1] if ':' in remote_part else 'icmp'
-                        }
-        else:
-            print(f"⚠️ ICMP connections not found or empty")
+                        # Добавляем удаленный адрес в список (если это не псевдо-соединение)
+                        if ':' in remote_part and '*' not in remote_part:
+                            remote_ip = remote_part.split(':')[0]
+                            networks['remote'][remote_ip] = {
+                                'name': 'unknown',
+                                'type': direction,
+                                'port': remote_part.split(':')[1] if ':' in remote_part else 'icmp'
+                            }
+            else:
+                print(f"⚠️ ICMP connections not found or empty")
         
-    except Exception as e:
-        print(f"⚠️ Error getting ICMP data: {e}")
-        icmp_info = {}
+        except Exception as e:
+            print(f"⚠️ Error getting ICMP data: {e}")
+            icmp_info = {}
 
     # Получаем UDP трафик и интегрируем его в основные соединения
-    try:
-        if platform.system() == 'Darwin':
-            udp_info = get_udp_information_macos(False)
-        else:
-            udp_info = get_udp_information(False)
+    with span('collect.udp'):
+        try:
+            if platform.system() == 'Darwin':
+                udp_info = get_udp_information_macos(False)
+            else:
+                udp_info = get_udp_information(False)
         
-        print(f"🔍 UDP tracker result: {len(udp_info.get('udp_connections', []))} connections")
+            print(f"🔍 UDP tracker result: {len(udp_info.get('udp_connections', []))} connections")
         
-        # Интегрируем UDP соединения в основную структуру соединений
-        if udp_info and udp_info.get('udp_connections'):
-            print(f"🔍 Found UDP connections: {len(udp_info['udp_connections'])}")
+            # Интегрируем UDP соединения в основную структуру соединений
+            if udp_info and udp_info.get('udp_connections'):
+                print(f"🔍 Found UDP connections: {len(udp_info['udp_connections'])}")
             
-            for udp_conn in udp_info['udp_connections'][:MAX_UDP_CONNECTIONS]:
-                # Парсим соединение
-                connection_str = udp_conn.get('connection', '')
-                if ' -> ' in connection_str:
-                    local_part, remote_part = connection_str.split(' -> ', 1)
+                for udp_conn in udp_info['udp_connections'][:tracker_limit]:
+                    # Парсим соединение
+                    connection_str = udp_conn.get('connection', '')
+                    if ' -> ' in connection_str:
+                        local_part, remote_part = connection_str.split(' -> ', 1)
                     
-                    # Создаем структуру соединения в формате анализатора
-                    conn_info = {
-                        "local": local_part,
-                        "remote": {"name": "unknown", "address": remote_part},
-                        "process": udp_conn.get('process', 'unknown'),
-                        "protocol": "udp",
-                        "first_seen": udp_conn.get('first_seen', 'unknown'),
-                        "last_seen": udp_conn.get('last_seen', 'unknown'),
-                        "count": udp_conn.get('packet_count', 1)
-                    }
+                        # Создаем структуру соединения в формате анализатора
+                        conn_info = {
+                            "local": local_part,
+                            "remote": {"name": "unknown", "address": remote_part},
+                            "process": udp_conn.get('process', 'unknown'),
+                            "protocol": "udp",
+                            "first_seen": udp_conn.get('first_seen', 'unknown'),
+                            "last_seen": udp_conn.get('last_seen', 'unknown'),
+                            "count": udp_conn.get('packet_count', 1)
+                        }
+                        # Epoch время от трекера, если есть (используется NetFlow генератором)
+                        for ts_key in ('first_seen_ts', 'last_seen_ts'):
+                            if ts_key in udp_conn:
+                                conn_info[ts_key] = udp_conn[ts_key]
                     
-                    # Определяем направление и добавляем в соответствующий список
-                    direction = udp_conn.get('direction', 'outgoing')
-                    if direction == 'incoming':
-                        networks['connections']['incoming'].append(conn_info)
-                    else:
-                        networks['connections']['outgoing'].append(conn_info)
+                        # Определяем направление и добавляем в соответствующий список
+                        direction = udp_conn.get('direction', 'outgoing')
+                        if cardinality is not None:
+                            cardinality.add_connection(direction, conn_info)
+                        count_connection(measurement_totals, direction, conn_info)
+                        if direction == 'incoming':
+                            networks['connections']['incoming'].append(conn_info)
+                            measured_connections['incoming'].append(conn_info)
+                        else:
+                            networks['connections']['outgoing'].append(conn_info)
+                            measured_connections['outgoing'].append(conn_info)
                     
-                    # Добавляем удаленный адрес в список
-                    if ':' in remote_part:
-                        remote_ip = remote_part.split(':')[0]
-                        networks['remote'][remote_ip] = {
-                            'name': 'unknown',
-                            'type': direction,
-                            'port': remote_part.split(':')[1] if ':' in remote_part else 'unknown'
-                        }
-        else:
-            print(f"⚠️ UDP connections not found or empty")
-        
-        # Если UDP трекер не дал результатов, пытаемся получить UDP соединения из основного сканирования
-        if not udp_info.get('udp_connections'):
-            print(f"🔍 Trying to find UDP connections in main scanning...")
-            # Проверяем, есть ли UDP соединения в networks
-            all_connections = networks.get('connections', {})
-            udp_found_in_main = 0
-            for conn_type in ['incoming', 'outgoing']:
-                for conn in all_connections.get(conn_type, []):
-                    if conn.get('protocol') == 'udp':
-                        udp_found_in_main += 1
-            
-            if udp_found_in_main > 0:
-                print(f"✅ Found {udp_found_in_main} UDP connections in main scanning")
+                        # Добавляем удаленный адрес в список
+                        if ':' in remote_part:
+                            remote_ip = remote_part.split(':')[0]
+                            networks['remote'][remote_ip] = {
+                                'name': 'unknown',
+                                'type': direction,
+                                'port': remote_part.split(':')[1] if ':' in remote_part else 'unknown'
+                            }
             else:
-                print(f"ℹ️ UDP connections not found in tracker or main scanning")
+                print(f"⚠️ UDP connections not found or empty")
+        
+            # Если UDP трекер не дал результатов, пытаемся получить UDP соединения из основного сканирования
+            if not udp_info.get('udp_connections'):
+                print(f"🔍 Trying to find UDP connections in main scanning...")
+                # Проверяем, есть ли UDP соединения в networks
+                all_connections = networks.get('connections', {})
+                udp_found_in_main = 0
+                for conn_type in ['incoming', 'outgoing']:
+                    for conn in all_connections.get(conn_type, []):
+                        if conn.get('protocol') == 'udp':
+                            udp_found_in_main += 1
+            
+                if udp_found_in_main > 0:
+                    print(f"✅ Found {udp_found_in_main} UDP connections in main scanning")
+                else:
+                    print(f"ℹ️ UDP connections not found in tracker or main scanning")
         
-        # Ограничиваем UDP соединения
-        if udp_info and 'udp_connections' in udp_info:
-            udp_info['udp_connections'] = udp_info['udp_connections'][:MAX_UDP_CONNECTIONS]
-    except Exception as e:
-        print(f"⚠️ Error getting UDP data: {e}")
-        udp_info = {}
+            # Ограничиваем UDP соединения
+            if udp_info and 'udp_connections' in udp_info:
+                udp_info['udp_connections'] = udp_info['udp_connections'][:MAX_UDP_CONNECTIONS]
+        except Exception as e:
+            print(f"⚠️ Error getting UDP data: {e}")
+            udp_info = {}
+    
+    # Сворачиваем сокеты по ключу сервиса: эфемерные порты к одному бэкенду - одна строка
+    if aggregate and networks.get('connections'):
+        with span('collect.aggregation'):
+            aggregator = FlowAggregator.from_config(configuration)
+            aggregator.add_connections(networks['connections'])
+            networks['connections'] = aggregator.result()
+            measured_connections = aggregate_connections(measured_connections, configuration)
+        folded = sum(len(rows) for rows in networks['connections'].values())
+        print(f"🧮 Flow aggregation: {aggregator.rows_in} sockets -> {folded} service rows")
     
     # Получаем расширенную системную информацию
-    extended_info = collect_extended_system_info()
+    with span('collect.extended_system_info'):
+        extended_info = collect_extended_system_info()
+    with span('collect.interfaces'):
+        interfaces = get_interfaces(configuration['local_interfaces'])
     
     return {
         'connections': networks.get('connections', {}),
@@ -449,12 +539,15 @@ def collect_system_data():
         'tcp_ports': networks.get('tcp', []),
         'udp_ports': networks.get('udp', []),
         'icmp_connections': networks.get('icmp', 0),  # Добавляем ICMP в возвращаемые данные
-        'interfaces': get_interfaces(configuration['local_interfaces']),
+        'interfaces': interfaces,
         'udp_traffic': udp_info,
         'icmp_traffic': icmp_info,  # Добавляем полную информацию об ICMP трафике
-        'extended_system_info': extended_info
+        'extended_system_info': extended_info,
+        'measurement_totals': dict(measurement_totals),
+        'measured_connections': measured_connections
     }
 
+@timed('analyze.detect_changes')
 def detect_changes(previous_state, current_state):
     """Обнаруживает изменения между предыдущим и текущим состоянием (оптимизированная версия)"""
     changes = {}
@@ -545,36 +638,28 @@ def generate_measurements_statistics(cumulative_state):
     first_run = cumulative_state.get('first_run', 'unknown')
     last_update = cumulative_state.get('last_update', 'unknown')
     
-    # Анализируем изменения по времени
-    changes_by_hour = {}
-    changes_by_category = {}
-    measurement_durations = []
-    
-    for change in changes_log:
-        # По часам
-        timestamp = change.get('timestamp', '')
-        if ' ' in timestamp:
-            hour = timestamp.split(' ')[1].split(':')[0]
-            changes_by_hour[hour] = changes_by_hour.get(hour, 0) + 1
-        
-        # По категориям
-        changes_dict = change.get('changes', {})
-        for category in changes_dict.keys():
-            changes_by_category[category] = changes_by_category.get(category, 0) + 1
-        
-        # Время выполнения
-        duration = change.get('time', 0)
-        if duration > 0:
-            measurement_durations.append(duration)
-    
-    # Вычисляем статистики
-    avg_duration = sum(measurement_durations) / len(measurement_durations) if measurement_durations else 0
-    min_duration = min(measurement_durations) if measurement_durations else 0
-    max_duration = max(measurement_durations) if measurement_durations else 0
+    # Накопительная статистика журнала (changes_log.py) учитывает и вытесненные записи;
+    # для отчетов без нее считаем по сохраненным записям
+    if cumulative_state.get('changes_stats'):
+        change_stats = ChangeStatistics.from_dict(cumulative_state['changes_stats'])
+    else:
+        change_stats = ChangeStatistics.from_entries(changes_log)
+    changes_by_hour = change_stats.by_hour
+    changes_by_category = change_stats.by_category
+    total_changes = change_stats.total
+    avg_duration = change_stats.average_duration
+    min_duration = change_stats.durations['min']
+    max_duration = change_stats.durations['max']
+    
+    # Время сбора по всем измерениям (включая измерения без изменений) из колец временных рядов
+    if cumulative_state.get('rollups'):
+        durations = RollupStore.from_dict(cumulative_state['rollups']).summary('collection_seconds')
+        if durations['count']:
+            avg_duration, min_duration, max_duration = durations['avg'], durations['min'], durations['max']
     
     return {
         'total_measurements': total_measurements,
-        'total_changes': len(changes_log),
+        'total_changes': total_changes,
         'first_run': first_run,
         'last_update': last_update,
         'changes_by_hour': changes_by_hour,
@@ -586,8 +671,12 @@ def generate_measurements_statistics(cumulative_state):
         'most_changed_category': max(changes_by_category.items(), key=lambda x: x[1]) if changes_by_category else ('unknown', 0)
     }
 
-def generate_compact_html_report(cumulative_state, html_filename):
-    """Генерирует улучшенный HTML отчет с кнопками навигации и интерактивным дизайном"""
+@timed('render.html')
+def generate_compact_html_report(cumulative_state, html_filename, codec=None, level=None):
+    """
+    Генерирует улучшенный HTML отчет с кнопками навигации и интерактивным дизайном
+    codec/level - сжатие файла (compression.open_report)
+    """
     current_state = cumulative_state.get('current_state', {})
     changes_log = cumulative_state.get('changes_log', [])
     
@@ -645,16 +734,29 @@ def generate_compact_html_report(cumulative_state, html_filename):
                 'last_seen': udp_conn.get('last_seen', 'unknown')
             })
     
-    # Подсчитываем уникальные процессы и хосты
-    unique_processes = set()
-    unique_hosts = set()
-    for conn in incoming_connections + outgoing_connections:
-        if conn.get('process') != 'unknown':
-            unique_processes.add(conn.get('process', 'unknown'))
-        remote_addr = conn.get('remote', {}).get('address', '')
-        if remote_addr and ':' in remote_addr:
-            host_ip = remote_addr.split(':')[0]
-            unique_hosts.add(host_ip)
+    # Подсчитываем уникальные процессы и хосты: скетчи HyperLogLog учитывают все
+    # соединения за время работы, множества - только текущие (усеченные) списки
+    host_sketches = None
+    if cumulative_state.get('cardinality'):
+        try:
+            host_sketches = CardinalityTracker.from_dict(cumulative_state['cardinality']).host
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"⚠️ Failed to restore cardinality sketches: {e}, counting current lists")
+    if host_sketches is not None:
+        processes_count = host_sketches['processes'].count()
+        hosts_count = host_sketches['peers'].count()
+    else:
+        unique_processes = set()
+        unique_hosts = set()
+        for conn in incoming_connections + outgoing_connections:
+            if conn.get('process') != 'unknown':
+                unique_processes.add(conn.get('process', 'unknown'))
+            remote_addr = conn.get('remote', {}).get('address', '')
+            if remote_addr and ':' in remote_addr:
+                host_ip = remote_addr.split(':')[0]
+                unique_hosts.add(host_ip)
+        processes_count = len(unique_processes)
+        hosts_count = len(unique_hosts)
     
     # Аналитика для обзора
     # Топ процессы по количеству соединений
@@ -685,18 +787,35 @@ def generate_compact_html_report(cumulative_state, html_filename):
     
     top_hosts = sorted(host_stats.items(), key=lambda x: x[1], reverse=True)[:5]
     
-    # Статистика по времени
-    recent_connections = [c for c in incoming_connections + outgoing_connections if c.get('last_seen') != 'unknown']
+    # Статистика по времени: среднее число соединений по часам суток из колец временных рядов,
+    # без них - по last_seen текущих соединений
     activity_hours = {}
-    for conn in recent_connections:
-        try:
-            last_seen = conn.get('last_seen', '')
-            if ' ' in last_seen:
-                time_part = last_seen.split(' ')[1]
-                hour = time_part.split(':')[0]
-                activity_hours[hour] = activity_hours.get(hour, 0) + 1
-        except:
-            pass
+    if cumulative_state.get('rollups'):
+        rollups = RollupStore.from_dict(cumulative_state['rollups'])
+        incoming_by_hour = rollups.by_hour_of_day('incoming')
+        outgoing_by_hour = rollups.by_hour_of_day('outgoing')
+        for hour in incoming_by_hour:
+            activity_hours[hour] = round(incoming_by_hour[hour] + outgoing_by_hour.get(hour, 0))
+    else:
+        recent_connections = [c for c in incoming_connections + outgoing_connections if c.get('last_seen') != 'unknown']
+        for conn in recent_connections:
+            try:
+                last_seen = conn.get('last_seen', '')
+                if ' ' in last_seen:
+                    time_part = last_seen.split(' ')[1]
+                    hour = time_part.split(':')[0]
+                    activity_hours[hour] = activity_hours.get(hour, 0) + 1
+            except:
+                pass
+    
+    # Динамика соединений по протоколам из часового кольца (последние 7 дней)
+    rollup_labels_js = []
+    rollup_series_js = {'tcp': [], 'udp': [], 'icmp': []}
+    if cumulative_state.get('rollups'):
+        for bucket in RollupStore.from_dict(cumulative_state['rollups']).rings['hour'].buckets(last=168):
+            rollup_labels_js.append(dt.fromtimestamp(bucket['start']).strftime('%d.%m %H:00'))
+            for protocol in rollup_series_js:
+                rollup_series_js[protocol].append(round(bucket[protocol]['avg'], 1))
     
     # Подготавливаем данные для JavaScript диаграмм
     hour_data_js = []
@@ -705,14 +824,25 @@ def generate_compact_html_report(cumulative_state, html_filename):
         activity = activity_hours.get(hour_str, 0)
         hour_data_js.append(activity)
     
+    rollup_chart_html = ''
+    if rollup_labels_js:
+        rollup_chart_html = """
+                <!-- Динамика соединений из временных рядов -->
+                <div class="chart-card">
+                    <div class="chart-title">
+                        📉 Соединения по часам (7 дней)
+                    </div>
+                    <div class="chart-wrapper chart-medium">
+                        <canvas id="rollupChart"></canvas>
+                    </div>
+                </div>"""
+    
     # Подготавливаем переменные для подстановки в HTML
     tcp_count = len(tcp_connections)
     udp_count = len(udp_connections)
     icmp_count = len(icmp_connections)
     incoming_count = len(incoming_connections)
     outgoing_count = len(outgoing_connections)
-    processes_count = len(unique_processes)
-    hosts_count = len(unique_hosts)
     
     html_content = f"""
 <!DOCTYPE html>
@@ -1711,15 +1841,15 @@ def generate_compact_html_report(cumulative_state, html_filename):
                                 <div class="stat-label">Исходящих</div>
                             </div>
                             <div class="stat-card">
-                                <div class="stat-number">{len(unique_processes)}</div>
+                                <div class="stat-number">{processes_count}</div>
                                 <div class="stat-label">Процессов</div>
                             </div>
                             <div class="stat-card">
-                                <div class="stat-number">{len(unique_hosts)}</div>
+                                <div class="stat-number">{hosts_count}</div>
                                 <div class="stat-label">Удаленных хостов</div>
                             </div>
                             <div class="stat-card">
-                                <div class="stat-number">{len(changes_log)}</div>
+                                <div class="stat-number">{(cumulative_state.get('changes_stats') or {}).get('total', len(changes_log))}</div>
                                 <div class="stat-label">Изменений</div>
                             </div>
                         </div>
@@ -1840,6 +1970,7 @@ def generate_compact_html_report(cumulative_state, html_filename):
                         </div>
                     </div>
                 </div>
+                {rollup_chart_html}
                 
                 <!-- Прогресс-бары для детальной статистики -->
                 <div class="chart-card">
@@ -3590,6 +3721,35 @@ def generate_compact_html_report(cumulative_state, html_filename):
                     }}
                 }}
             }});
+            
+            // 5. Динамика соединений по протоколам из часового кольца (Line)
+            const rollupCanvas = document.getElementById('rollupChart');
+            if (rollupCanvas) {{
+                const rollupSeries = {rollup_series_js};
+                new Chart(rollupCanvas.getContext('2d'), {{
+                    type: 'line',
+                    data: {{
+                        labels: {rollup_labels_js},
+                        datasets: [
+                            {{ label: 'TCP', data: rollupSeries.tcp, borderColor: colors.tcp, tension: 0.3, pointRadius: 0 }},
+                            {{ label: 'UDP', data: rollupSeries.udp, borderColor: colors.udp, tension: 0.3, pointRadius: 0 }},
+                            {{ label: 'ICMP', data: rollupSeries.icmp, borderColor: colors.warning, tension: 0.3, pointRadius: 0 }}
+                        ]
+                    }},
+                    options: {{
+                        responsive: true,
+                        maintainAspectRatio: false,
+                        scales: {{
+                            y: {{ beginAtZero: true }},
+                            x: {{ ticks: {{ maxTicksLimit: 14 }} }}
+                        }},
+                        interaction: {{
+                            intersect: false,
+                            mode: 'index'
+                        }}
+                    }}
+                }});
+            }}
         }}
         
         // Функция для копирования текста в буфер обмена
@@ -4099,7 +4259,7 @@ DATA RECORD:
                 <div class="tech-stack">
                     <div class="tech-item">
                         <h4>🐍 Backend</h4>
-                        <p>Python 3.6+<br>psutil, PyYAML<br>boto3, distro</p>
+                        <p>Python 3.6+<br>psutil, PyYAML<br>boto3</p>
                     </div>
                     <div class="tech-item">
                         <h4>📊 Analytics</h4>
@@ -4161,15 +4321,48 @@ DATA RECORD:
 </html>
     """
     
-    with open(html_filename, 'w', encoding='utf-8') as f:
+    with open_report(html_filename, 'w', codec, level) as f:
         f.write(html_content)
     
     return html_filename
 
-def upload_reports_to_s3(configuration, py_version, yaml_filename, html_filename):
+def report_upload_files(yaml_filename, html_filename, run=None):
     """
-    Функция для загрузки отчетов в S3 (адаптировано из коммита 9d583bf5)
-    Загружает все три файла: основной YAML, legacy backup и HTML
+    Файлы отчета для выгрузки: [(путь, ключ S3, описание)] существующих файлов
+    и признак, что все обязательные файлы на месте. С run (S3Client.report_run)
+    ключ - <reports_prefix>/<дата>/<hostname>/<run_id>.<расширение>, иначе имя файла
+    """
+    base = os.path.splitext(yaml_filename)[0]
+    files_to_upload = [
+        (yaml_filename, "основной YAML отчет"),
+        (html_filename, "HTML отчет")
+    ]
+    
+    # Добавляем legacy файл если он существует
+    legacy_filename = f"{yaml_filename}.legacy"
+    if os.path.exists(legacy_filename):
+        files_to_upload.append((legacy_filename, "legacy backup файл"))
+    else:
+        print(f"ℹ️ S3: Legacy file {legacy_filename} not found, skipping")
+    
+    existing = []
+    complete = True
+    for file_path, file_description in files_to_upload:
+        if os.path.exists(file_path):
+            key = file_path
+            if run is not None:
+                key = report_key(run['prefix'], run['hostname'], run['run_id'], file_path[len(base) + 1:], run['date'])
+            existing.append((file_path, key, file_description))
+        else:
+            print(f"⚠️ S3: File not found: {file_path}")
+            complete = False
+    return existing, complete
+
+def upload_files_to_s3(configuration, py_version, files, manifest_path=None):
+    """
+    Выгрузка файлов [(путь, ключ S3, описание)] в S3:
+    параллельно, общим для процесса клиентом (get_cached_client_s3);
+    manifest_path - манифест хэшей для пропуска неизменившихся файлов
     """
     print("🔍 S3: Checking configuration...")
     s3_config = configuration.get('s3', {})
@@ -4185,6 +4378,11 @@ def upload_reports_to_s3(configuration, py_version, yaml_filename, html_filename
     required_fields = ['url', 'user', 'access_key']
     missing_fields = [field for field in required_fields if not s3_config.get(field)]
     
+    if s3_config.get('stub_dir'):
+        # Воспроизведение записи (--replay): выгрузка в локальный каталог вместо S3
+        print(f"🧪 S3: Stub client, objects are copied to {s3_config['stub_dir']}")
+        missing_fields = []
+    
     if missing_fields:
         print(f"⚠️ S3: Configuration incomplete, missing: {', '.join(missing_fields)}")
         print("💡 S3: Set environment variables: S3_ENDPOINT_URL, S3_ACCESS_KEY_ID, S3_ACCESS_SECRET_KEY")
@@ -4207,15 +4405,11 @@ def upload_reports_to_s3(configuration, py_version, yaml_filename, html_filename
                 return False
         
         print("🔧 S3: Creating client...")
-        # Создаем клиент S3 (аналогично оригиналу)
-        s3_client = get_client_s3(
-            url_s3=s3_config['url'],
-            region=s3_config.get('region', 'endpoint'),
-            user=s3_config['user'],
-            access_key=s3_config['access_key'],
-            py_version=py_version,
-            is_cert=True
-        )
+        if s3_config.get('stub_dir'):
+            s3_client = LocalS3Client(s3_config['stub_dir'])
+        else:
+            # Клиент общий для процесса: повторные выгрузки не создают сессию заново
+            s3_client = get_cached_client_s3(s3_config, py_version, is_cert=True)
         
         if s3_client is None:
             print("❌ S3: Client creation returned None")
@@ -4227,36 +4421,29 @@ def upload_reports_to_s3(configuration, py_version, yaml_filename, html_filename
         upload_success = True
         uploaded_files = []
         
-        # Определяем файлы для загрузки
-        files_to_upload = [
-            (yaml_filename, "основной YAML отчет"),
-            (html_filename, "HTML отчет")
-        ]
-        
-        # Добавляем legacy файл если он существует
-        legacy_filename = f"{yaml_filename}.legacy"
-        if os.path.exists(legacy_filename):
-            files_to_upload.append((legacy_filename, "legacy backup файл"))
-        else:
-            print(f"ℹ️ S3: Legacy file {legacy_filename} not found, skipping")
-        
-        # Загружаем все файлы
-        for file_path, file_description in files_to_upload:
-            if os.path.exists(file_path):
-                print(f"📄 S3: Uploading {file_description} ({file_path})...")
-                try:
-                    status = upload_file_s3(s3_client, bucket, file_path, file_path)
-                    if status:
-                        print(f"✅ S3: {file_description} uploaded: {file_path}")
-                        uploaded_files.append(file_path)
-                    else:
-                        print(f"⚠️ S3: {file_description} upload failed")
-                        upload_success = False
-                except Exception as e:
-                    print(f"❌ S3: {file_description} upload error: {e}")
-                    upload_success = False
+        for file_path, key, file_description in files:
+            print(f"📄 S3: Uploading {file_description} ({key})...")
+        
+        # Манифест хэшей: файлы, не изменившиеся с прошлой выгрузки, не отправляются повторно
+        manifest = UploadManifest(manifest_path) if manifest_path and s3_config.get('skip_unchanged', True) else None
+        results = upload_files_s3(s3_client, bucket, [(file_path, key) for file_path, key, _ in files],
+                                  transfer_config=None if s3_config.get('stub_dir') else get_transfer_config(s3_config),
+                                  max_workers=s3_config.get('upload_workers', 4), manifest=manifest,
+                                  verify_remote=s3_config.get('verify_remote', True))
+        for file_path, key, file_description in files:
+            status = results.get(file_path)
+            if status == 'unchanged':
+                print(f"⏭️ S3: {file_description} unchanged since last upload, skipped: {key}")
+            elif status == 'copied':
+                print(f"⏭️ S3: {file_description} unchanged since previous run, copied in S3: {key}")
+            elif status is True:
+                print(f"✅ S3: {file_description} uploaded: {key}")
+                uploaded_files.append(key)
+            elif isinstance(status, Exception):
+                print(f"❌ S3: {file_description} upload error: {status}")
+                upload_success = False
             else:
-                print(f"⚠️ S3: File not found: {file_path}")
+                print(f"⚠️ S3: {file_description} upload failed")
                 upload_success = False
         
         if uploaded_files:
@@ -4275,10 +4462,44 @@ def upload_reports_to_s3(configuration, py_version, yaml_filename, html_filename
         
         return False
 
-def write_to_s3_scheduled(yaml_filename, html_filename, upload_time, upload_delay=60, is_upload=True, configuration=None, py_version=None):
+@timed('upload.s3')
+def upload_reports_to_s3(configuration, py_version, yaml_filename, html_filename, run=None):
+    """
+    Функция для загрузки отчетов в S3 (синхронно; фоновая выгрузка из очереди
+    в этапы измерений не попадает)
+    Загружает все три файла: основной YAML, legacy backup и HTML
+    """
+    files, complete = report_upload_files(yaml_filename, html_filename, run)
+    if not files:
+        return False
+    return upload_files_to_s3(configuration, py_version, files, f"{yaml_filename}.s3manifest") and complete
+
+def enqueue_reports(spool, yaml_filename, html_filename, delay=0, run=None):
+    """
+    Снимок файлов отчета в очередь выгрузки (upload_spool.py): возвращается сразу,
+    выгрузку с повторами выполняет фоновый поток
+    """
+    files, _ = report_upload_files(yaml_filename, html_filename, run)
+    entry = spool.enqueue(files, delay=delay)
+    if entry:
+        print(f"📥 S3: {len(files)} files queued for upload ({entry}, in {delay}s), pending {spool.pending()}")
+    return entry is not None
+
+def create_upload_spool(configuration, py_version, directory, manifest_path):
+    """Очередь выгрузки с фоновым потоком; выгрузка записи - upload_files_to_s3"""
+    uploader = lambda files: upload_files_to_s3(configuration, py_version, files, manifest_path)
+    spool = UploadSpool.from_config(configuration, directory, uploader)
+    pending = spool.pending()
+    if pending:
+        print(f"📤 S3: {pending} queued uploads from previous runs will be retried")
+    return spool.start()
+
+def write_to_s3_scheduled(yaml_filename, html_filename, upload_time, upload_delay=60, is_upload=True, configuration=None, py_version=None, spool=None, run=None):
     """
     Функция для загрузки отчетов в S3 по расписанию (улучшенная версия)
-    Поддерживает диапазон времени для более надежного срабатывания
+    Поддерживает диапазон времени для более надежного срабатывания.
+    С очередью spool случайная задержка - время готовности записи очереди,
+    цикл измерений не ждет ни задержку, ни саму выгрузку
     """
     if not is_upload:
         return False
@@ -4296,15 +4517,18 @@ def write_to_s3_scheduled(yaml_filename, html_filename, upload_time, upload_dela
         
         # Проверяем, попадаем ли в окно загрузки (+-2 минуты)
         if time_diff <= 2 or time_diff >= (24 * 60 - 2):  # Учитываем переход через полночь
-            # Добавляем случайную задержку
+            # Случайная задержка разносит выгрузки парка хостов во времени
             delay = random.randint(0, upload_delay)
-            time.sleep(delay)
-            
             print(f"⏰ S3: Upload time window reached (target: {upload_time}, current: {current_time.strftime('%H:%M')})")
+            
+            if spool is not None:
+                return enqueue_reports(spool, yaml_filename, html_filename, delay=delay, run=run)
+            
+            time.sleep(delay)
             print(f"⏰ S3: Starting upload after {delay}s delay...")
             
             # Вызываем загрузку
-            success = upload_reports_to_s3(configuration, py_version, yaml_filename, html_filename)
+            success = upload_reports_to_s3(configuration, py_version, yaml_filename, html_filename, run)
             if success:
                 print(f"✅ S3: Scheduled upload completed successfully")
             else:
@@ -4321,14 +4545,17 @@ def write_to_s3_scheduled(yaml_filename, html_filename, upload_time, upload_dela
     
     return False
 
-def upload_reports_at_end(yaml_filename, html_filename, configuration=None, py_version=None):
+def upload_reports_at_end(yaml_filename, html_filename, configuration=None, py_version=None, spool=None, run=None):
     """
     Функция для загрузки отчетов в S3 в конце всех измерений
     Загружает все три файла: основной YAML, legacy backup и HTML
+    (с очередью spool - ставит их в очередь, выгрузку дожидается drain_spool)
     """
     try:
         print(f"\n☁️ Final S3 Upload Process")
-        success = upload_reports_to_s3(configuration, py_version, yaml_filename, html_filename)
+        if spool is not None:
+            return enqueue_reports(spool, yaml_filename, html_filename, run=run)
+        success = upload_reports_to_s3(configuration, py_version, yaml_filename, html_filename, run)
         if success:
             print(f"✅ S3: Final reports successfully uploaded (all files)")
         else:
@@ -4338,12 +4565,29 @@ def upload_reports_at_end(yaml_filename, html_filename, configuration=None, py_v
         print(f"❌ S3: Final upload failed: {e}")
         return False
 
+def drain_spool(spool, timeout):
+    """
+    Конец запуска: ждет выгрузки очереди не дольше timeout секунд; невыгруженные
+    записи (S3 недоступен) остаются на диске и выгружаются следующим запуском
+    """
+    print(f"⏳ S3: Waiting up to {timeout}s for {spool.pending()} queued uploads...")
+    drained = spool.close(timeout)
+    if drained:
+        print(f"✅ S3: Upload queue drained ({spool.stats['uploaded']} uploaded, "
+              f"{spool.stats['failed_attempts']} retried attempts)")
+    else:
+        print(f"⚠️ S3: {spool.pending()} uploads stay queued in {spool.directory} for the next run")
+    return drained
+
 def analyze_integration_connections(current_state):
     """Анализирует соединения для создания правил групп безопасности"""
     connections = current_state.get('connections', {})
     incoming_connections = connections.get('incoming', [])
     outgoing_connections = connections.get('outgoing', [])
     
+    # Единый CIDR классификатор (встроенные категории + зоны из конфигурации)
+    classifier = get_address_classifier()
+    
     # Фильтруем интеграционные соединения (исключаем localhost и локальные адреса)
     def is_integration_connection(conn):
         """Проверяет, является ли соединение интеграционным"""
@@ -4357,90 +4601,11 @@ def analyze_integration_connections(current_state):
         # Исключаем явно неправильные адреса (пути к файлам, содержащие слеши)
         if '/' in remote_addr or '\\' in remote_addr:
             return False
-            
-        # Извлекаем IP из адреса правильно (учитывая IPv6)
-        def extract_ip_properly(address):
-            if not address:
-                return address
-            # IPv6 адрес в формате [IPv6]:port
-            if address.startswith('[') and ']:' in address:
-                return address.split(']:')[0][1:]
-            # IPv4 адрес в формате IPv4:port
-            elif address.count(':') == 1:  # Только один двоеточие = IPv4:port
-                return address.split(':')[0]
-            # Чистый IPv6 адрес без порта или с портом в конце
-            elif address.count(':') > 1:
-                # Проверяем, есть ли порт в конце
-                parts = address.split(':')
-                # Если последняя часть - число, то это порт
-                try:
-                    int(parts[-1])
-                    # Это порт, убираем его
-                    return ':'.join(parts[:-1])
-                except ValueError:
-                    # Последняя часть не число, значит это чистый IPv6
-                    return address
-            else:
-                return address
         
-        remote_ip = extract_ip_properly(remote_addr)
-        local_ip = extract_ip_properly(local_addr) if local_addr else ''
+        remote_ip = split_host_port(remote_addr)[0]
+        local_ip = split_host_port(local_addr)[0] if local_addr else ''
         
-        # Исключаем localhost
-        if remote_ip in ['127.0.0.1', '::1', 'localhost']:
-            return False
-        
-        # Исключаем IPv6 link-local адреса (fe80::/10)
-        if remote_ip.startswith('fe80:') or remote_ip.startswith('fe80'):
-            return False
-            
-        # Исключаем IPv6 unique local адреса (fc00::/7)
-        if remote_ip.startswith(('fc00:', 'fd00:')):
-            return False
-        
-        # Проверяем, что это похоже на IP-адрес
-        import re
-        # IPv4 адрес
-        ipv4_pattern = r'^(\d{1,3}\.){3}\d{1,3}$'
-        # IPv6 адрес (упрощенная проверка)
-        ipv6_pattern = r'^[0-9a-fA-F:]+$'
-        
-        is_valid_ip = (re.match(ipv4_pattern, remote_ip) is not None or 
-                      (re.match(ipv6_pattern, remote_ip) is not None and ':' in remote_ip))
-        
-        if not is_valid_ip:
-            return False
-        
-        # Исключаем приватные адреса локальной сети
-        if remote_ip.startswith(('192.168.', '10.', '172.')):
-            # Если это разные подсети, то это интеграция
-            if not local_ip.startswith(remote_ip.split('.')[0]):
-                return True
-            # Если адреса сильно отличаются в локальной сети
-            try:
-                if local_ip.split('.')[2] != remote_ip.split('.')[2]:
-                    return True
-            except IndexError:
-                pass
-            return False
-        
-        # Исключаем мультикаст и broadcast адреса
-        if remote_ip.startswith(('224.', '225.', '226.', '227.', '228.', '229.', 
-                                '230.', '231.', '232.', '233.', '234.', '235.',
-                                '236.', '237.', '238.', '239.', '255.')):
-            return False
-            
-        # Исключаем link-local адреса IPv4
-        if remote_ip.startswith('169.254.'):
-            return False
-            
-        # Исключаем зарезервированные диапазоны
-        if remote_ip.startswith(('0.', '240.', '241.', '242.', '243.', '244.', 
-                                '245.', '246.', '247.', '248.', '249.', '250.',
-                                '251.', '252.', '253.', '254.')):
-            return False
-        
-        return True
+        return classifier.is_integration(remote_ip, local_ip)
     
     # Анализируем входящие соединения
     incoming_integrations = []
@@ -4462,7 +4627,10 @@ def analyze_integration_connections(current_state):
     }
 
 def generate_security_group_rules(integration_connections):
-    """Генерирует правила групп безопасности в текстовом формате"""
+    """
+    Генерирует правила групп безопасности в текстовом формате
+    Адреса сворачиваются в CIDR, порты - в диапазоны (см. security_rules.py)
+    """
     
     def get_process_description(process_name):
         """Возвращает описание процесса для правила"""
@@ -4485,122 +4653,55 @@ def generate_security_group_rules(integration_connections):
         else:
             return f'Трафик от {process_name}'
     
-    def extract_port_from_address(address):
-        """Извлекает порт из адреса (поддерживает IPv4 и IPv6)"""
-        if not address or address == 'unknown':
-            return 'unknown'
-        
-        # IPv6 адрес в формате [IPv6]:port
-        if address.startswith('[') and ']:' in address:
-            return address.split(']:')[-1]
-        
-        # IPv4 адрес в формате IPv4:port
-        elif address.count(':') == 1:
-            return address.split(':')[-1]
-        
-        # IPv6 адрес без скобок - порт в конце после последнего :
-        elif address.count(':') > 1:
-            parts = address.split(':')
-            # Проверяем, является ли последняя часть портом (числом)
-            try:
-                int(parts[-1])
-                return parts[-1]
-            except ValueError:
-                return 'unknown'
-        
-        return 'unknown'
-    
-    def extract_ip_from_address(address):
-        """Извлекает IP из адреса (поддерживает IPv4 и IPv6)"""
-        if not address or address == 'unknown':
-            return address
-        
-        # IPv6 адрес в формате [IPv6]:port
-        if address.startswith('[') and ']:' in address:
-            return address.split(']:')[0][1:]  # Убираем [ в начале
-        
-        # IPv4 адрес в формате IPv4:port
-        elif address.count(':') == 1:
-            return address.split(':')[0]
-        
-        # IPv6 адрес без скобок
-        elif address.count(':') > 1:
-            parts = address.split(':')
-            # Проверяем, является ли последняя часть портом
-            try:
-                int(parts[-1])
-                # Последняя часть - порт, убираем его
-                return ':'.join(parts[:-1])
-            except ValueError:
-                # Последняя часть не порт, возвращаем весь адрес
-                return address
-        
-        # Просто IP без порта
-        return address
+    synthesizer = RuleSynthesizer.from_config()
+    
+    # Входящие: порт локальный, исходящие: порт удаленной стороны
+    for direction in ('incoming', 'outgoing'):
+        for conn in integration_connections[direction]:
+            remote_ip, remote_port = split_host_port(conn.get('remote', {}).get('address', ''))
+            if direction == 'incoming':
+                port = split_host_port(conn.get('local', ''))[1]
+            else:
+                port = remote_port
+            synthesizer.add_flow(direction,
+                                 conn.get('protocol', 'tcp').upper(),
+                                 conn.get('process', 'unknown'),
+                                 remote_ip or 'unknown',
+                                 port or 'unknown')
     
-    # Группируем соединения по процессам и портам
     incoming_rules = {}
     outgoing_rules = {}
     
-    # Обрабатываем входящие соединения
-    for conn in integration_connections['incoming']:
-        remote_addr = conn.get('remote', {}).get('address', '')
-        local_addr = conn.get('local', '')
-        process = conn.get('process', 'unknown')
-        protocol = conn.get('protocol', 'tcp').upper()
-        
-        remote_ip = extract_ip_from_address(remote_addr)
-        local_port = extract_port_from_address(local_addr)
-        
-        rule_key = f"{protocol}_{local_port}_{process}"
-        
-        if rule_key not in incoming_rules:
-            incoming_rules[rule_key] = {
-                'direction': 'Входящий',
-                'external_system': f'Внешняя система ({remote_ip})',
-                'description': get_process_description(process),
-                'endpoints': [],
-                'protocol': protocol,
-                'port': local_port,
-                'process': process,
-                'remote_ips': set()
-            }
-        
-        incoming_rules[rule_key]['remote_ips'].add(remote_ip)
-        incoming_rules[rule_key]['endpoints'].append(f"{remote_ip}|{local_port}|{protocol}")
-    
-    # Обрабатываем исходящие соединения
-    for conn in integration_connections['outgoing']:
-        remote_addr = conn.get('remote', {}).get('address', '')
-        local_addr = conn.get('local', '')
-        process = conn.get('process', 'unknown')
-        protocol = conn.get('protocol', 'tcp').upper()
-        
-        remote_ip = extract_ip_from_address(remote_addr)
-        remote_port = extract_port_from_address(remote_addr)
-        
-        rule_key = f"{protocol}_{remote_port}_{process}"
-        
-        if rule_key not in outgoing_rules:
-            outgoing_rules[rule_key] = {
-                'direction': 'Исходящий',
-                'external_system': f'Внешняя система ({remote_ip})',
-                'description': get_process_description(process),
-                'endpoints': [],
-                'protocol': protocol,
-                'port': remote_port,
-                'process': process,
-                'remote_ips': set()
-            }
-        
-        outgoing_rules[rule_key]['remote_ips'].add(remote_ip)
-        outgoing_rules[rule_key]['endpoints'].append(f"0.0.0.0/0|{remote_port}|{protocol}")
+    for rule in synthesizer.synthesize():
+        rule_key = f"{rule['protocol']}_{rule['port']}_{rule['process']}"
+        target = incoming_rules if rule['direction'] == 'incoming' else outgoing_rules
+        target[rule_key] = {
+            'direction': 'Входящий' if rule['direction'] == 'incoming' else 'Исходящий',
+            'external_system': f"Внешняя система ({rule['cidrs'][0]})",
+            'description': get_process_description(rule['process']),
+            'protocol': rule['protocol'],
+            'port': rule['port'],
+            'port_ranges': rule['port_ranges'],
+            'process': rule['process'],
+            'cidrs': rule['cidrs'],
+            'hosts': rule['hosts'],
+            'over_permit': rule['over_permit']
+        }
     
     return {
         'incoming_rules': incoming_rules,
         'outgoing_rules': outgoing_rules
     }
 
+def format_rule_endpoints(rule, limit=10):
+    """Формирует строки endpoint (cidr|порт|протокол) правила, не более limit строк"""
+    ports = [str(lo) if lo == hi else f"{lo}-{hi}" for lo, hi in rule['port_ranges']] or [rule['port']]
+    endpoints = [f"{cidr}|{port}|{rule['protocol']}" for cidr in rule['cidrs'] for port in ports]
+    if len(endpoints) > limit:
+        hidden = len(endpoints) - limit
+        endpoints = endpoints[:limit] + [f"... и еще {hidden}"]
+    return endpoints
+
 def format_security_group_markup(security_rules):
     """Форматирует правила в текстовую разметку для групп безопасности с улучшенной структурой"""
     
@@ -4611,91 +4712,156 @@ def format_security_group_markup(security_rules):
         'outgoing_summary': []
     }
     
-    # Форматируем входящие правила - по каждой интеграции отдельно
-    if security_rules['incoming_rules']:
-        for rule_key, rule in security_rules['incoming_rules'].items():
-            # Получаем первый IP для заголовка внешней системы
-            first_ip = list(rule['remote_ips'])[0] if rule['remote_ips'] else 'unknown'
-            
-            # Создаем детальный блок для каждой интеграции
-            integration = {
-                'title': f"{rule['process']} (порт {rule['port']})",
-                'external_system': f"Внешняя система ({first_ip})",
-                'process_description': rule['description'],
-                'technical_description': f"Техническая группа безопасности для миграции ВМ в рамках проекта.",
-                'endpoints': []
-            }
-            
-            # Формируем конкретные endpoints для этой интеграции
-            unique_ips = list(rule['remote_ips'])[:10]
-            for ip in unique_ips:
-                endpoint = f"{ip}|{rule['port']}|{rule['protocol']}"
-                integration['endpoints'].append(endpoint)
-            
-            integration['endpoints_text'] = '\n'.join(integration['endpoints'])
-            markup_sections['incoming_integrations'].append(integration)
-            
-            # Добавляем в суммарный блок (обобщенные правила)
-            for remote_ip in list(rule['remote_ips'])[:5]:  # Ограничиваем до 5 IP для краткости
-                summary_endpoint = f"{remote_ip}|{rule['port']}|{rule['protocol']}"
-                if summary_endpoint not in markup_sections['incoming_summary']:
-                    markup_sections['incoming_summary'].append(summary_endpoint)
-    
-    # Форматируем исходящие правила - по каждой интеграции отдельно
-    if security_rules['outgoing_rules']:
-        for rule_key, rule in security_rules['outgoing_rules'].items():
-            # Получаем первый IP для заголовка внешней системы
-            first_ip = list(rule['remote_ips'])[0] if rule['remote_ips'] else 'unknown'
-            
+    for direction, title_format in (('incoming', "{process} (порт {port})"),
+                                    ('outgoing', "{process} → порт {port}")):
+        for rule_key, rule in security_rules[f'{direction}_rules'].items():
             # Создаем детальный блок для каждой интеграции
             integration = {
-                'title': f"{rule['process']} → порт {rule['port']}",
-                'external_system': f"Внешняя система ({first_ip})",
+                'title': title_format.format(process=rule['process'], port=rule['port']),
+                'external_system': rule['external_system'],
                 'process_description': rule['description'],
                 'technical_description': f"Техническая группа безопасности для миграции ВМ в рамках проекта.",
-                'endpoints': []
+                'endpoints': format_rule_endpoints(rule)
             }
             
-            # Формируем конкретные endpoints
-            if len(rule['remote_ips']) == 1:
-                # Если только один IP, используем его
-                ip = list(rule['remote_ips'])[0]
-                endpoint = f"{ip}|{rule['port']}|{rule['protocol']}"
-                integration['endpoints'].append(endpoint)
-            else:
-                # Если несколько IP, показываем каждый
-                unique_ips = list(rule['remote_ips'])[:10]
-                for ip in unique_ips:
-                    endpoint = f"{ip}|{rule['port']}|{rule['protocol']}"
-                    integration['endpoints'].append(endpoint)
-            
             integration['endpoints_text'] = '\n'.join(integration['endpoints'])
-            markup_sections['outgoing_integrations'].append(integration)
+            markup_sections[f'{direction}_integrations'].append(integration)
             
             # Добавляем в суммарный блок (обобщенные правила)
-            port = rule['port']
-            protocol = rule['protocol']
-            
-            # Показываем реальные IP-адреса вместо 0.0.0.0/0
-            for remote_ip in list(rule['remote_ips'])[:5]:  # Ограничиваем до 5 IP для краткости
-                summary_endpoint = f"{remote_ip}|{rule['port']}|{rule['protocol']}"
-                if summary_endpoint not in markup_sections['outgoing_summary']:
-                    markup_sections['outgoing_summary'].append(summary_endpoint)
+            for summary_endpoint in format_rule_endpoints(rule, limit=5)[:5]:  # Ограничиваем до 5 сетей для краткости
+                if summary_endpoint not in markup_sections[f'{direction}_summary']:
+                    markup_sections[f'{direction}_summary'].append(summary_endpoint)
     
     return markup_sections
 
+def restore_from_netflow(cumulative_state, netflow_data, note):
+    """Восстанавливает кумулятивное состояние из NetFlow отчета (YAML или IPFIX архив)"""
+    restored_data = NetFlowGenerator.convert_netflow_yaml_to_legacy_format(netflow_data)
+    
+    # Восстанавливаем базовую кумулятивную структуру
+    cumulative_state['current_state'] = restored_data
+    cumulative_state['total_measurements'] = 1  # Начинаем с 1, так как данные уже есть
+    cumulative_state['cardinality'] = restored_data.get('cardinality', {})
+    cumulative_state['rollups'] = restored_data.get('rollups', {})
+    cumulative_state['timings'] = restored_data.get('timings', {})
+    cumulative_state['self_monitor'] = restored_data.get('self_monitor', {})
+    cumulative_state['changes_stats'] = restored_data.get('changes_stats', {})
+    cumulative_state['changes_log'] = [{
+        'id': 1,
+        'timestamp': (netflow_data.get('netflow_message', {}).get('header', {}).get('export_time') or
+                      netflow_data.get('system_information', {}).get('last_update') or
+                      cumulative_state['first_run']),
+        'time': 0.0,
+        'changes': {},
+        'first_run': True,
+        'note': note
+    }]
+
+def timings_state(last_measurement):
+    """Длительности этапов для отчета: последнее измерение, p50/p95 и история (profiling.SPANS)"""
+    return {
+        'last_measurement': last_measurement,
+        'summary': {name: {key: round(value, 6) for key, value in stats.items()}
+                    for name, stats in SPANS.summary().items()},
+        'samples': SPANS.to_dict()['samples']
+    }
+
+@timed('export.netflow')
+def export_measurement_netflow(exporter, netflow_generator, current_data):
+    """Отправляет соединения текущего измерения на NetFlow v9 коллектор"""
+    connections = current_data.get('connections', {})
+    flows = [netflow_generator.convert_connection_to_flow(conn, direction)
+             for direction in ('incoming', 'outgoing')
+             for conn in connections.get(direction, [])]
+    packets = exporter.export(flows)
+    print(f"📡 NetFlow v9: {len(flows)} flows sent to {exporter.collector[0]}:{exporter.collector[1]} in {packets} packets")
+
 ##### Main function #####
 def main():
-    parser = argparse.ArgumentParser(description='Glacier (optimized version)')
+    # Подкоманда поиска по локальной истории: glacier.py query --remote 10.20.0.0/16 --since 7d
+    if sys.argv[1:2] == ['query']:
+        sys.exit(query_main(sys.argv[2:], configuration))
+    
+    parser = argparse.ArgumentParser(description='Glacier (optimized version)',
+                                     epilog='Subcommands: query - search local history database (query --help)')
     parser.add_argument('-w', '--wait', type=int, default=10, help='Wait time between measurements in seconds')
     parser.add_argument('-t', '--times', type=int, default=1, help='Number of measurements')
     parser.add_argument('--no-s3', action='store_true', help='Disable S3 upload of reports')
     parser.add_argument('--force-s3', action='store_true', help='Force immediate S3 upload after analysis completion')
     parser.add_argument('-v', '--version', action='version', version=f'Glacier v{VERSION}')
     parser.add_argument('--upload-time', default='8:0', dest='upload_time', help='Time to upload report to S3')
+    parser.add_argument('--netflow-collector', dest='netflow_collector', metavar='HOST:PORT',
+                        help='Send NetFlow v9 packets to collector (nfcapd, pmacct) after each measurement')
+    sampling_group = parser.add_mutually_exclusive_group()
+    sampling_group.add_argument('--sample', type=int, metavar='N', dest='sample_interval',
+                                help='Deterministic 1-in-N flow sampling with scaled counters (large hosts)')
+    sampling_group.add_argument('--top-k', type=int, metavar='K', dest='top_k',
+                                help='Keep only the K heaviest (process, remote service) flow groups')
+    parser.add_argument('--aggregate', action='store_true',
+                        help='Fold sockets into one row per service (ephemeral ports wildcarded)')
+    parser.add_argument('--history-db', dest='history_db', metavar='PATH',
+                        help='Record every measurement into a local SQLite history database')
+    parser.add_argument('--metrics-port', dest='metrics_port', type=int, metavar='PORT',
+                        help='Serve the latest measurement as OpenMetrics on http://ADDRESS:PORT/metrics')
+    parser.add_argument('--profile', nargs='?', const='', metavar='PREFIX',
+                        help='Profile the run: write PREFIX.pstats (cProfile) and PREFIX.collapsed (flamegraph stacks)')
+    parser.add_argument('--cpu-budget', dest='cpu_budget', type=float, metavar='PCT',
+                        help='Own CPU budget in percent of one core; over budget the agent throttles itself')
+    parser.add_argument('--rss-budget', dest='rss_budget', type=float, metavar='MB',
+                        help='Own resident memory budget in MB; over budget the agent throttles itself')
+    capture_group = parser.add_mutually_exclusive_group()
+    capture_group.add_argument('--record', metavar='FILE',
+                               help='Record raw inputs of every measurement into a compressed capture file')
+    capture_group.add_argument('--replay', metavar='FILE',
+                               help='Run the whole pipeline from a capture file: no waits, no root, no network, '
+                                    'fresh state; reports and S3 uploads go to FILE.out/')
+    parser.add_argument('--compress', nargs='?', const='gzip', choices=CODECS + ('none',), metavar='CODEC',
+                        help='Compress YAML/HTML reports while writing: gzip (default), zstd or none')
 
     args = parser.parse_args()
     
+    if args.sample_interval is not None:
+        if args.sample_interval < 1:
+            parser.error('--sample must be >= 1')
+        configuration['flow_sampling'].update(mode='sample', interval=args.sample_interval)
+    elif args.top_k is not None:
+        if args.top_k < 1:
+            parser.error('--top-k must be >= 1')
+        configuration['flow_sampling'].update(mode='topk', top_k=args.top_k)
+    if args.aggregate:
+        configuration['flow_aggregation']['enabled'] = True
+    if args.cpu_budget is not None:
+        configuration['self_monitor']['cpu_percent'] = args.cpu_budget
+    if args.rss_budget is not None:
+        configuration['self_monitor']['rss_mb'] = args.rss_budget
+    capture_header = None
+    if args.replay:
+        try:
+            capture_header = CAPTURE.replay(args.replay)
+            args.times = count_measurements(args.replay)
+        except (OSError, ValueError) as e:
+            parser.error(f"--replay: {e}")
+        # Измерения подряд без пауз; выгрузка (если не --no-s3) сразу в локальную заглушку S3
+        args.wait = 0
+        configuration['s3'] = dict(configuration.get('s3', {}), stub_dir=os.path.join(f"{args.replay}.out", 's3'))
+        args.force_s3 = not args.no_s3
+        print(f"▶️ Replaying {args.times} measurements of {capture_header.get('hostname')} "
+              f"recorded {capture_header.get('created')}")
+    sampling = configuration['flow_sampling']
+    if sampling['mode'] not in SAMPLING_MODES:
+        print(f"⚠️ Unknown flow sampling mode '{sampling['mode']}', using truncate")
+        sampling['mode'] = 'truncate'
+    elif sampling['mode'] == 'sample':
+        print(f"🎯 Flow sampling: 1 in {sampling['interval']} flows, counters scaled")
+    elif sampling['mode'] == 'topk':
+        print(f"🎯 Flow sampling: top {sampling['top_k']} (process, remote service) groups")
+    
+    compression = configuration['report_compression']
+    report_codec = resolve_codec(args.compress if args.compress is not None else compression['codec'])
+    report_level = compression.get('level')
+    if report_codec:
+        print(f"🗜️ Reports are {report_codec} compressed (Content-Encoding on S3 upload)")
+    
     upload_time = args.upload_time
     print(f"🚀 Starting optimized analyzer: {args.times} measurements with {args.wait} second interval")
     print("📊 YAML and HTML reports will be generated")
@@ -4706,27 +4872,67 @@ def main():
         'name': platform.system(),
         'version': platform.release()
     }
-    
-    # Создаем имена файлов
+    if capture_header is not None:
+        # Отчеты воспроизведения называются по записанному хосту
+        hostname = capture_header.get('hostname', hostname)
+        os_info = capture_header.get('os', os_info)
+    elif args.record:
+        CAPTURE.record(args.record, hostname=hostname, os=os_info, glacier=VERSION)
+        print(f"⏺️ Recording measurement inputs to {args.record}")
+    
+    # Создаем имена файлов: воспроизведение пишет только в <запись>.out/ и не трогает
+    # отчеты, журналы и состояние реального хоста в текущем каталоге
     os_name = os_info.get('name', 'unknown').lower()
-    yaml_filename = f"{hostname}_{os_name}_report_analyzer.yaml"
-    html_filename = f"{hostname}_{os_name}_report_analyzer.html"
+    replay = capture_header is not None
+    file_prefix = f"{hostname}_{os_name}"
+    if replay:
+        os.makedirs(f"{args.replay}.out", exist_ok=True)
+        file_prefix = os.path.join(f"{args.replay}.out", file_prefix)
+    yaml_filename = f"{file_prefix}_report_analyzer.yaml"
+    html_filename = f"{file_prefix}_report_analyzer.html"
+    ipfix_filename = f"{file_prefix}_report_analyzer.ipfix"
+    
+    # Профилирование всего запуска (--profile): cProfile и выборка стеков для flamegraph
+    profiler = None
+    if args.profile is not None:
+        profiler = Profiler(args.profile or f"{file_prefix}_profile",
+                            configuration['profiling']['sample_interval'])
+        profiler.start()
+        print(f"🔬 Profiling enabled: {profiler.prefix}.pstats, {profiler.prefix}.collapsed")
     
     # Инициализируем оптимизированную структуру
     cumulative_state = {
         'hostname': hostname,
         'os': os_info,
-        'first_run': dt.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'first_run': (replay and capture_header.get('created')) or dt.now().strftime('%Y-%m-%d %H:%M:%S'),
         'last_update': None,
         'total_measurements': 0,
         'current_state': {},
         'changes_log': []
     }
     
+    # Бинарный IPFIX архив читается без разбора YAML, если он не старше YAML отчета.
+    # Воспроизведение начинается с пустого состояния: повторный прогон дает тот же отчет
+    ipfix_restored = False
+    if not replay and os.path.exists(ipfix_filename) and (not os.path.exists(yaml_filename) or
+                                           os.path.getmtime(ipfix_filename) >= os.path.getmtime(yaml_filename)):
+        print(f"🌊 IPFIX archive detected, converting to cumulative state...")
+        try:
+            archived = read_ipfix_report(ipfix_filename)
+            # Без сведений о системе (журнал изменений, скетчи) архив неполон - восстанавливаемся из YAML
+            if not archived['system_information']:
+                print(f"⚠️ IPFIX archive has no system information, skipping: {ipfix_filename}")
+            else:
+                restore_from_netflow(cumulative_state, archived, 'Restored from IPFIX archive')
+                ipfix_restored = True
+                print(f"✅ Restored cumulative state from IPFIX archive: {ipfix_filename}")
+        except Exception as e:
+            print(f"⚠️ Failed to restore from IPFIX: {e}")
+    
     # Загружаем существующий отчет (поддерживаем и NetFlow и legacy форматы)
-    if os.path.exists(yaml_filename):
+    if not replay and not ipfix_restored and os.path.exists(yaml_filename):
         try:
-            with open(yaml_filename, 'r', encoding='utf-8') as f:
+            with open_report(yaml_filename) as f:
                 loaded_data = yaml.safe_load(f)
             
             # Проверяем формат файла
@@ -4740,20 +4946,7 @@ def main():
                 # NetFlow формат - конвертируем обратно в кумулятивные данные
                 print(f"🌊 NetFlow format detected, converting to cumulative state...")
                 try:
-                    # Используем NetFlowGenerator для конвертации обратно
-                    restored_data = NetFlowGenerator.convert_netflow_yaml_to_legacy_format(loaded_data)
-                    
-                    # Восстанавливаем базовую кумулятивную структуру
-                    cumulative_state['current_state'] = restored_data
-                    cumulative_state['total_measurements'] = 1  # Начинаем с 1, так как данные уже есть
-                    cumulative_state['changes_log'] = [{
-                        'id': 1,
-                        'timestamp': loaded_data.get('netflow_message', {}).get('header', {}).get('export_time', cumulative_state['first_run']),
-                        'time': 0.0,
-                        'changes': {},
-                        'first_run': True,
-                        'note': 'Restored from NetFlow v9 format'
-                    }]
+                    restore_from_netflow(cumulative_state, loaded_data, 'Restored from NetFlow v9 format')
                     print(f"✅ Restored cumulative state from NetFlow data")
                 except Exception as e:
                     print(f"⚠️ Failed to restore from NetFlow: {e}, starting fresh")
@@ -4768,9 +4961,9 @@ def main():
             
     # Дополнительно проверяем наличие legacy файла для восстановления состояния
     legacy_filename = f"{yaml_filename}.legacy"
-    if os.path.exists(legacy_filename):
+    if not replay and os.path.exists(legacy_filename):
         try:
-            with open(legacy_filename, 'r', encoding='utf-8') as f:
+            with open_report(legacy_filename) as f:
                 legacy_backup = yaml.safe_load(f)
             
             if (legacy_backup and isinstance(legacy_backup, dict) and 
@@ -4782,9 +4975,9 @@ def main():
     
     # Проверяем наличие отдельного кумулятивного файла (старый формат)
     cumulative_filename = f"{yaml_filename}.cumulative"
-    if os.path.exists(cumulative_filename):
+    if not replay and os.path.exists(cumulative_filename):
         try:
-            with open(cumulative_filename, 'r', encoding='utf-8') as f:
+            with open_report(cumulative_filename) as f:
                 cumulative_backup = yaml.safe_load(f)
             
             if (cumulative_backup and isinstance(cumulative_backup, dict) and 
@@ -4794,23 +4987,176 @@ def main():
         except Exception as e:
             print(f"⚠️ Error loading cumulative backup: {e}")
     
+    # Локальная история измерений в SQLite (--history-db или GLACIER_HISTORY_DB;
+    # при воспроизведении - только явно заданная --history-db)
+    history_store = None
+    history_path = args.history_db or (None if replay else configuration['history_store']['path'])
+    if history_path:
+        try:
+            history_store = HistoryStore.from_config(configuration, history_path)
+            print(f"🗄️ History database: {history_path}")
+        except (sqlite3.Error, OSError) as e:
+            print(f"⚠️ History database unavailable: {e}")
+    
+    # Журнал изменений: последние MAX_CHANGES_LOG записей в памяти, вытесненные - в gzip журнал
+    # (при воспроизведении журнал на диске не ведется)
+    changes_settings = configuration['changes_log']
+    spill = None
+    if changes_settings['spill'] and not replay:
+        spill = SpillWriter(f"{file_prefix}_changes_log.jsonl.gz",
+                            changes_settings['spill_max_bytes'], changes_settings['spill_backups'])
+    try:
+        change_stats = (ChangeStatistics.from_dict(cumulative_state['changes_stats'])
+                        if cumulative_state.get('changes_stats') else None)
+    except (ValueError, TypeError, AttributeError) as e:
+        print(f"⚠️ Failed to restore change statistics: {e}, rebuilding from log")
+        change_stats = None
+    try:
+        changes_log = ChangesLog(cumulative_state.get('changes_log') or [], MAX_CHANGES_LOG, spill, change_stats)
+    except OSError as e:
+        print(f"⚠️ Changes log spill unavailable: {e}")
+        changes_log = ChangesLog(cumulative_state.get('changes_log') or [], MAX_CHANGES_LOG, None, change_stats)
+    cumulative_state['changes_log'] = changes_log.to_list()
+    cumulative_state['changes_stats'] = changes_log.statistics.to_dict()
+    
+    # Временные ряды измерений (минута/час/сутки) в кольцевых буферах постоянного размера
+    try:
+        rollups = RollupStore.from_dict(cumulative_state.get('rollups'), configuration['rollups'])
+    except (ValueError, TypeError, AttributeError) as e:
+        print(f"⚠️ Failed to restore rollups: {e}, starting fresh")
+        rollups = RollupStore.from_config(configuration)
+    
+    # История длительностей этапов (p50/p95 по последним измерениям)
+    SPANS.max_samples = configuration['profiling']['max_samples']
+    try:
+        SPANS.load(cumulative_state.get('timings'))
+    except (ValueError, TypeError, AttributeError) as e:
+        print(f"⚠️ Failed to restore stage timings: {e}, starting fresh")
+        SPANS.load(None)
+    
+    # Собственная нагрузка: ограничения прошлого запуска действуют, пока нагрузка не снизится
+    self_monitor = SelfMonitor()
+    if replay and args.cpu_budget is None and args.rss_budget is None:
+        # Нагрузка процесса воспроизведения не должна менять набор сборщиков между прогонами
+        throttle = AdaptiveThrottle()
+    else:
+        try:
+            throttle = AdaptiveThrottle.from_config(configuration)
+        except ValueError as e:
+            print(f"⚠️ Self monitor: {e}, throttling disabled")
+            throttle = AdaptiveThrottle()
+    throttle.load(cumulative_state.get('self_monitor'))
+    throttle_base = {'collectors': dict(configuration['collectors']),
+                     'flow_sampling': dict(configuration['flow_sampling'])}
+    wait = min(max(args.wait, configuration['self_monitor']['max_interval']),
+               args.wait * throttle.apply(configuration, throttle_base))
+    if throttle.enabled:
+        print(f"🚦 Self budget: cpu {throttle.cpu_percent or '-'}%, rss {throttle.rss_mb or '-'} MB"
+              + (f", active limits: {', '.join(throttle.active)}" if throttle.active else ''))
+    
+    # Скетчи уникальных собеседников накапливаются между запусками вместе с состоянием
+    try:
+        if cumulative_state.get('cardinality'):
+            cardinality = CardinalityTracker.from_dict(cumulative_state['cardinality'])
+        else:
+            cardinality = CardinalityTracker.from_config(configuration)
+    except (ValueError, TypeError, AttributeError) as e:
+        print(f"⚠️ Failed to restore cardinality sketches: {e}, starting fresh")
+        cardinality = CardinalityTracker.from_config(configuration)
+    
+    # HTTP эндпоинт метрик (--metrics-port или GLACIER_METRICS_PORT): снимок обновляется после измерения;
+    # при воспроизведении - только явно заданный --metrics-port
+    metrics_exporter = None
+    metrics_port = args.metrics_port
+    if metrics_port is None and not replay:
+        metrics_port = configuration['metrics_exporter']['port']
+    if metrics_port:
+        try:
+            metrics_exporter = MetricsExporter.from_config(configuration, metrics_port)
+            print(f"📡 Metrics endpoint: http://{configuration['metrics_exporter']['address'] or '0.0.0.0'}:{metrics_exporter.port}/metrics")
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Metrics endpoint unavailable: {e}")
+    
     start_time = time.time()
     
     # Переменная для отслеживания, была ли уже выполнена загрузка по расписанию
     scheduled_upload_done = False
     
+    # Ключи выгрузки запуска: <reports_prefix>/<дата>/<hostname>/<run_id>.<расширение>
+    s3_run = report_run(configuration['s3'].get('reports_prefix', ''), hostname)
+    if not args.no_s3:
+        print(f"☁️ S3 keys: {report_key(s3_run['prefix'], hostname, s3_run['run_id'], '*', s3_run['date'])}")
+    
+    # Очередь выгрузки в S3 (upload_spool.py): измерения не ждут S3, ошибки выгрузки
+    # повторяются в фоне; при воспроизведении, --force-s3 и неполных настройках S3 выгрузка синхронная
+    upload_spool = None
+    s3_configured = all(configuration['s3'].get(field) for field in ('url', 'user', 'access_key'))
+    if not args.no_s3 and not args.force_s3 and s3_configured and configuration['upload_spool']['enabled']:
+        try:
+            upload_spool = create_upload_spool(configuration, py_version, f"{hostname}_{os_name}_upload_spool",
+                                               f"{yaml_filename}.s3manifest")
+        except OSError as e:
+            print(f"⚠️ S3: Upload spool unavailable ({e}), uploading synchronously")
+    
+    # Бинарный экспорт NetFlow v9 на коллектор (--netflow-collector или netflow_export.collector);
+    # воспроизведение без сети: только явно заданный --netflow-collector
+    netflow_exporter = None
+    if not replay or args.netflow_collector:
+        netflow_exporter = get_netflow_exporter(configuration, collector=args.netflow_collector)
+    if netflow_exporter:
+        export_generator = NetFlowGenerator(observation_domain_id=netflow_exporter.source_id,
+                                            ip_database=get_ip_database(configuration))
+    
     for i in range(args.times):
         print(f"\n--- Measurement {i+1}/{args.times} ---")
         
         measurement_start = time.time()
-        measurement_timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S')
+        # Время измерения для отчета: при воспроизведении - записанное (capture.py)
+        measured_at = CAPTURE.begin_measurement()
+        measurement_timestamp = dt.fromtimestamp(measured_at).strftime('%Y-%m-%d %H:%M:%S')
         
         # Собираем данные (оптимизированная версия)
-        current_data = collect_system_data()
+        current_data = collect_system_data(cardinality)
+        CAPTURE.end_measurement()
+        measurement_totals = current_data.pop('measurement_totals', None)
+        measured_connections = current_data.pop('measured_connections', None)
         measurement_time = time.time() - measurement_start
         
+        # Нагрузка анализатора за цикл (прошлые сериализация и ожидание + текущий сбор)
+        self_usage = self_monitor.sample()
+        if measurement_totals is not None:
+            measurement_totals['self_cpu_percent'] = self_usage['cpu_percent']
+            measurement_totals['self_rss_mb'] = self_usage['rss_mb']
+        decision = throttle.observe(self_usage, measurement_timestamp)
+        if decision:
+            settings = configuration['self_monitor']
+            wait = min(max(args.wait, settings['max_interval']),
+                       args.wait * throttle.apply(configuration, throttle_base))
+            print(f"🚦 Self monitor: {decision['decision']} {decision['action']} ({', '.join(decision['reasons'])}), "
+                  f"interval {wait}s")
+        cumulative_state['self_monitor'] = dict(throttle.to_dict(), last=self_usage)
+        with span('store.cardinality'):
+            cumulative_state['cardinality'] = cardinality.to_dict()
+        
         # Сравниваем с предыдущим состоянием
         changes = detect_changes(cumulative_state.get('current_state', {}), current_data)
+        with span('store.rollups'):
+            measurement_values = rollups.record_measurement(measured_at, current_data, measurement_time,
+                                                            bool(changes) or not cumulative_state.get('current_state'),
+                                                            measurement_totals)
+            cumulative_state['rollups'] = rollups.to_dict()
+        
+        if history_store is not None:
+            try:
+                history_started = time.perf_counter()
+                with span('store.history'):
+                    history_store.record_measurement(measured_at, current_data, changes, measurement_time, hostname,
+                                                     connections=measured_connections)
+                print(f"🗄️ History: measurement saved in {(time.perf_counter() - history_started) * 1000:.1f} ms")
+            except (sqlite3.Error, OSError) as e:
+                print(f"⚠️ History database error: {e}, recording disabled")
+                history_store.close()
+                history_store = None
         
         # Увеличиваем счетчик измерений для каждого выполненного измерения
         cumulative_state['total_measurements'] += 1
@@ -4825,7 +5171,14 @@ def main():
                 'first_run': not cumulative_state.get('current_state')
             }
             
-            cumulative_state['changes_log'].append(change_entry)
+            try:
+                changes_log.append(change_entry)
+            except OSError as e:
+                # Запись остается в памяти; журнал на диске отключается до конца запуска
+                print(f"⚠️ Changes log spill error: {e}")
+                changes_log.spill = None
+            cumulative_state['changes_log'] = changes_log.to_list()
+            cumulative_state['changes_stats'] = changes_log.statistics.to_dict()
             cumulative_state['current_state'] = current_data
             cumulative_state['last_update'] = measurement_timestamp
             
@@ -4835,18 +5188,36 @@ def main():
             cumulative_state['last_update'] = measurement_timestamp
             print(f"ℹ️ No changes (measurement #{cumulative_state['total_measurements']} in {measurement_time:.2f}s)")
         
+        if metrics_exporter is not None:
+            with span('export.metrics'):
+                metrics_exporter.update(current_data, totals=measurement_totals, rates=measurement_values,
+                                        collector_seconds={name[len('collect.'):]: seconds
+                                                           for name, seconds in SPANS.current.items()
+                                                           if name.startswith('collect.')},
+                                        info={'hostname': hostname, 'version': VERSION, 'timestamp': measured_at,
+                                              'measurements': cumulative_state['total_measurements'],
+                                              'changes': changes_log.statistics.total,
+                                              'unique_remote_hosts': cardinality.host['peers'].count(),
+                                              'self_monitor': cumulative_state['self_monitor']})
+        
+        if netflow_exporter:
+            try:
+                export_measurement_netflow(netflow_exporter, export_generator, current_data)
+            except OSError as e:
+                print(f"⚠️ NetFlow export error: {e}")
+        
         # Сохраняем промежуточные отчеты только для локальных нужд
         if not args.no_s3:
             try:
                 # Сохраняем промежуточные файлы
-                with open(yaml_filename, 'w', encoding='utf-8') as f:
+                with open_report(yaml_filename, 'w', report_codec, report_level) as f, span('serialize.yaml'):
                     cumulative_state['session'] = {
                         'duration': round(time.time() - start_time, 2),
                         'measurements': cumulative_state['total_measurements']
                     }
                     yaml.dump(cumulative_state, f, default_flow_style=False, allow_unicode=True, sort_keys=False)
                 
-                generate_compact_html_report(cumulative_state, html_filename)
+                generate_compact_html_report(cumulative_state, html_filename, report_codec, report_level)
                 
                 # Проверяем время загрузки в S3 только один раз (если еще не выполнена)
                 if not args.no_s3 and not args.force_s3 and not scheduled_upload_done:
@@ -4857,7 +5228,9 @@ def main():
                             html_filename, 
                             upload_time=upload_time,
                             configuration=configuration, 
-                            py_version=py_version
+                            py_version=py_version,
+                            spool=upload_spool,
+                            run=s3_run
                         )
                     except Exception as e:
                         print(f"⚠️ S3 scheduled upload error: {e}")
@@ -4865,13 +5238,40 @@ def main():
             except Exception as e:
                 print(f"⚠️ S3: Preparation error: {e}")
         
+        # Длительности этапов измерения (сохраненный выше YAML содержит предыдущие измерения)
+        SPANS.add('measurement', time.time() - measurement_start)
+        cumulative_state['timings'] = timings_state(SPANS.take())
+        
         if i < args.times - 1:
-            time.sleep(args.wait)
+            time.sleep(wait)
     
-    # Ограничиваем размер лога изменений
-    if len(cumulative_state['changes_log']) > MAX_CHANGES_LOG:
-        cumulative_state['changes_log'] = cumulative_state['changes_log'][-MAX_CHANGES_LOG:]
-        print(f"🗂️ Changes log trimmed to {MAX_CHANGES_LOG} entries")
+    # Политика хранения истории: удаление старых измерений и периодическая очистка файла
+    if history_store is not None:
+        try:
+            deleted = history_store.apply_retention()
+            removed = sum(count for table, count in deleted.items() if table != 'vacuum')
+            if removed:
+                print(f"🧹 History retention: {removed} old rows removed")
+        except sqlite3.Error as e:
+            print(f"⚠️ History retention error: {e}")
+        history_store.close()
+    
+    if metrics_exporter is not None:
+        metrics_exporter.close()
+    
+    # Запись закрывается до отчетов: файл полный, даже если формирование отчета упадет
+    if CAPTURE.mode == 'record':
+        CAPTURE.close()
+        print(f"⏺️ Capture saved: {args.record} ({os.path.getsize(args.record)} bytes)")
+    elif CAPTURE.mode == 'replay':
+        if CAPTURE.misses:
+            print(f"⚠️ Replay: calls missing from the capture: {dict(CAPTURE.misses)}")
+        CAPTURE.close()
+    
+    # Журнал изменений ограничен с самого начала; вытесненные записи уже на диске
+    changes_log.close()
+    if changes_log.spilled and changes_log.spill is not None:
+        print(f"🗂️ Changes log: {changes_log.spilled} older entries moved to {changes_log.spill.path}")
     
     # Финализируем сессию
     total_time = time.time() - start_time
@@ -4882,42 +5282,57 @@ def main():
     
     # Генерируем NetFlow отчет (стандарт RFC 3954)
     print(f"\n🌊 Generating NetFlow v9 standard report...")
+    netflow_report = None
+    yaml_sink = None
+    ipfix_sink = None
+    legacy_sink = LegacyReportSink()
     try:
         # Создаем NetFlow генератор
-        netflow_generator = NetFlowGenerator(observation_domain_id=1)
+        netflow_generator = NetFlowGenerator(observation_domain_id=1,
+                                             ip_database=get_ip_database(configuration))
         
-        # Генерируем NetFlow отчет из собранных данных
-        netflow_report = netflow_generator.generate_netflow_report(cumulative_state)
+        # Приемники потоков: YAML отчет, IPFIX архив и legacy данные для HTML.
+        # Каждый поток создается один раз и сразу пишется во все приемники
+        yaml_sink = YAMLReportSink(yaml_filename, report_codec, report_level)
+        sinks = [yaml_sink, legacy_sink]
+        try:
+            # Бинарный IPFIX архив (RFC 7011) - компактнее YAML и читается без разбора YAML
+            ipfix_sink = IPFIXReportSink(ipfix_filename, observation_domain_id=1)
+            sinks.append(ipfix_sink)
+        except OSError as e:
+            print(f"⚠️ Failed to save IPFIX archive: {e}")
         
-        # Форматируем для YAML
-        netflow_yaml_data = netflow_generator.format_netflow_yaml(netflow_report)
+        with span('serialize.netflow'):
+            netflow_report = netflow_generator.stream_netflow_report(cumulative_state, sinks)
         
-        print(f"✅ NetFlow v9 report generated: {len(netflow_report['flow_records'])} flows, {netflow_report['statistics']['total_packets']} packets")
+        print(f"✅ NetFlow v9 report generated: {netflow_report['statistics']['total_flows']} flows, {netflow_report['statistics']['total_packets']} packets")
         print(f"📊 NetFlow header version: {netflow_report['message_header']['version']}, flows: {netflow_report['message_header']['count']}")
     except Exception as e:
         print(f"⚠️ NetFlow generation error: {e}")
         # Если NetFlow генерация не удалась, используем старый формат
-        netflow_yaml_data = None
+        netflow_report = None
     
     # Сохраняем отчеты в оба формата для максимальной совместимости
     try:
-        if netflow_yaml_data:
-            # Сохраняем NetFlow стандартный отчет
-            with open(yaml_filename, 'w', encoding='utf-8') as f:
-                yaml.dump(netflow_yaml_data, f, default_flow_style=False, allow_unicode=True, sort_keys=False)
+        if netflow_report and yaml_sink.error is None:
+            # NetFlow стандартный отчет уже записан приемником
             print(f"✅ NetFlow v9 YAML report: {yaml_filename}")
+            if ipfix_sink is not None and ipfix_sink.error is None:
+                print(f"✅ IPFIX archive: {ipfix_filename} ({ipfix_sink.flow_count} flows, {os.path.getsize(ipfix_filename)} bytes)")
             
             # Создаем legacy бэкап для совместимости и восстановления состояния
             legacy_filename = f"{yaml_filename}.legacy"
             try:
-                with open(legacy_filename, 'w', encoding='utf-8') as f:
+                with open_report(legacy_filename, 'w', report_codec, report_level) as f, span('serialize.legacy_backup'):
                     yaml.dump(cumulative_state, f, default_flow_style=False, allow_unicode=True, sort_keys=False)
                 print(f"✅ Legacy backup saved: {legacy_filename}")
             except Exception as e:
                 print(f"⚠️ Failed to save legacy backup: {e}")
+        elif yaml_sink is not None and isinstance(yaml_sink.error, PermissionError):
+            raise yaml_sink.error
         else:
             # Fallback: сохраняем только legacy формат
-            with open(yaml_filename, 'w', encoding='utf-8') as f:
+            with open_report(yaml_filename, 'w', report_codec, report_level) as f:
                 yaml.dump(cumulative_state, f, default_flow_style=False, allow_unicode=True, sort_keys=False)
             print(f"✅ Legacy YAML report (NetFlow failed): {yaml_filename}")
             
@@ -4926,9 +5341,9 @@ def main():
         print(f"💡 Try: sudo chown $USER:staff {yaml_filename}")
         print(f"📁 Or run analyzer with administrator rights")
         # Пытаемся сохранить в альтернативное место
-        alt_filename = f"temp_{yaml_filename}"
+        alt_filename = os.path.join(os.path.dirname(yaml_filename), f"temp_{os.path.basename(yaml_filename)}")
         try:
-            with open(alt_filename, 'w', encoding='utf-8') as f:
+            with open_report(alt_filename, 'w', report_codec, report_level) as f:
                 yaml.dump(cumulative_state, f, default_flow_style=False, allow_unicode=True, sort_keys=False)
             print(f"✅ Alternative cumulative YAML report: {alt_filename}")
         except Exception as e:
@@ -4941,23 +5356,24 @@ def main():
     
     # Создаем HTML отчет (конвертируем NetFlow в legacy формат для совместимости)
     try:
-        if netflow_yaml_data:
-            # Конвертируем NetFlow данные обратно в legacy формат для HTML генератора
-            html_compatible_data = NetFlowGenerator.convert_netflow_yaml_to_legacy_format(netflow_yaml_data)
+        if legacy_sink.result is not None:
+            # Legacy формат для HTML генератора собран из тех же NetFlow потоков
+            html_compatible_data = legacy_sink.result
             print(f"🔄 Converting NetFlow data for HTML compatibility...")
         else:
             # Используем кумулятивные данные напрямую
             html_compatible_data = cumulative_state
         
-        html_report_path = generate_compact_html_report(html_compatible_data, html_filename)
+        html_report_path = generate_compact_html_report(html_compatible_data, html_filename, report_codec, report_level)
         print(f"✅ HTML report: {html_report_path}")
     except PermissionError:
         print(f"❌ Permission error for HTML file: {html_filename}")
         print(f"💡 Try: sudo chown $USER:staff {html_filename}")
         # Пытаемся сохранить в альтернативное место
-        alt_html_filename = f"temp_{html_filename}"
+        alt_html_filename = os.path.join(os.path.dirname(html_filename), f"temp_{os.path.basename(html_filename)}")
         try:
-            html_report_path = generate_compact_html_report(html_compatible_data, alt_html_filename)
+            html_report_path = generate_compact_html_report(html_compatible_data, alt_html_filename, report_codec,
+                                                            report_level)
             print(f"✅ Alternative HTML report: {alt_html_filename}")
         except Exception as e:
             print(f"❌ Failed to create HTML report: {e}")
@@ -4968,7 +5384,7 @@ def main():
     if args.force_s3:
         print(f"\n☁️ Force S3 Upload Process")
         try:
-            upload_success = upload_reports_to_s3(configuration, py_version, yaml_filename, html_filename)
+            upload_success = upload_reports_to_s3(configuration, py_version, yaml_filename, html_filename, s3_run)
             if upload_success:
                 print(f"🌐 S3: All reports successfully uploaded (forced)")
             else:
@@ -4979,17 +5395,37 @@ def main():
     # Загрузка в S3 в конце всех измерений (если не было принудительной загрузки и не выполнялась по расписанию)
     elif not args.no_s3 and not scheduled_upload_done:
         try:
-            upload_reports_at_end(yaml_filename, html_filename, configuration=configuration, py_version=py_version)
+            upload_reports_at_end(yaml_filename, html_filename, configuration=configuration, py_version=py_version,
+                                  spool=upload_spool, run=s3_run)
         except Exception as e:
             print(f"❌ S3: End upload failed: {e}")
     
+    if upload_spool is not None:
+        drain_spool(upload_spool, configuration['upload_spool']['drain_timeout'])
+    
+    # Этапы формирования отчетов: выводятся здесь, в отчет попадают только этапы измерений
+    report_stages = SPANS.take()
+    if report_stages:
+        print(f"\n⏱️ Report stages: " + ', '.join(f"{name} {seconds:.2f}s" for name, seconds in report_stages.items()))
+    if cumulative_state.get('timings', {}).get('summary'):
+        print(f"⏱️ Slowest measurement stages (p50/p95 over last {SPANS.max_samples} measurements):")
+        for line in format_timings(cumulative_state['timings']['summary'], limit=8):
+            print(f"   {line}")
+    
+    if profiler is not None:
+        paths = profiler.stop()
+        print(f"🔬 Profile saved: {paths['pstats']} (python -m pstats), {paths['collapsed']} (flamegraph.pl)")
+        print(profiler.top(15))
+        print(f"📦 Import time by subsystem ({paths['imports']}):")
+        for line in format_imports():
+            print(f"  {line}")
+    
     print(f"\n🎉 Analysis completed in {total_time:.2f} seconds")
 
 # Get attribute from user
 if __name__ == "__main__":
     configuration = get_config()
     hostname = socket.gethostname()
-    os_info = {"name": distro.name(), "version": distro.version()}
 
     try:
         py_major = sys.version_info[0]
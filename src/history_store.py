@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Локальная история измерений в SQLite
+Каждое измерение записывает потоки, слушающие порты и события изменений одной
+транзакцией (WAL, executemany). Индексы по удаленному IP, порту, процессу и
+времени отвечают на вопросы вида "какой процесс ходил в 10.20.0.0/16 на прошлой
+неделе" без разбора YAML отчетов:
+
+    python3 src/glacier.py query --remote 10.20.0.0/16 --since 7d
+"""
+
+import argparse
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+from urllib.parse import quote
+
+from address_classifier import split_host_port
+from netflow_generator import parse_seen_time
+
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_VACUUM_INTERVAL_HOURS = 24
+SCHEMA_VERSION = 1
+IPV4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    hostname TEXT,
+    duration REAL,
+    changed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS flows (
+    measurement_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    direction TEXT NOT NULL,
+    protocol TEXT,
+    process TEXT,
+    local_ip TEXT,
+    local_port INTEGER,
+    remote_ip TEXT,
+    remote_port INTEGER,
+    remote_key BLOB,
+    remote_name TEXT,
+    count INTEGER,
+    first_seen INTEGER,
+    last_seen INTEGER
+);
+CREATE TABLE IF NOT EXISTS listeners (
+    measurement_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    protocol TEXT NOT NULL,
+    port INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    measurement_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS flows_remote ON flows (remote_key, ts);
+CREATE INDEX IF NOT EXISTS flows_port ON flows (remote_port, ts);
+CREATE INDEX IF NOT EXISTS flows_local_port ON flows (local_port, ts);
+CREATE INDEX IF NOT EXISTS flows_process ON flows (process, ts);
+CREATE INDEX IF NOT EXISTS flows_ts ON flows (ts);
+CREATE INDEX IF NOT EXISTS listeners_port ON listeners (port, ts);
+CREATE INDEX IF NOT EXISTS changes_ts ON changes (ts);
+CREATE INDEX IF NOT EXISTS measurements_ts ON measurements (ts);
+"""
+
+
+@lru_cache(maxsize=65536)
+def address_key(host: Optional[str]) -> Optional[bytes]:
+    """16-байтный ключ адреса (IPv4 как ::ffff:a.b.c.d): диапазон CIDR - это диапазон ключей"""
+    host = (host or '').split('%')[0]
+    try:
+        return IPV4_MAPPED_PREFIX + socket.inet_pton(socket.AF_INET, host)
+    except OSError:
+        pass
+    try:
+        return socket.inet_pton(socket.AF_INET6, host)
+    except OSError:
+        return None
+
+
+def network_range(network: str) -> tuple:
+    """(минимальный, максимальный) ключ адресов сети '10.20.0.0/16' или одного адреса"""
+    parsed = ipaddress.ip_network(network, strict=False)
+    return address_key(str(parsed.network_address)), address_key(str(parsed.broadcast_address))
+
+
+def parse_since(value: Optional[str], now: Optional[float] = None) -> Optional[int]:
+    """'7d', '12h', '30m', epoch или дата 'YYYY-MM-DD[ HH:MM:SS]' -> epoch"""
+    if not value:
+        return None
+    now = time.time() if now is None else now
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    if value[-1] in units and value[:-1].isdigit():
+        return int(now - int(value[:-1]) * units[value[-1]])
+    if value.isdigit():
+        return int(value)
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return int(datetime.strptime(value, fmt).timestamp())
+        except ValueError:
+            continue
+    raise ValueError(f"Unsupported time value: {value!r} (use 7d, 12h, epoch or YYYY-MM-DD)")
+
+
+def _port(value: Optional[str]) -> Optional[int]:
+    return int(value) if value and value.isdigit() else None
+
+
+def _seen(connection: Dict[str, Any], key: str) -> Optional[int]:
+    timestamp = connection.get(f'{key}_ts')
+    if timestamp is not None:
+        return int(timestamp)
+    value = connection.get(key)
+    return parse_seen_time(value) if isinstance(value, str) and value != 'unknown' else None
+
+
+class HistoryStore:
+    """SQLite база истории измерений (WAL) с политикой хранения и периодической очисткой"""
+
+    def __init__(self, path: str, retention_days: int = DEFAULT_RETENTION_DAYS,
+                 vacuum_interval_hours: float = DEFAULT_VACUUM_INTERVAL_HOURS, read_only: bool = False):
+        self.path = path
+        self.retention_days = retention_days
+        self.vacuum_interval_hours = vacuum_interval_hours
+        if read_only:
+            # Только чтение (glacier query): не создает файл и не меняет схему работающего агента
+            self.connection = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)
+            return
+        self.connection = sqlite3.connect(path)
+        # auto_vacuum действует только до создания первой таблицы
+        self.connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            self.connection.execute("INSERT OR IGNORE INTO meta VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+
+    @classmethod
+    def from_config(cls, configuration: Dict[str, Any], path: Optional[str] = None) -> 'HistoryStore':
+        settings = configuration.get('history_store', {})
+        return cls(path or settings['path'], settings.get('retention_days', DEFAULT_RETENTION_DAYS),
+                   settings.get('vacuum_interval_hours', DEFAULT_VACUUM_INTERVAL_HOURS))
+
+    def record_measurement(self, timestamp: float, current_data: Dict[str, Any], changes: Dict[str, Any],
+                           duration: float = 0.0, hostname: Optional[str] = None,
+                           connections: Optional[Dict[str, List[Dict[str, Any]]]] = None) -> int:
+        """
+        Записывает измерение одной транзакцией; возвращает его id
+        connections - соединения этого измерения без дополнения из истории (иначе current_data['connections'])
+        """
+        ts = int(timestamp)
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO measurements (ts, hostname, duration, changed) VALUES (?, ?, ?, ?)',
+                (ts, hostname, round(duration, 3), 1 if changes else 0))
+            measurement_id = cursor.lastrowid
+
+            flow_rows = []
+            if connections is None:
+                connections = current_data.get('connections', {})
+            for direction in ('incoming', 'outgoing'):
+                for connection in connections.get(direction, []):
+                    remote = connection.get('remote', {})
+                    if not isinstance(remote, dict):
+                        remote = {'address': str(remote)}
+                    local_ip, local_port = split_host_port(connection.get('local', ''))
+                    remote_ip, remote_port = split_host_port(remote.get('address', ''))
+                    flow_rows.append((measurement_id, ts, direction, connection.get('protocol', 'tcp'),
+                                      connection.get('process', 'unknown'), local_ip, _port(local_port),
+                                      remote_ip, _port(remote_port), address_key(remote_ip), remote.get('name'),
+                                      connection.get('count', 1), _seen(connection, 'first_seen'),
+                                      _seen(connection, 'last_seen')))
+            self.connection.executemany('INSERT INTO flows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                        flow_rows)
+
+            listener_rows = [(measurement_id, ts, protocol, int(port))
+                             for protocol in ('tcp', 'udp')
+                             for port in current_data.get(f'{protocol}_ports', [])
+                             if str(port).isdigit()]
+            self.connection.executemany('INSERT INTO listeners VALUES (?, ?, ?, ?)', listener_rows)
+
+            change_rows = [(measurement_id, ts, category, json.dumps(detail, ensure_ascii=False, default=str))
+                           for category, detail in (changes or {}).items()]
+            self.connection.executemany('INSERT INTO changes VALUES (?, ?, ?, ?)', change_rows)
+        return measurement_id
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def apply_retention(self, now: Optional[float] = None, force_vacuum: bool = False) -> Dict[str, int]:
+        """Удаляет записи старше retention_days; раз в vacuum_interval_hours возвращает место на диске"""
+        now = time.time() if now is None else now
+        deleted = {}
+        if self.retention_days:
+            cutoff = int(now - self.retention_days * 86400)
+            with self.connection:
+                for table in ('flows', 'listeners', 'changes', 'measurements'):
+                    deleted[table] = self.connection.execute(f'DELETE FROM {table} WHERE ts < ?', (cutoff,)).rowcount
+        last_vacuum = float(self._meta('last_vacuum') or 0)
+        if force_vacuum or now - last_vacuum >= self.vacuum_interval_hours * 3600:
+            self.connection.execute('PRAGMA incremental_vacuum')
+            self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            with self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('last_vacuum', ?)", (str(int(now)),))
+            deleted['vacuum'] = 1
+        return deleted
+
+    def query_flows(self, remote: Optional[str] = None, port: Optional[int] = None,
+                    process: Optional[str] = None, direction: Optional[str] = None,
+                    since: Optional[int] = None, until: Optional[int] = None,
+                    limit: Optional[int] = 100, group: bool = True) -> List[Dict[str, Any]]:
+        """
+        Потоки по фильтрам. remote - адрес или сеть CIDR, port - удаленный порт
+        (у входящих - локальный). group=True сворачивает измерения в строку на
+        (направление, процесс, протокол, удаленный адрес, порт)
+        """
+        conditions, params = [], []
+        if remote:
+            low, high = network_range(remote)
+            conditions.append('remote_key BETWEEN ? AND ?')
+            params += [low, high]
+        if port is not None:
+            conditions.append("(remote_port = ? AND direction = 'outgoing' OR local_port = ? AND direction = 'incoming')")
+            params += [port, port]
+        if process:
+            conditions.append('process = ?')
+            params.append(process)
+        if direction:
+            conditions.append('direction = ?')
+            params.append(direction)
+        if since is not None:
+            conditions.append('ts >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('ts <= ?')
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        if group:
+            sql = f"""
+                SELECT direction, process, protocol, remote_ip, remote_port, local_port,
+                       COUNT(DISTINCT measurement_id) AS measurements, MAX(count) AS count,
+                       MIN(COALESCE(first_seen, ts)) AS first_seen, MAX(COALESCE(last_seen, ts)) AS last_seen
+                FROM flows {where}
+                GROUP BY direction, process, protocol, remote_ip, remote_port,
+                         CASE direction WHEN 'incoming' THEN local_port END
+                ORDER BY last_seen DESC"""
+        else:
+            sql = f"""
+                SELECT ts, direction, process, protocol, local_ip, local_port, remote_ip, remote_port,
+                       remote_name, count, first_seen, last_seen
+                FROM flows {where} ORDER BY ts DESC"""
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        cursor = self.connection.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def query_changes(self, since: Optional[int] = None, limit: Optional[int] = 100) -> List[Dict[str, Any]]:
+        sql = 'SELECT ts, category, detail FROM changes'
+        params: List[Any] = []
+        if since is not None:
+            sql += ' WHERE ts >= ?'
+            params.append(since)
+        sql += ' ORDER BY ts DESC'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [{'ts': ts, 'category': category, 'detail': json.loads(detail) if detail else None}
+                for ts, category, detail in self.connection.execute(sql, params)]
+
+    def close(self):
+        self.connection.close()
+
+
+def _format_time(value: Optional[int]) -> str:
+    return datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S') if value else '-'
+
+
+def _endpoint(host: Optional[str], port: Optional[int]) -> str:
+    host = host or '*'
+    if ':' in host:
+        host = f"[{host}]"
+    return f"{host}:{port}" if port is not None else host
+
+
+def query_main(argv: Sequence[str], configuration: Dict[str, Any]) -> int:
+    """Подкоманда `glacier query`: поиск по локальной истории измерений"""
+    parser = argparse.ArgumentParser(prog='glacier.py query', description='Query local Glacier history (SQLite)')
+    parser.add_argument('--db', default=configuration.get('history_store', {}).get('path'),
+                        help='History database (default: history_store.path / GLACIER_HISTORY_DB)')
+    parser.add_argument('--remote', help='Remote address or CIDR network, e.g. 10.20.0.0/16')
+    parser.add_argument('--port', type=int, help='Remote service port (local port for incoming flows)')
+    parser.add_argument('--process', help='Process name')
+    parser.add_argument('--direction', choices=('incoming', 'outgoing'))
+    parser.add_argument('--since', help='Start: 7d, 12h, 30m, epoch or YYYY-MM-DD')
+    parser.add_argument('--until', help='End: same formats as --since')
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--raw', action='store_true', help='One row per measurement instead of grouped flows')
+    parser.add_argument('--changes', action='store_true', help='Show change events instead of flows')
+    parser.add_argument('--json', action='store_true', help='JSON output')
+    args = parser.parse_args(list(argv))
+
+    if not args.db:
+        parser.error('history database is not configured: use --db or GLACIER_HISTORY_DB')
+    try:
+        since, until = parse_since(args.since), parse_since(args.until)
+        if args.remote:
+            network_range(args.remote)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if not os.path.exists(args.db):
+        print(f"❌ History database not found: {args.db}")
+        return 1
+    try:
+        store = HistoryStore(args.db, retention_days=0, read_only=True)
+    except sqlite3.Error as e:
+        print(f"❌ Cannot open history database {args.db}: {e}")
+        return 1
+    try:
+        started = time.perf_counter()
+        if args.changes:
+            rows = store.query_changes(since=since, limit=args.limit)
+        else:
+            rows = store.query_flows(remote=args.remote, port=args.port, process=args.process,
+                                     direction=args.direction, since=since, until=until,
+                                     limit=args.limit, group=not args.raw)
+        elapsed = time.perf_counter() - started
+    finally:
+        store.close()
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2, default=str))
+        return 0
+    for row in rows:
+        if args.changes:
+            print(f"{_format_time(row['ts'])}  {row['category']}: {json.dumps(row['detail'], ensure_ascii=False)}")
+            continue
+        local = f":{row['local_port']} " if row['direction'] == 'incoming' and row['local_port'] is not None else ''
+        arrow = '<-' if row['direction'] == 'incoming' else '->'
+        seen = (f"{_format_time(row['first_seen'])} .. {_format_time(row['last_seen'])}"
+                if not args.raw else _format_time(row['ts']))
+        extra = f", {row['measurements']} measurements" if not args.raw else ''
+        print(f"{row['process']:<24} {row['protocol']:<4} {local}{arrow} {_endpoint(row['remote_ip'], row['remote_port'])}"
+              f"  count={row['count']}{extra}  {seen}")
+    print(f"🔎 {len(rows)} rows in {elapsed * 1000:.1f} ms ({args.db})")
+    return 0
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    # Месяц измерений раз в 5 минут: 200 потоков на измерение
+    path = os.path.join(tempfile.mkdtemp(), 'history.sqlite')
+    store = HistoryStore(path, retention_days=30)
+    begin = time.time() - 30 * 86400
+    timings = []
+    for i in range(30 * 288 // 10):
+        ts = begin + i * 3000
+        data = {'connections': {'outgoing': [
+            {'local': f"10.0.0.5:{40000 + j}", 'remote': {'address': f"10.{20 + j % 3}.{j}.{i % 250}:443"},
+             'process': ('curl', 'python3', 'envoy')[j % 3], 'protocol': 'tcp', 'count': j,
+             'first_seen_ts': int(ts) - 60, 'last_seen_ts': int(ts)} for j in range(200)]},
+            'tcp_ports': [22, 443], 'udp_ports': [53]}
+        started = time.perf_counter()
+        store.record_measurement(ts, data, {'connections': {'count_changed': {'delta': 1}}}, 1.2, 'demo')
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    print(f"⏱️ {len(timings)} measurements x 200 flows: median {timings[len(timings) // 2] * 1000:.2f} ms, "
+          f"p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} ms per measurement")
+
+    started = time.perf_counter()
+    rows = store.query_flows(remote='10.20.0.0/16', since=parse_since('7d'), limit=5)
+    print(f"🔎 10.20.0.0/16 for 7 days: {rows[:2]} in {(time.perf_counter() - started) * 1000:.1f} ms")
+    print(f"🧹 Retention: {store.apply_retention(time.time() + 7 * 86400, force_vacuum=True)}")
+    store.close()
+    print(f"💾 Database: {os.path.getsize(path) / 1024 / 1024:.1f} MB")
@@ -8,6 +8,9 @@ import json
 from datetime import datetime
 from typing import Dict, Any, List
 
+from address_classifier import split_host_port
+from security_rules import RuleSynthesizer
+
 class HTMLReportGenerator:
     """Генератор HTML отчетов"""
     
@@ -1758,7 +1761,7 @@ Protocol | Packets | Bytes | Flags
                 <div class="tech-stack">
                     <div class="tech-item">
                         <h4>🐍 Backend</h4>
-                        <p>Python 3.6+<br>psutil, PyYAML<br>boto3, distro</p>
+                        <p>Python 3.6+<br>psutil, PyYAML<br>boto3</p>
                     </div>
                     <div class="tech-item">
                         <h4>📊 Analytics</h4>
@@ -1977,28 +1980,22 @@ Protocol | Packets | Bytes | Flags
     
     def _generate_recommended_security_rules(self, connections: Dict[str, List]) -> str:
         """Генерирует рекомендуемые правила безопасности"""
-        rules = []
-        
-        # Анализируем соединения и формируем правила
+        # Сворачиваем адреса назначения в CIDR, порты - в диапазоны
+        synthesizer = RuleSynthesizer.from_config()
         for process, process_connections in connections.items():
             for conn in process_connections:
-                remote = conn.get('remote', {})
-                protocol = conn.get('protocol', 'tcp').upper()
-                
-                if 'address' in remote and ':' in remote['address']:
-                    try:
-                        ip, port = remote['address'].rsplit(':', 1)
-                        rule = {
-                            'source': 'HOST',
-                            'destination': ip,
-                            'port': port,
-                            'protocol': protocol,
-                            'process': process,
-                            'action': 'ALLOW'
-                        }
-                        rules.append(rule)
-                    except ValueError:
-                        continue
+                ip, port = split_host_port(conn.get('remote', {}).get('address', ''))
+                if port:
+                    synthesizer.add_flow('outgoing', conn.get('protocol', 'tcp').upper(), process, ip, port)
+        
+        rules = [{
+            'source': 'HOST',
+            'destination': ', '.join(rule['cidrs']),
+            'port': rule['port'],
+            'protocol': rule['protocol'],
+            'process': rule['process'],
+            'action': 'ALLOW'
+        } for rule in synthesizer.synthesize()]
         
         if not rules:
             return "<p>Нет данных для формирования правил</p>"
@@ -2090,12 +2087,17 @@ Protocol | Packets | Bytes | Flags
             return "STANDARD"
 
 
-def generate_html_report_from_data(original_report: Dict[str, Any], output_file: str = None) -> str:
-    """Функция для интеграции в основной анализатор"""
+def generate_html_report_from_data(original_report: Dict[str, Any], output_file: str = None,
+                                   configuration: Dict[str, Any] = None) -> str:
+    """
+    Функция для интеграции в основной анализатор
+    configuration - конфигурация анализатора (по умолчанию get_config()), из нее берется IP база
+    """
+    from ip_database import get_ip_database
     from report_enhancer import enhance_analyzer_report
     
-    # Улучшаем отчет
-    enhanced_report = enhance_analyzer_report(original_report)
+    # Улучшаем отчет: география по офлайн IP базе, если она настроена
+    enhanced_report = enhance_analyzer_report(original_report, ip_database=get_ip_database(configuration))
     
     # Генерируем HTML
     generator = HTMLReportGenerator()
@@ -8,8 +8,8 @@ ICMP трекер для анализатора сетевых соединен
 на различных операционных системах.
 """
 
+import os
 import socket
-import psutil
 import time
 import platform
 import subprocess
@@ -18,6 +18,11 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional
 import logging
 
+from capture import captured
+from profiling import lazy_import
+
+psutil = lazy_import('psutil')
+
 # Константы для ICMP
 ICMP_ECHO_REQUEST = 8
 ICMP_ECHO_REPLY = 0
@@ -93,7 +98,7 @@ class ICMPTracker:
             
         try:
             # Читаем /proc/net/icmp
-            with open('/proc/net/icmp', 'r') as f:
+            with open(os.path.join(psutil.PROCFS_PATH, 'net', 'icmp'), 'r') as f:
                 lines = f.readlines()
                 
             for line in lines[1:]:  # Пропускаем заголовок
@@ -105,7 +110,7 @@ class ICMPTracker:
                         
             # Читаем /proc/net/snmp для статистики ICMP
             try:
-                with open('/proc/net/snmp', 'r') as f:
+                with open(os.path.join(psutil.PROCFS_PATH, 'net', 'snmp'), 'r') as f:
                     snmp_data = f.read()
                     
                 icmp_stats = self._parse_snmp_icmp_stats(snmp_data)
@@ -582,6 +587,7 @@ class ICMPTracker:
         }
 
 
+@captured('icmp_tracker', default=lambda debug=False: {})
 def get_icmp_information(debug: bool = False) -> Dict[str, Any]:
     """
     Основная функция для получения информации об ICMP трафике
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Офлайн база диапазонов IP адресов для гео/ASN атрибуции
+Загружает диапазоны (страна, ASN, провайдер) из CSV или бинарного снимка в
+отсортированные целочисленные массивы и ищет адреса бинарным поиском (bisect)
+без обращения к DNS
+"""
+
+import bisect
+import csv
+import heapq
+import ipaddress
+import os
+import socket
+import struct
+from array import array
+from typing import Dict, List, Any, Optional, Tuple
+
+# Заголовок бинарного снимка: magic, количество записей, диапазонов IPv4 и IPv6
+BINARY_MAGIC = b'GIPDB1'
+BINARY_HEADER = struct.Struct('!6sIII')
+BINARY_RECORD = struct.Struct('!2sIH')      # country, asn, длина имени провайдера
+BINARY_RANGE_V4 = struct.Struct('!III')     # start, end, индекс записи
+BINARY_RANGE_V6 = struct.Struct('!16s16sI')  # start, end, индекс записи
+
+
+def ip_to_int(address: str) -> Tuple[int, int]:
+    """Конвертирует строку адреса в (версия, целое число)"""
+    try:
+        return 4, struct.unpack('!I', socket.inet_aton(address))[0]
+    except (OSError, TypeError):
+        pass
+    ip = ipaddress.ip_address(address.strip('[]').split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        return 4, int(ip.ipv4_mapped)
+    return ip.version, int(ip)
+
+
+def _flatten_ranges(ranges: List[Tuple[int, int, int]]) -> List[Tuple[int, int, int]]:
+    """
+    Превращает пересекающиеся диапазоны в непересекающиеся
+    Вложенный (более специфичный) диапазон имеет приоритет над объемлющим
+    """
+    heap = [(start, -end, seq, record) for seq, (start, end, record) in enumerate(ranges)]
+    heapq.heapify(heap)
+
+    flat = []
+    stack = []  # открытые диапазоны (start, end, record), вложенные друг в друга
+    cursor = 0
+
+    def emit(start, end, record):
+        if start > end:
+            return
+        if flat and flat[-1][2] == record and flat[-1][1] + 1 == start:
+            flat[-1] = (flat[-1][0], end, record)
+        else:
+            flat.append((start, end, record))
+
+    while heap:
+        start, neg_end, seq, record = heapq.heappop(heap)
+        end = -neg_end
+
+        # Закрываем диапазоны, которые закончились до начала текущего
+        while stack and stack[-1][1] < start:
+            _, top_end, top_record = stack.pop()
+            emit(cursor, top_end, top_record)
+            cursor = top_end + 1
+
+        if stack:
+            top_end = stack[-1][1]
+            # Частичное пересечение: хвост за пределами родителя обрабатываем отдельно
+            if end > top_end:
+                heapq.heappush(heap, (top_end + 1, -end, seq, record))
+                end = top_end
+            emit(cursor, start - 1, stack[-1][2])
+
+        cursor = start
+        stack.append((start, end, record))
+
+    while stack:
+        _, top_end, top_record = stack.pop()
+        emit(cursor, top_end, top_record)
+        cursor = top_end + 1
+
+    return flat
+
+
+class IPRangeDatabase:
+    """База IP диапазонов с поиском за O(log n)"""
+
+    def __init__(self):
+        self.records: List[Tuple[str, int, str]] = []
+        self._record_index: Dict[Tuple[str, int, str], int] = {}
+        self._pending = {4: [], 6: []}
+
+        # IPv4 хранится в компактных массивах, IPv6 - в списках (128 бит не помещаются в array)
+        self.v4_starts = array('L')
+        self.v4_ends = array('L')
+        self.v4_records = array('L')
+        self.v6_starts: List[int] = []
+        self.v6_ends: List[int] = []
+        self.v6_records = array('L')
+
+    def __len__(self) -> int:
+        return len(self.v4_starts) + len(self.v6_starts)
+
+    def _get_record_id(self, country: str, asn: int, provider: str) -> int:
+        key = ((country or '').upper()[:2], int(asn or 0), provider or '')
+        record_id = self._record_index.get(key)
+        if record_id is None:
+            record_id = len(self.records)
+            self.records.append(key)
+            self._record_index[key] = record_id
+        return record_id
+
+    def add_range(self, start: str, end: str, country: str = '', asn: int = 0, provider: str = ''):
+        """Добавляет диапазон адресов (применяется после вызова build)"""
+        start_version, start_int = ip_to_int(start)
+        end_version, end_int = ip_to_int(end)
+        if start_version != end_version:
+            raise ValueError(f"Диапазон {start}-{end} смешивает IPv4 и IPv6")
+        if start_int > end_int:
+            start_int, end_int = end_int, start_int
+        record_id = self._get_record_id(country, asn, provider)
+        self._pending[start_version].append((start_int, end_int, record_id))
+
+    def add_network(self, network: str, country: str = '', asn: int = 0, provider: str = ''):
+        """Добавляет сеть в нотации CIDR"""
+        net = ipaddress.ip_network(network, strict=False)
+        record_id = self._get_record_id(country, asn, provider)
+        self._pending[net.version].append((int(net.network_address), int(net.broadcast_address), record_id))
+
+    def build(self):
+        """Сортирует накопленные диапазоны и строит массивы для бинарного поиска"""
+        for version in (4, 6):
+            pending = self._pending[version]
+            if not pending:
+                continue
+            if version == 4:
+                existing = list(zip(self.v4_starts, self.v4_ends, self.v4_records))
+            else:
+                existing = list(zip(self.v6_starts, self.v6_ends, self.v6_records))
+            # Новые диапазоны добавлены позже и считаются более точными при равных границах
+            flat = _flatten_ranges(existing + pending)
+            self._pending[version] = []
+
+            if version == 4:
+                self.v4_starts = array('L', (r[0] for r in flat))
+                self.v4_ends = array('L', (r[1] for r in flat))
+                self.v4_records = array('L', (r[2] for r in flat))
+            else:
+                self.v6_starts = [r[0] for r in flat]
+                self.v6_ends = [r[1] for r in flat]
+                self.v6_records = array('L', (r[2] for r in flat))
+        return self
+
+    def lookup_int(self, version: int, ip_int: int) -> Optional[Tuple[str, int, str]]:
+        """Ищет запись (country, asn, provider) по целочисленному адресу"""
+        if version == 4:
+            starts, ends, records = self.v4_starts, self.v4_ends, self.v4_records
+        else:
+            starts, ends, records = self.v6_starts, self.v6_ends, self.v6_records
+        i = bisect.bisect_right(starts, ip_int) - 1
+        if i >= 0 and ip_int <= ends[i]:
+            return self.records[records[i]]
+        return None
+
+    def lookup(self, address: str) -> Optional[Dict[str, Any]]:
+        """Возвращает атрибуцию адреса или None, если адрес не найден"""
+        if not address:
+            return None
+        try:
+            version, ip_int = ip_to_int(address)
+        except ValueError:
+            return None
+        record = self.lookup_int(version, ip_int)
+        if record is None:
+            return None
+        country, asn, provider = record
+        return {'country': country, 'asn': asn, 'provider': provider}
+
+    def get_asn(self, address: str) -> int:
+        """Возвращает номер AS для адреса (0 если неизвестен)"""
+        info = self.lookup(address)
+        return info['asn'] if info else 0
+
+    def load_csv(self, path: str):
+        """
+        Загружает CSV с диапазонами. Поддерживаются строки вида:
+        start_ip,end_ip,country,asn,provider
+        network/prefix,country,asn,provider
+        Строки, начинающиеся с '#', и заголовок игнорируются
+        """
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.reader(f):
+                if not row or row[0].lstrip().startswith('#'):
+                    continue
+                row = [col.strip() for col in row]
+                try:
+                    if '/' in row[0]:
+                        network, country, asn, provider = (row + ['', '0', ''])[:4]
+                        self.add_network(network, country, _parse_asn(asn), provider)
+                    else:
+                        start, end, country, asn, provider = (row + ['', '', '0', ''])[:5]
+                        self.add_range(start, end, country, _parse_asn(asn), provider)
+                except ValueError:
+                    # Заголовок или некорректная строка
+                    continue
+        return self.build()
+
+    def save_binary(self, path: str):
+        """Сохраняет базу в компактный бинарный снимок"""
+        self.build()
+        with open(path, 'wb') as f:
+            f.write(BINARY_HEADER.pack(BINARY_MAGIC, len(self.records), len(self.v4_starts), len(self.v6_starts)))
+            for country, asn, provider in self.records:
+                provider_bytes = provider.encode('utf-8')
+                f.write(BINARY_RECORD.pack(country.encode('ascii', 'replace').ljust(2)[:2], asn, len(provider_bytes)))
+                f.write(provider_bytes)
+            for start, end, record in zip(self.v4_starts, self.v4_ends, self.v4_records):
+                f.write(BINARY_RANGE_V4.pack(start, end, record))
+            for start, end, record in zip(self.v6_starts, self.v6_ends, self.v6_records):
+                f.write(BINARY_RANGE_V6.pack(start.to_bytes(16, 'big'), end.to_bytes(16, 'big'), record))
+
+    def load_binary(self, path: str):
+        """Загружает бинарный снимок, созданный save_binary"""
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        magic, n_records, n_v4, n_v6 = BINARY_HEADER.unpack_from(data, 0)
+        if magic != BINARY_MAGIC:
+            raise ValueError(f"{path}: не является бинарной IP базой")
+        offset = BINARY_HEADER.size
+
+        self.records = []
+        self._record_index = {}
+        for _ in range(n_records):
+            country, asn, provider_len = BINARY_RECORD.unpack_from(data, offset)
+            offset += BINARY_RECORD.size
+            provider = data[offset:offset + provider_len].decode('utf-8')
+            offset += provider_len
+            self._get_record_id(country.decode('ascii').strip(), asn, provider)
+
+        v4 = list(BINARY_RANGE_V4.iter_unpack(data[offset:offset + n_v4 * BINARY_RANGE_V4.size]))
+        offset += n_v4 * BINARY_RANGE_V4.size
+        self.v4_starts = array('L', (r[0] for r in v4))
+        self.v4_ends = array('L', (r[1] for r in v4))
+        self.v4_records = array('L', (r[2] for r in v4))
+
+        v6 = list(BINARY_RANGE_V6.iter_unpack(data[offset:offset + n_v6 * BINARY_RANGE_V6.size]))
+        self.v6_starts = [int.from_bytes(r[0], 'big') for r in v6]
+        self.v6_ends = [int.from_bytes(r[1], 'big') for r in v6]
+        self.v6_records = array('L', (r[2] for r in v6))
+        return self
+
+    @classmethod
+    def load(cls, path: str) -> 'IPRangeDatabase':
+        """Загружает базу, определяя формат (бинарный снимок или CSV) по содержимому"""
+        with open(path, 'rb') as f:
+            magic = f.read(len(BINARY_MAGIC))
+        database = cls()
+        if magic == BINARY_MAGIC:
+            return database.load_binary(path)
+        return database.load_csv(path)
+
+
+def _parse_asn(value: str) -> int:
+    """Разбирает ASN в форматах '13335' и 'AS13335'"""
+    value = (value or '').strip().upper()
+    if value.startswith('AS'):
+        value = value[2:]
+    return int(value) if value else 0
+
+
+_database_cache: Dict[str, Optional[IPRangeDatabase]] = {}
+
+
+def get_ip_database(configuration: Optional[Dict[str, Any]] = None) -> Optional[IPRangeDatabase]:
+    """
+    Возвращает загруженную базу из конфигурации (ip_database.path)
+    База загружается один раз на процесс; None если путь не задан или файл недоступен
+    """
+    if configuration is None:
+        from analyzer_config import get_config
+        configuration = get_config()
+    path = (configuration.get('ip_database') or {}).get('path')
+    if not path:
+        return None
+    if path not in _database_cache:
+        database = None
+        if os.path.exists(path):
+            try:
+                database = IPRangeDatabase.load(path)
+                print(f"🌍 IP база загружена: {len(database)} диапазонов ({path})")
+            except (OSError, ValueError, struct.error) as e:
+                print(f"⚠️ Ошибка загрузки IP базы {path}: {e}")
+        else:
+            print(f"⚠️ IP база не найдена: {path}")
+        _database_cache[path] = database
+    return _database_cache[path]
+
+
+if __name__ == "__main__":
+    # Компиляция CSV в бинарный снимок: ip_database.py input.csv output.gipdb
+    import sys
+    if len(sys.argv) != 3:
+        print("Использование: ip_database.py <input.csv> <output.gipdb>")
+        sys.exit(1)
+    db = IPRangeDatabase().load_csv(sys.argv[1])
+    db.save_binary(sys.argv[2])
+    print(f"✅ Сохранено {len(db)} диапазонов, {len(db.records)} записей: {sys.argv[2]}")
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+HTTP эндпоинт метрик в формате OpenMetrics / Prometheus для режима демона
+Текст метрик строится один раз после каждого измерения (вместе с gzip версией),
+поэтому запрос /metrics только отдает готовые байты и не запускает сбор данных.
+Сервер (http.server) работает в фоновом потоке:
+
+    python3 src/glacier.py -w 60 -t 1440 --metrics-port 9877
+"""
+
+import gzip
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from profiling import import_span
+from rollups import count_connection
+
+DEFAULT_MAX_PROCESSES = 20
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# TCP собирается только в состоянии ESTABLISHED; у UDP/ICMP потоков состояния нет
+_STATE_BY_PROTOCOL = {'tcp': 'established'}
+
+# (имя, тип, описание, [(метки, значение), ...])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(round(float(value), 6))
+
+
+def render(families: Iterable[Family], openmetrics: bool = True) -> bytes:
+    """
+    Текст экспозиции: OpenMetrics 1.0 (с '# EOF') или Prometheus 0.0.4.
+    Имя семейства счетчика без суффикса _total, образцы - с суффиксом
+    """
+    lines = []
+    for name, kind, help_text, samples in families:
+        family = name
+        if kind == 'counter' and not openmetrics:
+            family = f"{name}_total"
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {kind}")
+        sample_name = f"{name}_total" if kind == 'counter' else name
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+            lines.append(f"{sample_name}{{{label_text}}} {_format_value(value)}" if label_text
+                         else f"{sample_name} {_format_value(value)}")
+    if openmetrics:
+        lines.append('# EOF')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def _limited(counts: Dict[str, int], limit: int) -> List[Tuple[str, int]]:
+    """limit самых больших значений, остальные суммируются в 'other' (ограничение числа рядов)"""
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    if len(ranked) <= limit:
+        return ranked
+    return ranked[:limit] + [('other', sum(count for _, count in ranked[limit:]))]
+
+
+def measurement_families(current_data: Dict[str, Any], totals: Optional[Dict[str, Any]] = None,
+                         rates: Optional[Dict[str, float]] = None,
+                         collector_seconds: Optional[Dict[str, float]] = None,
+                         info: Optional[Dict[str, Any]] = None,
+                         max_processes: int = DEFAULT_MAX_PROCESSES) -> List[Family]:
+    """
+    Семейства метрик одного измерения
+    totals - счетчики count_connection (до усечения списков), rates - значения
+    RollupStore.record_measurement, info - hostname/version/timestamp/measurements/changes/self_monitor
+    """
+    info = info or {}
+    if totals is None:
+        totals = Counter()
+        for direction in ('incoming', 'outgoing'):
+            for connection in current_data.get('connections', {}).get(direction, []):
+                count_connection(totals, direction, connection)
+    rates = rates or {}
+
+    connections = []
+    processes = {}
+    for key, count in sorted(totals.items()):
+        if key.startswith('process:'):
+            processes[key[len('process:'):]] = count
+        elif '/' in key:
+            direction, protocol = key.split('/', 1)
+            connections.append(({'direction': direction, 'protocol': protocol,
+                                 'state': _STATE_BY_PROTOCOL.get(protocol, 'active')}, count))
+
+    listeners = [({'protocol': 'tcp'}, len(current_data.get('tcp_ports', []))),
+                 ({'protocol': 'udp'}, len(current_data.get('udp_ports', [])))]
+    if 'tcp_listen_ports' in totals:
+        listeners = [({'protocol': 'tcp'}, totals['tcp_listen_ports']),
+                     ({'protocol': 'udp'}, totals.get('udp_listen_ports', 0))]
+
+    families: List[Family] = [
+        ('glacier_info', 'gauge', 'Glacier agent information',
+         [({'hostname': info.get('hostname', ''), 'version': info.get('version', '')}, 1)]),
+        ('glacier_connections', 'gauge', 'Connections in the last measurement by direction, protocol and state',
+         connections),
+        ('glacier_listen_ports', 'gauge', 'Listening ports in the last measurement', listeners),
+        ('glacier_process_connections', 'gauge',
+         f"Connections per process in the last measurement (top {max_processes}, rest as other)",
+         [({'process': process}, count) for process, count in _limited(processes, max_processes)]),
+        ('glacier_packets_rate', 'gauge', 'UDP and ICMP packets per second since the previous measurement',
+         [({'protocol': 'udp'}, rates.get('udp_packets_rate', 0)),
+          ({'protocol': 'icmp'}, rates.get('icmp_packets_rate', 0))]),
+        ('glacier_collector_duration_seconds', 'gauge', 'Duration of each collector in the last measurement',
+         [({'collector': name}, seconds) for name, seconds in (collector_seconds or {}).items()]),
+        ('glacier_measurement_duration_seconds', 'gauge', 'Duration of the last measurement',
+         [({}, rates.get('collection_seconds', 0))]),
+        ('glacier_last_measurement_timestamp_seconds', 'gauge', 'Unix time of the last measurement',
+         [({}, info.get('timestamp', 0))]),
+        ('glacier_measurements', 'counter', 'Measurements taken (cumulative across runs)',
+         [({}, info.get('measurements', 0))]),
+        ('glacier_changes', 'counter', 'Measurements with detected changes (cumulative across runs)',
+         [({}, info.get('changes', 0))]),
+    ]
+    if info.get('self_monitor'):
+        monitor = info['self_monitor']
+        usage = monitor.get('last', {})
+        families += [
+            ('glacier_self_cpu_percent', 'gauge', 'Agent CPU usage over the last cycle, percent of one core',
+             [({}, usage.get('cpu_percent', 0))]),
+            ('glacier_self_resident_memory_bytes', 'gauge', 'Agent resident memory',
+             [({}, int(usage.get('rss_mb', 0) * 1024 * 1024))]),
+            ('glacier_throttle_active', 'gauge', 'Self-throttling limits currently in effect',
+             [({'action': action}, 1) for action in monitor.get('active', [])]),
+        ]
+    if 'unique_remote_hosts' in info:
+        families.append(('glacier_unique_remote_hosts', 'gauge', 'Estimated distinct remote hosts (HyperLogLog)',
+                         [({}, info['unique_remote_hosts'])]))
+    return families
+
+
+@lru_cache(maxsize=None)
+def _server_classes():
+    """
+    http.server тянет http.client, ssl и email (~20 мс импорта): классы сервера
+    создаются при первом запуске экспортера, а не при импорте модуля
+    """
+    with import_span('http.server'):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        server_version = 'Glacier'
+
+        def do_GET(self):
+            if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            exporter = self.server.exporter
+            openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+            compressed = 'gzip' in self.headers.get('Accept-Encoding', '')
+            body = exporter.snapshot[(openmetrics, compressed)]
+            self.send_response(200)
+            self.send_header('Content-Type', OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+            if compressed:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Опросы каждые 15 секунд не должны засорять вывод анализатора
+            pass
+
+    return ThreadingHTTPServer, _Handler
+
+
+class MetricsExporter:
+    """HTTP сервер метрик в фоновом потоке; update() подменяет готовый снимок целиком"""
+
+    def __init__(self, port: int, address: str = '', max_processes: int = DEFAULT_MAX_PROCESSES):
+        self.max_processes = max_processes
+        self.snapshot: Dict[Tuple[bool, bool], bytes] = {}
+        self._publish([])
+        server_class, handler_class = _server_classes()
+        self.server = server_class((address, port), handler_class)
+        self.server.daemon_threads = True
+        self.server.exporter = self
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics-exporter', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def from_config(cls, configuration: Dict[str, Any], port: Optional[int] = None) -> 'MetricsExporter':
+        settings = configuration.get('metrics_exporter', {})
+        return cls(int(port if port is not None else settings['port']), settings.get('address', ''),
+                   settings.get('max_processes', DEFAULT_MAX_PROCESSES))
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def _publish(self, families: List[Family]):
+        snapshot = {}
+        for openmetrics in (True, False):
+            body = render(families, openmetrics)
+            snapshot[(openmetrics, False)] = body
+            snapshot[(openmetrics, True)] = gzip.compress(body, 6)
+        # Одно присваивание: поток сервера видит либо старый, либо новый снимок
+        self.snapshot = snapshot
+
+    def update(self, current_data: Dict[str, Any], **kwargs):
+        """Аргументы measurement_families; вызывается один раз после измерения"""
+        kwargs.setdefault('max_processes', self.max_processes)
+        self._publish(measurement_families(current_data, **kwargs))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+if __name__ == "__main__":
+    import time
+    import urllib.request
+
+    # Снимок большого хоста и стоимость одного опроса
+    data = {'tcp_ports': [22, 80, 443], 'udp_ports': [53], 'connections': {
+        'incoming': [{'process': f"worker-{i % 40}", 'protocol': 'tcp'} for i in range(5000)],
+        'outgoing': [{'process': 'resolver', 'protocol': 'udp'} for _ in range(300)]}}
+    exporter = MetricsExporter(0, '127.0.0.1')
+    started = time.perf_counter()
+    exporter.update(data, rates={'udp_packets_rate': 12.5, 'collection_seconds': 1.8},
+                    collector_seconds={'connections': 1.2, 'udp': 0.3},
+                    info={'hostname': 'demo', 'version': '2.3.0', 'timestamp': time.time(), 'measurements': 1})
+    print(f"⏱️ Snapshot rendered in {(time.perf_counter() - started) * 1000:.2f} ms")
+    url = f"http://127.0.0.1:{exporter.port}/metrics"
+    started = time.perf_counter()
+    for _ in range(100):
+        body = urllib.request.urlopen(url).read()
+    print(f"📡 100 scrapes in {time.perf_counter() - started:.3f}s, {len(body)} bytes each")
+    print(body.decode('utf-8'))
+    exporter.close()
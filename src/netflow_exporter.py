@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Бинарный экспорт NetFlow v9 (RFC 3954) по UDP
+Упаковывает потоки NetFlowGenerator в Template и Data FlowSet заранее
+скомпилированными struct форматами и отправляет их на коллектор
+(nfcapd, pmacct или встроенный тестовый приемник NetFlowV9Listener)
+"""
+
+import socket
+import struct
+import time
+from typing import Dict, List, Any, Optional, Tuple
+
+from address_classifier import split_host_port
+from netflow_generator import NETFLOW_V9_FIELDS, FIELD_LENGTHS, FLOW_TEMPLATE_FIELDS
+
+NETFLOW_VERSION = 9
+PACKET_HEADER = struct.Struct('!HHIIII')    # version, count, sys_uptime, unix_secs, sequence, source_id
+FLOWSET_HEADER = struct.Struct('!HH')       # flowset_id, length
+TEMPLATE_HEADER = struct.Struct('!HH')      # template_id, field_count
+FIELD_SPEC = struct.Struct('!HH')           # field_type, field_length
+TEMPLATE_FLOWSET_ID = 0
+
+TEMPLATE_ID_V4 = 256
+TEMPLATE_ID_V6 = 257
+FLOW_TEMPLATE_FIELDS_V6 = [{'IPV4_SRC_ADDR': 'IPV6_SRC_ADDR', 'IPV4_DST_ADDR': 'IPV6_DST_ADDR'}.get(f, f)
+                           for f in FLOW_TEMPLATE_FIELDS]
+
+# Заголовки IP + UDP, которые не входят в полезную нагрузку датаграммы
+UDP_OVERHEAD = {socket.AF_INET: 28, socket.AF_INET6: 48}
+
+_STRUCT_CODES = {1: 'B', 2: 'H', 4: 'I', 8: 'Q', 16: '16s'}
+_FIELD_NAMES = {field_id: name for name, field_id in NETFLOW_V9_FIELDS.items()}
+
+_ZERO_V6 = bytes(16)
+
+
+class FlowTemplate:
+    """Шаблон NetFlow v9 с предкомпилированным форматом записи"""
+
+    __slots__ = ('template_id', 'fields', 'record', 'spec', 'limits')
+
+    def __init__(self, template_id: int, fields: List[str]):
+        self.template_id = template_id
+        self.fields = list(fields)
+        self.record = struct.Struct('!' + ''.join(_STRUCT_CODES[FIELD_LENGTHS[f]] for f in self.fields))
+        self.spec = TEMPLATE_HEADER.pack(template_id, len(self.fields)) + b''.join(
+            FIELD_SPEC.pack(NETFLOW_V9_FIELDS[f], FIELD_LENGTHS[f]) for f in self.fields)
+        # Максимальные значения числовых полей (переполнение насыщается)
+        self.limits = [(1 << (8 * FIELD_LENGTHS[f])) - 1 for f in self.fields]
+
+
+def parse_collector(address: str) -> Tuple[str, int]:
+    """Разбирает адрес коллектора host:port или [ipv6]:port (порт по умолчанию 2055)"""
+    host, port = split_host_port(address.strip())
+    port = int(port) if port else 2055
+    if not 0 < port < 65536:
+        raise ValueError(f"порт вне диапазона: {port}")
+    return host or '127.0.0.1', port
+
+
+def _ipv6_bytes(address: str, version: int) -> bytes:
+    """Упаковывает адрес в 16 байт (IPv4 - как IPv4-mapped IPv6)"""
+    try:
+        if version == 6:
+            return socket.inet_pton(socket.AF_INET6, address.split('%', 1)[0])
+        return socket.inet_pton(socket.AF_INET6, f"::ffff:{address}")
+    except (OSError, AttributeError, TypeError):
+        return _ZERO_V6
+
+
+class NetFlowV9Exporter:
+    """
+    Экспортер NetFlow v9: формирует пакеты не больше MTU, нумерует их
+    (sequence_number считает отправленные пакеты) и периодически повторяет шаблоны
+    """
+
+    def __init__(self, collector: Tuple[str, int], source_id: int = 1, mtu: int = 1500,
+                 template_refresh_packets: int = 20, template_refresh_seconds: int = 60,
+                 boot_time: Optional[float] = None):
+        self.collector = collector
+        self.source_id = source_id
+        self.template_refresh_packets = max(1, int(template_refresh_packets))
+        self.template_refresh_seconds = float(template_refresh_seconds)
+        self.sequence_number = 0
+        self.packets_sent = 0
+        self.flows_sent = 0
+
+        info = socket.getaddrinfo(collector[0], collector[1], 0, socket.SOCK_DGRAM)[0]
+        self.family, self.address = info[0], info[4]
+        self.max_packet_size = int(mtu) - UDP_OVERHEAD.get(self.family, 48)
+        self._socket = None
+
+        # sysUptime отсчитывается от загрузки системы; FIRST/LAST_SWITCHED - в той же шкале
+        if boot_time is None:
+            try:
+                import psutil
+                boot_time = psutil.boot_time()
+            except Exception:
+                boot_time = time.time()
+        self.boot_time = boot_time
+
+        self.templates = {
+            TEMPLATE_ID_V4: FlowTemplate(TEMPLATE_ID_V4, FLOW_TEMPLATE_FIELDS),
+            TEMPLATE_ID_V6: FlowTemplate(TEMPLATE_ID_V6, FLOW_TEMPLATE_FIELDS_V6),
+        }
+        self._template_flowset = self._pack_template_flowset()
+        self._packets_since_template = None
+        self._last_template_time = 0.0
+
+    def _pack_template_flowset(self) -> bytes:
+        body = b''.join(t.spec for t in self.templates.values())
+        return FLOWSET_HEADER.pack(TEMPLATE_FLOWSET_ID, FLOWSET_HEADER.size + len(body)) + body
+
+    def _uptime_ms(self, timestamp: float) -> int:
+        return int((timestamp - self.boot_time) * 1000) & 0xFFFFFFFF
+
+    def _templates_due(self, now: float) -> bool:
+        return (self._packets_since_template is None
+                or self._packets_since_template >= self.template_refresh_packets
+                or now - self._last_template_time >= self.template_refresh_seconds)
+
+    def pack_flow(self, flow: Dict[str, Any]) -> Tuple[FlowTemplate, bytes]:
+        """Упаковывает поток NetFlowGenerator в запись данных подходящего шаблона"""
+        meta = flow.get('_meta', {})
+        src_version = meta.get('src_ip_version', 4)
+        dst_version = meta.get('dst_ip_version', 4)
+        template = self.templates[TEMPLATE_ID_V6 if 6 in (src_version, dst_version) else TEMPLATE_ID_V4]
+
+        values = []
+        for field, limit in zip(template.fields, template.limits):
+            if field == 'IPV6_SRC_ADDR':
+                values.append(_ipv6_bytes(meta.get('src_addr_str', ''), src_version))
+            elif field == 'IPV6_DST_ADDR':
+                values.append(_ipv6_bytes(meta.get('dst_addr_str', ''), dst_version))
+            elif field in ('FIRST_SWITCHED', 'LAST_SWITCHED'):
+                values.append(self._uptime_ms(flow.get(field) or time.time()))
+            else:
+                value = int(flow.get(field) or 0)
+                values.append(limit if value > limit else max(value, 0))
+        return template, template.record.pack(*values)
+
+    def build_packets(self, flows: List[Dict[str, Any]], export_time: Optional[float] = None) -> List[bytes]:
+        """Формирует датаграммы NetFlow v9 для списка потоков"""
+        now = time.time() if export_time is None else export_time
+        records: Dict[int, List[bytes]] = {template_id: [] for template_id in self.templates}
+        for flow in flows:
+            template, record = self.pack_flow(flow)
+            records[template.template_id].append(record)
+
+        packets = []
+        parts: List[bytes] = []
+        size = PACKET_HEADER.size
+        count = 0
+
+        def start_packet():
+            nonlocal parts, size, count
+            parts, size, count = [], PACKET_HEADER.size, 0
+            if self._templates_due(now):
+                parts.append(self._template_flowset)
+                size += len(self._template_flowset)
+                count += len(self.templates)
+                self._packets_since_template = 0
+                self._last_template_time = now
+
+        def finish_packet():
+            header = PACKET_HEADER.pack(NETFLOW_VERSION, count, self._uptime_ms(now), int(now),
+                                        self.sequence_number, self.source_id)
+            packets.append(header + b''.join(parts))
+            self.sequence_number = (self.sequence_number + 1) & 0xFFFFFFFF
+            self._packets_since_template += 1
+
+        start_packet()
+        for template_id, template_records in records.items():
+            record_size = self.templates[template_id].record.size
+            i = 0
+            while i < len(template_records):
+                # Место под записи с учетом заголовка FlowSet и выравнивания до 4 байт
+                room = self.max_packet_size - size - FLOWSET_HEADER.size - 3
+                n = min(room // record_size, len(template_records) - i)
+                if n <= 0:
+                    finish_packet()
+                    start_packet()
+                    continue
+                body = b''.join(template_records[i:i + n])
+                padding = b'\0' * (-len(body) % 4)
+                parts.append(FLOWSET_HEADER.pack(template_id, FLOWSET_HEADER.size + len(body) + len(padding)))
+                parts.append(body + padding)
+                size += FLOWSET_HEADER.size + len(body) + len(padding)
+                count += n
+                i += n
+        if count:
+            finish_packet()
+        return packets
+
+    def export(self, flows: List[Dict[str, Any]]) -> int:
+        """Отправляет потоки на коллектор, возвращает количество отправленных пакетов"""
+        if self._socket is None:
+            self._socket = socket.socket(self.family, socket.SOCK_DGRAM)
+        packets = self.build_packets(flows)
+        for packet in packets:
+            self._socket.sendto(packet, self.address)
+        self.packets_sent += len(packets)
+        self.flows_sent += len(flows)
+        return len(packets)
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def decode_packet(data: bytes, templates: Dict[Tuple[int, int], List[Tuple[str, int]]]) -> Dict[str, Any]:
+    """
+    Разбирает датаграмму NetFlow v9. Шаблоны накапливаются в templates
+    по ключу (source_id, template_id); данные без известного шаблона пропускаются
+    """
+    version, count, sys_uptime, unix_secs, sequence, source_id = PACKET_HEADER.unpack_from(data, 0)
+    if version != NETFLOW_VERSION:
+        raise ValueError(f"Неподдерживаемая версия NetFlow: {version}")
+    packet = {
+        'header': {'version': version, 'count': count, 'sys_uptime': sys_uptime,
+                   'unix_secs': unix_secs, 'sequence_number': sequence, 'source_id': source_id},
+        'templates': [],
+        'flows': [],
+        'skipped_flowsets': 0,
+    }
+
+    offset = PACKET_HEADER.size
+    while offset + FLOWSET_HEADER.size <= len(data):
+        flowset_id, length = FLOWSET_HEADER.unpack_from(data, offset)
+        if length < FLOWSET_HEADER.size:
+            break
+        end = min(offset + length, len(data))
+        position = offset + FLOWSET_HEADER.size
+
+        if flowset_id == TEMPLATE_FLOWSET_ID:
+            while position + TEMPLATE_HEADER.size <= end:
+                template_id, field_count = TEMPLATE_HEADER.unpack_from(data, position)
+                position += TEMPLATE_HEADER.size
+                fields = []
+                for _ in range(field_count):
+                    field_type, field_length = FIELD_SPEC.unpack_from(data, position)
+                    position += FIELD_SPEC.size
+                    fields.append((_FIELD_NAMES.get(field_type, str(field_type)), field_length))
+                templates[(source_id, template_id)] = fields
+                packet['templates'].append(template_id)
+        elif flowset_id >= 256:
+            fields = templates.get((source_id, flowset_id))
+            if fields is None:
+                packet['skipped_flowsets'] += 1
+            else:
+                record_size = sum(length for _, length in fields)
+                while record_size and position + record_size <= end:
+                    flow = {}
+                    for name, field_length in fields:
+                        raw = data[position:position + field_length]
+                        position += field_length
+                        if field_length == 16:
+                            flow[name] = socket.inet_ntop(socket.AF_INET6, raw)
+                        elif name in ('IPV4_SRC_ADDR', 'IPV4_DST_ADDR', 'IPV4_NEXT_HOP'):
+                            flow[name] = socket.inet_ntoa(raw)
+                        else:
+                            flow[name] = int.from_bytes(raw, 'big')
+                    flow['template_id'] = flowset_id
+                    packet['flows'].append(flow)
+        offset += length
+    return packet
+
+
+class NetFlowV9Listener:
+    """Встроенный тестовый приемник NetFlow v9 (UDP), разбирает пакеты через decode_packet"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        family = socket.AF_INET6 if ':' in host else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.templates: Dict[Tuple[int, int], List[Tuple[str, int]]] = {}
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.socket.getsockname()[:2]
+
+    def receive(self, timeout: float = 1.0) -> Optional[Dict[str, Any]]:
+        """Принимает и разбирает один пакет; None по таймауту"""
+        self.socket.settimeout(timeout)
+        try:
+            data, _ = self.socket.recvfrom(65535)
+        except socket.timeout:
+            return None
+        return decode_packet(data, self.templates)
+
+    def close(self):
+        self.socket.close()
+
+
+_exporter_cache: Dict[Tuple[str, int], NetFlowV9Exporter] = {}
+
+
+def get_netflow_exporter(configuration: Optional[Dict[str, Any]] = None,
+                         collector: Optional[str] = None) -> Optional[NetFlowV9Exporter]:
+    """
+    Возвращает экспортер для коллектора (аргумент или netflow_export.collector)
+    Экспортер создается один раз на коллектор, чтобы нумерация пакетов не сбрасывалась
+    """
+    if configuration is None:
+        from analyzer_config import get_config
+        configuration = get_config()
+    settings = configuration.get('netflow_export') or {}
+    collector = collector or settings.get('collector')
+    if not collector:
+        return None
+    try:
+        # Некорректный адрес (host:abc, порт вне диапазона) отключает экспорт, а не запуск анализатора
+        address = parse_collector(collector)
+        exporter = _exporter_cache.get(address)
+        if exporter is None:
+            exporter = NetFlowV9Exporter(address,
+                                         source_id=settings.get('source_id', 1),
+                                         mtu=settings.get('mtu', 1500),
+                                         template_refresh_packets=settings.get('template_refresh_packets', 20),
+                                         template_refresh_seconds=settings.get('template_refresh_seconds', 60))
+            _exporter_cache[address] = exporter
+    except (OSError, ValueError) as e:
+        print(f"⚠️ NetFlow экспорт: некорректный коллектор {collector}: {e}")
+        return None
+    return exporter
+
+
+if __name__ == "__main__":
+    # Тестовый приемник: netflow_exporter.py [host:port]
+    import sys
+    listen_host, listen_port = parse_collector(sys.argv[1] if len(sys.argv) > 1 else '127.0.0.1:2055')
+    listener = NetFlowV9Listener(listen_host, listen_port)
+    print(f"📡 Ожидаем NetFlow v9 на {listener.address[0]}:{listener.address[1]} (Ctrl+C для выхода)")
+    try:
+        while True:
+            received = listener.receive(timeout=5.0)
+            if received is None:
+                continue
+            header = received['header']
+            print(f"📦 seq={header['sequence_number']} count={header['count']} "
+                  f"templates={received['templates']} flows={len(received['flows'])}")
+            for received_flow in received['flows']:
+                src = received_flow.get('IPV4_SRC_ADDR') or received_flow.get('IPV6_SRC_ADDR')
+                dst = received_flow.get('IPV4_DST_ADDR') or received_flow.get('IPV6_DST_ADDR')
+                print(f"   {src}:{received_flow.get('L4_SRC_PORT')} -> {dst}:{received_flow.get('L4_DST_PORT')} "
+                      f"proto={received_flow.get('PROTOCOL')} pkts={received_flow.get('IN_PKTS')}")
+    except KeyboardInterrupt:
+        listener.close()
@@ -6,11 +6,22 @@ NetFlow генератор для анализатора сети
 Соответствует стандартам RFC 3954 (NetFlow Version 9) и RFC 7011 (IPFIX)
 """
 
+import os
 import time
 import socket
 import struct
+import shutil
+import tempfile
+import textwrap
 from datetime import datetime as dt
-from typing import Dict, List, Any, Optional
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Iterator
+
+from compression import open_report
+from ipfix import IPFIXWriter
+from profiling import lazy_import
+
+yaml = lazy_import('yaml')
 
 # NetFlow v9 стандартные поля (согласно RFC 3954)
 NETFLOW_V9_FIELDS = {
@@ -44,6 +55,7 @@ NETFLOW_V9_FIELDS = {
     'IPV6_DST_ADDR': 28,    # IPv6 адрес назначения
     'IPV6_SRC_MASK': 29,    # IPv6 маска подсети источника
     'IPV6_DST_MASK': 30,    # IPv6 маска подсети назначения
+    'SAMPLING_INTERVAL': 34, # Интервал выборки: поток представляет N потоков (1 - без выборки)
 }
 
 # Размеры полей в байтах
@@ -63,8 +75,8 @@ FIELD_LENGTHS = {
     'DST_MASK': 1,
     'OUTPUT_SNMP': 2,
     'IPV4_NEXT_HOP': 4,
-    'SRC_AS': 2,
-    'DST_AS': 2,
+    'SRC_AS': 4,            # RFC 3954 допускает 2 или 4 байта; 4 байта вмещают ASN из RFC 6793
+    'DST_AS': 4,
     'BGP_IPV4_NEXT_HOP': 4,
     'MUL_DST_PKTS': 4,
     'MUL_DST_BYTES': 4,
@@ -78,8 +90,16 @@ FIELD_LENGTHS = {
     'IPV6_DST_ADDR': 16,
     'IPV6_SRC_MASK': 1,
     'IPV6_DST_MASK': 1,
+    'SAMPLING_INTERVAL': 4,
 }
 
+# Поля шаблона потоков (template 256)
+FLOW_TEMPLATE_FIELDS = [
+    'IPV4_SRC_ADDR', 'IPV4_DST_ADDR', 'L4_SRC_PORT', 'L4_DST_PORT',
+    'PROTOCOL', 'IN_PKTS', 'IN_BYTES', 'FIRST_SWITCHED', 'LAST_SWITCHED',
+    'TCP_FLAGS', 'INPUT_SNMP', 'OUTPUT_SNMP', 'SRC_AS', 'DST_AS', 'SAMPLING_INTERVAL', 'FLOWS'
+]
+
 # Протоколы
 PROTOCOL_NUMBERS = {
     'icmp': 1,
@@ -87,11 +107,144 @@ PROTOCOL_NUMBERS = {
     'udp': 17
 }
 
+# Имена сервисов, которые встречаются вместо номера порта
+SERVICE_PORTS = {
+    'https': 443, 'http': 80, 'ssh': 22,
+    'imaps': 993, 'imap': 143, 'smtp': 25,
+    'pop3': 110, 'pop3s': 995, 'ftp': 21
+}
+
+# Форматы строковых first_seen/last_seen: сборщики (network_info, трекеры) и старые отчеты
+SEEN_TIME_FORMATS = ('%d.%m.%Y %H:%M:%S', '%Y-%m-%d %H:%M:%S')
+
+
+@lru_cache(maxsize=65536)
+def parse_address(address_str: str) -> tuple:
+    """
+    Парсит адрес в формате 'ip:port', '[ipv6]:port' или просто 'ip'
+    Возвращает (ip, port, ip_int, ip_version). Результат кэшируется: локальные
+    и удаленные адреса повторяются во многих потоках отчета
+    """
+    try:
+        # Обработка IPv6 адресов в квадратных скобках [IPv6]:port
+        if address_str.startswith('[') and ']:' in address_str:
+            bracket_end = address_str.find(']:')
+            ip_str = address_str[1:bracket_end]  # Убираем квадратные скобки
+            port_str = address_str[bracket_end+2:]
+        elif ':' in address_str and not address_str.startswith('['):
+            # IPv4 адрес в формате IP:port или просто port
+            ip_str, port_str = address_str.rsplit(':', 1)
+        else:
+            # Только IP адрес без порта
+            ip_str = address_str.strip('[]')
+            port_str = None
+
+        if port_str is None:
+            port = 0
+        else:
+            try:
+                port = int(port_str)
+            except ValueError:
+                # Обрабатываем имена сервисов
+                port = SERVICE_PORTS.get(port_str, 0)
+
+        # Определяем тип IP адреса и конвертируем для NetFlow
+        try:
+            # Пытаемся как IPv4
+            ip_int = struct.unpack('!I', socket.inet_aton(ip_str))[0]
+            return ip_str, port, ip_int, 4  # IPv4
+        except socket.error:
+            # IPv6 адрес не помещается в поля IPV4_*: сохраняем строковое
+            # представление и помечаем версию 6, ip_int=0
+            if ip_str and ip_str != '0.0.0.0' and ip_str != '*':
+                return ip_str, port, 0, 6
+            # Псевдо-адреса, неизвестные адреса
+            return ip_str, port, 0, 4
+    except Exception:
+        return address_str, 0, 0, 4
+
+
+@lru_cache(maxsize=4096)
+def parse_seen_time(value: str) -> Optional[int]:
+    """Переводит строковое время first_seen/last_seen в epoch секунды (None если формат неизвестен)"""
+    for fmt in SEEN_TIME_FORMATS:
+        try:
+            return int(dt.strptime(value, fmt).timestamp())
+        except ValueError:
+            continue
+    return None
+
+
+@lru_cache(maxsize=4096)
+def format_epoch(timestamp: int) -> str:
+    """Форматирует epoch секунды для полей *_switched_time"""
+    return dt.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def format_message_header(header: Dict[str, Any]) -> Dict[str, Any]:
+    """Заголовок сообщения в виде для YAML отчета"""
+    return {
+        'netflow_version': header['version'],
+        'record_count': header['count'],
+        'system_uptime_ms': header['sys_uptime'],
+        'export_timestamp': header['unix_secs'],
+        'export_time': dt.fromtimestamp(header['unix_secs']).strftime('%Y-%m-%d %H:%M:%S'),
+        'sequence_number': header['sequence_number'],
+        'observation_domain_id': header['source_id']
+    }
+
+
+def format_templates(templates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Шаблоны в виде для YAML отчета"""
+    formatted_templates = []
+    for template in templates:
+        formatted_templates.append({
+            'template_id': template['template_id'],
+            'field_count': template['field_count'],
+            'fields': [{'name': spec['field_name'], 'type': spec['field_type'], 'length': spec['field_length']}
+                       for spec in template['field_specs']]
+        })
+    return formatted_templates
+
+
+class FlowStatistics:
+    """Накопительная статистика потоков (flow_statistics) без хранения самих потоков"""
+
+    def __init__(self):
+        self.total_flows = 0
+        self.total_bytes = 0
+        self.total_packets = 0
+        self.protocols: Dict[str, int] = {}
+
+    def add(self, flow: Dict[str, Any]):
+        self.total_flows += 1
+        self.total_bytes += flow.get('IN_BYTES', 0)
+        self.total_packets += flow.get('IN_PKTS', 0)
+        protocol_num = flow.get('PROTOCOL', 0)
+        protocol_name = 'unknown'
+        for name, num in PROTOCOL_NUMBERS.items():
+            if num == protocol_num:
+                protocol_name = name
+                break
+        self.protocols[protocol_name] = self.protocols.get(protocol_name, 0) + 1
+
+    def as_dict(self, flow_duration: float) -> Dict[str, Any]:
+        return {
+            'total_flows': self.total_flows,
+            'total_bytes': self.total_bytes,
+            'total_packets': self.total_packets,
+            'flow_duration': flow_duration,
+            'protocols': self.protocols
+        }
+
+
 class NetFlowGenerator:
     """Генератор NetFlow отчетов"""
     
-    def __init__(self, observation_domain_id: int = 1):
+    def __init__(self, observation_domain_id: int = 1, ip_database=None):
         self.observation_domain_id = observation_domain_id
+        # Офлайн база IP диапазонов для заполнения SRC_AS/DST_AS (ip_database.IPRangeDatabase)
+        self.ip_database = ip_database
         self.sequence_number = 0
         self.start_time = time.time()
         self.templates = {}
@@ -136,60 +289,33 @@ class NetFlowGenerator:
         return template
     
     def parse_connection_address(self, address_str: str) -> tuple:
-        """Парсит адрес в формате 'ip:port' или просто 'ip'"""
+        """Парсит адрес в формате 'ip:port' или просто 'ip' (кэшируется, см. parse_address)"""
         try:
-            # Обработка IPv6 адресов в квадратных скобках [IPv6]:port
-            if address_str.startswith('[') and ']:' in address_str:
-                bracket_end = address_str.find(']:')
-                ip_str = address_str[1:bracket_end]  # Убираем квадратные скобки
-                port_str = address_str[bracket_end+2:]
-                try:
-                    port = int(port_str)
-                except ValueError:
-                    # Обрабатываем имена сервисов
-                    port_map = {
-                        'https': 443, 'http': 80, 'ssh': 22,
-                        'imaps': 993, 'imap': 143, 'smtp': 25,
-                        'pop3': 110, 'pop3s': 995, 'ftp': 21
-                    }
-                    port = port_map.get(port_str, 0)
-            elif ':' in address_str and not address_str.startswith('['):
-                # IPv4 адрес в формате IP:port или просто port  
-                ip_str, port_str = address_str.rsplit(':', 1)
-                try:
-                    port = int(port_str)
-                except ValueError:
-                    # Обрабатываем имена сервисов
-                    port_map = {
-                        'https': 443, 'http': 80, 'ssh': 22,
-                        'imaps': 993, 'imap': 143, 'smtp': 25,
-                        'pop3': 110, 'pop3s': 995, 'ftp': 21
-                    }
-                    port = port_map.get(port_str, 0)
-            else:
-                # Только IP адрес без порта
-                ip_str = address_str.strip('[]')
-                port = 0
-            
-            # Определяем тип IP адреса и конвертируем для NetFlow
-            try:
-                # Пытаемся как IPv4
-                ip_int = struct.unpack('!I', socket.inet_aton(ip_str))[0]
-                return ip_str, port, ip_int, 4  # IPv4
-            except socket.error:
-                # Это IPv6 адрес - для NetFlow v9 мы не можем использовать IPv6 напрямую
-                # Сохраняем оригинальный IPv6 адрес в строковом виде
-                # и используем специальное значение для индикации IPv6
-                if ip_str and ip_str != '0.0.0.0' and ip_str != '*':
-                    # Для IPv6 адресов в NetFlow v9 мы сохраняем только строковое представление
-                    # и помечаем как IPv6, но в IPV4_SRC_ADDR/IPV4_DST_ADDR ставим 0
-                    return ip_str, port, 0, 6  # IPv6, ip_int=0 означает что это IPv6
-                else:
-                    # Псевдо-адреса, неизвестные адреса
-                    return ip_str, port, 0, 4
-        except Exception:
+            return parse_address(address_str)
+        except TypeError:
+            # Нехэшируемое значение вместо строки адреса
             return address_str, 0, 0, 4
     
+    @staticmethod
+    def _seen_timestamp(connection: Dict[str, Any], key: str, default: int) -> int:
+        """
+        Время first_seen/last_seen соединения в epoch секундах: берется из
+        {key}_ts, если сборщик передал его, иначе разбирается строка
+        """
+        timestamp = connection.get(f'{key}_ts')
+        if timestamp is not None:
+            return int(timestamp)
+        value = connection.get(key)
+        if not value or value == 'unknown':
+            return default
+        if isinstance(value, str):
+            parsed = parse_seen_time(value)
+            return default if parsed is None else parsed
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+    
     def convert_connection_to_flow(self, connection: Dict[str, Any], direction: str) -> Dict[str, Any]:
         """Конвертирует соединение из текущего формата в NetFlow поток"""
         
@@ -208,7 +334,13 @@ class NetFlowGenerator:
         is_server_connection = False
         
         # Определяем, является ли это серверным соединением (локальная система предоставляет сервис)
-        if local_port <= 1024:  # Системные порты
+        if local_addr.endswith(':*') and not local_addr.startswith('*'):
+            # Свернутые эфемерные порты клиента (flow_aggregation): локальная сторона - клиент
+            is_server_connection = False
+        elif remote_addr.endswith(':*') and not remote_addr.startswith('*'):
+            # Свернутые порты удаленных клиентов: локальная сторона - сервер
+            is_server_connection = True
+        elif local_port <= 1024:  # Системные порты
             is_server_connection = True
         elif local_port in [22, 80, 443, 993, 995, 143, 110, 25, 587, 465, 53, 8080, 8443, 3306, 5432, 6379, 27017]:
             # Известные серверные порты
@@ -240,41 +372,23 @@ class NetFlowGenerator:
         protocol_str = connection.get('protocol', 'tcp').lower()
         protocol_num = PROTOCOL_NUMBERS.get(protocol_str, 6)  # по умолчанию TCP
         
-        # Парсим временные метки
+        # Временные метки: epoch от сборщика (first_seen_ts/last_seen_ts) или разбор строки
         current_time = int(time.time())
-        first_switched = current_time - 300  # 5 минут назад как пример
-        last_switched = current_time
+        first_switched = self._seen_timestamp(connection, 'first_seen', current_time - 300)  # 5 минут назад как пример
+        last_switched = self._seen_timestamp(connection, 'last_seen', current_time)
         
-        try:
-            if connection.get('first_seen') and connection['first_seen'] != 'unknown':
-                if isinstance(connection['first_seen'], str):
-                    # Пытаемся парсить различные форматы времени
-                    for fmt in ['%Y-%m-%d %H:%M:%S', '%d.%m.%Y %H:%M:%S']:
-                        try:
-                            dt_obj = dt.strptime(connection['first_seen'], fmt)
-                            first_switched = int(dt_obj.timestamp())
-                            break
-                        except ValueError:
-                            continue
-                else:
-                    first_switched = int(connection['first_seen'])
-            
-            if connection.get('last_seen') and connection['last_seen'] != 'unknown':
-                if isinstance(connection['last_seen'], str):
-                    for fmt in ['%Y-%m-%d %H:%M:%S', '%d.%m.%Y %H:%M:%S']:
-                        try:
-                            dt_obj = dt.strptime(connection['last_seen'], fmt)
-                            last_switched = int(dt_obj.timestamp())
-                            break
-                        except ValueError:
-                            continue
-                else:
-                    last_switched = int(connection['last_seen'])
-        except Exception:
-            pass
+        # Номера AS из офлайн IP базы (0 если база не настроена или адрес неизвестен)
+        src_as = 0
+        dst_as = 0
+        if self.ip_database is not None:
+            src_as = self.ip_database.get_asn(src_ip)
+            dst_as = self.ip_database.get_asn(dst_ip)
         
-        # Оценка трафика на основе количества пакетов
+        # Оценка трафика на основе количества пакетов (при выборке count уже масштабирован)
         packet_count = connection.get('count', 1)
+        sampling_interval = connection.get('sampling_interval', 1)
+        # Число свернутых сокетов для строк flow_aggregation
+        flow_count = connection.get('flows', 1)
         estimated_bytes = packet_count * 1024  # Оценка: 1KB на пакет
         
         # Создаем NetFlow запись
@@ -291,6 +405,10 @@ class NetFlowGenerator:
             'TCP_FLAGS': 0x18 if protocol_str == 'tcp' else 0,  # ACK+PSH для TCP
             'INPUT_SNMP': 1,   # Интерфейс по умолчанию
             'OUTPUT_SNMP': 2,  # Интерфейс по умолчанию
+            'SRC_AS': src_as,
+            'DST_AS': dst_as,
+            'SAMPLING_INTERVAL': sampling_interval,
+            'FLOWS': flow_count,
             # Дополнительная информация для отладки
             '_meta': {
                 'direction': netflow_direction,  # Корректированное направление
@@ -310,50 +428,26 @@ class NetFlowGenerator:
         
         return flow_record
     
-    def generate_netflow_report(self, analyzer_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Генерирует полный NetFlow отчет из данных анализатора"""
-        
-        # Очищаем потоки для новой генерации
-        self.flows = []
-        
-        # Конвертируем соединения в потоки
+    def iter_flows(self, analyzer_data: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Потоково конвертирует входящие, затем исходящие соединения в NetFlow потоки"""
         connections = analyzer_data.get('current_state', {}).get('connections', {})
-        
-        # Обрабатываем входящие соединения
-        for connection in connections.get('incoming', []):
-            flow = self.convert_connection_to_flow(connection, 'incoming')
-            self.flows.append(flow)
-        
-        # Обрабатываем исходящие соединения
-        for connection in connections.get('outgoing', []):
-            flow = self.convert_connection_to_flow(connection, 'outgoing')
-            self.flows.append(flow)
-        
+        for direction in ('incoming', 'outgoing'):
+            for connection in connections.get(direction, []):
+                yield self.convert_connection_to_flow(connection, direction)
+    
+    def _build_report(self, flow_count: int, statistics: Dict[str, Any],
+                      analyzer_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Заголовок, шаблон и сведения о системе отчета (без списка потоков)"""
         # Создаем шаблон для наших полей
-        template_fields = [
-            'IPV4_SRC_ADDR', 'IPV4_DST_ADDR', 'L4_SRC_PORT', 'L4_DST_PORT',
-            'PROTOCOL', 'IN_PKTS', 'IN_BYTES', 'FIRST_SWITCHED', 'LAST_SWITCHED',
-            'TCP_FLAGS', 'INPUT_SNMP', 'OUTPUT_SNMP'
-        ]
+        template = self.create_template_record(template_id=256, fields=FLOW_TEMPLATE_FIELDS)
         
-        template = self.create_template_record(template_id=256, fields=template_fields)
+        # Создаем заголовок сообщения: 1 template record + flow records
+        header = self.create_netflow_header(count=1 + flow_count)
         
-        # Создаем заголовок сообщения
-        total_records = 1 + len(self.flows)  # 1 template record + flow records
-        header = self.create_netflow_header(count=total_records)
-        
-        # Собираем итоговый NetFlow отчет
-        netflow_report = {
+        return {
             'message_header': header,
             'template_records': [template],
-            'flow_records': self.flows,
-            'statistics': {
-                'total_flows': len(self.flows),
-                'total_bytes': sum(flow.get('IN_BYTES', 0) for flow in self.flows),
-                'total_packets': sum(flow.get('IN_PKTS', 0) for flow in self.flows),
-                'flow_duration': time.time() - self.start_time,
-                'protocols': self._get_protocol_statistics()
-            },
+            'statistics': statistics,
             # Сохраняем дополнительную информацию из анализатора для HTML отчета
             'additional_info': {
                 'hostname': analyzer_data.get('hostname', 'unknown'),
@@ -363,136 +457,159 @@ class NetFlowGenerator:
                 'total_measurements': analyzer_data.get('total_measurements', 1),
                 'extended_system_info': analyzer_data.get('current_state', {}).get('extended_system_info', {}),
                 'session': analyzer_data.get('session', {}),
-                'changes_log': analyzer_data.get('changes_log', [])
+                'changes_log': analyzer_data.get('changes_log', []),
+                'changes_stats': analyzer_data.get('changes_stats', {}),
+                # Скетчи HyperLogLog (cardinality.py): переживают восстановление из NetFlow/IPFIX
+                'cardinality': analyzer_data.get('cardinality', {}),
+                # Кольцевые буферы временных рядов (rollups.py)
+                'rollups': analyzer_data.get('rollups', {}),
+                # Длительности этапов измерений (profiling.py)
+                'timings': analyzer_data.get('timings', {}),
+                # Собственная нагрузка и решения ограничителя (self_monitor.py)
+                'self_monitor': analyzer_data.get('self_monitor', {})
             }
         }
+    
+    def generate_netflow_report(self, analyzer_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Генерирует полный NetFlow отчет из данных анализатора (все потоки в памяти)"""
+        self.flows = []
+        statistics = FlowStatistics()
+        for flow in self.iter_flows(analyzer_data):
+            statistics.add(flow)
+            self.flows.append(flow)
         
+        netflow_report = self._build_report(len(self.flows),
+                                            statistics.as_dict(time.time() - self.start_time),
+                                            analyzer_data)
+        netflow_report['flow_records'] = self.flows
         return netflow_report
     
-    def _get_protocol_statistics(self) -> Dict[str, int]:
-        """Подсчитывает статистику по протоколам"""
-        protocol_stats = {}
+    def stream_netflow_report(self, analyzer_data: Dict[str, Any], sinks: List[Any]) -> Dict[str, Any]:
+        """
+        Генерирует отчет за один проход без списков потоков: каждый поток
+        конвертируется один раз и сразу передается во все приемники
+        (YAMLReportSink, IPFIXReportSink, LegacyReportSink). Память не растет
+        с числом форматов. Приемник с ошибкой отключается (sink.error), остальные
+        продолжают работу. Возвращает отчет без flow_records
+        """
+        active = list(sinks)
+        needs_formatted = any(sink.formatted for sink in active)
+        statistics = FlowStatistics()
+        
+        for flow in self.iter_flows(analyzer_data):
+            statistics.add(flow)
+            formatted = self.format_flow(flow) if needs_formatted else None
+            for sink in tuple(active):
+                try:
+                    sink.add(flow, formatted)
+                except Exception as e:
+                    self._disable_sink(active, sink, e)
+        
+        netflow_report = self._build_report(statistics.total_flows,
+                                            statistics.as_dict(time.time() - self.start_time),
+                                            analyzer_data)
+        for sink in tuple(active):
+            try:
+                sink.finish(netflow_report)
+            except Exception as e:
+                self._disable_sink(active, sink, e)
         
-        for flow in self.flows:
-            protocol_num = flow.get('PROTOCOL', 0)
-            protocol_name = 'unknown'
+        return netflow_report
+    
+    @staticmethod
+    def _disable_sink(active: List[Any], sink: Any, error: Exception):
+        active.remove(sink)
+        sink.error = error
+        sink.discard()
+        print(f"⚠️ {sink.description} failed: {error}")
+    
+    def write_ipfix_file(self, netflow_data: Dict[str, Any], path: str) -> int:
+        """
+        Записывает отчет в бинарный IPFIX файл (RFC 7011): сведения о системе
+        и потоки, включая IPv6 адреса (поля 27/28). Возвращает число потоков
+        """
+        with open(path, 'wb') as f:
+            with IPFIXWriter(f, observation_domain_id=self.observation_domain_id,
+                             export_time=netflow_data['message_header']['unix_secs']) as writer:
+                writer.write_system_information(netflow_data.get('additional_info', {}))
+                return writer.write_flows(netflow_data['flow_records'])
+    
+    def format_flow(self, flow: Dict[str, Any]) -> Dict[str, Any]:
+        """Форматирует один поток для YAML отчета"""
+        # Получаем реальные IP адреса из метаданных для правильного отображения IPv6
+        meta = flow.get('_meta', {})
+        
+        # Если в метаданных есть реальные адреса, используем их (но проверяем, что это не псевдо-адреса)
+        if (meta.get('src_addr_str') and meta.get('dst_addr_str') and 
+            meta['src_addr_str'] not in ['*', '0.0.0.0', 'None'] and 
+            meta['dst_addr_str'] not in ['*', '0.0.0.0', 'None']):
+            src_ip = meta['src_addr_str']
+            dst_ip = meta['dst_addr_str']
+        else:
+            # Для псевдо-адресов или IPv4 используем специальную обработку
+            src_ip_int = flow.get('IPV4_SRC_ADDR', 0)
+            dst_ip_int = flow.get('IPV4_DST_ADDR', 0)
             
-            for name, num in PROTOCOL_NUMBERS.items():
-                if num == protocol_num:
-                    protocol_name = name
-                    break
+            # Проверяем псевдо-адреса в метаданных
+            if meta.get('src_addr_str') == '*':
+                src_ip = '*'
+            elif src_ip_int == 0:
+                # Если это IPv6 или псевдо-адрес, используем оригинальную строку
+                src_ip = meta.get('src_addr_str', '0.0.0.0')
+            else:
+                # Конвертируем IPv4
+                src_ip = self._int_to_ip(src_ip_int)
             
-            if protocol_name not in protocol_stats:
-                protocol_stats[protocol_name] = 0
-            protocol_stats[protocol_name] += 1
+            if meta.get('dst_addr_str') == '*':
+                dst_ip = '*'
+            elif dst_ip_int == 0:
+                # Если это IPv6 или псевдо-адрес, используем оригинальную строку
+                dst_ip = meta.get('dst_addr_str', '0.0.0.0')
+            else:
+                # Конвертируем IPv4
+                dst_ip = self._int_to_ip(dst_ip_int)
+        
+        first_switched = flow.get('FIRST_SWITCHED', 0)
+        last_switched = flow.get('LAST_SWITCHED', 0)
+        formatted_flow = {
+            'source_address': src_ip,
+            'destination_address': dst_ip,
+            'source_port': flow.get('L4_SRC_PORT', 0),
+            'destination_port': flow.get('L4_DST_PORT', 0),
+            'protocol': flow.get('PROTOCOL', 0),
+            'protocol_name': self._get_protocol_name(flow.get('PROTOCOL', 0)),
+            'packet_count': flow.get('IN_PKTS', 0),
+            'byte_count': flow.get('IN_BYTES', 0),
+            'first_switched': first_switched,
+            'last_switched': last_switched,
+            'first_switched_time': format_epoch(first_switched) if first_switched > 0 else 'unknown',
+            'last_switched_time': format_epoch(last_switched) if last_switched > 0 else 'unknown',
+            'tcp_flags': flow.get('TCP_FLAGS', 0),
+            'input_interface': flow.get('INPUT_SNMP', 0),
+            'output_interface': flow.get('OUTPUT_SNMP', 0),
+            'source_as': flow.get('SRC_AS', 0),
+            'destination_as': flow.get('DST_AS', 0),
+            'sampling_interval': flow.get('SAMPLING_INTERVAL', 1),
+            'flow_count': flow.get('FLOWS', 1)
+        }
         
-        return protocol_stats
+        # Добавляем метаданные если есть
+        if '_meta' in flow:
+            formatted_flow['meta'] = flow['_meta']
+        
+        return formatted_flow
     
     def format_netflow_yaml(self, netflow_data: Dict[str, Any]) -> Dict[str, Any]:
         """Форматирует NetFlow данные для сохранения в YAML"""
-        
-        # Форматируем заголовок сообщения
-        header = netflow_data['message_header']
-        formatted_header = {
-            'netflow_version': header['version'],
-            'record_count': header['count'],
-            'system_uptime_ms': header['sys_uptime'],
-            'export_timestamp': header['unix_secs'],
-            'export_time': dt.fromtimestamp(header['unix_secs']).strftime('%Y-%m-%d %H:%M:%S'),
-            'sequence_number': header['sequence_number'],
-            'observation_domain_id': header['source_id']
-        }
-        
-        # Форматируем шаблоны
-        formatted_templates = []
-        for template in netflow_data['template_records']:
-            formatted_template = {
-                'template_id': template['template_id'],
-                'field_count': template['field_count'],
-                'fields': []
-            }
-            
-            for field_spec in template['field_specs']:
-                formatted_template['fields'].append({
-                    'name': field_spec['field_name'],
-                    'type': field_spec['field_type'],
-                    'length': field_spec['field_length']
-                })
-            
-            formatted_templates.append(formatted_template)
-        
-        # Форматируем записи потоков
-        formatted_flows = []
-        for flow in netflow_data['flow_records']:
-            # Получаем реальные IP адреса из метаданных для правильного отображения IPv6
-            meta = flow.get('_meta', {})
-            
-            # Если в метаданных есть реальные адреса, используем их (но проверяем, что это не псевдо-адреса)
-            if (meta.get('src_addr_str') and meta.get('dst_addr_str') and 
-                meta['src_addr_str'] not in ['*', '0.0.0.0', 'None'] and 
-                meta['dst_addr_str'] not in ['*', '0.0.0.0', 'None']):
-                src_ip = meta['src_addr_str']
-                dst_ip = meta['dst_addr_str']
-            else:
-                # Для псевдо-адресов или IPv4 используем специальную обработку
-                src_ip_int = flow.get('IPV4_SRC_ADDR', 0)
-                dst_ip_int = flow.get('IPV4_DST_ADDR', 0)
-                
-                # Проверяем псевдо-адреса в метаданных
-                if meta.get('src_addr_str') == '*':
-                    src_ip = '*'
-                elif src_ip_int == 0:
-                    # Если это IPv6 или псевдо-адрес, используем оригинальную строку
-                    src_ip = meta.get('src_addr_str', '0.0.0.0')
-                else:
-                    # Конвертируем IPv4
-                    src_ip = self._int_to_ip(src_ip_int)
-                
-                if meta.get('dst_addr_str') == '*':
-                    dst_ip = '*'
-                elif dst_ip_int == 0:
-                    # Если это IPv6 или псевдо-адрес, используем оригинальную строку
-                    dst_ip = meta.get('dst_addr_str', '0.0.0.0')
-                else:
-                    # Конвертируем IPv4
-                    dst_ip = self._int_to_ip(dst_ip_int)
-            
-            formatted_flow = {
-                'source_address': src_ip,
-                'destination_address': dst_ip,
-                'source_port': flow.get('L4_SRC_PORT', 0),
-                'destination_port': flow.get('L4_DST_PORT', 0),
-                'protocol': flow.get('PROTOCOL', 0),
-                'protocol_name': self._get_protocol_name(flow.get('PROTOCOL', 0)),
-                'packet_count': flow.get('IN_PKTS', 0),
-                'byte_count': flow.get('IN_BYTES', 0),
-                'first_switched': flow.get('FIRST_SWITCHED', 0),
-                'last_switched': flow.get('LAST_SWITCHED', 0),
-                'first_switched_time': dt.fromtimestamp(flow.get('FIRST_SWITCHED', 0)).strftime('%Y-%m-%d %H:%M:%S') if flow.get('FIRST_SWITCHED', 0) > 0 else 'unknown',
-                'last_switched_time': dt.fromtimestamp(flow.get('LAST_SWITCHED', 0)).strftime('%Y-%m-%d %H:%M:%S') if flow.get('LAST_SWITCHED', 0) > 0 else 'unknown',
-                'tcp_flags': flow.get('TCP_FLAGS', 0),
-                'input_interface': flow.get('INPUT_SNMP', 0),
-                'output_interface': flow.get('OUTPUT_SNMP', 0)
-            }
-            
-            # Добавляем метаданные если есть
-            if '_meta' in flow:
-                formatted_flow['meta'] = flow['_meta']
-            
-            formatted_flows.append(formatted_flow)
-        
-        # Собираем итоговую структуру
-        yaml_structure = {
+        return {
             'netflow_message': {
-                'header': formatted_header,
-                'templates': formatted_templates,
-                'flows': formatted_flows
+                'header': format_message_header(netflow_data['message_header']),
+                'templates': format_templates(netflow_data['template_records']),
+                'flows': [self.format_flow(flow) for flow in netflow_data['flow_records']]
             },
             'flow_statistics': netflow_data['statistics'],
             'system_information': netflow_data['additional_info']
         }
-        
-        return yaml_structure
     
     def _int_to_ip(self, ip_int: int) -> str:
         """Конвертирует целое число в IP адрес"""
@@ -513,160 +630,123 @@ class NetFlowGenerator:
     @staticmethod
     def convert_netflow_yaml_to_legacy_format(netflow_yaml_data: Dict[str, Any]) -> Dict[str, Any]:
         """Конвертирует NetFlow YAML обратно в формат, понятный HTML генератору"""
-        
-        # Извлекаем системную информацию
-        system_info = netflow_yaml_data.get('system_information', {})
-        flows = netflow_yaml_data.get('netflow_message', {}).get('flows', [])
-        
-        # Создаем структуру connections из flows
-        incoming_connections = []
-        outgoing_connections = []
-        
-        for flow in flows:
-            # Получаем реальные адреса из метаданных для правильного восстановления
-            meta = flow.get('meta', {})
-            
-            # ВСЕГДА используем оригинальные адреса из метаданных если доступны
-            # Это правильно обрабатывает IPv6 адреса, UDP listening порты и псевдо-адреса
-            if meta.get('local_original') and meta.get('remote_original'):
-                local_addr = meta['local_original']
-                remote_addr = meta['remote_original']
-            else:
-                # Fallback: используем стандартный формат из source/destination
-                src_addr = flow.get('source_address', '0.0.0.0')
-                dst_addr = flow.get('destination_address', '0.0.0.0')
-                src_port = flow.get('source_port', 0)
-                dst_port = flow.get('destination_port', 0)
-                
-                # Для псевдо-адресов сохраняем оригинальный формат
-                if src_addr == '*':
-                    local_addr = f"*:{src_port}" if src_port > 0 else "*:*"
-                else:
-                    local_addr = f"{src_addr}:{src_port}"
-                    
-                if dst_addr == '*':
-                    remote_addr = f"*:{dst_port}" if dst_port > 0 else "*:*"
-                else:
-                    remote_addr = f"{dst_addr}:{dst_port}"
-            
-            # Восстанавливаем структуру соединения
-            connection = {
-                'local': local_addr,
-                'remote': {
-                    'address': remote_addr,
-                    'name': 'unknown'
-                },
+        builder = LegacyReportSink()
+        for flow in netflow_yaml_data.get('netflow_message', {}).get('flows', []):
+            builder.add_formatted(flow)
+        return builder.build(netflow_yaml_data.get('system_information', {}))
+
+
+def _endpoint(address: str, port: int) -> str:
+    """Адрес для legacy формата; псевдо-адрес '*' сохраняет исходный вид"""
+    if address == '*':
+        return f"*:{port}" if port > 0 else "*:*"
+    return f"{address}:{port}"
+
+
+class LegacyReportSink:
+    """
+    Собирает legacy структуру для HTML генератора по мере поступления
+    отформатированных потоков (см. convert_netflow_yaml_to_legacy_format)
+    """
+    formatted = True
+    error = None
+    description = "HTML data"
+    
+    def __init__(self):
+        self.incoming_connections = []
+        self.outgoing_connections = []
+        # dict вместо list: порядок первого появления и проверка за O(1)
+        self.tcp_ports: Dict[int, None] = {}
+        self.udp_ports: Dict[int, None] = {}
+        self.udp_traffic = {'udp_connections': [], 'total_connections': 0, 'total_packets': 0}
+        self.icmp_traffic = {'connections': [], 'total_connections': 0, 'total_packets': 0}
+        self.result: Optional[Dict[str, Any]] = None
+    
+    def add(self, flow: Dict[str, Any], formatted: Dict[str, Any]):
+        self.add_formatted(formatted)
+    
+    def add_formatted(self, flow: Dict[str, Any]):
+        # Получаем реальные адреса из метаданных для правильного восстановления
+        meta = flow.get('meta', {})
+        protocol_name = flow.get('protocol_name', 'tcp')
+        src_port = flow.get('source_port', 0)
+        dst_port = flow.get('destination_port', 0)
+        
+        # ВСЕГДА используем оригинальные адреса из метаданных если доступны
+        # Это правильно обрабатывает IPv6 адреса, UDP listening порты и псевдо-адреса
+        has_original = bool(meta.get('local_original') and meta.get('remote_original'))
+        if has_original:
+            local_addr = meta['local_original']
+            remote_addr = meta['remote_original']
+        else:
+            # Fallback: используем стандартный формат из source/destination
+            local_addr = _endpoint(flow.get('source_address', '0.0.0.0'), src_port)
+            remote_addr = _endpoint(flow.get('destination_address', '0.0.0.0'), dst_port)
+        
+        # Восстанавливаем структуру соединения
+        connection = {
+            'local': local_addr,
+            'remote': {
+                'address': remote_addr,
+                'name': 'unknown'
+            },
+            'process': meta.get('process', 'unknown'),
+            'protocol': protocol_name,
+            'first_seen': flow.get('first_switched_time', 'unknown'),
+            'last_seen': flow.get('last_switched_time', 'unknown'),
+            'count': flow.get('packet_count', 1)
+        }
+        if flow.get('sampling_interval', 1) > 1:
+            connection['sampling_interval'] = flow['sampling_interval']
+        if flow.get('flow_count', 1) > 1:
+            connection['flows'] = flow['flow_count']
+        
+        # Определяем направление из метаданных
+        direction = meta.get('direction', 'outgoing')
+        if direction == 'incoming':
+            self.incoming_connections.append(connection)
+        else:
+            self.outgoing_connections.append(connection)
+        
+        # Добавляем порты в соответствующие списки
+        if protocol_name in ('tcp', 'udp'):
+            ports = self.tcp_ports if protocol_name == 'tcp' else self.udp_ports
+            if src_port > 0:
+                ports[src_port] = None
+            if dst_port > 0:
+                ports[dst_port] = None
+        
+        # UDP и ICMP потоки дублируются в разделы трафика
+        if protocol_name == 'udp':
+            self.udp_traffic['udp_connections'].append({
+                'connection': f"{local_addr} -> {remote_addr}",
                 'process': meta.get('process', 'unknown'),
-                'protocol': flow.get('protocol_name', 'tcp'),
+                'direction': meta.get('direction', 'outgoing'),
+                'packet_count': flow.get('packet_count', 1),
                 'first_seen': flow.get('first_switched_time', 'unknown'),
-                'last_seen': flow.get('last_switched_time', 'unknown'),
-                'count': flow.get('packet_count', 1)
-            }
-            
-            # Определяем направление из метаданных
-            direction = meta.get('direction', 'outgoing')
-            if direction == 'incoming':
-                incoming_connections.append(connection)
+                'last_seen': flow.get('last_switched_time', 'unknown')
+            })
+            self.udp_traffic['total_packets'] += flow.get('packet_count', 1)
+        elif protocol_name == 'icmp':
+            if has_original:
+                connection_str = f"{local_addr} -> {remote_addr}"
             else:
-                outgoing_connections.append(connection)
-        
-        # Извлекаем порты из потоков
-        tcp_ports = []
-        udp_ports = []
-        
-        for flow in flows:
-            protocol_name = flow.get('protocol_name', 'tcp')
-            src_port = flow.get('source_port', 0)
-            dst_port = flow.get('destination_port', 0)
-            
-            # Добавляем порты в соответствующие списки
-            if protocol_name == 'tcp':
-                if src_port not in tcp_ports and src_port > 0:
-                    tcp_ports.append(src_port)
-                if dst_port not in tcp_ports and dst_port > 0:
-                    tcp_ports.append(dst_port)
-            elif protocol_name == 'udp':
-                if src_port not in udp_ports and src_port > 0:
-                    udp_ports.append(src_port)
-                if dst_port not in udp_ports and dst_port > 0:
-                    udp_ports.append(dst_port)
-        
-        # Создаем UDP трафик для HTML
-        udp_traffic = {
-            'udp_connections': [],
-            'total_connections': 0,
-            'total_packets': 0
-        }
-        
-        # ICMP трафик
-        icmp_traffic = {
-            'connections': [],
-            'total_connections': 0,
-            'total_packets': 0
-        }
+                # Fallback для ICMP: адреса без портов
+                connection_str = f"{flow.get('source_address', '0.0.0.0')} -> {flow.get('destination_address', '0.0.0.0')}"
+            self.icmp_traffic['connections'].append({
+                'connection': connection_str,
+                'process': meta.get('process', 'unknown'),
+                'direction': meta.get('direction', 'outgoing'),
+                'packet_count': flow.get('packet_count', 1)
+            })
+            self.icmp_traffic['total_packets'] += flow.get('packet_count', 1)
+    
+    def build(self, system_info: Dict[str, Any]) -> Dict[str, Any]:
+        """Собирает legacy формат из накопленных потоков"""
+        self.udp_traffic['total_connections'] = len(self.udp_traffic['udp_connections'])
+        self.icmp_traffic['total_connections'] = len(self.icmp_traffic['connections'])
         
-        # Обрабатываем UDP и ICMP потоки
-        for flow in flows:
-            protocol_name = flow.get('protocol_name', 'tcp')
-            meta = flow.get('meta', {})
-            
-            if protocol_name == 'udp':
-                # ВСЕГДА используем оригинальные адреса из метаданных если доступны
-                if meta.get('local_original') and meta.get('remote_original'):
-                    connection_str = f"{meta['local_original']} -> {meta['remote_original']}"
-                else:
-                    # Fallback для UDP
-                    src_addr = flow.get('source_address', '0.0.0.0')
-                    dst_addr = flow.get('destination_address', '0.0.0.0')
-                    src_port = flow.get('source_port', 0)
-                    dst_port = flow.get('destination_port', 0)
-                    
-                    # Для псевдо-адресов сохраняем правильный формат
-                    if src_addr == '*':
-                        src_part = f"*:{src_port}" if src_port > 0 else "*:*"
-                    else:
-                        src_part = f"{src_addr}:{src_port}"
-                        
-                    if dst_addr == '*':
-                        dst_part = f"*:{dst_port}" if dst_port > 0 else "*:*"
-                    else:
-                        dst_part = f"{dst_addr}:{dst_port}"
-                    
-                    connection_str = f"{src_part} -> {dst_part}"
-                
-                udp_conn = {
-                    'connection': connection_str,
-                    'process': meta.get('process', 'unknown'),
-                    'direction': meta.get('direction', 'outgoing'),
-                    'packet_count': flow.get('packet_count', 1),
-                    'first_seen': flow.get('first_switched_time', 'unknown'),
-                    'last_seen': flow.get('last_switched_time', 'unknown')
-                }
-                udp_traffic['udp_connections'].append(udp_conn)
-                udp_traffic['total_packets'] += flow.get('packet_count', 1)
-            
-            elif protocol_name == 'icmp':
-                # ВСЕГДА используем оригинальные адреса из метаданных если доступны
-                if meta.get('local_original') and meta.get('remote_original'):
-                    connection_str = f"{meta['local_original']} -> {meta['remote_original']}"
-                else:
-                    # Fallback для ICMP
-                    connection_str = f"{flow.get('source_address', '0.0.0.0')} -> {flow.get('destination_address', '0.0.0.0')}"
-                
-                icmp_conn = {
-                    'connection': connection_str,
-                    'process': meta.get('process', 'unknown'),
-                    'direction': meta.get('direction', 'outgoing'),
-                    'packet_count': flow.get('packet_count', 1)
-                }
-                icmp_traffic['connections'].append(icmp_conn)
-                icmp_traffic['total_packets'] += flow.get('packet_count', 1)
-        
-        udp_traffic['total_connections'] = len(udp_traffic['udp_connections'])
-        icmp_traffic['total_connections'] = len(icmp_traffic['connections'])
-        
-        # Собираем legacy формат
-        legacy_format = {
+        return {
             'hostname': system_info.get('hostname', 'unknown'),
             'os': system_info.get('os', {}),
             'first_run': system_info.get('first_run', dt.now().strftime('%Y-%m-%d %H:%M:%S')),
@@ -674,17 +754,104 @@ class NetFlowGenerator:
             'total_measurements': system_info.get('total_measurements', 1),
             'current_state': {
                 'connections': {
-                    'incoming': incoming_connections,
-                    'outgoing': outgoing_connections
+                    'incoming': self.incoming_connections,
+                    'outgoing': self.outgoing_connections
                 },
-                'tcp_ports': tcp_ports,
-                'udp_ports': udp_ports,
-                'udp_traffic': udp_traffic,
-                'icmp_traffic': icmp_traffic,
+                'tcp_ports': list(self.tcp_ports),
+                'udp_ports': list(self.udp_ports),
+                'udp_traffic': self.udp_traffic,
+                'icmp_traffic': self.icmp_traffic,
                 'extended_system_info': system_info.get('extended_system_info', {})
             },
             'changes_log': system_info.get('changes_log', []),
-            'session': system_info.get('session', {})
+            'changes_stats': system_info.get('changes_stats', {}),
+            'session': system_info.get('session', {}),
+            'cardinality': system_info.get('cardinality', {}),
+            'rollups': system_info.get('rollups', {}),
+            'timings': system_info.get('timings', {}),
+            'self_monitor': system_info.get('self_monitor', {})
         }
-        
-        return legacy_format 
\ No newline at end of file
+    
+    def finish(self, netflow_report: Dict[str, Any]):
+        self.result = self.build(netflow_report['additional_info'])
+    
+    def discard(self):
+        self.result = None
+
+
+class YAMLReportSink:
+    """
+    Пишет NetFlow отчет в YAML (структура format_netflow_yaml), не держа потоки
+    в памяти: каждый поток сериализуется во временный файл, а заголовок с
+    итоговым числом записей и статистика дописываются в finish
+    """
+    formatted = True
+    error = None
+    
+    def __init__(self, path: str, codec: Optional[str] = None, level: Optional[int] = None):
+        self.path = path
+        self.codec = codec
+        self.level = level
+        self.description = f"YAML report {path}"
+        self.flow_count = 0
+        self._spool = tempfile.TemporaryFile('w+', encoding='utf-8')
+    
+    def add(self, flow: Dict[str, Any], formatted: Dict[str, Any]):
+        item = yaml.dump([formatted], default_flow_style=False, allow_unicode=True, sort_keys=False)
+        # Элемент списка flows внутри netflow_message
+        self._spool.write(textwrap.indent(item, '  '))
+        self.flow_count += 1
+    
+    def finish(self, netflow_report: Dict[str, Any]):
+        self._spool.seek(0)
+        with open_report(self.path, 'w', self.codec, self.level) as f:
+            yaml.dump({'netflow_message': {'header': format_message_header(netflow_report['message_header']),
+                                           'templates': format_templates(netflow_report['template_records'])}},
+                      f, default_flow_style=False, allow_unicode=True, sort_keys=False)
+            if self.flow_count:
+                f.write('  flows:\n')
+                shutil.copyfileobj(self._spool, f)
+            else:
+                f.write('  flows: []\n')
+            yaml.dump({'flow_statistics': netflow_report['statistics'],
+                       'system_information': netflow_report['additional_info']},
+                      f, default_flow_style=False, allow_unicode=True, sort_keys=False)
+        self._spool.close()
+    
+    def discard(self):
+        self._spool.close()
+
+
+class IPFIXReportSink:
+    """
+    Пишет потоки в бинарный IPFIX архив по мере поступления (см. write_ipfix_file)
+    Архив пишется во временный файл и заменяет прежний только в finish: при сбое
+    на диске не остается частичного архива, который предпочитается YAML при восстановлении
+    """
+    formatted = False
+    error = None
+    
+    def __init__(self, path: str, observation_domain_id: int = 1):
+        self.path = path
+        self.temp_path = f"{path}.tmp"
+        self.description = f"IPFIX archive {path}"
+        self.flow_count = 0
+        self._file = open(self.temp_path, 'wb')
+        self._writer = IPFIXWriter(self._file, observation_domain_id=observation_domain_id)
+    
+    def add(self, flow: Dict[str, Any], formatted: Optional[Dict[str, Any]]):
+        self._writer.write_flow(flow)
+        self.flow_count += 1
+    
+    def finish(self, netflow_report: Dict[str, Any]):
+        self._writer.write_system_information(netflow_report.get('additional_info', {}))
+        self._writer.close()
+        self._file.close()
+        os.replace(self.temp_path, self.path)
+    
+    def discard(self):
+        self._file.close()
+        try:
+            os.unlink(self.temp_path)
+        except OSError:
+            pass
@@ -1,8 +1,14 @@
 import socket
-import psutil
-import time
+from collections import namedtuple
 from datetime import datetime
 from analyzer_utils import execute_command
+from address_classifier import get_address_classifier
+from flow_sampling import FlowSampler, SpaceSaving
+from profiling import lazy_import, span
+from capture import CAPTURE, captured
+
+psutil = lazy_import('psutil')
+
 
 def format_timestamp(timestamp):
     """Форматирует timestamp в человекочитаемый вид"""
@@ -11,6 +17,34 @@ def format_timestamp(timestamp):
     except (ValueError, TypeError):
         return str(timestamp)
 
+# Соединение из записи (capture.py) с полями psutil.net_connections()
+_CapturedAddress = namedtuple('addr', 'ip port')
+_CapturedConnection = namedtuple('sconn', 'fd family type laddr raddr status pid')
+
+def _encode_connections(connections):
+    # Таблица сокетов для записи (capture.py): адреса - списки [ip, port]
+    return [[conn.fd, int(conn.family), int(conn.type), list(conn.laddr), list(conn.raddr), conn.status, conn.pid]
+            for conn in connections]
+
+def _decode_connections(rows):
+    return [_CapturedConnection(fd, socket.AddressFamily(family), socket.SocketKind(kind),
+                                _CapturedAddress(*laddr) if laddr else (),
+                                _CapturedAddress(*raddr) if raddr else (), status, pid)
+            for fd, family, kind, laddr, raddr, status, pid in rows]
+
+@captured('net_connections', _encode_connections, _decode_connections, lambda kind: [])
+def _net_connections(kind):
+    return psutil.net_connections(kind=kind)
+
+@captured('reverse_dns', default=lambda ip: "unknown")
+def _reverse_lookup(ip):
+    """Имя удаленного хоста по PTR записи или 'unknown'"""
+    try:
+        return socket.gethostbyaddr(ip)[0]
+    except (socket.herror, socket.gaierror):
+        return "unknown"
+
+@captured('process', decode=tuple, default=lambda pid: ("unknown", "no_access"))
 def get_process_details(pid):
     """Получает детальную информацию о процессе"""
     try:
@@ -58,6 +92,7 @@ def get_process_details(pid):
     except (psutil.NoSuchProcess, psutil.AccessDenied, AttributeError, TypeError):
         return "unknown", "no_access"
 
+@captured('process_by_port', default=lambda port, protocol='tcp': "unknown")
 def get_process_name_by_port(port, protocol='tcp'):
     """Получает имя процесса по порту через lsof (для macOS)"""
     try:
@@ -65,7 +100,8 @@ def get_process_name_by_port(port, protocol='tcp'):
         if platform.system() == 'Darwin':
             # Используем lsof для получения процесса по порту
             cmd = ['lsof', '-i', f'{protocol}:{port}', '-n']
-            result = execute_command(cmd)
+            with span('collect.lsof'):
+                result = execute_command(cmd)
             
             for line in result:
                 if line.strip() and not line.startswith('COMMAND'):
@@ -102,7 +138,7 @@ def filter_unique_connections(stored_connections, l_addr, l_port, r_addr, r_port
         for key in keys_to_delete:
             del stored_connections[key]
     
-    current_time = time.time()
+    current_time = CAPTURE.now()
     
     if connect_key not in stored_connections:
         # Новое соединение - добавляем его
@@ -122,9 +158,85 @@ def filter_unique_connections(stored_connections, l_addr, l_port, r_addr, r_port
 
     return is_new, connect_key
 
-def finalize_result(networks, snapshot_connections, outgoing_ports, local_addresses, except_local: bool):
+def _socket_address(addr):
+    return f"{addr.ip}:{addr.port}" if addr and hasattr(addr, 'ip') else "*"
+
+@captured('process_name', default=lambda pid: "unknown")
+def _lookup_process_name(pid):
+    try:
+        return psutil.Process(pid).name() if pid else "unknown"
+    except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+        return "unknown"
+
+def _process_name(pid, cache):
+    """Имя процесса по PID для группировки top-K (кэш на одно измерение, без exe/cmdline)"""
+    if pid not in cache:
+        cache[pid] = _lookup_process_name(pid)
+    return cache[pid]
+
+def _service_key(conn, process_names, outgoing_ports):
+    """Группа top-K: (процесс, протокол, направление, удаленный хост, порт сервиса)"""
+    process = _process_name(getattr(conn, 'pid', None), process_names)
+    local_port = conn.laddr.port if conn.laddr and hasattr(conn.laddr, 'port') else 0
+    remote_ip = conn.raddr.ip if conn.raddr and hasattr(conn.raddr, 'ip') else "*"
+    if local_port <= outgoing_ports:
+        # Входящие: сервис - локальный порт, группируем по клиенту
+        return (process, conn.type, 'incoming', remote_ip, local_port)
+    remote_port = conn.raddr.port if conn.raddr and hasattr(conn.raddr, 'port') else 0
+    return (process, conn.type, 'outgoing', remote_ip, remote_port)
+
+def _is_reportable(conn, is_local_address, except_local):
+    """Попадет ли сокет в отчет finalize_result (TCP - только ESTABLISHED, UDP/ICMP - всегда, с учетом except_local)"""
+    if conn.type == socket.SOCK_STREAM and (conn.status != psutil.CONN_ESTABLISHED or not conn.raddr):
+        return False
+    if conn.raddr and hasattr(conn.raddr, 'ip'):
+        return not except_local or not is_local_address(conn.raddr.ip)
+    return conn.type in (socket.SOCK_DGRAM, socket.SOCK_RAW)
+
+def select_connections(open_connections, sampling, outgoing_ports, reportable=None):
+    """
+    Рабочий набор соединений по настройкам flow_sampling
+    Возвращает список (соединение, вес): вес - сколько реальных соединений
+    представляет выбранное, на него умножается счетчик
+    - truncate: первые max_connections (прежнее поведение)
+    - sample: детерминированная выборка 1 из interval по 5-tuple
+    - topk: Space-Saving по (процесс, удаленный сервис), по одному
+      представителю на каждую из top_k групп; reportable - фильтр сокетов,
+      которые попадут в отчет (LISTEN/TIME_WAIT не занимают группы и не
+      становятся представителями)
+    """
+    mode = sampling.get('mode', 'truncate')
+    if mode == 'sample':
+        sampler = FlowSampler(sampling.get('interval', 1), sampling.get('seed', 0))
+        return [(conn, sampler.interval) for conn in open_connections
+                if sampler.keep(f"{conn.type}|{_socket_address(conn.laddr)}|{_socket_address(conn.raddr)}")]
+    if mode == 'topk':
+        summary = SpaceSaving(sampling.get('top_k', 50))
+        process_names = {}
+        if reportable:
+            open_connections = [conn for conn in open_connections if reportable(conn)]
+        for conn in open_connections:
+            summary.add(_service_key(conn, process_names, outgoing_ports), item=conn)
+        # Второй проход по снимку уточняет счетчики выживших групп до точных (память O(K))
+        exact = {key: 0 for key in summary.counters}
+        for conn in open_connections:
+            key = _service_key(conn, process_names, outgoing_ports)
+            if key in exact:
+                exact[key] += 1
+        ranked = sorted(exact.items(), key=lambda item: -item[1])
+        return [(summary.items[key], count) for key, count in ranked]
+    max_connections = sampling.get('max_connections', 100)
+    return [(conn, 1) for conn in open_connections[:max_connections]]
+
+def finalize_result(networks, snapshot_connections, outgoing_ports, local_addresses, except_local: bool, sampling=None,
+                    aggregate=False, collectors=None):
+    # collectors: {'reverse_dns': bool, 'lsof': bool} - дорогие сборщики (отключаются ограничителем нагрузки)
+    collectors = collectors or {}
+    resolve_names = collectors.get('reverse_dns', True)
+    use_lsof = collectors.get('lsof', True)
     # Используем соединения со статусом ESTABLISHED для TCP, все UDP соединения с удаленным адресом и ICMP соединения
-    open_connections = list(set(snapshot_connections['connections_all']))
+    # Дубликаты убираются с сохранением порядка таблицы сокетов (одинаковый отчет при воспроизведении записи)
+    open_connections = list(dict.fromkeys(snapshot_connections['connections_all']))
     
     # Инициализируем структуру для накапливания соединений, если её ещё нет
     if 'stored_connections' not in networks:
@@ -148,17 +260,27 @@ def finalize_result(networks, snapshot_connections, outgoing_ports, local_addres
         # Очищаем текущий список удаленных адресов (но не историю)
         current_remote.clear()
 
-    # Рабочий набор соединений (не более 100)
-    max_connections = 100
-    if len(open_connections) > max_connections:
-        open_connections = open_connections[:max_connections]
+    # Локальность адресов определяет CIDR классификатор (loopback + адреса из local_address)
+    is_local_address = get_address_classifier(local_addresses=local_addresses).is_local
+
+    # Рабочий набор соединений: усечение, выборка 1 из N или top-K (flow_sampling)
+    sampling = sampling or {}
+    if aggregate and sampling.get('mode', 'truncate') == 'truncate':
+        # Агрегация сворачивает сокеты в сервисы, поэтому усечение до max_connections не нужно
+        sampling = dict(sampling, max_connections=None)
+    selected_connections = select_connections(
+        open_connections, sampling, outgoing_ports,
+        reportable=lambda conn: _is_reportable(conn, is_local_address, except_local))
+    # Ключи хранилища соединений, уже попавших в отчет (для агрегации)
+    reported_keys = set()
+    sampling_interval = sampling.get('interval', 1) if sampling.get('mode') == 'sample' else 1
 
     # Счетчики для отладки
     tcp_count = 0
     udp_count = 0
     icmp_count = 0
 
-    for conn in open_connections:
+    for conn, weight in selected_connections:
         # Для TCP проверяем статус ESTABLISHED
         if conn.type == socket.SOCK_STREAM and conn.status != psutil.CONN_ESTABLISHED:
             continue
@@ -226,11 +348,15 @@ def finalize_result(networks, snapshot_connections, outgoing_ports, local_addres
             stored_connections, conn_local_addr, conn_local_port, conn_remote_addr, conn_remote_port, type_conn, protocol)
             
         # Для новых соединений или для обновления данных существующих
-        if is_new or time.time() - stored_connections[conn_key].get('info_updated', 0) > 3600:
+        if is_new or CAPTURE.now() - stored_connections[conn_key].get('info_updated', 0) > 3600:
             try:
                 # Проверяем, что у нас есть валидный IP адрес
                 if hasattr(conn, 'raddr') and conn.raddr and hasattr(conn.raddr, 'ip'):
-                    remote_hostname = socket.gethostbyaddr(conn.raddr.ip)
+                    if resolve_names:
+                        with span('collect.reverse_dns'):
+                            remote_hostname = [_reverse_lookup(conn.raddr.ip)]
+                    else:
+                        remote_hostname = ["unknown"]
                 else:
                     # Для UDP listening портов и ICMP
                     if protocol == 'udp' and not (hasattr(conn, 'raddr') and conn.raddr):
@@ -249,7 +375,7 @@ def finalize_result(networks, snapshot_connections, outgoing_ports, local_addres
             
             # Если не удалось получить через PID, пробуем через порт (только для TCP/UDP)
             if (proc_status == "no_access" or conn_proc_name == "unknown") and protocol != 'icmp':
-                port_based_name = get_process_name_by_port(conn_local_port, protocol)
+                port_based_name = get_process_name_by_port(conn_local_port, protocol) if use_lsof else "unknown"
                 if port_based_name != "unknown":
                     conn_proc_name = port_based_name
             elif protocol == 'icmp' and conn_proc_name == "unknown":
@@ -263,16 +389,19 @@ def finalize_result(networks, snapshot_connections, outgoing_ports, local_addres
                 "protocol": protocol,
                 "first_seen": format_timestamp(stored_connections[conn_key]['first_seen']),
                 "last_seen": format_timestamp(stored_connections[conn_key]['last_seen']),
+                # Epoch время для NetFlow генератора (без повторного разбора строк)
+                "first_seen_ts": int(stored_connections[conn_key]['first_seen']),
+                "last_seen_ts": int(stored_connections[conn_key]['last_seen']),
                 "count": stored_connections[conn_key]['count']
             }
             
             # Сохраняем информацию о соединении
             stored_connections[conn_key]['info'] = conn_info
-            stored_connections[conn_key]['info_updated'] = time.time()
+            stored_connections[conn_key]['info_updated'] = CAPTURE.now()
             
             # Сохраняем информацию о хосте (только для реальных удаленных адресов)
             if (hasattr(conn, 'raddr') and conn.raddr and hasattr(conn.raddr, 'ip') and 
-                (conn_remote_addr not in local_addresses or not except_local)):
+                (not is_local_address(conn_remote_addr) or not except_local)):
                 info_remote = {"name": remote_hostname[0], 'type': type_conn}
                 if type_conn == "outgoing":
                     info_remote['port'] = conn_remote_port
@@ -282,13 +411,28 @@ def finalize_result(networks, snapshot_connections, outgoing_ports, local_addres
                 # Обновляем информацию о хосте в хранилище и для текущего отчета
                 current_remote[conn_remote_addr] = info_remote
         
+        # Масштабированный счетчик: соединение представляет weight реальных (выборка или группа top-K)
+        if weight != 1 and 'info' in stored_connections[conn_key]:
+            stored_connections[conn_key]['info']['count'] = stored_connections[conn_key]['count'] * weight
+            if sampling_interval > 1:
+                stored_connections[conn_key]['info']['sampling_interval'] = sampling_interval
+        
         # Добавляем соединение в текущий отчет, даже если оно не новое
         if conn_key in stored_connections and 'info' in stored_connections[conn_key]:
             # Для UDP listening портов и ICMP добавляем всегда, для остальных проверяем локальность
             if (protocol in ['udp', 'icmp'] and not (hasattr(conn, 'raddr') and conn.raddr)) or \
                ((hasattr(conn, 'raddr') and conn.raddr and hasattr(conn.raddr, 'ip')) and 
-                (conn_remote_addr not in local_addresses or not except_local)):
-                current_connections[type_conn].append(stored_connections[conn_key]['info'])
+                (not is_local_address(conn_remote_addr) or not except_local)):
+                if aggregate:
+                    # Запись хранилища общая для сокетов с разными эфемерными портами:
+                    # для агрегации нужны фактические адреса сокета и ключ записи (счетчик один на запись)
+                    info = stored_connections[conn_key]['info']
+                    current_connections[type_conn].append(dict(
+                        info, local=conn_local_full,
+                        remote=dict(info['remote'], address=conn_remote_full), _conn_key=conn_key))
+                    reported_keys.add(conn_key)
+                else:
+                    current_connections[type_conn].append(stored_connections[conn_key]['info'])
 
     # Обрабатываем TCP, UDP и ICMP порты
     join_ports(snapshot_connections, networks, 'tcp')
@@ -301,6 +445,10 @@ def finalize_result(networks, snapshot_connections, outgoing_ports, local_addres
         # Для ICMP сохраняем информацию о количестве raw сокетов
         networks['icmp'] = len(snapshot_connections['icmp'])
 
+    # Соединения этого измерения идут в начале списков, дальше - дополнение из истории
+    networks['live_connections'] = {conn_type: len(current_connections[conn_type])
+                                    for conn_type in ['incoming', 'outgoing']}
+
     # Добавляем все сохраненные соединения в отчет
     # Ограничиваем количество соединений в отчете
     for conn_type in ['incoming', 'outgoing']:
@@ -310,7 +458,11 @@ def finalize_result(networks, snapshot_connections, outgoing_ports, local_addres
             conn_history = []
             for conn_key, conn_data in stored_connections.items():
                 if conn_data.get('type') == conn_type and 'info' in conn_data:
-                    conn_history.append(conn_data['info'])
+                    if aggregate:
+                        if conn_key not in reported_keys:
+                            conn_history.append(dict(conn_data['info'], _conn_key=conn_key))
+                    else:
+                        conn_history.append(conn_data['info'])
             
             # Сортируем по последнему наблюдению (в обратном порядке)
             conn_history.sort(key=lambda x: x.get('last_seen', 0), reverse=True)
@@ -328,6 +480,12 @@ def finalize_result(networks, snapshot_connections, outgoing_ports, local_addres
 
     return networks
 
+def live_connections(networks):
+    """Соединения текущего измерения без дополнения из истории finalize_result (для счетчиков и метрик)"""
+    live = networks.get('live_connections', {})
+    return {conn_type: rows[:live.get(conn_type, len(rows))]
+            for conn_type, rows in networks.get('connections', {}).items()}
+
 def join_ports(current_ports, networks, type_of_port):
     if type_of_port not in networks:
         networks[type_of_port] = []
@@ -358,7 +516,8 @@ def get_connections_alternative_macos():
         from analyzer_utils import execute_command
         
         # Получаем все сетевые соединения через lsof
-        result = execute_command(['lsof', '-i', '-n'])
+        with span('collect.lsof'):
+            result = execute_command(['lsof', '-i', '-n'])
         
         # Объединяем многострочные записи
         combined_lines = []
@@ -661,7 +820,7 @@ def get_connections_alternative_macos():
             'udp': []
         }
 
-def get_current_connections(except_ipv6):
+def get_current_connections(except_ipv6, use_lsof=True):
     if except_ipv6:
         mode = "inet4"
     else:
@@ -675,7 +834,7 @@ def get_current_connections(except_ipv6):
 
     try:
         # Get all my connections
-        connections = psutil.net_connections(kind=mode)
+        connections = _net_connections(mode)
         psutil_worked = True
         for connection in connections:
             # Для TCP добавляем только соединения со статусом ESTABLISHED
@@ -705,7 +864,7 @@ def get_current_connections(except_ipv6):
         # Пытаемся получить хотя бы базовую информацию
         try:
             # Получаем только listening порты (обычно доступно без sudo)
-            connections = psutil.net_connections(kind=mode)
+            connections = _net_connections(mode)
             for connection in connections:
                 if connection.status == psutil.CONN_LISTEN:
                     listen_ports.append(connection.laddr.port)
@@ -723,7 +882,7 @@ def get_current_connections(except_ipv6):
 
     # Всегда дополняем данные альтернативным методом на macOS для получения UDP соединений
     import platform
-    if platform.system() == 'Darwin':
+    if platform.system() == 'Darwin' and use_lsof:
         try:
             if psutil_worked:
                 print(f"🔍 Дополняем данные альтернативным методом lsof для UDP соединений...")
@@ -785,7 +944,8 @@ def get_ports_alternative_macos():
         from analyzer_utils import execute_command
         
         # Получаем все сетевые соединения через lsof
-        result = execute_command(['lsof', '-i', '-n'])
+        with span('collect.lsof'):
+            result = execute_command(['lsof', '-i', '-n'])
         
         for line in result[1:]:  # Пропускаем заголовок
             if line.strip():
@@ -831,12 +991,13 @@ def get_ports_alternative_macos():
     
     return tcp_ports, udp_ports
 
-def get_connections(networks: dict, outgoing_ports, local_address, except_ipv6: bool, except_local: bool):
+def get_connections(networks: dict, outgoing_ports, local_address, except_ipv6: bool, except_local: bool, sampling=None,
+                    aggregate=False, collectors=None):
     # Проверяем инициализацию структур
     if 'stored_connections' not in networks:
         networks['stored_connections'] = {}
         
-    snapshot_connections = get_current_connections(except_ipv6)
+    snapshot_connections = get_current_connections(except_ipv6, (collectors or {}).get('lsof', True))
     
     # Если нет реальных соединений, возвращаем пустые структуры вместо демо-данных
     if not snapshot_connections['connections_all'] and not snapshot_connections['tcp'] and not snapshot_connections['udp']:
@@ -853,7 +1014,10 @@ def get_connections(networks: dict, outgoing_ports, local_address, except_ipv6:
                                snapshot_connections,
                                outgoing_ports,
                                local_address,
-                               except_local)
+                               except_local,
+                               sampling,
+                               aggregate,
+                               collectors)
     
     # Добавляем отладочную информацию о найденных соединениях
     total_connections = len(networks.get('connections', {}).get('incoming', [])) + len(networks.get('connections', {}).get('outgoing', []))
@@ -910,6 +1074,7 @@ def get_connections(networks: dict, outgoing_ports, local_address, except_ipv6:
     
     return networks
 
+@captured('interfaces', default=lambda local_interfaces: {})
 def get_interfaces(local_interfaces):
     data_interfaces = {}
     interfaces = psutil.net_if_addrs()
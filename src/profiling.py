@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Замеры времени этапов анализатора и режим профилирования
+span('collect.udp') измеряет этап: время одноименных вызовов за измерение
+суммируется, take() закрывает измерение и добавляет суммы в ограниченную
+историю, по которой считаются p50/p95. Режим --profile пишет cProfile
+статистику (.pstats) и свернутые стеки (.collapsed) для flamegraph.pl/speedscope.
+IMPORTS учитывает время импорта подсистем (как python -X importtime, но по группам
+модулей); lazy_import() откладывает импорт тяжелой зависимости до первого обращения
+"""
+
+import io
+import math
+import os
+import sys
+import threading
+import time
+import types
+from collections import Counter, deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Dict, List, Optional
+
+DEFAULT_MAX_SAMPLES = 100
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    """Процентиль по ближайшему рангу (ordered отсортирован)"""
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class SpanRecorder:
+    """Суммы времени этапов текущего измерения и история последних max_samples измерений"""
+
+    def __init__(self, max_samples: int = DEFAULT_MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.current: Dict[str, float] = {}
+        self.samples: Dict[str, deque] = {}
+
+    @contextmanager
+    def span(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name: str, seconds: float):
+        """Учитывает время этапа, измеренное вызывающим кодом (для длинных блоков без with)"""
+        self.current[name] = self.current.get(name, 0.0) + seconds
+
+    def timed(self, name: str):
+        """Декоратор: каждый вызов функции учитывается в этапе name"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def take(self) -> Dict[str, float]:
+        """Закрывает измерение: возвращает суммы этапов и добавляет их в историю"""
+        taken = {name: round(seconds, 6) for name, seconds in self.current.items()}
+        self.current = {}
+        for name, seconds in taken.items():
+            self.samples.setdefault(name, deque(maxlen=self.max_samples)).append(seconds)
+        return taken
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """{этап: {'count', 'p50', 'p95', 'max', 'last'}} по истории"""
+        result = {}
+        for name, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            result[name] = {'count': len(ordered), 'p50': _percentile(ordered, 0.5),
+                            'p95': _percentile(ordered, 0.95), 'max': ordered[-1], 'last': samples[-1]}
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'max_samples': self.max_samples,
+                'samples': {name: list(samples) for name, samples in self.samples.items()}}
+
+    def load(self, data: Optional[Dict[str, Any]]):
+        """Восстанавливает историю из to_dict (на месте: span уже импортирован модулями)"""
+        self.samples = {}
+        for name, values in ((data or {}).get('samples') or {}).items():
+            self.samples[str(name)] = deque((float(value) for value in values), maxlen=self.max_samples)
+
+
+# Общий регистратор процесса: модули импортируют span и timed
+SPANS = SpanRecorder()
+span = SPANS.span
+timed = SPANS.timed
+
+
+# Время импорта подсистем за запуск (не сбрасывается take(): импорт происходит один раз)
+IMPORTS = SpanRecorder()
+import_span = IMPORTS.span
+
+
+class LazyModule(types.ModuleType):
+    """
+    Заместитель модуля: настоящий модуль импортируется при первом обращении к
+    атрибуту (время учитывается в IMPORTS), дальше атрибуты читаются из него,
+    поэтому изменения модуля (psutil.PROCFS_PATH в тестах) видны сразу
+    """
+
+    def __init__(self, name: str, subsystem: str):
+        super().__init__(name)
+        self._subsystem = subsystem
+        self._module: Optional[types.ModuleType] = None
+
+    def _load(self) -> types.ModuleType:
+        if self._module is None:
+            with import_span(self._subsystem):
+                # __import__, а не importlib.import_module: импорт виден в python -X importtime
+                __import__(self.__name__)
+            self._module = sys.modules[self.__name__]
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._module or self._load(), attr)
+
+
+def lazy_import(name: str, subsystem: Optional[str] = None) -> LazyModule:
+    """Отложенный импорт: psutil = lazy_import('psutil')"""
+    return LazyModule(name, subsystem or name)
+
+
+def format_imports(limit: int = 15) -> List[str]:
+    """Строки таблицы времени импорта подсистем (по убыванию)"""
+    rows = sorted(IMPORTS.current.items(), key=lambda item: -item[1])[:limit]
+    return [f"{name:<36} {seconds * 1000:9.1f} ms" for name, seconds in rows]
+
+
+def format_timings(summary: Dict[str, Dict[str, float]], limit: int = 15) -> List[str]:
+    """Строки таблицы самых долгих этапов (по p95)"""
+    rows = sorted(summary.items(), key=lambda item: -item[1]['p95'])[:limit]
+    return [f"{name:<36} p50 {stats['p50'] * 1000:9.1f} ms  p95 {stats['p95'] * 1000:9.1f} ms  "
+            f"last {stats['last'] * 1000:9.1f} ms  n={stats['count']}" for name, stats in rows]
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Выборочный профилировщик: фоновый поток раз в interval секунд снимает стек
+    целевого потока и считает одинаковые стеки (формат collapsed: 'a;b;c N')
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """Режим --profile: cProfile и выборочный профилировщик на все время запуска"""
+
+    def __init__(self, prefix: str, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        import cProfile
+        self.prefix = prefix
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler(interval=interval)
+
+    def start(self):
+        self.sampler.start()
+        self.profile.enable()
+
+    def stop(self) -> Dict[str, str]:
+        """Останавливает профилирование и пишет файлы; возвращает их пути"""
+        self.profile.disable()
+        self.sampler.stop()
+        paths = {'pstats': f"{self.prefix}.pstats", 'collapsed': f"{self.prefix}.collapsed",
+                 'imports': f"{self.prefix}.imports"}
+        self.profile.dump_stats(paths['pstats'])
+        self.sampler.write(paths['collapsed'])
+        with open(paths['imports'], 'w', encoding='utf-8') as f:
+            f.writelines(f"{line}\n" for line in format_imports(limit=len(IMPORTS.current)))
+        return paths
+
+    def top(self, limit: int = 15) -> str:
+        """Самые дорогие функции по накопленному времени"""
+        import pstats
+        output = io.StringIO()
+        pstats.Stats(self.profile, stream=output).sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    @timed('demo.serialize')
+    def serialize(n):
+        return ','.join(str(i) for i in range(n))
+
+    recorder_started = time.perf_counter()
+    for measurement in range(50):
+        with span('demo.collect'):
+            time.sleep(0.001 + (measurement % 10) / 5000)
+        serialize(20000)
+        SPANS.take()
+    print(f"⏱️ 50 measurements in {time.perf_counter() - recorder_started:.2f}s")
+    for line in format_timings(SPANS.summary()):
+        print(f"  {line}")
+
+    prefix = os.path.join(tempfile.mkdtemp(), 'demo_profile')
+    profiler = Profiler(prefix)
+    profiler.start()
+    for _ in range(20):
+        serialize(50000)
+    paths = profiler.stop()
+    print(f"🔬 Profile: {paths}")
+    print(profiler.top(5))
+    yaml = lazy_import('yaml')
+    print(f"📦 yaml loaded: {'yaml' in sys.modules}, dump: {yaml.dump([1]).strip()}, imports: {format_imports()}")
+    with open(paths['collapsed'], encoding='utf-8') as f:
+        print(f"🔥 Top stack: {f.readline().strip()[:160]}")
@@ -8,9 +8,13 @@ import re
 import socket
 from collections import defaultdict, Counter
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Optional, Tuple
 import ipaddress
 
+from address_classifier import split_host_port
+from cardinality import CardinalityTracker
+from profiling import span
+
 # Константы для категоризации
 SUSPICIOUS_PORTS = {443, 80, 22, 3389, 5432, 3306, 1433, 6379, 27017}
 CLOUD_PROVIDERS = {
@@ -31,22 +35,29 @@ COMMON_SERVICES = {
 class ReportEnhancer:
     """Класс для улучшения отчетов анализатора"""
     
-    def __init__(self):
+    def __init__(self, ip_database=None):
         self.security_alerts = []
         self.performance_insights = []
         self.recommendations = []
+        # Офлайн база IP диапазонов (ip_database.IPRangeDatabase), если настроена
+        self.ip_database = ip_database
     
     def enhance_report(self, original_report: Dict[str, Any]) -> Dict[str, Any]:
         """Улучшает исходный отчет, добавляя аналитику и структурирование"""
-        enhanced_report = {
-            'metadata': self._create_metadata(original_report),
-            'executive_summary': self._create_executive_summary(original_report),
-            'security_analysis': self._analyze_security(original_report),
-            'network_analysis': self._analyze_network(original_report),
-            'system_health': self._analyze_system_health(original_report),
-            'recommendations': self.recommendations,
-            'detailed_data': self._structure_detailed_data(original_report)
-        }
+        stages = (
+            ('metadata', self._create_metadata),
+            ('executive_summary', self._create_executive_summary),
+            ('security_analysis', self._analyze_security),
+            ('network_analysis', self._analyze_network),
+            ('system_health', self._analyze_system_health),
+        )
+        enhanced_report = {}
+        for section, stage in stages:
+            with span(f"enhance.{section}"):
+                enhanced_report[section] = stage(original_report)
+        enhanced_report['recommendations'] = self.recommendations
+        with span('enhance.detailed_data'):
+            enhanced_report['detailed_data'] = self._structure_detailed_data(original_report)
         
         return enhanced_report
     
@@ -71,22 +82,29 @@ class ReportEnhancer:
         incoming = connections.get('incoming', [])
         outgoing = connections.get('outgoing', [])
         
-        # Подсчет уникальных процессов и хостов
-        processes = set()
-        remote_hosts = set()
-        
-        for conn in incoming + outgoing:
-            if 'process' in conn:
-                processes.add(conn['process'])
-            if 'remote' in conn and 'address' in conn['remote']:
-                remote_hosts.add(conn['remote']['address'].split(':')[0])
+        # Подсчет уникальных процессов и хостов: скетчи HyperLogLog накоплены по всем
+        # соединениям за время работы, без них считаем по текущим спискам
+        cardinality = self._cardinality_summary(report)
+        if cardinality is None:
+            processes = set()
+            remote_hosts = set()
+            
+            for conn in incoming + outgoing:
+                if 'process' in conn:
+                    processes.add(conn['process'])
+                if 'remote' in conn and 'address' in conn['remote']:
+                    remote_hosts.add(conn['remote']['address'].split(':')[0])
+            cardinality = {'unique_processes': len(processes), 'unique_remote_hosts': len(remote_hosts),
+                           'process_peers': {}, 'port_clients': {}}
         
         return {
             'total_connections': len(incoming) + len(outgoing),
             'incoming_connections': len(incoming),
             'outgoing_connections': len(outgoing),
-            'unique_processes': len(processes),
-            'unique_remote_hosts': len(remote_hosts),
+            'unique_processes': cardinality['unique_processes'],
+            'unique_remote_hosts': cardinality['unique_remote_hosts'],
+            'peers_per_process': cardinality['process_peers'],
+            'clients_per_port': cardinality['port_clients'],
             'tcp_listening_ports': len(report.get('listen_ports', {}).get('tcp', [])),
             'udp_listening_ports': len(report.get('listen_ports', {}).get('udp', [])),
             'security_alerts_count': len(self.security_alerts),
@@ -94,6 +112,15 @@ class ReportEnhancer:
             'top_destinations': self._get_top_destinations(outgoing)
         }
     
+    def _cardinality_summary(self, report: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Оценки уникальных значений из скетчей отчета (None, если скетчей нет или они повреждены)"""
+        if not report.get('cardinality'):
+            return None
+        try:
+            return CardinalityTracker.from_dict(report['cardinality']).summary(limit=5)
+        except (ValueError, TypeError, AttributeError):
+            return None
+    
     def _analyze_security(self, report: Dict[str, Any]) -> Dict[str, Any]:
         """Анализирует безопасность системы"""
         security_analysis = {
@@ -298,10 +325,18 @@ class ReportEnhancer:
         return dict(protocol_count)
     
     def _analyze_geographic_distribution(self, outgoing: List[Dict]) -> Dict[str, Any]:
-        """Упрощенный географический анализ на основе доменных имен"""
+        """Географический анализ по офлайн IP базе, с fallback на доменные имена"""
         regions = defaultdict(int)
         
         for conn in outgoing:
+            # Атрибуция по IP базе не требует обратного DNS
+            if self.ip_database is not None:
+                remote_ip, _ = split_host_port(conn.get('remote', {}).get('address', ''))
+                info = self.ip_database.lookup(remote_ip)
+                if info and info['country']:
+                    regions[info['country']] += 1
+                    continue
+            
             if 'remote' in conn and 'name' in conn['remote']:
                 hostname = conn['remote']['name']
                 
@@ -653,9 +688,9 @@ class ReportEnhancer:
         return dict(categories)
 
 
-def enhance_analyzer_report(original_report: Dict[str, Any]) -> Dict[str, Any]:
+def enhance_analyzer_report(original_report: Dict[str, Any], ip_database=None) -> Dict[str, Any]:
     """Функция для интеграции в основной анализатор"""
-    enhancer = ReportEnhancer()
+    enhancer = ReportEnhancer(ip_database=ip_database)
     return enhancer.enhance_report(original_report)
 
 
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Временные ряды измерений в кольцевых буферах
+Каждое измерение попадает в три кольца: минутное, часовое и суточное.
+Ячейка хранит число измерений и сумму/минимум/максимум каждой метрики,
+поэтому обновление O(1), а память постоянна при сколь угодно долгой работе
+демона: старые ячейки перезаписываются новыми интервалами
+"""
+
+from array import array
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+# Метрики одного измерения
+METRICS = (
+    'incoming', 'outgoing', 'tcp', 'udp', 'icmp',
+    'tcp_listen_ports', 'udp_listen_ports',
+    'udp_packets_rate', 'icmp_packets_rate',
+    'collection_seconds', 'changed',
+    'self_cpu_percent', 'self_rss_mb',
+)
+
+# (имя, длительность ячейки в секундах, число ячеек по умолчанию)
+RESOLUTIONS = (
+    ('minute', 60, 180),    # 3 часа
+    ('hour', 3600, 168),    # 7 дней
+    ('day', 86400, 366),    # год (сутки UTC)
+)
+
+
+def count_connection(totals: Counter, direction: str, connection: Dict[str, Any]):
+    """
+    Учитывает соединение в счетчиках по протоколу и направлению (до усечения списков)
+    Ключи 'incoming/tcp' и 'process:nginx' используются экспортером метрик
+    """
+    protocol = connection.get('protocol', 'tcp')
+    totals[direction] += 1
+    totals[protocol] += 1
+    totals[f"{direction}/{protocol}"] += 1
+    totals[f"process:{connection.get('process', 'unknown')}"] += 1
+
+
+class RingBuffer:
+    """Кольцо из size ячеек по seconds секунд; ячейка i хранит интервал с номером slots[i]"""
+
+    def __init__(self, seconds: int, size: int, metrics: Iterable[str] = METRICS):
+        if seconds < 1 or size < 1:
+            raise ValueError(f"Ring buffer needs positive resolution and size, got {seconds}s x {size}")
+        self.seconds = seconds
+        self.size = size
+        self.metrics = tuple(metrics)
+        width = len(self.metrics)
+        self.slots = array('q', [-1]) * size
+        self.counts = array('l', [0]) * size
+        self.sums = array('d', [0.0]) * (size * width)
+        self.mins = array('d', [0.0]) * (size * width)
+        self.maxs = array('d', [0.0]) * (size * width)
+
+    def _slot(self, interval: int) -> int:
+        """Ячейка интервала; ячейка с более старым интервалом очищается"""
+        slot = interval % self.size
+        if self.slots[slot] != interval:
+            self.slots[slot] = interval
+            self.counts[slot] = 0
+            base = slot * len(self.metrics)
+            for offset in range(base, base + len(self.metrics)):
+                self.sums[offset] = self.mins[offset] = self.maxs[offset] = 0.0
+        return slot
+
+    def add(self, timestamp: float, values: Dict[str, float]):
+        interval = int(timestamp // self.seconds)
+        slot = interval % self.size
+        if self.slots[slot] > interval:
+            return  # Интервал старше окна кольца
+        slot = self._slot(interval)
+        first = self.counts[slot] == 0
+        self.counts[slot] += 1
+        base = slot * len(self.metrics)
+        for offset, metric in enumerate(self.metrics, base):
+            value = float(values.get(metric, 0) or 0)
+            self.sums[offset] += value
+            if first or value < self.mins[offset]:
+                self.mins[offset] = value
+            if first or value > self.maxs[offset]:
+                self.maxs[offset] = value
+
+    def buckets(self, now: Optional[float] = None, last: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Заполненные ячейки по возрастанию времени: {'start', 'count', metric: {'avg','min','max','sum'}}"""
+        newest = max(self.slots) if now is None else int(now // self.seconds)
+        oldest = newest - (self.size if last is None else min(last, self.size)) + 1
+        result = []
+        for interval in range(oldest, newest + 1):
+            slot = interval % self.size
+            if self.slots[slot] != interval or not self.counts[slot]:
+                continue
+            count = self.counts[slot]
+            base = slot * len(self.metrics)
+            bucket = {'start': interval * self.seconds, 'count': count}
+            for offset, metric in enumerate(self.metrics, base):
+                bucket[metric] = {'avg': self.sums[offset] / count, 'min': self.mins[offset],
+                                  'max': self.maxs[offset], 'sum': self.sums[offset]}
+            result.append(bucket)
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        width = len(self.metrics)
+        buckets = []
+        for slot in range(self.size):
+            if self.slots[slot] < 0 or not self.counts[slot]:
+                continue
+            base = slot * width
+            buckets.append([self.slots[slot], self.counts[slot],
+                            [round(v, 3) for v in self.sums[base:base + width]],
+                            [round(v, 3) for v in self.mins[base:base + width]],
+                            [round(v, 3) for v in self.maxs[base:base + width]]])
+        return {'seconds': self.seconds, 'size': self.size, 'buckets': sorted(buckets)}
+
+    def load(self, data: Dict[str, Any], metrics: List[str]):
+        """Восстанавливает ячейки из to_dict (метрики сопоставляются по имени)"""
+        positions = [(self.metrics.index(name), index) for index, name in enumerate(metrics)
+                     if name in self.metrics]
+        width = len(self.metrics)
+        for interval, count, sums, mins, maxs in data.get('buckets', []):
+            interval = int(interval)
+            if self.slots[interval % self.size] > interval:
+                continue
+            slot = self._slot(interval)
+            self.counts[slot] = int(count)
+            base = slot * width
+            for mine, theirs in positions:
+                self.sums[base + mine] = sums[theirs]
+                self.mins[base + mine] = mins[theirs]
+                self.maxs[base + mine] = maxs[theirs]
+
+
+class RollupStore:
+    """Минутные, часовые и суточные кольца метрик измерений"""
+
+    def __init__(self, sizes: Optional[Dict[str, int]] = None):
+        sizes = sizes or {}
+        self.rings = {name: RingBuffer(seconds, sizes.get(name, size))
+                      for name, seconds, size in RESOLUTIONS}
+        # Последние счетчики пакетов трекеров: скорость считается по разнице
+        self.last_packets: Dict[str, List[float]] = {}
+
+    @classmethod
+    def from_config(cls, configuration: Dict[str, Any]) -> 'RollupStore':
+        return cls(configuration.get('rollups', {}))
+
+    def add(self, timestamp: float, values: Dict[str, float]):
+        for ring in self.rings.values():
+            ring.add(timestamp, values)
+
+    def _packet_rate(self, name: str, timestamp: float, total: int) -> float:
+        previous = self.last_packets.get(name)
+        self.last_packets[name] = [timestamp, total]
+        if not previous or timestamp <= previous[0]:
+            return 0.0
+        # Сброс счетчика трекера (перезапуск): весь текущий объем пришелся на интервал
+        delta = total - previous[1] if total >= previous[1] else total
+        return delta / (timestamp - previous[0])
+
+    def record_measurement(self, timestamp: float, current_data: Dict[str, Any], duration: float,
+                           changed: bool, totals: Optional[Dict[str, int]] = None) -> Dict[str, float]:
+        """
+        Добавляет измерение collect_system_data; возвращает записанные значения
+        totals - счетчики соединений и портов до усечения списков (иначе считаются по current_data)
+        """
+        if totals is None:
+            totals = Counter()
+            connections = current_data.get('connections', {})
+            for direction in ('incoming', 'outgoing'):
+                for connection in connections.get(direction, []):
+                    count_connection(totals, direction, connection)
+            totals['tcp_listen_ports'] = len(current_data.get('tcp_ports', []))
+            totals['udp_listen_ports'] = len(current_data.get('udp_ports', []))
+        values = {metric: totals.get(metric, 0) for metric in METRICS}
+        values['udp_packets_rate'] = self._packet_rate(
+            'udp', timestamp, (current_data.get('udp_traffic') or {}).get('total_packets', 0))
+        values['icmp_packets_rate'] = self._packet_rate(
+            'icmp', timestamp, (current_data.get('icmp_traffic') or {}).get('total_packets', 0))
+        values['collection_seconds'] = duration
+        values['changed'] = 1 if changed else 0
+        self.add(timestamp, values)
+        return values
+
+    def series(self, resolution: str, metric: str, stat: str = 'avg',
+               now: Optional[float] = None, last: Optional[int] = None) -> List[List[Any]]:
+        """[[начало интервала (epoch), значение], ...] для графиков"""
+        return [[bucket['start'], bucket[metric][stat]]
+                for bucket in self.rings[resolution].buckets(now, last)]
+
+    def by_hour_of_day(self, metric: str, stat: str = 'avg') -> Dict[str, float]:
+        """Значение метрики по часам суток ('00'..'23') из часового кольца"""
+        totals: Dict[str, List[float]] = {}
+        for bucket in self.rings['hour'].buckets():
+            hour = datetime.fromtimestamp(bucket['start']).strftime('%H')
+            total = totals.setdefault(hour, [0.0, 0])
+            total[0] += bucket[metric]['sum'] if stat == 'sum' else bucket[metric]['avg']
+            total[1] += 1
+        return {hour: (value if stat == 'sum' else value / n) for hour, (value, n) in totals.items()}
+
+    def summary(self, metric: str) -> Dict[str, float]:
+        """Число измерений, среднее, минимум и максимум метрики за все суточное кольцо"""
+        buckets = self.rings['day'].buckets()
+        count = sum(bucket['count'] for bucket in buckets)
+        if not count:
+            return {'count': 0, 'sum': 0, 'avg': 0, 'min': 0, 'max': 0}
+        total = sum(bucket[metric]['sum'] for bucket in buckets)
+        return {'count': count, 'sum': total, 'avg': total / count,
+                'min': min(bucket[metric]['min'] for bucket in buckets),
+                'max': max(bucket[metric]['max'] for bucket in buckets)}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'metrics': list(METRICS),
+                'rings': {name: ring.to_dict() for name, ring in self.rings.items()},
+                'last_packets': self.last_packets}
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]], sizes: Optional[Dict[str, int]] = None) -> 'RollupStore':
+        store = cls(sizes)
+        data = data or {}
+        metrics = data.get('metrics', list(METRICS))
+        for name, ring_data in data.get('rings', {}).items():
+            ring = store.rings.get(name)
+            if ring is not None and ring_data.get('seconds') == ring.seconds:
+                ring.load(ring_data, metrics)
+        store.last_packets = {name: list(value) for name, value in data.get('last_packets', {}).items()}
+        return store
+
+
+if __name__ == "__main__":
+    import time
+    import tracemalloc
+
+    # Демон, работающий месяц с измерением раз в 30 секунд
+    tracemalloc.start()
+    store = RollupStore()
+    started = time.perf_counter()
+    begin = 1700000000
+    for i in range(30 * 24 * 120):
+        timestamp = begin + i * 30
+        store.add(timestamp, {'incoming': 100 + i % 50, 'outgoing': 200, 'tcp': 250, 'udp': 50,
+                              'collection_seconds': 1.5 + (i % 7) / 10, 'changed': i % 3 == 0})
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    print(f"⏱️ {30 * 24 * 120} measurements in {elapsed:.2f}s ({elapsed / (30 * 24 * 120) * 1e6:.1f} us each)")
+    print(f"💾 Memory: {current / 1024:.0f} KB (peak {peak / 1024:.0f} KB)")
+    print(f"📈 Last 5 hours: {store.series('hour', 'incoming')[-5:]}")
+    print(f"⏱️ Collection time: {store.summary('collection_seconds')}")
+    state = store.to_dict()
+    print(f"📦 Serialized buckets: {sum(len(ring['buckets']) for ring in state['rings'].values())}, "
+          f"restored equal: {RollupStore.from_dict(state).to_dict() == state}")
@@ -16,7 +16,7 @@ from typing import Dict, List, Optional, Set
 from dataclasses import dataclass, asdict
 from collections import defaultdict
 from cryptography.fernet import Fernet
-import ipaddress
+from address_classifier import get_address_classifier, split_host_port
 
 
 @dataclass
@@ -141,12 +141,14 @@ class SecurityValidator:
         """Маскирует приватные IP адреса"""
         try:
             # Извлекаем IP из строки вида "192.168.1.1:8080"
-            ip_part = ip_str.split(':')[0] if ':' in ip_str else ip_str
-            ip = ipaddress.ip_address(ip_part)
+            ip_part, _ = split_host_port(ip_str)
+            info = get_address_classifier().classify(ip_part)
+            if info.category == 'invalid':
+                return '[INVALID_IP]'
             
-            if ip.is_private:
+            if info.category in ('private', 'local', 'loopback', 'link_local'):
                 # Маскируем последний октет для IPv4
-                if ip.version == 4:
+                if info.version == 4:
                     masked = '.'.join(ip_part.split('.')[:-1] + ['XXX'])
                 else:
                     masked = '[IPv6_PRIVATE]'
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Синтез правил групп безопасности
+Сворачивает адреса интеграций в минимальные покрывающие CIDR с ограничением
+на ширину сети и долю "лишних" (не наблюдавшихся) разрешенных адресов,
+объединяет порты в диапазоны. Работает за O(n log n) от числа потоков:
+группировка по словарям, агрегация соседних сетей через кучу
+"""
+
+import heapq
+import ipaddress
+from typing import Dict, List, Any, Optional, Tuple
+
+from ip_database import ip_to_int
+
+WIDTH = {4: 32, 6: 128}
+
+# При агрегации IPv6 единицей считается подсеть /64 (адреса хостов внутри нее случайны)
+V6_SUBNET_PREFIX = 64
+
+DEFAULT_MAX_PREFIX = {4: 20, 6: 48}
+DEFAULT_MAX_CIDRS_PER_RULE = 8
+DEFAULT_MAX_OVER_PERMIT_RATIO = 0.5
+
+
+def _version_map(values: Optional[Dict[Any, int]], default: Dict[int, int]) -> Dict[int, int]:
+    """Приводит словарь вида {"v4": 20, "v6": 48} к {4: 20, 6: 48}"""
+    result = dict(default)
+    for version, value in (values or {}).items():
+        result[int(str(version).lstrip('v'))] = int(value)
+    return result
+
+
+def _exact_blocks(values: List[int], width: int) -> List[Tuple[int, int]]:
+    """Разбивает отсортированные уникальные адреса на минимальный набор точных CIDR блоков"""
+    blocks = []
+    i = 0
+    n = len(values)
+    while i < n:
+        # Непрерывный отрезок адресов [start, end]
+        start = end = values[i]
+        i += 1
+        while i < n and values[i] == end + 1:
+            end = values[i]
+            i += 1
+        while start <= end:
+            size = (start & -start) if start else 1 << width
+            while start + size - 1 > end:
+                size >>= 1
+            blocks.append((start, width - size.bit_length() + 1))
+            start += size
+    return blocks
+
+
+def _aggregate(blocks: List[Tuple[int, int]], width: int, max_prefix: int,
+               max_blocks: int, max_ratio: float) -> Tuple[List[Tuple[int, int]], int]:
+    """
+    Жадно объединяет соседние блоки в общую надсеть, начиная с самых "дешевых"
+    (меньше всего лишних адресов), пока блоков больше max_blocks.
+    Надсети шире max_prefix не создаются, доля лишних адресов среди разрешенных
+    не превышает max_ratio. Возвращает (блоки, количество лишних адресов)
+    """
+    n = len(blocks)
+    if n <= max_blocks:
+        return blocks, 0
+    observed = sum(1 << (width - prefix) for _, prefix in blocks)
+
+    starts = [b[0] for b in blocks]
+    prefixes = [b[1] for b in blocks]
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    nxt[-1] = -1
+    alive = [True] * n
+    count = n
+    used = 0
+
+    def candidate(i):
+        """Стоимость объединения блока i со следующим: (лишние адреса, надсеть, границы поглощения)"""
+        j = nxt[i]
+        if i < 0 or j < 0:
+            return None
+        common = width - (starts[i] ^ starts[j]).bit_length()
+        prefix = min(prefixes[i], prefixes[j], common)
+        if prefix < max_prefix:
+            return None
+        shift = width - prefix
+        start = (starts[i] >> shift) << shift
+        end = start + (1 << shift) - 1
+        # Блоки, попадающие в надсеть, целиком в ней содержатся (CIDR не пересекаются)
+        lo, hi = i, j
+        while prev[lo] >= 0 and starts[prev[lo]] >= start:
+            lo = prev[lo]
+        while nxt[hi] >= 0 and starts[nxt[hi]] <= end:
+            hi = nxt[hi]
+        absorbed = 0
+        k = lo
+        while True:
+            absorbed += 1 << (width - prefixes[k])
+            if k == hi:
+                break
+            k = nxt[k]
+        return (1 << shift) - absorbed, start, prefix, lo, hi
+
+    heap = []
+    for i in range(n - 1):
+        found = candidate(i)
+        if found:
+            heap.append((found[0], i, nxt[i]))
+    heapq.heapify(heap)
+
+    while heap:
+        cost, i, j = heapq.heappop(heap)
+        if not (alive[i] and alive[j] and nxt[i] == j):
+            continue
+        found = candidate(i)
+        if found is None:
+            continue
+        if found[0] != cost:
+            # Соседи изменились после постановки в очередь - пересчитываем стоимость
+            heapq.heappush(heap, (found[0], i, j))
+            continue
+        if cost and count <= max_blocks:
+            break
+        if used + cost > max_ratio * (observed + used + cost):
+            break
+
+        cost, start, prefix, lo, hi = found
+        k = lo
+        removed = 0
+        while k != hi:
+            k = nxt[k]
+            alive[k] = False
+            removed += 1
+        starts[lo] = start
+        prefixes[lo] = prefix
+        nxt[lo] = nxt[hi]
+        if nxt[lo] >= 0:
+            prev[nxt[lo]] = lo
+        count -= removed
+        used += cost
+
+        for left in (prev[lo], lo):
+            found = candidate(left)
+            if found:
+                heapq.heappush(heap, (found[0], left, nxt[left]))
+
+    result = []
+    k = next(i for i in range(n) if alive[i] and prev[i] < 0)
+    while k >= 0:
+        result.append((starts[k], prefixes[k]))
+        k = nxt[k]
+    return result, used
+
+
+def merge_port_ranges(ports) -> List[Tuple[int, int]]:
+    """Объединяет номера портов в непрерывные диапазоны [(начало, конец), ...]"""
+    ranges = []
+    for port in sorted(set(ports)):
+        if ranges and port == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], port)
+        else:
+            ranges.append((port, port))
+    return ranges
+
+
+def format_port_ranges(ranges: List[Tuple[int, int]], extra: Optional[List[str]] = None) -> str:
+    """Форматирует диапазоны портов: '80,443,8000-8010'"""
+    parts = [str(lo) if lo == hi else f"{lo}-{hi}" for lo, hi in ranges]
+    parts.extend(sorted(extra or []))
+    return ','.join(parts)
+
+
+class RuleSynthesizer:
+    """
+    Накопитель потоков (направление, протокол, процесс, адрес, порт) и синтезатор правил
+    1. потоки группируются по (направление, протокол, процесс, порт) в множества адресов
+    2. адреса каждой группы сворачиваются в CIDR в пределах бюджета
+    3. группы с одинаковым набором CIDR объединяются, их порты - в диапазоны
+    """
+
+    def __init__(self, max_prefix: Optional[Dict[Any, int]] = None,
+                 max_cidrs_per_rule: int = DEFAULT_MAX_CIDRS_PER_RULE,
+                 max_over_permit_ratio: float = DEFAULT_MAX_OVER_PERMIT_RATIO):
+        self.max_prefix = _version_map(max_prefix, DEFAULT_MAX_PREFIX)
+        self.max_cidrs_per_rule = max(1, int(max_cidrs_per_rule))
+        self.max_over_permit_ratio = min(max(float(max_over_permit_ratio), 0.0), 1.0)
+        # (direction, protocol, process, port) -> {4: set, 6: set, 'other': set}
+        self._groups: Dict[Tuple[str, str, str, Any], Dict[Any, set]] = {}
+        self.flows = 0
+
+    @classmethod
+    def from_config(cls, configuration: Optional[Dict[str, Any]] = None) -> 'RuleSynthesizer':
+        """Создает синтезатор с параметрами из конфигурации (security_rules)"""
+        if configuration is None:
+            from analyzer_config import get_config
+            configuration = get_config()
+        settings = configuration.get('security_rules') or {}
+        return cls(max_prefix=settings.get('max_prefix'),
+                   max_cidrs_per_rule=settings.get('max_cidrs_per_rule', DEFAULT_MAX_CIDRS_PER_RULE),
+                   max_over_permit_ratio=settings.get('max_over_permit_ratio', DEFAULT_MAX_OVER_PERMIT_RATIO))
+
+    def add_flow(self, direction: str, protocol: str, process: str, remote_ip: str, port: Any):
+        """Добавляет поток; некорректные адреса (unknown, *) сохраняются как есть"""
+        port_str = str(port)
+        port_key = int(port_str) if port_str.isdigit() else port_str
+        key = (direction, protocol, process, port_key)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = {4: set(), 6: set(), 'other': set()}
+        try:
+            version, value = ip_to_int(remote_ip)
+            group[version].add(value)
+        except (ValueError, AttributeError):
+            group['other'].add(remote_ip or 'unknown')
+        self.flows += 1
+
+    def _collapse(self, group: Dict[Any, set]) -> Tuple[Tuple[str, ...], int]:
+        """
+        Сворачивает адреса группы в CIDR; возвращает (сети, лишние адреса)
+        Лишние адреса IPv6 считаются в подсетях /64
+        """
+        cidrs = []
+        over_permit = 0
+        for version in (4, 6):
+            values = group[version]
+            if not values:
+                continue
+            width = WIDTH[version]
+            shift = 0
+            if version == 6 and len(values) > self.max_cidrs_per_rule:
+                # Много IPv6 адресов - агрегируем с точностью до подсети /64
+                shift = width - V6_SUBNET_PREFIX
+                values = {value >> shift for value in values}
+                width = V6_SUBNET_PREFIX
+            blocks = _exact_blocks(sorted(values), width)
+            blocks, used = _aggregate(blocks, width, self.max_prefix[version], self.max_cidrs_per_rule,
+                                      self.max_over_permit_ratio)
+            over_permit += used
+            network_class = ipaddress.IPv4Network if version == 4 else ipaddress.IPv6Network
+            cidrs.extend(str(network_class((start << shift, prefix))) for start, prefix in blocks)
+        cidrs.extend(sorted(group['other']))
+        return tuple(cidrs), over_permit
+
+    def synthesize(self) -> List[Dict[str, Any]]:
+        """Возвращает список правил, отсортированный по направлению, протоколу и процессу"""
+        merged: Dict[Tuple[str, str, str, Tuple[str, ...]], Dict[str, Any]] = {}
+        for (direction, protocol, process, port), group in self._groups.items():
+            cidrs, over_permit = self._collapse(group)
+            key = (direction, protocol, process, cidrs)
+            entry = merged.get(key)
+            if entry is None:
+                entry = merged[key] = {'ports': [], 'named_ports': [], 'hosts': set(), 'over_permit': 0}
+            if isinstance(port, int):
+                entry['ports'].append(port)
+            else:
+                entry['named_ports'].append(port)
+            for version in (4, 6):
+                entry['hosts'].update((version, value) for value in group[version])
+            entry['hosts'].update(group['other'])
+            entry['over_permit'] = max(entry['over_permit'], over_permit)
+
+        rules = []
+        for (direction, protocol, process, cidrs), entry in merged.items():
+            port_ranges = merge_port_ranges(entry['ports'])
+            rules.append({
+                'direction': direction,
+                'protocol': protocol,
+                'process': process,
+                'cidrs': list(cidrs),
+                'port_ranges': port_ranges,
+                'port': format_port_ranges(port_ranges, entry['named_ports']),
+                'hosts': len(entry['hosts']),
+                'over_permit': entry['over_permit'],
+            })
+        rules.sort(key=lambda r: (r['direction'], r['protocol'], r['process'],
+                                  r['port_ranges'][0] if r['port_ranges'] else (-1, -1), r['port']))
+        return rules
+
+
+def synthesize_rules(flows, configuration: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Синтезирует правила из итерируемого набора (direction, protocol, process, remote_ip, port)"""
+    synthesizer = RuleSynthesizer.from_config(configuration)
+    for flow in flows:
+        synthesizer.add_flow(*flow)
+    return synthesizer.synthesize()
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    random.seed(1)
+    demo_flows = []
+    for _ in range(10000):
+        pool = random.choice(['52.216.', '54.231.', '3.5.'])
+        address = f"{pool}{random.randint(0, 15)}.{random.randint(1, 254)}"
+        demo_flows.append(('outgoing', 'TCP', 'aws', address, 443))
+    demo_flows += [('outgoing', 'TCP', 'java', '10.0.0.5', port) for port in range(8080, 8090)]
+
+    started = time.perf_counter()
+    demo_rules = synthesize_rules(demo_flows, configuration={})
+    elapsed = time.perf_counter() - started
+    for demo_rule in demo_rules:
+        print(f"{demo_rule['process']:>6} {demo_rule['protocol']} {demo_rule['port']:<12} "
+              f"{', '.join(demo_rule['cidrs'])} (адресов: {demo_rule['hosts']}, лишних: {demo_rule['over_permit']})")
+    print(f"⏱️ {len(demo_flows)} потоков -> {len(demo_rules)} правил за {elapsed * 1000:.1f} мс")
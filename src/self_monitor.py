@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Контроль собственной нагрузки анализатора
+SelfMonitor измеряет процессорное время (включая дочерние lsof/docker/iptables)
+и RSS собственного процесса за каждый цикл измерения. AdaptiveThrottle
+сравнивает их с бюджетом и по одному шагу включает ограничения: отключение
+обратного DNS, отключение lsof, выборку потоков, удлинение интервала.
+После recover_after спокойных измерений последнее ограничение снимается.
+Каждое решение записывается в отчет (self_monitor.decisions)
+"""
+
+import os
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional
+
+from profiling import lazy_import
+
+psutil = lazy_import('psutil')
+
+# Порядок включения ограничений: от дешевых для полноты отчета к заметным
+DEFAULT_ACTIONS = ('reverse_dns', 'lsof', 'sampling', 'interval')
+DEFAULT_RECOVER_AFTER = 5
+DEFAULT_HEADROOM = 0.5
+DEFAULT_MAX_DECISIONS = 50
+
+
+class SelfMonitor:
+    """Процессорное время и память собственного процесса между вызовами sample()"""
+
+    def __init__(self, process: Optional['psutil.Process'] = None):
+        self.process = process or psutil.Process(os.getpid())
+        # Первый цикл считается от запуска процесса (включая импорт модулей)
+        self._last_wall = self.process.create_time()
+        self._last_cpu = 0.0
+
+    def _cpu_seconds(self) -> float:
+        times = self.process.cpu_times()
+        return (times.user + times.system +
+                getattr(times, 'children_user', 0.0) + getattr(times, 'children_system', 0.0))
+
+    def sample(self, now: Optional[float] = None) -> Dict[str, float]:
+        """Нагрузка за цикл с прошлого вызова; cpu_percent - доля одного ядра"""
+        now = time.time() if now is None else now
+        cpu = self._cpu_seconds()
+        cpu_delta = max(0.0, cpu - self._last_cpu)
+        wall_delta = max(now - self._last_wall, 1e-6)
+        self._last_cpu, self._last_wall = cpu, now
+        return {
+            'cpu_seconds': round(cpu_delta, 3),
+            'wall_seconds': round(wall_delta, 3),
+            'cpu_percent': round(cpu_delta / wall_delta * 100, 2),
+            'rss_mb': round(self.process.memory_info().rss / (1024 * 1024), 1),
+        }
+
+
+class AdaptiveThrottle:
+    """Включает и снимает ограничения по бюджетам cpu_percent / rss_mb (0 - без бюджета)"""
+
+    def __init__(self, cpu_percent: float = 0, rss_mb: float = 0, actions: Iterable[str] = DEFAULT_ACTIONS,
+                 recover_after: int = DEFAULT_RECOVER_AFTER, headroom: float = DEFAULT_HEADROOM,
+                 max_decisions: int = DEFAULT_MAX_DECISIONS):
+        unknown = set(actions) - set(DEFAULT_ACTIONS)
+        if unknown:
+            raise ValueError(f"Unknown throttle actions: {sorted(unknown)}")
+        self.cpu_percent = cpu_percent
+        self.rss_mb = rss_mb
+        self.actions = tuple(actions)
+        self.recover_after = recover_after
+        self.headroom = headroom
+        self.active: List[str] = []
+        self.decisions = deque(maxlen=max_decisions)
+        self.calm = 0
+
+    @classmethod
+    def from_config(cls, configuration: Dict[str, Any]) -> 'AdaptiveThrottle':
+        settings = configuration.get('self_monitor', {})
+        return cls(settings.get('cpu_percent', 0), settings.get('rss_mb', 0),
+                   settings.get('actions', DEFAULT_ACTIONS), settings.get('recover_after', DEFAULT_RECOVER_AFTER),
+                   settings.get('headroom', DEFAULT_HEADROOM))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.cpu_percent or self.rss_mb)
+
+    def _breaches(self, sample: Dict[str, float], scale: float = 1.0) -> List[str]:
+        reasons = []
+        if self.cpu_percent and sample['cpu_percent'] > self.cpu_percent * scale:
+            reasons.append(f"cpu {sample['cpu_percent']}% > {self.cpu_percent * scale:g}%")
+        if self.rss_mb and sample['rss_mb'] > self.rss_mb * scale:
+            reasons.append(f"rss {sample['rss_mb']} MB > {self.rss_mb * scale:g} MB")
+        return reasons
+
+    def observe(self, sample: Dict[str, float], timestamp: str = '') -> Optional[Dict[str, Any]]:
+        """Учитывает цикл; возвращает решение (throttle/relax) или None, если ограничения не меняются"""
+        if not self.enabled:
+            return None
+        reasons = self._breaches(sample)
+        decision = None
+        if reasons:
+            self.calm = 0
+            pending = [action for action in self.actions if action not in self.active]
+            if pending:
+                # Память растет со списками соединений: при превышении только RSS сначала выборка
+                memory_only = all(reason.startswith('rss') for reason in reasons)
+                action = 'sampling' if memory_only and 'sampling' in pending else pending[0]
+                self.active.append(action)
+                decision = {'decision': 'throttle', 'action': action, 'reasons': reasons}
+        elif self.active and not self._breaches(sample, self.headroom):
+            self.calm += 1
+            if self.calm >= self.recover_after:
+                self.calm = 0
+                action = self.active.pop()
+                decision = {'decision': 'relax', 'action': action,
+                            'reasons': [f"{self.recover_after} measurements under {self.headroom:.0%} of budget"]}
+        else:
+            self.calm = 0
+        if decision is not None:
+            decision.update(timestamp=timestamp, cpu_percent=sample['cpu_percent'], rss_mb=sample['rss_mb'],
+                            active=list(self.active))
+            self.decisions.append(decision)
+        return decision
+
+    def apply(self, configuration: Dict[str, Any], base: Dict[str, Any]) -> float:
+        """
+        Строит настройки сборщиков и выборки из исходных (base) с учетом активных
+        ограничений; возвращает множитель интервала между измерениями
+        """
+        settings = configuration.get('self_monitor', {})
+        collectors = dict(base['collectors'])
+        if 'reverse_dns' in self.active:
+            collectors['reverse_dns'] = False
+        if 'lsof' in self.active:
+            collectors['lsof'] = False
+        sampling = dict(base['flow_sampling'])
+        if 'sampling' in self.active:
+            if sampling['mode'] == 'truncate':
+                sampling.update(mode='sample', interval=settings.get('sample_interval', 10))
+            elif sampling['mode'] == 'sample':
+                sampling['interval'] = sampling['interval'] * 2
+            elif sampling['mode'] == 'topk':
+                sampling['top_k'] = max(1, sampling['top_k'] // 2)
+        configuration['collectors'] = collectors
+        configuration['flow_sampling'] = sampling
+        return settings.get('interval_factor', 2) if 'interval' in self.active else 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'budgets': {'cpu_percent': self.cpu_percent, 'rss_mb': self.rss_mb},
+                'active': list(self.active), 'calm': self.calm, 'decisions': list(self.decisions)}
+
+    def load(self, data: Optional[Dict[str, Any]]):
+        """Восстанавливает активные ограничения и журнал решений прошлого запуска"""
+        data = data or {}
+        # Без бюджета ограничения прошлого запуска не действуют
+        self.active = [action for action in data.get('active', []) if action in self.actions] if self.enabled else []
+        self.calm = int(data.get('calm', 0))
+        self.decisions.extend(data.get('decisions', []))
+
+
+if __name__ == "__main__":
+    monitor = SelfMonitor()
+    throttle = AdaptiveThrottle(cpu_percent=20, recover_after=2)
+    configuration = {'self_monitor': {'sample_interval': 10, 'interval_factor': 2}}
+    base = {'collectors': {'reverse_dns': True, 'lsof': True},
+            'flow_sampling': {'mode': 'truncate', 'interval': 100, 'top_k': 50}}
+    monitor.sample()
+    # Три нагруженных цикла, затем три спокойных
+    for cycle in range(6):
+        started = time.time()
+        if cycle < 3:
+            while time.time() - started < 0.2:
+                sum(range(10000))
+        else:
+            time.sleep(0.2)
+        sample = monitor.sample()
+        decision = throttle.observe(sample, f"cycle {cycle}")
+        factor = throttle.apply(configuration, base)
+        print(f"📈 cycle {cycle}: cpu {sample['cpu_percent']}%, rss {sample['rss_mb']} MB, "
+              f"active {throttle.active}, interval x{factor}")
+        if decision:
+            print(f"   🚦 {decision['decision']} {decision['action']}: {', '.join(decision['reasons'])}")
+    print(f"⚙️ Collectors: {configuration['collectors']}, sampling: {configuration['flow_sampling']}")
@@ -13,6 +13,7 @@ from datetime import datetime
 import socket
 import platform
 from analyzer_utils import execute_command
+from capture import captured
 
 class UDPTrackerMacOS:
     """UDP трекер для macOS"""
@@ -407,6 +408,8 @@ class UDPTrackerMacOS:
                 'packet_count': packet_count,
                 'first_seen': first_seen_str,
                 'last_seen': last_seen_str,
+                'first_seen_ts': int(first_seen),
+                'last_seen_ts': int(last_seen),
                 'is_synthetic': is_synthetic
             }
             
@@ -451,6 +454,7 @@ class UDPTrackerMacOS:
             'network_activity': self.get_network_activity()
         }
 
+@captured('udp_tracker', default=lambda debug=False: {})
 def get_udp_information_macos(debug=False):
     """Функция для интеграции в основной анализатор (macOS)"""
     if debug:
@@ -11,6 +11,10 @@ from datetime import datetime
 import socket
 import os
 from analyzer_utils import execute_command
+from capture import captured
+from profiling import lazy_import
+
+psutil = lazy_import('psutil')
 
 class UDPTracker:
     """Универсальный трекер UDP трафика"""
@@ -89,7 +93,7 @@ class UDPTracker:
         """Получает UDP соединения через /proc/net/udp"""
         try:
             connections = []
-            with open('/proc/net/udp', 'r') as f:
+            with open(os.path.join(psutil.PROCFS_PATH, 'net', 'udp'), 'r') as f:
                 lines = f.readlines()[1:]  # Пропускаем заголовок
             
             for line in lines:
@@ -209,7 +213,7 @@ class UDPTracker:
     def monitor_network_activity(self):
         """Мониторит сетевую активность через изменения в статистике"""
         try:
-            with open('/proc/net/dev', 'r') as f:
+            with open(os.path.join(psutil.PROCFS_PATH, 'net', 'dev'), 'r') as f:
                 lines = f.readlines()[2:]  # Пропускаем заголовки
             
             activity = {}
@@ -455,6 +459,7 @@ class UDPTracker:
             'total_local_ports': len(udp_local_ports)
         }
 
+@captured('udp_tracker', default=lambda debug=False: {})
 def get_udp_information(debug=False):
     """Функция для интеграции в основной анализатор"""
     if debug:
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Дисковая очередь выгрузки отчетов в S3 с фоновым потоком
+enqueue() копирует файлы отчета в каталог очереди (снимок: сами отчеты
+перезаписываются следующими измерениями) и сразу возвращается, поэтому цикл
+измерений не ждет S3. Фоновый поток выгружает записи по очереди: успех -
+запись удаляется, ошибка - повтор с экспоненциальной задержкой и случайным
+разбросом. Записи переживают перезапуск (выгружаются следующим запуском),
+размер очереди ограничен: лишние старые записи удаляются. Отчеты кумулятивные,
+поэтому новая запись заменяет ожидающие записи с теми же ключами
+"""
+
+import json
+import os
+import random
+import shutil
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+ENTRY_FILE = 'entry.json'
+
+# Выгрузка записи: [(путь к копии, ключ S3, описание), ...] -> True при полном успехе
+Uploader = Callable[[List[Tuple[str, str, str]]], bool]
+
+
+def backoff_delay(attempts: int, base: float, maximum: float, rng: random.Random = random) -> float:
+    """Задержка перед повтором: base * 2^(attempts-1), не больше maximum, с разбросом 50-100% ("equal jitter")"""
+    delay = min(maximum, base * (2 ** max(0, attempts - 1)))
+    return delay / 2 + rng.uniform(0, delay / 2)
+
+
+class UploadSpool:
+    """Очередь в каталоге directory: подкаталог на запись (файлы + entry.json)"""
+
+    def __init__(self, directory: str, uploader: Uploader, max_bytes: int = 200 * 1024 * 1024,
+                 max_entries: int = 50, base_delay: float = 5.0, max_delay: float = 600.0):
+        self.directory = directory
+        self.uploader = uploader
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {'enqueued': 0, 'uploaded': 0, 'failed_attempts': 0, 'superseded': 0, 'dropped': 0}
+        self._condition = threading.Condition()
+        self._active: Optional[str] = None
+        self._stopping = False
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+        # Недописанные записи прошлого запуска (сбой во время enqueue) не выгружаются
+        for name in os.listdir(directory):
+            if name.startswith('.tmp-'):
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+        self._thread = threading.Thread(target=self._run, name='upload-spool', daemon=True)
+
+    @classmethod
+    def from_config(cls, configuration: Dict, directory: str, uploader: Uploader) -> 'UploadSpool':
+        settings = configuration.get('upload_spool', {})
+        return cls(settings.get('dir') or directory, uploader,
+                   max_bytes=int(settings.get('max_mb', 200) * 1024 * 1024),
+                   max_entries=settings.get('max_entries', 50),
+                   base_delay=settings.get('base_delay', 5.0), max_delay=settings.get('max_delay', 600.0))
+
+    def start(self) -> 'UploadSpool':
+        self._thread.start()
+        return self
+
+    # --- записи на диске ---
+
+    def _entries(self) -> List[Tuple[str, Dict]]:
+        """Записи очереди по порядку постановки: [(имя каталога, entry.json)]"""
+        entries = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name, ENTRY_FILE)
+            if name.startswith('.tmp-') or not os.path.isfile(path):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entries.append((name, json.load(f)))
+            except (OSError, ValueError):
+                continue
+        return entries
+
+    def _save(self, name: str, entry: Dict):
+        path = os.path.join(self.directory, name, ENTRY_FILE)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _remove(self, name: str):
+        shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def _size(self, name: str) -> int:
+        directory = os.path.join(self.directory, name)
+        return sum(os.path.getsize(os.path.join(directory, file)) for file in os.listdir(directory))
+
+    def _superseded(self, name: str, entry: Dict) -> bool:
+        """Есть ли более новая запись, ключи которой покрывают ключи записи name"""
+        keys = {item['key'] for item in entry['files']}
+        return any(other > name and keys <= {item['key'] for item in data['files']}
+                   for other, data in self._entries())
+
+    def pending(self) -> int:
+        return len(self._entries())
+
+    def enqueue(self, files: List[Tuple[str, str, str]], delay: float = 0.0) -> Optional[str]:
+        """
+        Ставит в очередь снимок файлов [(путь, ключ S3, описание)]; выгрузка не раньше
+        чем через delay секунд (разброс по парку хостов). Возвращает имя записи
+        """
+        files = [(path, key, description) for path, key, description in files if os.path.exists(path)]
+        if not files:
+            return None
+        with self._condition:
+            self._sequence += 1
+            name = f"{time.time():017.6f}-{os.getpid()}-{self._sequence:04d}"
+            temp = os.path.join(self.directory, f".tmp-{name}")
+            os.makedirs(temp)
+            stored = []
+            for index, (path, key, description) in enumerate(files):
+                local = f"{index}-{os.path.basename(path)}"
+                shutil.copyfile(path, os.path.join(temp, local))
+                stored.append({'file': local, 'key': key, 'description': description})
+            entry = {'files': stored, 'attempts': 0, 'not_before': time.time() + delay,
+                     'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+            with open(os.path.join(temp, ENTRY_FILE), 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.rename(temp, os.path.join(self.directory, name))
+            self.stats['enqueued'] += 1
+
+            # Кумулятивный отчет заменяет ожидающие записи с теми же ключами
+            keys = {item['key'] for item in stored}
+            entries = self._entries()
+            for other, data in entries:
+                if other != name and other != self._active and {item['key'] for item in data['files']} <= keys:
+                    self._remove(other)
+                    self.stats['superseded'] += 1
+            self._enforce_limits()
+            self._condition.notify_all()
+        return name
+
+    def _enforce_limits(self):
+        """Удаляет самые старые записи сверх max_entries / max_bytes (новая запись сохраняется)"""
+        entries = [name for name, _ in self._entries()]
+        sizes = {name: self._size(name) for name in entries}
+        while len(entries) > 1 and (len(entries) > self.max_entries or sum(sizes[name] for name in entries) > self.max_bytes):
+            oldest = next((name for name in entries if name != self._active), None)
+            if oldest is None or oldest == entries[-1]:
+                break
+            print(f"⚠️ Upload spool over limit, dropping {oldest}")
+            self._remove(oldest)
+            entries.remove(oldest)
+            self.stats['dropped'] += 1
+
+    # --- фоновая выгрузка ---
+
+    def _next_ready(self) -> Tuple[Optional[str], Optional[Dict], float]:
+        """(имя, запись) первой готовой записи или (None, None, секунд до ближайшей)"""
+        now = time.time()
+        wait = None
+        for name, entry in self._entries():
+            if entry['not_before'] <= now:
+                return name, entry, 0.0
+            remaining = entry['not_before'] - now
+            wait = remaining if wait is None else min(wait, remaining)
+        return None, None, wait if wait is not None else 3600.0
+
+    def _upload(self, name: str, entry: Dict) -> bool:
+        directory = os.path.join(self.directory, name)
+        files = [(os.path.join(directory, item['file']), item['key'], item['description']) for item in entry['files']]
+        try:
+            return bool(self.uploader(files))
+        except Exception as e:
+            print(f"⚠️ Upload spool: {name} upload error: {e}")
+            return False
+
+    def run_once(self) -> Optional[bool]:
+        """Выгружает одну готовую запись; None - готовых нет (для тестов и drain)"""
+        with self._condition:
+            name, entry, _ = self._next_ready()
+            if name is None:
+                return None
+            self._active = name
+        try:
+            success = self._upload(name, entry)
+        finally:
+            with self._condition:
+                self._active = None
+                if success:
+                    self._remove(name)
+                    self.stats['uploaded'] += 1
+                elif self._superseded(name, entry):
+                    # Во время выгрузки поставлен более новый снимок тех же ключей:
+                    # повтор перезаписал бы его в S3 устаревшим содержимым
+                    self._remove(name)
+                    self.stats['superseded'] += 1
+                elif os.path.isdir(os.path.join(self.directory, name)):
+                    entry['attempts'] += 1
+                    delay = backoff_delay(entry['attempts'], self.base_delay, self.max_delay)
+                    entry['not_before'] = time.time() + delay
+                    self._save(name, entry)
+                    self.stats['failed_attempts'] += 1
+                    print(f"⚠️ Upload spool: {name} failed (attempt {entry['attempts']}), retry in {delay:.0f}s")
+                self._condition.notify_all()
+        return success
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._stopping:
+                    return
+                name, _, wait = self._next_ready()
+                if name is None:
+                    self._condition.wait(timeout=wait)
+                    continue
+            self.run_once()
+
+    def drain(self, timeout: float) -> bool:
+        """
+        Ждет выгрузки записей, готовых в пределах timeout (задержки расписания
+        сокращаются до нуля); True, если очередь пуста
+        """
+        deadline = time.time() + timeout
+        with self._condition:
+            for name, entry in self._entries():
+                if entry['attempts'] == 0 and entry['not_before'] > time.time():
+                    entry['not_before'] = time.time()
+                    self._save(name, entry)
+            self._condition.notify_all()
+            while self._entries() and time.time() < deadline:
+                self._condition.wait(timeout=min(1.0, max(0.0, deadline - time.time())))
+            return not self._entries()
+
+    def close(self, timeout: float = 0.0) -> bool:
+        """Останавливает поток (после drain(timeout)); невыгруженные записи остаются на диске"""
+        drained = self.drain(timeout) if timeout > 0 else not self._entries()
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread.is_alive():
+            self._thread.join(timeout=max(1.0, timeout))
+        return drained
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    root = tempfile.mkdtemp()
+    report = os.path.join(root, 'report.yaml')
+    outage = {'remaining': 2}
+    uploaded = []
+
+    def flaky_uploader(files):
+        # Первые попытки - недоступный endpoint
+        if outage['remaining'] > 0:
+            outage['remaining'] -= 1
+            raise ConnectionError('endpoint unavailable')
+        uploaded.extend(key for _, key, _ in files)
+        return True
+
+    spool = UploadSpool(os.path.join(root, 'spool'), flaky_uploader, base_delay=0.2, max_delay=1.0).start()
+    started = time.perf_counter()
+    for measurement in range(3):
+        with open(report, 'w') as f:
+            f.write(f"measurements: {measurement + 1}\n")
+        spool.enqueue([(report, 'report.yaml', 'YAML report')])
+    print(f"📥 3 enqueues in {(time.perf_counter() - started) * 1000:.1f} ms, pending {spool.pending()}")
+    drained = spool.close(timeout=10)
+    print(f"☁️ Drained: {drained}, uploaded {uploaded}, stats {spool.stats}")
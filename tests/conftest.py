@@ -0,0 +1,29 @@
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+import S3Client  # noqa: E402
+from analyzer_config import get_config  # noqa: E402
+
+PY_VERSION = {"major": sys.version_info[0], "minor": sys.version_info[1]}
+
+
+@pytest.fixture
+def s3_endpoint():
+    """Локальный S3 (moto server) с отдельным бакетом на тест (состояние moto общее для процесса)"""
+    server_module = pytest.importorskip("moto.server")
+    server = server_module.ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    s3_config = dict(get_config()["s3"], url=f"http://{host}:{port}", user="testing", access_key="testing",
+                     region="us-east-1", bucket=f"analyzer-{uuid.uuid4().hex[:12]}")
+    S3Client.reset_client_cache()
+    S3Client.get_cached_client_s3(s3_config, PY_VERSION).create_bucket(Bucket=s3_config["bucket"])
+    yield s3_config
+    S3Client.reset_client_cache()
+    server.stop()
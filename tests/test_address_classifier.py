@@ -0,0 +1,60 @@
+import ipaddress
+import random
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from address_classifier import AddressClassifier, RadixTree, split_host_port  # noqa: E402
+
+
+def test_radix_tree_longest_match_matches_linear_scan():
+    random.seed(7)
+    tree = RadixTree(32)
+    networks = []
+    for i in range(300):
+        prefix = random.randint(4, 30)
+        network_address = random.randint(0, 2**32 - 1) >> (32 - prefix) << (32 - prefix)
+        net = ipaddress.IPv4Network((network_address, prefix))
+        networks.append((net, i))
+        tree.insert(int(net.network_address), net.prefixlen, i)
+    for _ in range(2000):
+        address = ipaddress.IPv4Address(random.randint(0, 2**32 - 1))
+        matches = [(net.prefixlen, i) for net, i in networks if address in net]
+        expected = None
+        if matches:
+            # При одинаковых префиксах побеждает последняя вставка
+            longest = max(m[0] for m in matches)
+            expected = [i for p, i in matches if p == longest][-1]
+        assert tree.longest_match(int(address)) == expected
+
+
+def test_categories_and_zones():
+    classifier = AddressClassifier(
+        zones={"prod": ["10.20.0.0/16"], "partners": ["203.0.113.0/24"]},
+        local_addresses=["127.0.0.1", "::1"],
+    )
+    assert classifier.classify("127.0.0.53").category == "loopback"
+    assert classifier.classify("172.31.1.1").category == "private"
+    assert classifier.classify("172.32.1.1").category == "public"
+    assert classifier.classify("fe80::1").category == "link_local"
+    assert classifier.classify("::ffff:10.20.1.1").zone == "prod"
+    assert classifier.classify("bogus").category == "invalid"
+
+    # Разные зоны - интеграция, одна зона - нет
+    assert classifier.is_integration("10.30.0.1", "10.20.0.5")
+    assert not classifier.is_integration("10.20.9.9", "10.20.0.5")
+    assert classifier.is_integration("203.0.113.10", "10.20.0.5")
+    # Частные адреса вне зон сравниваются по подсети /24
+    assert not classifier.is_integration("192.168.1.20", "192.168.1.5")
+    assert classifier.is_integration("192.168.2.20", "192.168.1.5")
+    assert not classifier.is_integration("224.0.0.251", "10.20.0.5")
+    assert classifier.is_integration("8.8.8.8", "10.20.0.5")
+
+
+def test_split_host_port():
+    assert split_host_port("10.0.0.1:443") == ("10.0.0.1", "443")
+    assert split_host_port("[2001:db8::1]:443") == ("2001:db8::1", "443")
+    assert split_host_port("2001:db8::1:443") == ("2001:db8::1", "443")
+    assert split_host_port("::1") == ("::1", None)
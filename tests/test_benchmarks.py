@@ -0,0 +1,39 @@
+import socket
+import sys
+from pathlib import Path
+
+import psutil
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "benchmarks"))
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from proc_fixtures import build_proc_tree  # noqa: E402
+from run_benchmarks import compare, run_scale  # noqa: E402
+
+
+def test_psutil_reads_synthetic_proc_tree(tmp_path, monkeypatch):
+    summary = build_proc_tree(str(tmp_path), sockets=300, processes=10)
+    monkeypatch.setattr(psutil, "PROCFS_PATH", str(tmp_path))
+    connections = psutil.net_connections(kind="inet")
+    assert len(connections) == sum(summary["sockets"].values()) == 300
+    assert {conn.pid for conn in connections} == set(summary["pids"])
+    assert sum(1 for conn in connections if conn.status == psutil.CONN_LISTEN) == 40
+    ipv6 = [conn for conn in connections if conn.family == socket.AF_INET6]
+    assert ipv6 and ipv6[0].laddr.ip == "2001:db8::5" and ipv6[0].raddr.port == 443
+    assert psutil.Process(summary["pids"][0]).name() == "nginx"
+
+
+def test_run_scale_measures_every_stage_and_detects_regressions():
+    results = run_scale(200, repeat=1)
+    assert psutil.PROCFS_PATH == "/proc"
+    for stage in ("collect.snapshot", "collect.finalize", "collect.udp", "collect.icmp", "store.history",
+                  "analyze.detect_changes", "serialize.netflow", "serialize.yaml", "enhance.report", "render.html"):
+        assert results[stage]["seconds"] > 0 and results[stage]["peak_kb"] > 0
+    assert "current_data" not in results
+
+    baseline = {"200": {"serialize.yaml": {"seconds": 0.01, "peak_kb": 100.0}}}
+    current = {"200": {"serialize.yaml": {"seconds": 0.05, "peak_kb": 110.0}}}
+    regressions = compare(current, baseline, threshold=1.25)
+    assert len(regressions) == 1 and "seconds" in regressions[0]
+    assert compare({"200": {"serialize.yaml": {"seconds": 0.012, "peak_kb": 100.0}}}, baseline) == []
@@ -0,0 +1,136 @@
+import contextlib
+import io
+import os
+import runpy
+import sys
+from pathlib import Path
+
+import psutil
+import yaml
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "benchmarks"))
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from capture import CAPTURE, CaptureSession, count_measurements  # noqa: E402
+from network_info import finalize_result, get_current_connections  # noqa: E402
+from proc_fixtures import build_proc_tree  # noqa: E402
+
+
+def test_session_replays_calls_in_order_per_arguments(tmp_path):
+    session = CaptureSession()
+    calls = []
+
+    @session.captured("lookup", decode=tuple, default=lambda name: ("unknown",))
+    def lookup(name):
+        calls.append(name)
+        return [name, len(calls)]
+
+    @session.captured("outer")
+    def outer():
+        return lookup("nested")
+
+    path = str(tmp_path / "capture.gz")
+    session.record(path, hostname="db1")
+    assert lookup("before") == ["before", 1]  # вне измерения - без записи
+    recorded = []
+    for _ in range(2):
+        session.begin_measurement()
+        result = lookup("db")
+        recorded.append((result[1], lookup("web")[1], lookup("db")[1], outer()[1]))
+        result.append("changed after the call")
+        session.end_measurement()
+    session.close()
+    assert count_measurements(path) == 2
+
+    header = session.replay(path)
+    assert header["hostname"] == "db1" and header["format"] == "glacier-capture"
+    replayed = []
+    for _ in range(2):
+        timestamp = session.begin_measurement()
+        assert session.now() == timestamp
+        first = lookup("db")
+        replayed.append((first[1], lookup("web")[1], lookup("db")[1], outer()[1]))
+        assert first == ("db", recorded[len(replayed) - 1][0])
+        assert lookup("cache") == ("unknown",)
+        session.end_measurement()
+    session.close()
+    assert replayed == recorded
+    assert session.misses == {"lookup": 2}
+    assert len(calls) == 9  # при воспроизведении функции не вызываются
+
+
+def test_replayed_socket_table_gives_same_connections(tmp_path, monkeypatch):
+    build_proc_tree(str(tmp_path / "proc"), sockets=300, processes=8)
+    monkeypatch.setattr(psutil, "PROCFS_PATH", str(tmp_path / "proc"))
+    path = str(tmp_path / "capture.gz")
+
+    def measure():
+        CAPTURE.begin_measurement()
+        snapshot = get_current_connections(False, use_lsof=False)
+        networks = finalize_result({}, snapshot, 1024, [], False, {"mode": "truncate", "max_connections": None},
+                                   collectors={"reverse_dns": False, "lsof": False})
+        CAPTURE.end_measurement()
+        return networks
+
+    try:
+        CAPTURE.record(path, hostname="fixture")
+        recorded = measure()
+        CAPTURE.close()
+        # Воспроизведение не читает /proc
+        monkeypatch.setattr(psutil, "PROCFS_PATH", str(tmp_path / "missing"))
+        CAPTURE.replay(path)
+        replayed = measure()
+    finally:
+        CAPTURE.close()
+    assert sum(len(rows) for rows in recorded["connections"].values()) > 200
+    assert replayed["connections"] == recorded["connections"]
+    assert replayed["tcp"] == recorded["tcp"] and replayed["remote"] == recorded["remote"]
+    assert not CAPTURE.misses
+
+
+def run_replay(path):
+    argv = sys.argv[:]
+    sys.argv = ["glacier.py", "--replay", path, "--no-s3"]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            runpy.run_path(str(ROOT_DIR / "src" / "glacier.py"), run_name="__main__")
+    finally:
+        sys.argv = argv
+    with open(f"{path}.out/fixture_linux_report_analyzer.yaml.legacy", encoding="utf-8") as f:
+        state = yaml.safe_load(f)
+    # Собственная нагрузка процесса воспроизведения (длительность, CPU, память) от прогона к прогону разная
+    for key in ("timings", "self_monitor", "rollups", "session"):
+        state.pop(key)
+    state["changes_stats"].pop("durations")
+    for entry in state["changes_log"]:
+        entry.pop("time")
+    return state
+
+
+def test_replay_is_deterministic_and_leaves_host_state_alone(tmp_path, monkeypatch):
+    build_proc_tree(str(tmp_path / "proc"), sockets=100, processes=4)
+    procfs = psutil.PROCFS_PATH
+    path = str(tmp_path / "capture.gz")
+    try:
+        psutil.PROCFS_PATH = str(tmp_path / "proc")
+        CAPTURE.record(path, hostname="fixture", os={"name": "Linux", "version": "test"})
+        for _ in range(2):
+            CAPTURE.begin_measurement()
+            get_current_connections(False, use_lsof=False)
+            CAPTURE.end_measurement()
+    finally:
+        CAPTURE.close()
+        psutil.PROCFS_PATH = procfs
+
+    # Отчет реального хоста с тем же именем, история и коллектор из окружения не используются
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "fixture_linux_report_analyzer.yaml").write_text("current_state: {}\nchanges_log: []\n"
+                                                                 "total_measurements: 40\n", encoding="utf-8")
+    monkeypatch.setenv("GLACIER_HISTORY_DB", str(tmp_path / "history.sqlite"))
+    monkeypatch.setenv("GLACIER_NETFLOW_COLLECTOR", "127.0.0.1:9")
+    first, second = run_replay(path), run_replay(path)
+    assert first == second
+    assert first["total_measurements"] == 2 and first["current_state"]["connections"]["outgoing"]
+    assert sorted(os.listdir(tmp_path)) == ["capture.gz", "capture.gz.out", "fixture_linux_report_analyzer.yaml",
+                                            "proc"]
@@ -0,0 +1,85 @@
+import sys
+from pathlib import Path
+
+import pytest
+import yaml
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from cardinality import CardinalityTracker, HyperLogLog, merge_cardinality  # noqa: E402
+from ipfix import read_ipfix_report  # noqa: E402
+from netflow_generator import IPFIXReportSink, LegacyReportSink, NetFlowGenerator, YAMLReportSink  # noqa: E402
+from report_enhancer import ReportEnhancer  # noqa: E402
+
+
+def test_sketches_estimate_and_merge_across_precisions():
+    first, second = HyperLogLog(12), HyperLogLog(10)
+    first.update(f"10.0.{i >> 8}.{i & 255}" for i in range(30000))
+    second.update(f"10.0.{i >> 8}.{i & 255}" for i in range(20000, 50000))
+    assert abs(first.count() - 30000) < 30000 * 0.05
+    assert HyperLogLog(12).count() == 0
+
+    restored = HyperLogLog.decode(first.encode())
+    assert restored.registers == first.registers and len(first.encode()) < 6000
+    merged = restored.merge(second)
+    assert merged.precision == 10
+    assert abs(merged.count() - 50000) < 50000 * 0.08
+    with pytest.raises(ValueError):
+        HyperLogLog.decode("hll1:12:bm90IHpsaWI=")
+
+    tracker = CardinalityTracker()
+    for i in range(5000):
+        tracker.add_connection("incoming", {"local": "10.0.0.5:443", "process": "nginx", "protocol": "tcp",
+                                            "remote": {"address": f"198.51.{i >> 8}.{i & 255}:{40000 + i}"}})
+    tracker.add_connection("outgoing", {"local": "10.0.0.5", "process": "kernel/system", "protocol": "icmp",
+                                        "remote": {"address": "*:*"}})
+    summary = tracker.summary()
+    assert summary["unique_processes"] == 2
+    assert abs(summary["port_clients"]["tcp/443"] - 5000) < 5000 * 0.08
+    assert set(summary["process_peers"]) == {"nginx"}
+
+    other = CardinalityTracker()
+    other.add_connection("outgoing", {"process": "curl", "remote": {"address": "[2001:db8::1]:443"}})
+    fleet = merge_cardinality([tracker.to_dict(), None, other.to_dict()])
+    # Повторный отчет того же хоста не меняет сводку парка
+    assert merge_cardinality([fleet.to_dict(), tracker.to_dict()]).to_dict() == fleet.to_dict()
+    assert fleet.summary()["unique_processes"] == 3
+    assert set(fleet.summary()["process_peers"]) == {"nginx", "curl"}
+
+
+def test_sketches_survive_netflow_report_and_feed_enhancer(tmp_path):
+    tracker = CardinalityTracker()
+    for i in range(2000):
+        tracker.add_connection("outgoing", {"process": "envoy", "remote": {"address": f"10.1.{i >> 8}.{i & 255}:8080"}})
+    state = {"hostname": "sketch-host", "cardinality": tracker.to_dict(),
+             "current_state": {"connections": {"incoming": [], "outgoing": [
+                 {"local": "10.0.0.5:40000", "remote": {"address": "10.1.0.1:8080"}, "process": "envoy",
+                  "protocol": "tcp", "count": 1}]}}}
+
+    legacy = LegacyReportSink()
+    NetFlowGenerator().stream_netflow_report(state, [YAMLReportSink(str(tmp_path / "r.yaml")),
+                                                     IPFIXReportSink(str(tmp_path / "r.ipfix")), legacy])
+    with open(tmp_path / "r.yaml", encoding="utf-8") as f:
+        from_yaml = yaml.safe_load(f)["system_information"]["cardinality"]
+    from_ipfix = read_ipfix_report(str(tmp_path / "r.ipfix"))["system_information"]["cardinality"]
+    assert from_yaml == from_ipfix == legacy.result["cardinality"] == tracker.to_dict()
+
+    summary = ReportEnhancer()._create_executive_summary({"connections": state["current_state"]["connections"],
+                                                          "cardinality": from_yaml})
+    assert summary["unique_processes"] == 1
+    assert abs(summary["unique_remote_hosts"] - 2000) < 2000 * 0.05
+    assert abs(summary["peers_per_process"]["envoy"] - 2000) < 2000 * 0.08
+    fallback = ReportEnhancer()._create_executive_summary({"connections": state["current_state"]["connections"]})
+    assert (fallback["unique_processes"], fallback["unique_remote_hosts"]) == (1, 1)
+
+
+def test_html_report_survives_corrupt_sketches(tmp_path):
+    import glacier
+    state = {"hostname": "sketch-host", "cardinality": {"precision": "fourteen", "host": {"peers": 42}},
+             "current_state": {"connections": {"incoming": [], "outgoing": [
+                 {"local": "10.0.0.5:40000", "remote": {"address": "10.1.0.1:8080"}, "process": "envoy",
+                  "protocol": "tcp", "count": 1}]}}}
+    html_file = tmp_path / "report.html"
+    glacier.generate_compact_html_report(state, str(html_file))
+    assert "envoy" in html_file.read_text(encoding="utf-8")
@@ -0,0 +1,77 @@
+import gzip
+import os
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from changes_log import ChangeStatistics, ChangesLog, SpillWriter, iter_spilled_entries  # noqa: E402
+
+
+def make_entry(i):
+    return {'id': i, 'timestamp': f"2025-02-01 {i % 24:02d}:00:00", 'time': 1.0 + i % 3,
+            'changes': {'connections': {}} if i % 2 else {'tcp_ports': {}, 'udp_ports': {}}, 'first_run': i == 0}
+
+
+def test_bounded_log_spills_evicted_entries_to_rotating_gzip(tmp_path):
+    path = str(tmp_path / "changes.jsonl.gz")
+    entries = [make_entry(i) for i in range(3000)]
+    log = ChangesLog(max_entries=50, spill=SpillWriter(path, max_bytes=8 * 1024, backups=2))
+    for entry in entries:
+        log.append(entry)
+        assert len(log) <= 50
+    log.close()
+
+    assert log.to_list() == entries[-50:] and log.spilled == 2950
+    assert sorted(os.listdir(tmp_path)) == ["changes.jsonl.gz", "changes.jsonl.gz.1", "changes.jsonl.gz.2"]
+    assert all(os.path.getsize(tmp_path / name) < 9 * 1024 for name in os.listdir(tmp_path))
+    # Старые ротации удалены, оставшиеся записи идут подряд до первой записи в памяти
+    spilled = list(iter_spilled_entries(path))
+    assert spilled == entries[2950 - len(spilled):2950]
+
+    # Накопительная статистика совпадает с полным проходом по всем записям
+    assert log.statistics.to_dict() == ChangeStatistics.from_entries(entries).to_dict()
+    assert log.statistics.by_category == {'connections': 1500, 'tcp_ports': 1500, 'udp_ports': 1500}
+    assert (log.statistics.durations['min'], log.statistics.durations['max']) == (1.0, 3.0)
+
+
+def test_restart_appends_and_survives_truncated_spill(tmp_path):
+    path = str(tmp_path / "changes.jsonl.gz")
+    first = ChangesLog([make_entry(i) for i in range(12)], max_entries=10, spill=SpillWriter(path))
+    first.close()
+    state = {'changes_log': first.to_list(), 'changes_stats': first.statistics.to_dict()}
+
+    # Следующий запуск восстанавливает журнал и статистику из отчета
+    second = ChangesLog(state['changes_log'], max_entries=10, spill=SpillWriter(path),
+                        statistics=ChangeStatistics.from_dict(state['changes_stats']))
+    second.append(make_entry(12))
+    # Аварийное завершение: gzip член без завершающего блока
+    second.spill._gzip.flush()
+    second.spill._raw.close()
+
+    assert [entry['id'] for entry in iter_spilled_entries(path)] == [0, 1, 2]
+    assert second.statistics.total == 13
+    with gzip.open(path, 'rb') as f:
+        assert f.read(2) == b'{"'
+
+    # Ошибка записи на диск не теряет запись: она остается в памяти, spill отключается
+    def disk_full(entry):
+        raise OSError(28, "No space left on device")
+
+    second.spill.write = disk_full
+    try:
+        second.append(make_entry(13))
+    except OSError:
+        second.spill = None
+    second.append(make_entry(14))
+    assert [entry['id'] for entry in second][-2:] == [13, 14] and len(second) == 10
+    assert second.statistics.total == 15
+
+    # Перезапуск после аварии: оборванный файл уходит в ротацию, новые записи читаются вслед за ним
+    third = SpillWriter(path)
+    third.write(make_entry(100))
+    third.write(make_entry(101))
+    third.close()
+    assert [entry['id'] for entry in iter_spilled_entries(path)] == [0, 1, 2, 100, 101]
+    assert os.path.exists(f"{path}.1")
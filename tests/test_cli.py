@@ -1,9 +1,17 @@
+import gzip
 import runpy
 import sys
+import time
 from io import StringIO
 from contextlib import redirect_stdout
+from pathlib import Path
 import pytest
 
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from history_store import HistoryStore  # noqa: E402
+
 
 def run_cli(args, expect_exit=True):
     argv = sys.argv[:]
@@ -35,3 +43,36 @@ def test_version():
     code, output = run_cli(["-v"])
     assert code == 0
     assert "Glacier v" in output
+
+
+def test_query_subcommand(tmp_path):
+    db = tmp_path / "history.sqlite"
+    code, output = run_cli(["query", "--db", str(db), "--since", "1d"])
+    assert code == 1
+    assert "History database not found" in output and not db.exists()
+
+    store = HistoryStore(str(db))
+    store.record_measurement(time.time(), {"connections": {"outgoing": [
+        {"local": "10.0.0.5:40001", "remote": {"address": "203.0.113.7:443"}, "process": "curl"}]}}, {})
+    store.close()
+    code, output = run_cli(["query", "--db", str(db), "--since", "1d"])
+    assert code == 0
+    assert "203.0.113.7:443" in output and "1 rows" in output
+
+
+def test_replay_rejects_non_capture_file(tmp_path, capsys):
+    report = tmp_path / "report.gz"
+    with gzip.open(report, "wt") as f:
+        f.write('{"hostname": "db1"}\n')
+    code, _ = run_cli(["--replay", str(report)])
+    assert code == 2
+    assert "not a glacier capture" in capsys.readouterr().err
+
+
+def test_malformed_numeric_environment_does_not_abort(monkeypatch):
+    monkeypatch.setenv("GLACIER_METRICS_PORT", "abc")
+    monkeypatch.setenv("GLACIER_CPU_BUDGET", "5%")
+    code, output = run_cli(["-v"])
+    assert code == 0
+    assert "GLACIER_METRICS_PORT='abc' is not a number" in output and "Glacier v" in output
+    assert "GLACIER_CPU_BUDGET='5%' is not a number" in output
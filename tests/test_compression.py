@@ -0,0 +1,80 @@
+import gzip
+import os
+import runpy
+import sys
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+import pytest
+import yaml
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from compression import content_headers, detect_codec, open_report, resolve_codec  # noqa: E402
+
+
+@pytest.mark.parametrize("codec", ["gzip", "zstd"])
+def test_reports_round_trip_and_carry_content_encoding(tmp_path, codec):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    text = "".join(f"- remote: 52.1.{i % 256}.7:443\n  process: nginx\n" for i in range(5000))
+    path = str(tmp_path / "report.html")
+    with open_report(path, "w", resolve_codec(codec)) as f:
+        f.write(text)
+    assert detect_codec(path) == codec
+    assert os.path.getsize(path) * 10 < len(text)
+    with open_report(path) as f:
+        assert f.read() == text
+    assert content_headers(path) == {"ContentType": "text/html; charset=utf-8", "ContentEncoding": codec}
+
+    plain = str(tmp_path / "report.yaml.legacy")
+    with open_report(plain, "w", resolve_codec("none")) as f:
+        f.write(text)
+    assert detect_codec(plain) is None and content_headers(plain) == {"ContentType": "application/yaml"}
+    with pytest.raises(ValueError):
+        resolve_codec("brotli")
+
+
+def _run(args, cwd):
+    argv, old_cwd = sys.argv[:], os.getcwd()
+    sys.argv = ["glacier.py", *args]
+    sys.path.insert(0, str(ROOT_DIR / "src"))
+    os.chdir(cwd)
+    try:
+        with redirect_stdout(StringIO()):
+            runpy.run_path(str(ROOT_DIR / "src" / "glacier.py"), run_name="__main__")
+    finally:
+        os.chdir(old_cwd)
+        sys.argv = argv
+        sys.path.pop(0)
+
+
+def test_compressed_reports_are_written_and_restored(tmp_path):
+    capture = str(tmp_path / "run.capture.gz")
+    _run(["-w", "0", "-t", "1", "--no-s3", "--compress", "--record", capture], tmp_path)
+    yaml_files = list(tmp_path.glob("*_report_analyzer.yaml"))
+    assert len(yaml_files) == 1
+    base = str(yaml_files[0])
+    html_file = base[:-len(".yaml")] + ".html"
+    for path in (base, f"{base}.legacy", html_file):
+        assert detect_codec(path) == "gzip"
+    with gzip.open(html_file, "rt", encoding="utf-8") as f:
+        assert "<html" in f.read(2000).lower()
+    with open_report(base) as f:
+        assert "netflow_message" in yaml.safe_load(f)
+
+    # Следующий запуск восстанавливает состояние из сжатых отчетов (без IPFIX архива)
+    os.remove(base[:-len(".yaml")] + ".ipfix")
+    _run(["-w", "0", "-t", "1", "--no-s3", "--compress", "none"], tmp_path)
+    assert detect_codec(base) is None
+    with open_report(f"{base}.legacy") as f:
+        assert yaml.safe_load(f)["total_measurements"] == 2
+
+    # Воспроизведение не читает и не перезаписывает отчеты хоста
+    _run(["--replay", capture, "--no-s3", "--compress", "none"], tmp_path)
+    with open_report(f"{base}.legacy") as f:
+        assert yaml.safe_load(f)["total_measurements"] == 2
+    with open_report(f"{capture}.out/{os.path.basename(base)}.legacy") as f:
+        assert yaml.safe_load(f)["total_measurements"] == 1
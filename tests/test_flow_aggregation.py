@@ -0,0 +1,62 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from flow_aggregation import FlowAggregator, aggregate_connections  # noqa: E402
+from netflow_generator import NetFlowGenerator  # noqa: E402
+
+
+def test_ephemeral_sockets_fold_into_service_rows():
+    outgoing = []
+    for i in range(3000):
+        backend = "10.0.1.10" if i % 2 else "10.0.1.11"
+        # Сокеты к одному бэкенду разделяют запись хранилища network_info (_conn_key)
+        outgoing.append({"local": f"10.0.0.5:{40000 + i}", "remote": {"name": "api", "address": f"{backend}:8080"},
+                         "process": "envoy", "protocol": "tcp", "count": 1500, "_conn_key": backend,
+                         "first_seen_ts": 1700000000 + i, "last_seen_ts": 1700001000 + i})
+    outgoing.append({"local": "[2001:db8::5]:50001", "remote": {"address": "[2001:db8::1]:53"},
+                     "process": "dns", "protocol": "udp", "count": 2, "first_seen": "01.02.2025 10:00:00"})
+    outgoing.append({"local": "[2001:db8::5]:50002", "remote": {"address": "[2001:db8::1]:53"},
+                     "process": "dns", "protocol": "udp", "count": 3, "first_seen": "01.02.2025 09:00:00"})
+    incoming = [{"local": "10.0.0.5:443", "remote": {"address": f"198.51.100.7:{50000 + i}"},
+                 "process": "envoy", "protocol": "tcp", "count": 1} for i in range(20)]
+
+    result = aggregate_connections({"incoming": incoming, "outgoing": outgoing}, {})
+    rows = {(r["process"], r["remote"]["address"]): r for r in result["outgoing"]}
+    assert len(result["outgoing"]) == 3
+
+    api = rows[("envoy", "10.0.1.10:8080")]
+    assert api["local"] == "10.0.0.5:*"
+    assert (api["flows"], api["local_ports"], api["count"]) == (1500, 1500, 1500)
+    assert (api["first_seen_ts"], api["last_seen_ts"]) == (1700000001, 1700003999)
+    assert "_conn_key" not in api
+
+    dns = rows[("dns", "[2001:db8::1]:53")]
+    assert dns["local"] == "[2001:db8::5]:*" and dns["count"] == 5
+    assert dns["first_seen"] == "01.02.2025 09:00:00"
+
+    (clients,) = result["incoming"]
+    assert clients["local"] == "10.0.0.5:443"
+    assert clients["remote"]["address"] == "198.51.100.7:*"
+    assert (clients["flows"], clients["remote_ports"], clients["count"]) == (20, 20, 20)
+
+    with pytest.raises(ValueError):
+        FlowAggregator(["process", "pid"])
+
+
+def test_aggregated_row_keeps_flow_count_in_netflow():
+    row = aggregate_connections({"outgoing": [
+        {"local": f"10.0.0.5:{40000 + i}", "remote": {"address": "93.184.216.34:443"},
+         "process": "curl", "protocol": "tcp", "count": 2} for i in range(7)]}, {})["outgoing"][0]
+
+    generator = NetFlowGenerator()
+    flow = generator.convert_connection_to_flow(row, "outgoing")
+    assert (flow["FLOWS"], flow["IN_PKTS"], flow["L4_SRC_PORT"], flow["L4_DST_PORT"]) == (7, 14, 0, 443)
+    formatted = generator.format_flow(flow)
+    assert formatted["flow_count"] == 7
+    legacy = NetFlowGenerator.convert_netflow_yaml_to_legacy_format({"netflow_message": {"flows": [formatted]}})
+    assert legacy["current_state"]["connections"]["outgoing"][0]["flows"] == 7
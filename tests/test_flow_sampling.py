@@ -0,0 +1,86 @@
+import socket
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from flow_sampling import FlowSampler, SpaceSaving  # noqa: E402
+from netflow_generator import NetFlowGenerator  # noqa: E402
+from network_info import finalize_result, select_connections  # noqa: E402
+
+Addr = namedtuple("Addr", "ip port")
+Conn = namedtuple("Conn", "fd family type laddr raddr status pid")
+
+
+def make_sockets():
+    sockets = []
+    # Балансировщик: тысячи клиентов на 443 и два тяжелых бэкенда
+    for i in range(3000):
+        sockets.append(Conn(-1, socket.AF_INET, socket.SOCK_STREAM, Addr("10.0.0.5", 443),
+                            Addr(f"198.51.{i // 250}.{i % 250}", 30000 + i), "ESTABLISHED", None))
+    for i in range(6000):
+        backend = "10.0.1.10" if i % 3 else "10.0.1.11"
+        sockets.append(Conn(-1, socket.AF_INET, socket.SOCK_STREAM, Addr("10.0.0.5", 40000 + i % 20000),
+                            Addr(backend, 8080), "ESTABLISHED", None))
+    return sockets
+
+
+def test_sampler_is_deterministic_and_space_saving_keeps_heavy_hitters():
+    keys = [f"flow-{i}" for i in range(20000)]
+    first = [k for k in keys if FlowSampler(50).keep(k)]
+    assert first == [k for k in keys if FlowSampler(50).keep(k)]
+    assert first != [k for k in keys if FlowSampler(50, seed=1).keep(k)]
+    assert 0.8 < FlowSampler(50).scale(len(first)) / len(keys) < 1.2
+
+    summary = SpaceSaving(10)
+    for i in range(50000):
+        summary.add("heavy-a" if i % 4 == 0 else "heavy-b" if i % 10 == 1 else f"tail-{i}")
+    assert len(summary) == 10
+    (a, a_count, a_error), (b, b_count, b_error) = summary.top(2)
+    assert (a, b) == ("heavy-a", "heavy-b")
+    assert a_count - a_error <= 12500 <= a_count
+    assert b_count - b_error <= 5000 <= b_count
+    assert len(summary._heap) <= 4 * summary.capacity + 1
+
+
+def test_select_connections_modes_and_netflow_interval():
+    sockets = make_sockets()
+
+    sampled = select_connections(sockets, {"mode": "sample", "interval": 20}, 1024)
+    assert sampled == select_connections(list(reversed(sockets))[::-1], {"mode": "sample", "interval": 20}, 1024)
+    assert all(weight == 20 for _, weight in sampled)
+    assert 0.7 < len(sampled) * 20 / len(sockets) < 1.3
+
+    top = select_connections(sockets, {"mode": "topk", "top_k": 5}, 1024)
+    assert len(top) == 5
+    assert [(c.raddr.ip, w) for c, w in top[:2]] == [("10.0.1.10", 4000), ("10.0.1.11", 2000)]
+
+    assert len(select_connections(sockets, {"max_connections": 100}, 1024)) == 100
+
+    generator = NetFlowGenerator()
+    flow = generator.convert_connection_to_flow(
+        {"local": "10.0.0.5:40001", "remote": {"address": "10.0.1.10:8080"}, "count": 40,
+         "sampling_interval": 20}, "outgoing")
+    assert flow["SAMPLING_INTERVAL"] == 20 and flow["IN_PKTS"] == 40
+    assert generator.format_flow(flow)["sampling_interval"] == 20
+
+
+def test_topk_groups_only_reported_sockets():
+    backend = Addr("10.0.1.10", 8080)
+    sockets = [
+        # Первыми в группах идут сокеты, которых не будет в отчете
+        Conn(-1, socket.AF_INET, socket.SOCK_STREAM, Addr("0.0.0.0", 443), (), "LISTEN", None),
+        Conn(-1, socket.AF_INET, socket.SOCK_STREAM, Addr("10.0.0.5", 40000), backend, "TIME_WAIT", None),
+    ]
+    sockets += [Conn(-1, socket.AF_INET, socket.SOCK_STREAM, Addr("10.0.0.5", 40001 + i), backend,
+                     "ESTABLISHED", None) for i in range(3)]
+    sockets += [Conn(-1, socket.AF_INET, socket.SOCK_STREAM, Addr("0.0.0.0", 2000 + i), (), "LISTEN", None)
+                for i in range(5)]
+    snapshot = {"connections_all": sockets, "tcp": [], "udp": []}
+    networks = finalize_result({}, snapshot, 1024, [], False, {"mode": "topk", "top_k": 1},
+                               collectors={"reverse_dns": False, "lsof": False})
+    outgoing = networks["connections"]["outgoing"]
+    assert [(row["remote"]["address"], row["count"]) for row in outgoing] == [("10.0.1.10:8080", 3)]
+    assert networks["connections"]["incoming"] == []
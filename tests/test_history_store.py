@@ -0,0 +1,75 @@
+import json
+import sys
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from history_store import HistoryStore, address_key, parse_since, query_main  # noqa: E402
+
+NOW = 1760000000
+
+
+def measurement(day, remote):
+    return {'connections': {
+        'outgoing': [{'local': '10.0.0.5:40000', 'remote': {'name': 'api', 'address': f"{remote}:443"},
+                      'process': 'curl', 'protocol': 'tcp', 'count': 3,
+                      'first_seen_ts': NOW - day * 86400 - 60, 'last_seen_ts': NOW - day * 86400}],
+        'incoming': [{'local': '10.0.0.5:22', 'remote': {'address': '[2001:db8::7]:51000'},
+                      'process': 'sshd', 'protocol': 'tcp', 'count': 1, 'first_seen': '01.02.2025 10:00:00'}]},
+        'tcp_ports': [22, 443], 'udp_ports': [53]}
+
+
+def test_flows_are_indexed_by_network_port_process_and_time(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.sqlite"), retention_days=20)
+    assert store.connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    for day, remote in ((30, '10.20.1.1'), (6, '10.20.9.9'), (2, '10.20.9.9'), (1, '192.0.2.10')):
+        store.record_measurement(NOW - day * 86400, measurement(day, remote), {'tcp_ports': {'added': [443]}}, 0.4)
+
+    week = store.query_flows(remote='10.20.0.0/16', since=parse_since('7d', NOW))
+    assert [(r['process'], r['remote_ip'], r['measurements'], r['count']) for r in week] == \
+        [('curl', '10.20.9.9', 2, 3)]
+    assert (week[0]['first_seen'], week[0]['last_seen']) == (NOW - 6 * 86400 - 60, NOW - 2 * 86400)
+    assert len(store.query_flows(remote='10.20.0.0/16')) == 2
+
+    (ssh,) = store.query_flows(port=22, direction='incoming', group=False, limit=1)
+    assert (ssh['process'], ssh['remote_ip'], ssh['local_port']) == ('sshd', '2001:db8::7', 22)
+    assert store.query_flows(remote='2001:db8::/32', process='sshd', since=NOW - 86400 - 1)[0]['measurements'] == 1
+    assert address_key('10.0.0.1') < address_key('10.0.0.2') and address_key('*') is None
+
+    plan = ' '.join(row[-1] for row in store.connection.execute(
+        'EXPLAIN QUERY PLAN SELECT * FROM flows WHERE remote_key BETWEEN ? AND ?', (b'', b'')))
+    assert 'flows_remote' in plan
+
+    deleted = store.apply_retention(NOW, force_vacuum=True)
+    assert (deleted['measurements'], deleted['flows'], deleted['listeners'], deleted['vacuum']) == (1, 2, 3, 1)
+    assert len(store.query_flows(remote='10.20.0.0/16')) == 1
+    store.close()
+
+
+def test_query_subcommand_prints_json(tmp_path):
+    path = str(tmp_path / "history.sqlite")
+    store = HistoryStore(path)
+    store.record_measurement(NOW, measurement(0, '10.20.3.4'), {})
+    # Дополнение отчета из истории соединений не попадает в базу
+    padded = measurement(0, '192.0.2.50')
+    store.record_measurement(NOW + 60, padded, {}, connections={'incoming': padded['connections']['incoming']})
+    store.close()
+
+    out = StringIO()
+    with redirect_stdout(out):
+        assert query_main(['--db', path, '--remote', '10.20.3.4', '--json'], {}) == 0
+    (row,) = json.loads(out.getvalue())
+    assert (row['process'], row['remote_port'], row['direction']) == ('curl', 443, 'outgoing')
+
+    out = StringIO()
+    with redirect_stdout(out):
+        query_main(['--db', path, '--process', 'sshd'], {})
+    assert '<- [2001:db8::7]:51000' in out.getvalue() and '1 rows' in out.getvalue()
+
+    out = StringIO()
+    with redirect_stdout(out):
+        query_main(['--db', path, '--remote', '192.0.2.50'], {})
+    assert '0 rows' in out.getvalue()
@@ -0,0 +1,65 @@
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from ip_database import IPRangeDatabase  # noqa: E402
+from netflow_generator import NetFlowGenerator  # noqa: E402
+from report_enhancer import ReportEnhancer  # noqa: E402
+
+
+CSV_DATA = """# start,end,country,asn,provider
+10.0.0.0/8,RU,64512,Corp
+10.20.0.0,10.20.255.255,RU,64513,Office
+52.0.0.0/11,US,AS16509,Amazon
+2a02:6b8::/29,RU,13238,Yandex
+"""
+
+
+def make_db(tmp_path):
+    csv_file = tmp_path / "ranges.csv"
+    csv_file.write_text(CSV_DATA)
+    return IPRangeDatabase.load(str(csv_file))
+
+
+def test_lookup_nested_and_ipv6(tmp_path):
+    db = make_db(tmp_path)
+    assert db.lookup("10.1.2.3")["provider"] == "Corp"
+    assert db.lookup("10.20.5.5")["provider"] == "Office"
+    # Адрес после вложенного диапазона снова относится к объемлющей сети
+    assert db.lookup("10.21.0.1")["asn"] == 64512
+    assert db.lookup("52.1.1.1") == {"country": "US", "asn": 16509, "provider": "Amazon"}
+    assert db.lookup("2a02:6b8::feed")["asn"] == 13238
+    assert db.lookup("8.8.8.8") is None
+    assert db.lookup("*") is None
+
+
+def test_binary_roundtrip(tmp_path):
+    db = make_db(tmp_path)
+    binary = tmp_path / "ranges.gipdb"
+    db.save_binary(str(binary))
+    loaded = IPRangeDatabase.load(str(binary))
+    for address in ("10.1.2.3", "10.20.5.5", "10.21.0.1", "52.1.1.1", "2a02:6b8::1", "1.1.1.1"):
+        assert loaded.lookup(address) == db.lookup(address)
+
+
+def test_netflow_as_fields(tmp_path):
+    generator = NetFlowGenerator(ip_database=make_db(tmp_path))
+    connection = {
+        "local": "10.20.0.5:50000",
+        "remote": {"name": "unknown", "address": "52.1.1.1:443"},
+        "process": "curl",
+        "protocol": "tcp",
+        "count": 1,
+    }
+    flow = generator.convert_connection_to_flow(connection, "outgoing")
+    assert flow["SRC_AS"] == 64513
+    assert flow["DST_AS"] == 16509
+
+
+def test_geographic_distribution_from_database(tmp_path):
+    outgoing = [{"remote": {"name": "unknown", "address": address}}
+                for address in ("52.1.1.1:443", "[2a02:6b8::1]:443", "2a02:6b8::2:443", "unknown", "")]
+    regions = ReportEnhancer(ip_database=make_db(tmp_path))._analyze_geographic_distribution(outgoing)
+    assert regions == {"US": 1, "RU": 2, "International": 2}
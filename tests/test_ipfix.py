@@ -0,0 +1,101 @@
+import io
+import json
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from ipfix import MESSAGE_HEADER, IPFIXWriter, iter_ipfix_records, read_ipfix_report  # noqa: E402
+from netflow_generator import NetFlowGenerator  # noqa: E402
+from rollups import RollupStore  # noqa: E402
+
+
+def make_report(count=50):
+    outgoing = [{
+        "local": f"10.0.0.5:{40000 + i}",
+        "remote": {"name": "unknown", "address": f"93.184.0.{i % 250 + 1}:443"},
+        "process": "curl" if i % 2 else "процесс",
+        "protocol": "tcp",
+        "count": i + 1,
+        "first_seen": "2024-01-01 10:00:00",
+        "last_seen": "2024-01-01 10:05:00",
+    } for i in range(count)]
+    incoming = [
+        {"local": "[2001:db8::5]:22", "remote": {"address": "[2001:db8::1]:50000"},
+         "process": "sshd", "protocol": "tcp", "count": 3},
+        {"local": "*:5353", "remote": {"address": "*:*"}, "process": "mdns", "protocol": "udp"},
+    ]
+    state = {"hostname": "host-1", "current_state": {"connections": {"incoming": incoming, "outgoing": outgoing}},
+             "changes_log": [{"id": 1, "changes": {}}]}
+    generator = NetFlowGenerator()
+    return generator, generator.generate_netflow_report(state)
+
+
+def test_ipfix_roundtrip_matches_yaml_conversion(tmp_path):
+    generator, report = make_report()
+    path = tmp_path / "report.ipfix"
+    assert generator.write_ipfix_file(report, str(path)) == len(report["flow_records"])
+
+    archived = read_ipfix_report(str(path))
+    assert archived["system_information"]["hostname"] == "host-1"
+    yaml_flows = generator.format_netflow_yaml(report)["netflow_message"]["flows"]
+    ipfix_flows = archived["netflow_message"]["flows"]
+    assert len(ipfix_flows) == len(yaml_flows)
+    for restored, original in zip(ipfix_flows, yaml_flows):
+        for key in ("source_address", "destination_address", "source_port", "destination_port",
+                    "protocol_name", "packet_count", "byte_count", "first_switched_time"):
+            assert restored[key] == original[key], key
+        assert restored["meta"]["process"] == original["meta"]["process"]
+        assert restored["meta"]["local_original"] == original["meta"]["local_original"]
+
+    legacy = NetFlowGenerator.convert_netflow_yaml_to_legacy_format(archived)
+    expected = NetFlowGenerator.convert_netflow_yaml_to_legacy_format(generator.format_netflow_yaml(report))
+    assert legacy["current_state"]["connections"] == expected["current_state"]["connections"]
+
+
+def test_messages_split_and_sequence_counts_records():
+    _, report = make_report(400)
+    buffer = io.BytesIO()
+    with IPFIXWriter(buffer, max_message_size=1400, export_time=1700000000) as writer:
+        writer.write_flows(report["flow_records"])
+
+    data = buffer.getvalue()
+    offset, sequences = 0, []
+    while offset < len(data):
+        version, length, export_time, sequence, _ = MESSAGE_HEADER.unpack_from(data, offset)
+        assert version == 10 and length <= 1400 and export_time == 1700000000
+        # Номер последовательности равен количеству записей в предыдущих сообщениях
+        assert sequence == len(list(iter_ipfix_records(io.BytesIO(data[:offset]))))
+        sequences.append(sequence)
+        offset += length
+    assert len(sequences) > 1
+
+    records = list(iter_ipfix_records(io.BytesIO(data)))
+    assert len(records) == len(report["flow_records"])
+    assert {template_id for template_id, _ in records} == {256, 257}
+
+
+def test_large_system_information_roundtrip(tmp_path):
+    # Временные ряды за месяц наблюдений (каждые 5 минут) и журнал изменений - больше 65535 байт
+    rollups = RollupStore()
+    start = 1700000000
+    for i in range(30 * 24 * 12):
+        rollups.record_measurement(start + i * 300, {}, 0.5 + i % 7, changed=i % 3 == 0)
+    changes_log = [{"id": i, "timestamp": "2024-01-01 10:00:00",
+                    "changes": {"new_connections": [f"10.0.0.{i % 250}:{1024 + i} -> процесс"]}}
+                   for i in range(600)]
+    _, report = make_report(20)
+    info = dict(report["additional_info"], rollups=rollups.to_dict(), changes_log=changes_log)
+    assert len(json.dumps(info)) > 2 * 65535
+
+    for max_message_size in (65535, 1400):
+        path = tmp_path / f"report-{max_message_size}.ipfix"
+        with open(path, "wb") as f, IPFIXWriter(f, max_message_size=max_message_size) as writer:
+            writer.write_system_information(info)
+            writer.write_flows(report["flow_records"])
+        archived = read_ipfix_report(str(path))
+        assert len(archived["netflow_message"]["flows"]) == len(report["flow_records"])
+        assert archived["system_information"]["hostname"] == "host-1"
+        assert archived["system_information"]["changes_log"] == changes_log
+        assert archived["system_information"]["rollups"] == json.loads(json.dumps(rollups.to_dict()))
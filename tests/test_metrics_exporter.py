@@ -0,0 +1,59 @@
+import gzip
+import sys
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from metrics_exporter import MetricsExporter, measurement_families, render  # noqa: E402
+
+DATA = {"tcp_ports": [22, 443], "udp_ports": [53], "connections": {
+    "incoming": [{"process": f"worker-{i % 5}", "protocol": "tcp"} for i in range(50)],
+    "outgoing": [{"process": 'resolver "dns"', "protocol": "udp"}, {"process": "ping", "protocol": "icmp"}]}}
+
+
+def test_families_limit_process_series_and_render_both_formats():
+    families = measurement_families(DATA, rates={"udp_packets_rate": 2.5, "collection_seconds": 0.75},
+                                    collector_seconds={"connections": 0.5},
+                                    info={"hostname": "web-1", "measurements": 7}, max_processes=3)
+    text = render(families).decode("utf-8")
+    lines = text.splitlines()
+    assert lines[-1] == "# EOF"
+    assert 'glacier_connections{direction="incoming",protocol="tcp",state="established"} 50' in lines
+    assert 'glacier_connections{direction="outgoing",protocol="udp",state="active"} 1' in lines
+    assert 'glacier_listen_ports{protocol="tcp"} 2' in lines
+    process_lines = [line for line in lines if line.startswith("glacier_process_connections{")]
+    assert len(process_lines) == 4 and process_lines[-1] == 'glacier_process_connections{process="other"} 22'
+    assert 'glacier_packets_rate{protocol="udp"} 2.5' in lines
+    assert 'glacier_collector_duration_seconds{collector="connections"} 0.5' in lines
+    assert "# TYPE glacier_measurements counter" in lines and "glacier_measurements_total 7" in lines
+
+    escaped = render(measurement_families(DATA, max_processes=10), openmetrics=False).decode("utf-8")
+    assert 'process="resolver \\"dns\\""' in escaped
+    assert "# TYPE glacier_measurements_total counter" in escaped and "# EOF" not in escaped
+
+
+def test_endpoint_serves_prerendered_snapshot():
+    exporter = MetricsExporter(0, "127.0.0.1")
+    url = f"http://127.0.0.1:{exporter.port}/metrics"
+    try:
+        assert urllib.request.urlopen(url).read() == b"\n"
+        exporter.update(DATA, info={"hostname": "web-1", "measurements": 1})
+
+        with urllib.request.urlopen(urllib.request.Request(url, headers={
+                "Accept": "application/openmetrics-text; version=1.0.0", "Accept-Encoding": "gzip"})) as response:
+            assert response.headers["Content-Type"].startswith("application/openmetrics-text")
+            body = gzip.decompress(response.read())
+        assert body == exporter.snapshot[(True, False)] and body.endswith(b"# EOF\n")
+
+        with urllib.request.urlopen(url) as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert b'glacier_info{hostname="web-1",version=""} 1' in response.read()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"http://127.0.0.1:{exporter.port}/other")
+    finally:
+        exporter.close()
@@ -0,0 +1,72 @@
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from netflow_exporter import (  # noqa: E402
+    NetFlowV9Exporter, NetFlowV9Listener, PACKET_HEADER, decode_packet, get_netflow_exporter, parse_collector,
+)
+from netflow_generator import NetFlowGenerator  # noqa: E402
+
+
+def make_flows(count):
+    generator = NetFlowGenerator()
+    flows = []
+    for i in range(count):
+        connection = {
+            "local": f"10.0.0.5:{40000 + i}",
+            "remote": {"name": "unknown", "address": f"93.184.{i // 250}.{i % 250 + 1}:443"},
+            "process": "curl",
+            "protocol": "tcp",
+            "count": i + 1,
+        }
+        flows.append(generator.convert_connection_to_flow(connection, "outgoing"))
+    flows.append(generator.convert_connection_to_flow(
+        {"local": "[2001:db8::5]:50000", "remote": {"address": "[2001:db8::1]:53"},
+         "protocol": "udp", "count": 7}, "outgoing"))
+    return flows
+
+
+def test_udp_roundtrip_through_listener():
+    listener = NetFlowV9Listener()
+    try:
+        with NetFlowV9Exporter(listener.address, source_id=7, boot_time=0) as exporter:
+            assert exporter.export(make_flows(3)) == 1
+            packet = listener.receive(timeout=2.0)
+    finally:
+        listener.close()
+
+    assert packet["header"]["version"] == 9
+    assert packet["header"]["source_id"] == 7
+    assert packet["header"]["count"] == 2 + 4  # два шаблона и четыре записи
+    assert sorted(packet["templates"]) == [256, 257]
+    v4 = [f for f in packet["flows"] if f["template_id"] == 256]
+    v6 = [f for f in packet["flows"] if f["template_id"] == 257]
+    assert v4[0]["IPV4_SRC_ADDR"] == "10.0.0.5"
+    assert v4[0]["IPV4_DST_ADDR"] == "93.184.0.1"
+    assert v4[0]["L4_DST_PORT"] == 443
+    assert [f["IN_PKTS"] for f in v4] == [1, 2, 3]
+    assert v6[0]["IPV6_DST_ADDR"] == "2001:db8::1"
+    assert v6[0]["PROTOCOL"] == 17
+
+
+def test_mtu_batching_sequence_and_template_refresh():
+    exporter = NetFlowV9Exporter(parse_collector("127.0.0.1:2055"), mtu=576,
+                                 template_refresh_packets=3, boot_time=0)
+    packets = exporter.build_packets(make_flows(200), export_time=1000.0)
+    assert len(packets) > 1
+    assert all(len(p) <= 576 - 28 for p in packets)
+
+    templates = {}
+    decoded = [decode_packet(p, templates) for p in packets]
+    assert [d["header"]["sequence_number"] for d in decoded] == list(range(len(packets)))
+    # Шаблоны в первом пакете и далее каждые 3 пакета
+    assert [i for i, d in enumerate(decoded) if d["templates"]] == list(range(0, len(packets), 3))
+    assert sum(len(d["flows"]) for d in decoded) == 201
+    assert all(d["skipped_flowsets"] == 0 for d in decoded)
+    assert PACKET_HEADER.unpack_from(packets[0])[1] == len(decoded[0]["flows"]) + 2
+
+    # Некорректный адрес коллектора отключает экспорт без исключения
+    for collector in ("host:abc", "127.0.0.1:70000"):
+        assert get_netflow_exporter({"netflow_export": {}}, collector) is None
@@ -0,0 +1,90 @@
+import sys
+from pathlib import Path
+
+import yaml
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from ipfix import read_ipfix_report  # noqa: E402
+from netflow_generator import (  # noqa: E402
+    IPFIXReportSink, LegacyReportSink, NetFlowGenerator, YAMLReportSink, parse_address,
+)
+
+
+def make_state():
+    incoming = [{"local": "10.0.0.5:443", "remote": {"address": f"198.51.100.{i}:{50000 + i}"},
+                 "process": "nginx", "protocol": "tcp", "count": i,
+                 "first_seen": "01.02.2025 10:00:00", "last_seen": "01.02.2025 10:05:00"} for i in range(1, 40)]
+    outgoing = [{"local": "[2001:db8::5]:50000", "remote": {"address": "[2001:db8::1]:53"},
+                 "process": "dns", "protocol": "udp", "count": 3,
+                 "first_seen": "2025-02-01 10:00:00", "last_seen": "2025-02-01 10:01:00"},
+                {"local": "10.0.0.5", "remote": {"address": "*:*"}, "process": "kernel/system",
+                 "protocol": "icmp", "count": 1, "first_seen": "01.02.2025 10:00:00",
+                 "last_seen": "01.02.2025 10:00:30"}]
+    return {"hostname": "stream-host", "os": {"name": "Linux"}, "first_run": "2025-02-01 09:00:00",
+            "last_update": "2025-02-01 10:05:00", "total_measurements": 2, "changes_log": [{"id": 1}],
+            "current_state": {"connections": {"incoming": incoming, "outgoing": outgoing}}}
+
+
+def test_streamed_sinks_match_materialized_report(tmp_path):
+    state = make_state()
+    generator = NetFlowGenerator()
+    expected = generator.format_netflow_yaml(generator.generate_netflow_report(state))
+
+    yaml_sink = YAMLReportSink(str(tmp_path / "report.yaml"))
+    ipfix_sink = IPFIXReportSink(str(tmp_path / "report.ipfix"))
+    legacy_sink = LegacyReportSink()
+    report = NetFlowGenerator().stream_netflow_report(state, [yaml_sink, ipfix_sink, legacy_sink])
+
+    assert "flow_records" not in report
+    assert report["statistics"]["total_flows"] == 41
+    with open(tmp_path / "report.yaml", encoding="utf-8") as f:
+        streamed = yaml.safe_load(f)
+    for section in (streamed, expected):
+        for key in ("system_uptime_ms", "export_timestamp", "export_time"):
+            section["netflow_message"]["header"].pop(key)
+        section["flow_statistics"].pop("flow_duration")
+    assert streamed == expected
+
+    assert legacy_sink.result == NetFlowGenerator.convert_netflow_yaml_to_legacy_format(expected)
+    assert ipfix_sink.flow_count == 41
+    assert len(read_ipfix_report(str(tmp_path / "report.ipfix"))["netflow_message"]["flows"]) == 41
+
+
+def test_failed_sink_is_disabled_and_epoch_timestamps_win(tmp_path):
+    class BrokenSink(LegacyReportSink):
+        description = "broken"
+
+        def add(self, flow, formatted):
+            raise OSError("disk full")
+
+    broken, legacy = BrokenSink(), LegacyReportSink()
+    NetFlowGenerator().stream_netflow_report(make_state(), [broken, legacy])
+    assert isinstance(broken.error, OSError) and broken.result is None
+    assert legacy.result["current_state"]["icmp_traffic"]["total_connections"] == 1
+
+    # Сбой IPFIX архива не заменяет прежний архив и не оставляет временный файл
+    class BrokenIPFIXSink(IPFIXReportSink):
+        def add(self, flow, formatted):
+            super().add(flow, formatted)
+            raise OSError("disk full")
+
+    path = tmp_path / "report.ipfix"
+    path.write_bytes(b"previous")
+    ipfix_sink = BrokenIPFIXSink(str(path))
+    NetFlowGenerator().stream_netflow_report(make_state(), [ipfix_sink])
+    assert isinstance(ipfix_sink.error, OSError)
+    assert path.read_bytes() == b"previous" and list(tmp_path.iterdir()) == [path]
+
+    generator = NetFlowGenerator()
+    flow = generator.convert_connection_to_flow(
+        {"local": "10.0.0.5:40000", "remote": {"address": "93.184.216.34:https"},
+         "first_seen": "not a date", "last_seen": "01.02.2025 10:00:00",
+         "first_seen_ts": 1700000000, "last_seen_ts": 1700000060}, "outgoing")
+    assert (flow["FIRST_SWITCHED"], flow["LAST_SWITCHED"]) == (1700000000, 1700000060)
+    assert flow["L4_DST_PORT"] == 443
+
+    hits = parse_address.cache_info().hits
+    generator.parse_connection_address("93.184.216.34:https")
+    assert parse_address.cache_info().hits == hits + 1
@@ -0,0 +1,59 @@
+import pstats
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from profiling import Profiler, SpanRecorder  # noqa: E402
+from report_enhancer import ReportEnhancer  # noqa: E402
+import profiling  # noqa: E402
+
+
+def test_spans_sum_per_measurement_and_keep_percentiles():
+    recorder = SpanRecorder(max_samples=20)
+    for measurement in range(40):
+        for _ in range(3):
+            recorder.add('collect.reverse_dns', 0.01)
+        recorder.add('collect.udp', measurement / 100)
+        taken = recorder.take()
+        assert taken['collect.reverse_dns'] == 0.03
+    assert recorder.current == {}
+
+    summary = recorder.summary()
+    # В истории только последние 20 измерений: 0.20 .. 0.39
+    assert summary['collect.udp'] == {'count': 20, 'p50': 0.29, 'p95': 0.38, 'max': 0.39, 'last': 0.39}
+
+    with recorder.span('serialize.yaml'):
+        time.sleep(0.002)
+    assert recorder.current['serialize.yaml'] >= 0.002
+
+    restored = SpanRecorder(max_samples=20)
+    restored.load(recorder.to_dict())
+    assert restored.summary() == summary
+
+    profiling.SPANS.take()
+    ReportEnhancer().enhance_report({'connections': {'incoming': [], 'outgoing': []}})
+    stages = profiling.SPANS.take()
+    assert {'enhance.metadata', 'enhance.security_analysis', 'enhance.detailed_data'} <= set(stages)
+
+
+def test_profiler_writes_pstats_and_collapsed_stacks(tmp_path):
+    def busy():
+        deadline = time.perf_counter() + 0.15
+        while time.perf_counter() < deadline:
+            sum(range(1000))
+
+    profiler = Profiler(str(tmp_path / "run"), interval=0.001)
+    profiler.start()
+    busy()
+    paths = profiler.stop()
+
+    stats = pstats.Stats(paths['pstats'])
+    assert any(name == 'busy' for _, _, name in stats.stats)
+    lines = Path(paths['collapsed']).read_text(encoding='utf-8').splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0 and 'busy (test_profiling.py:' in stack and ';' in stack
+    assert 'busy' in profiler.top(5)
@@ -47,3 +47,20 @@ def test_report_generation(tmp_path):
     with open(yaml_file) as f:
         data = yaml.safe_load(f)
     assert 'netflow_message' in data
+
+    # Бинарный IPFIX архив содержит те же потоки, что и YAML отчет
+    from ipfix import read_ipfix_report
+    ipfix_file = tmp_path / f"{hostname}_linux_report_analyzer.ipfix"
+    assert ipfix_file.exists()
+    archived = read_ipfix_report(str(ipfix_file))
+    assert len(archived['netflow_message']['flows']) == len(data['netflow_message']['flows'])
+    assert archived['system_information']['hostname'] == hostname
+
+    # Измерение записано в кольца временных рядов и переживает сохранение отчета
+    rollups = data['system_information']['rollups']
+    assert [len(rollups['rings'][name]['buckets']) for name in ('minute', 'hour', 'day')] == [1, 1, 1]
+
+    # Длительности этапов измерения сохраняются в отчете
+    timings = data['system_information']['timings']
+    assert {'collect.connections', 'collect.udp', 'measurement'} <= set(timings['last_measurement'])
+    assert timings['summary']['measurement']['p95'] >= timings['summary']['measurement']['p50'] > 0
@@ -0,0 +1,89 @@
+import socket
+import sys
+from collections import Counter, namedtuple
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from network_info import finalize_result, live_connections  # noqa: E402
+from rollups import METRICS, RingBuffer, RollupStore, count_connection  # noqa: E402
+
+BEGIN = 1700000000 - 1700000000 % 86400
+
+
+def test_rings_keep_constant_size_over_long_runs():
+    store = RollupStore({'minute': 60, 'hour': 48, 'day': 30})
+    sizes = [len(ring.sums) for ring in store.rings.values()]
+    # 90 дней измерений раз в минуту
+    for i in range(90 * 1440):
+        store.add(BEGIN + i * 60, {'incoming': i % 10, 'collection_seconds': 2.0, 'changed': i % 60 == 0})
+    assert [len(ring.sums) for ring in store.rings.values()] == sizes
+
+    minutes = store.rings['minute'].buckets()
+    assert len(minutes) == 60 and minutes[-1]['start'] == BEGIN + (90 * 1440 - 1) * 60
+    hours = store.series('hour', 'incoming', 'max')
+    assert len(hours) == 48 and all(value == 9 for _, value in hours)
+    days = store.rings['day'].buckets()
+    assert len(days) == 30 and days[0]['start'] == BEGIN + 60 * 86400
+    assert days[-1]['count'] == 1440 and days[-1]['changed']['sum'] == 24
+    assert store.summary('collection_seconds') == {'count': 30 * 1440, 'sum': 30 * 1440 * 2.0,
+                                                    'avg': 2.0, 'min': 2.0, 'max': 2.0}
+
+    # Измерение старше окна кольца не затирает новые ячейки
+    store.add(BEGIN, {'incoming': 1000})
+    assert store.series('hour', 'incoming', 'max') == hours
+
+
+def test_rollups_roundtrip_and_packet_rates():
+    store = RollupStore()
+    data = {'connections': {'incoming': [{'protocol': 'tcp'}], 'outgoing': [{'protocol': 'udp'}, {'protocol': 'icmp'}]},
+            'tcp_ports': [22, 443], 'udp_traffic': {'total_packets': 100}, 'icmp_traffic': {}}
+    first = store.record_measurement(BEGIN, data, 1.5, True)
+    assert (first['incoming'], first['outgoing'], first['udp'], first['tcp_listen_ports']) == (1, 2, 1, 2)
+    assert first['udp_packets_rate'] == 0
+
+    data['udp_traffic']['total_packets'] = 400
+    second = store.record_measurement(BEGIN + 30, data, 2.5, False,
+                                      totals={'incoming': 5000, 'tcp': 5000, 'tcp_listen_ports': 80})
+    assert (second['incoming'], second['tcp_listen_ports'], second['udp_packets_rate']) == (5000, 80, 10.0)
+
+    state = store.to_dict()
+    restored = RollupStore.from_dict(state)
+    assert restored.to_dict() == state
+    assert restored.summary('collection_seconds')['avg'] == 2.0
+    assert restored.summary('changed')['sum'] == 1
+
+    # Кольцо без части метрик загружает общие по имени
+    state['metrics'] = list(reversed(METRICS))
+    for ring in state['rings'].values():
+        for bucket in ring['buckets']:
+            for values in bucket[2:]:
+                values.reverse()
+    partial = RingBuffer(60, 10, metrics=('incoming', 'collection_seconds'))
+    partial.load(state['rings']['minute'], state['metrics'])
+    (bucket,) = partial.buckets()
+    assert (bucket['incoming']['max'], bucket['collection_seconds']['sum']) == (5000, 4.0)
+
+
+def test_totals_count_only_live_connections():
+    Addr = namedtuple("Addr", "ip port")
+    Conn = namedtuple("Conn", "fd family type laddr raddr status pid")
+    sockets = [Conn(-1, socket.AF_INET, socket.SOCK_STREAM, Addr("10.0.0.5", 40001), Addr("203.0.113.7", 443),
+                    "ESTABLISHED", None),
+               # Локальное соединение не попадает в отчет, но остается в истории соединений
+               Conn(-1, socket.AF_INET, socket.SOCK_STREAM, Addr("127.0.0.1", 40002), Addr("127.0.0.1", 5432),
+                    "ESTABLISHED", None)]
+    networks = finalize_result({}, {"connections_all": sockets, "tcp": [], "udp": []}, 1024, [], True,
+                               collectors={"reverse_dns": False, "lsof": False})
+    # Список отчета дополнен из истории, счетчики - нет
+    assert len(networks["connections"]["outgoing"]) == 2
+    measured = live_connections(networks)
+    assert [row["remote"]["address"] for row in measured["outgoing"]] == ["203.0.113.7:443"]
+
+    totals = Counter()
+    for direction, rows in measured.items():
+        for row in rows:
+            count_connection(totals, direction, row)
+    values = RollupStore().record_measurement(BEGIN, {}, 0.1, False, totals=totals)
+    assert values["outgoing"] == 1 and values["tcp"] == 1
@@ -0,0 +1,71 @@
+import sys
+from datetime import datetime
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+sys.path.insert(0, str(ROOT_DIR / "grafana" / "yaml-processor"))
+
+import S3Client  # noqa: E402
+from s3_source import S3ReportSource  # noqa: E402
+
+PY_VERSION = {"major": sys.version_info[0], "minor": sys.version_info[1]}
+
+
+def upload_run(client, bucket, tmp_path, hostname, started, flows):
+    run = S3Client.report_run("reports/", hostname, started)
+    report = tmp_path / f"{hostname}.yaml"
+    report.write_text(f"netflow_message:\n  flows: {flows}\n", encoding="utf-8")
+    html = tmp_path / f"{hostname}.html"
+    html.write_text("<html></html>", encoding="utf-8")
+    for path, extension in ((report, "yaml"), (html, "html")):
+        client.upload_file(str(path), bucket, S3Client.report_key("reports/", hostname, run["run_id"], extension,
+                                                                 run["date"]))
+    return S3Client.report_key("reports/", hostname, run["run_id"], "yaml", run["date"])
+
+
+def test_source_ingests_new_reports_once_across_restarts(s3_endpoint, tmp_path):
+    client, bucket = S3Client.get_cached_client_s3(s3_endpoint, PY_VERSION), s3_endpoint["bucket"]
+    state = tmp_path / "state.json"
+    ingested = []
+
+    def process(path, item):
+        ingested.append((item["hostname"], path.read_text(encoding="utf-8")))
+        return True
+
+    today = datetime.now()
+    first = upload_run(client, bucket, tmp_path, "web01", today, 1)
+    upload_run(client, bucket, tmp_path, "db01.example.com", today, 2)
+    source = S3ReportSource(client, bucket, "reports/", state, tmp_path / "incoming", workers=2)
+    assert source.poll(process) == {"new": 2, "processed": 2, "failed": 0}
+    assert sorted(host for host, _ in ingested) == ["db01.example.com", "web01"]
+
+    # Новый процесс с тем же состоянием: старые объекты не загружаются повторно
+    restarted = S3ReportSource(client, bucket, "reports/", state, tmp_path / "incoming")
+    assert restarted.state["mark"] is not None and restarted.poll(process)["new"] == 0
+
+    # Перезапись отчета запуском (новый ETag) и новый запуск попадают в следующий проход
+    (tmp_path / "web01.yaml").write_text("netflow_message:\n  flows: 3\n", encoding="utf-8")
+    client.upload_file(str(tmp_path / "web01.yaml"), bucket, first)
+    upload_run(client, bucket, tmp_path, "web02", today, 4)
+    assert restarted.poll(process) == {"new": 2, "processed": 2, "failed": 0}
+    assert sorted(ingested[2:]) == [("web01", "netflow_message:\n  flows: 3\n"),
+                                    ("web02", "netflow_message:\n  flows: 4\n")]
+
+
+def test_failed_reports_are_retried_up_to_max_attempts(s3_endpoint, tmp_path):
+    client, bucket = S3Client.get_cached_client_s3(s3_endpoint, PY_VERSION), s3_endpoint["bucket"]
+    key = upload_run(client, bucket, tmp_path, "web01", datetime.now(), 1)
+    source = S3ReportSource(client, bucket, "reports/", tmp_path / "state.json", tmp_path / "incoming",
+                            max_attempts=2)
+    failing = lambda path, item: False  # noqa: E731
+    assert source.poll(failing) == {"new": 1, "processed": 0, "failed": 1}
+    assert source.state["failed"][key]["attempts"] == 1
+    assert source.poll(failing) == {"new": 1, "processed": 0, "failed": 1}
+    assert source.poll(failing)["new"] == 0
+
+    # Новая версия (другое содержимое - другой ETag) получает новые попытки
+    (tmp_path / "web01.yaml").write_text("netflow_message:\n  flows: 2\n", encoding="utf-8")
+    client.upload_file(str(tmp_path / "web01.yaml"), bucket, key)
+    assert source.poll(lambda path, item: True) == {"new": 1, "processed": 1, "failed": 0}
+    assert key not in source.state["failed"]
@@ -0,0 +1,179 @@
+import gzip
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+import S3Client  # noqa: E402
+from analyzer_config import get_config  # noqa: E402
+
+PY_VERSION = {"major": sys.version_info[0], "minor": sys.version_info[1]}
+
+
+def test_cached_client_uploads_files_in_parallel_with_multipart(s3_endpoint, tmp_path):
+    client = S3Client.get_cached_client_s3(s3_endpoint, PY_VERSION)
+    assert S3Client.get_cached_client_s3(dict(s3_endpoint), PY_VERSION) is client
+    assert client.meta.config.max_pool_connections == s3_endpoint["max_pool_connections"]
+
+    large = tmp_path / "report.yaml"
+    large.write_bytes(b"flow: 1\n" * (1024 * 1024))
+    small = tmp_path / "report.html"
+    small.write_text("<html></html>", encoding="utf-8")
+    transfer = S3Client.get_transfer_config(dict(s3_endpoint, multipart_threshold_mb=5, multipart_chunksize_mb=5))
+    results = S3Client.upload_files_s3(client, s3_endpoint["bucket"], [(str(large), "r/report.yaml"), (str(small), "r/report.html")],
+                                       transfer_config=transfer)
+    assert results == {str(large): True, str(small): True}
+
+    head = client.head_object(Bucket=s3_endpoint["bucket"], Key="r/report.yaml")
+    assert head["ContentLength"] == large.stat().st_size and head["ETag"].endswith('-2"')
+    assert [item["Key"] for item in S3Client.read_from_s3(client, s3_endpoint["bucket"])] == ["r/report.html", "r/report.yaml"]
+    missing = S3Client.upload_files_s3(client, s3_endpoint["bucket"], [(str(tmp_path / "absent.yaml"), "absent.yaml")])
+    assert isinstance(missing[str(tmp_path / "absent.yaml")], Exception)
+
+
+def test_upload_reports_to_s3_sends_all_report_files(s3_endpoint, tmp_path, monkeypatch):
+    import glacier
+
+    monkeypatch.chdir(tmp_path)
+    for name in ("vm_linux_report_analyzer.yaml", "vm_linux_report_analyzer.yaml.legacy",
+                 "vm_linux_report_analyzer.html"):
+        (tmp_path / name).write_text(f"{name}\n", encoding="utf-8")
+    with gzip.open(tmp_path / "vm_linux_report_analyzer.html", "wt", encoding="utf-8") as f:
+        f.write("<html></html>")
+    configuration = dict(get_config(), s3=s3_endpoint)
+    assert glacier.upload_reports_to_s3(configuration, PY_VERSION, "vm_linux_report_analyzer.yaml",
+                                        "vm_linux_report_analyzer.html")
+    assert glacier.upload_reports_to_s3(configuration, PY_VERSION, "vm_linux_report_analyzer.yaml",
+                                        "vm_linux_report_analyzer.html")
+    client = S3Client.get_cached_client_s3(s3_endpoint, PY_VERSION)
+    keys = {item["Key"] for item in client.list_objects_v2(Bucket=s3_endpoint["bucket"])["Contents"]}
+    assert keys == {"vm_linux_report_analyzer.yaml", "vm_linux_report_analyzer.yaml.legacy",
+                    "vm_linux_report_analyzer.html"}
+    assert len(S3Client._clients) == 1
+    head = client.head_object(Bucket=s3_endpoint["bucket"], Key="vm_linux_report_analyzer.html")
+    assert head["ContentEncoding"] == "gzip" and head["ContentType"] == "text/html; charset=utf-8"
+
+
+def test_unchanged_files_are_skipped_by_manifest_and_remote_checksum(s3_endpoint, tmp_path):
+    client = S3Client.get_cached_client_s3(s3_endpoint, PY_VERSION)
+    bucket = s3_endpoint["bucket"]
+    report = tmp_path / "report.yaml"
+    report.write_text("flows: 1\n", encoding="utf-8")
+    manifest_path = str(tmp_path / "report.yaml.s3manifest")
+
+    def upload(verify_remote=True):
+        manifest = S3Client.UploadManifest(manifest_path)
+        return S3Client.upload_files_s3(client, bucket, [(str(report), "report.yaml")], manifest=manifest,
+                                        verify_remote=verify_remote)[str(report)]
+
+    assert upload() is True
+    head = client.head_object(Bucket=bucket, Key="report.yaml")
+    assert head["Metadata"]["sha256"] == S3Client.file_digests(str(report))[1]
+    assert upload() == "unchanged"
+
+    report.write_text("flows: 2\n", encoding="utf-8")
+    assert upload() is True
+    client.delete_object(Bucket=bucket, Key="report.yaml")
+    assert upload(verify_remote=False) == "unchanged"
+    assert upload() is True  # объект удален из S3: манифесту не доверяем
+
+    (tmp_path / "report.yaml.s3manifest").unlink()
+    assert upload() == "unchanged"  # содержимое узнано по метаданным объекта
+    entry = S3Client.UploadManifest(manifest_path).get(bucket, "report.yaml")
+    assert entry["sha256"] == S3Client.file_digests(str(report))[1] and entry["size"] == report.stat().st_size
+
+
+def test_spooled_reports_survive_endpoint_outage(s3_endpoint, tmp_path, monkeypatch):
+    import glacier
+
+    monkeypatch.chdir(tmp_path)
+    for name in ("vm_linux_report_analyzer.yaml", "vm_linux_report_analyzer.html"):
+        (tmp_path / name).write_text(f"{name}\n", encoding="utf-8")
+    # Закрытый порт: EndpointConnectionError при каждой попытке
+    configuration = dict(get_config(), s3=dict(s3_endpoint, url="http://127.0.0.1:9", max_attempts=1))
+    configuration["upload_spool"] = dict(configuration["upload_spool"], base_delay=0.1, max_delay=0.5)
+    spool = glacier.create_upload_spool(configuration, PY_VERSION, str(tmp_path / "spool"),
+                                        "vm_linux_report_analyzer.yaml.s3manifest")
+    assert glacier.upload_reports_at_end("vm_linux_report_analyzer.yaml", "vm_linux_report_analyzer.html",
+                                         configuration, PY_VERSION, spool=spool)
+    assert glacier.drain_spool(spool, timeout=1) is False
+    spool._thread.join(timeout=60)  # текущая попытка (повторы botocore) завершается после остановки
+    assert spool.stats["failed_attempts"] >= 1 and spool.stats["uploaded"] == 0
+
+    # Следующий запуск с доступным endpoint выгружает отчеты из очереди
+    configuration["s3"] = s3_endpoint
+    S3Client.reset_client_cache()
+    spool = glacier.create_upload_spool(configuration, PY_VERSION, str(tmp_path / "spool"),
+                                        "vm_linux_report_analyzer.yaml.s3manifest")
+    assert glacier.drain_spool(spool, timeout=10) is True
+    client = S3Client.get_cached_client_s3(s3_endpoint, PY_VERSION)
+    keys = {item["Key"] for item in client.list_objects_v2(Bucket=s3_endpoint["bucket"])["Contents"]}
+    assert keys == {"vm_linux_report_analyzer.yaml", "vm_linux_report_analyzer.html"}
+
+
+def test_partitioned_report_keys_listing_and_parallel_downloads(s3_endpoint, tmp_path, monkeypatch):
+    import glacier
+    from datetime import date, datetime
+
+    monkeypatch.chdir(tmp_path)
+    configuration = dict(get_config(), s3=s3_endpoint)
+    for name in ("vm_linux_report_analyzer.yaml", "vm_linux_report_analyzer.yaml.legacy",
+                 "vm_linux_report_analyzer.html"):
+        (tmp_path / name).write_text(f"{name}\n", encoding="utf-8")
+    runs = [S3Client.report_run("reports/", host, datetime(2026, 10, day, 8)) for host, day in
+            (("vm", 18), ("vm", 19), ("db.example.com", 19), ("vm", 19))]
+    for run in runs:
+        assert glacier.upload_reports_to_s3(configuration, PY_VERSION, "vm_linux_report_analyzer.yaml",
+                                            "vm_linux_report_analyzer.html", run)
+
+    client = S3Client.get_cached_client_s3(s3_endpoint, PY_VERSION)
+    bucket = s3_endpoint["bucket"]
+    assert S3Client.parse_report_key(f"reports/2026-10-19/vm/{runs[1]['run_id']}.yaml.legacy", "reports/") == {
+        "date": "2026-10-19", "hostname": "vm", "run_id": runs[1]["run_id"], "extension": "yaml.legacy"}
+    assert len(S3Client.read_from_s3(client, bucket, "reports/", page_size=2)) == 12
+    day = S3Client.list_reports(client, bucket, "reports/", date(2026, 10, 19), hostname="vm", page_size=2)
+    assert {item["run_id"] for item in day} == {runs[1]["run_id"], runs[3]["run_id"]} and len(day) == 6
+    assert {item["hostname"] for item in S3Client.list_reports(client, bucket, "reports", date(2026, 10, 18),
+                                                               date(2026, 10, 19))} == {"vm", "db.example.com"}
+
+    objects = [(item["Key"], str(tmp_path / "download" / item["Key"])) for item in day]
+    assert S3Client.download_files_s3(client, bucket, objects) == {key: True for key, _ in objects}
+    legacy = tmp_path / "download" / "reports" / "2026-10-19" / "vm" / f"{runs[3]['run_id']}.yaml.legacy"
+    assert legacy.read_text(encoding="utf-8") == "vm_linux_report_analyzer.yaml.legacy\n"
+    missing = S3Client.download_files_s3(client, bucket, [("reports/absent.yaml", str(tmp_path / "absent.yaml"))])
+    assert isinstance(missing["reports/absent.yaml"], Exception)
+
+
+def test_unchanged_report_of_previous_run_is_copied_not_uploaded(s3_endpoint, tmp_path, monkeypatch):
+    import glacier
+    from datetime import datetime
+
+    monkeypatch.chdir(tmp_path)
+    configuration = dict(get_config(), s3=s3_endpoint)
+    for name in ("vm_linux_report_analyzer.yaml", "vm_linux_report_analyzer.yaml.legacy"):
+        (tmp_path / name).write_text(f"{name}\n", encoding="utf-8")
+    with gzip.open(tmp_path / "vm_linux_report_analyzer.html", "wt", encoding="utf-8") as f:
+        f.write("<html></html>")
+    first, second = (S3Client.report_run("reports/", "vm", datetime(2026, 10, 19, hour)) for hour in (8, 9))
+    assert glacier.upload_reports_to_s3(configuration, PY_VERSION, "vm_linux_report_analyzer.yaml",
+                                        "vm_linux_report_analyzer.html", first)
+
+    # Следующий запуск: новые ключи, содержимое прежнее - копирование внутри бакета без выгрузки
+    uploads = []
+    upload_file_s3 = S3Client.upload_file_s3
+    monkeypatch.setattr(S3Client, "upload_file_s3", lambda *args, **kwargs: uploads.append(args[3]) or
+                        upload_file_s3(*args, **kwargs))
+    (tmp_path / "vm_linux_report_analyzer.yaml").write_text("changed\n", encoding="utf-8")
+    assert glacier.upload_reports_to_s3(configuration, PY_VERSION, "vm_linux_report_analyzer.yaml",
+                                        "vm_linux_report_analyzer.html", second)
+    assert uploads == [S3Client.report_key("reports/", "vm", second["run_id"], "yaml", second["date"])]
+
+    client = S3Client.get_cached_client_s3(s3_endpoint, PY_VERSION)
+    bucket = s3_endpoint["bucket"]
+    html_key = S3Client.report_key("reports/", "vm", second["run_id"], "html", second["date"])
+    head = client.head_object(Bucket=bucket, Key=html_key)
+    assert head["ContentEncoding"] == "gzip" and head["Metadata"]["sha256"]
+    legacy_key = S3Client.report_key("reports/", "vm", second["run_id"], "yaml.legacy", second["date"])
+    body = client.get_object(Bucket=bucket, Key=legacy_key)["Body"].read()
+    assert body == b"vm_linux_report_analyzer.yaml.legacy\n"
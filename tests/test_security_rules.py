@@ -0,0 +1,52 @@
+import ipaddress
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from security_rules import RuleSynthesizer, merge_port_ranges  # noqa: E402
+
+
+def test_pool_collapses_into_covering_cidrs_quickly():
+    random.seed(3)
+    synthesizer = RuleSynthesizer(max_prefix={"v4": 20}, max_cidrs_per_rule=8, max_over_permit_ratio=0.5)
+    observed = set()
+    for _ in range(10000):
+        address = f"52.216.{random.randint(0, 15)}.{random.randint(0, 255)}"
+        observed.add(address)
+        synthesizer.add_flow("outgoing", "TCP", "aws", address, 443)
+
+    started = time.perf_counter()
+    rules = synthesizer.synthesize()
+    assert time.perf_counter() - started < 1.0
+
+    assert len(rules) == 1
+    rule = rules[0]
+    assert len(rule["cidrs"]) <= 8
+    networks = [ipaddress.ip_network(cidr) for cidr in rule["cidrs"]]
+    assert all(net.prefixlen >= 20 for net in networks)
+    assert all(any(ipaddress.ip_address(a) in net for net in networks) for a in observed)
+    allowed = sum(net.num_addresses for net in networks)
+    assert rule["over_permit"] == allowed - len(observed)
+    assert rule["over_permit"] <= 0.5 * allowed
+
+
+def test_scattered_hosts_stay_exact_and_ports_merge():
+    synthesizer = RuleSynthesizer(max_prefix={"v4": 24}, max_cidrs_per_rule=2)
+    for port in list(range(8080, 8090)) + [9000]:
+        synthesizer.add_flow("outgoing", "TCP", "java", "10.0.0.5", port)
+    for address in ("198.51.100.7", "203.0.113.9", "192.0.2.1"):
+        synthesizer.add_flow("incoming", "TCP", "nginx", address, "443")
+    synthesizer.add_flow("outgoing", "UDP", "dns", "unknown", "*")
+
+    rules = {(r["direction"], r["process"]): r for r in synthesizer.synthesize()}
+    java = rules[("outgoing", "java")]
+    assert java["cidrs"] == ["10.0.0.5/32"]
+    assert java["port"] == "8080-8089,9000"
+    # Адреса в разных /24 не объединяются шире max_prefix, даже если правил больше лимита
+    assert len(rules[("incoming", "nginx")]["cidrs"]) == 3
+    assert rules[("outgoing", "dns")]["cidrs"] == ["unknown"]
+    assert merge_port_ranges([5, 3, 4, 10]) == [(3, 5), (10, 10)]
@@ -0,0 +1,62 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from self_monitor import AdaptiveThrottle, SelfMonitor  # noqa: E402
+
+BASE = {"collectors": {"reverse_dns": True, "lsof": True},
+        "flow_sampling": {"mode": "truncate", "interval": 100, "top_k": 50}}
+
+
+def usage(cpu, rss=50.0):
+    return {"cpu_percent": cpu, "rss_mb": rss}
+
+
+def test_throttle_escalates_one_step_per_breach_and_relaxes():
+    configuration = {"self_monitor": {"sample_interval": 10, "interval_factor": 3}}
+    throttle = AdaptiveThrottle(cpu_percent=5, recover_after=2)
+    decisions = [throttle.observe(usage(cpu), f"t{n}") for n, cpu in enumerate((9, 7, 6, 8, 9))]
+    assert [d["action"] for d in decisions[:4]] == ["reverse_dns", "lsof", "sampling", "interval"]
+    assert decisions[4] is None  # все ограничения уже включены
+    assert decisions[0]["reasons"] == ["cpu 9% > 5%"] and decisions[3]["active"] == list(throttle.active)
+
+    assert throttle.apply(configuration, BASE) == 3
+    assert configuration["collectors"] == {"reverse_dns": False, "lsof": False}
+    assert configuration["flow_sampling"]["mode"] == "sample" and configuration["flow_sampling"]["interval"] == 10
+    assert BASE["flow_sampling"]["mode"] == "truncate"
+
+    # Ниже бюджета, но выше половины - ограничения не снимаются
+    assert throttle.observe(usage(4)) is None and throttle.observe(usage(4)) is None
+    assert throttle.observe(usage(1)) is None
+    relaxed = throttle.observe(usage(1))
+    assert (relaxed["decision"], relaxed["action"]) == ("relax", "interval")
+    assert throttle.apply(configuration, BASE) == 1
+
+    restored = AdaptiveThrottle(cpu_percent=5)
+    restored.load(throttle.to_dict())
+    assert restored.active == ["reverse_dns", "lsof", "sampling"] and len(restored.decisions) == 5
+    unbudgeted = AdaptiveThrottle()
+    unbudgeted.load(throttle.to_dict())
+    assert unbudgeted.active == [] and unbudgeted.observe(usage(500)) is None
+
+    memory = AdaptiveThrottle(cpu_percent=50, rss_mb=100)
+    assert memory.observe(usage(1, rss=300))["action"] == "sampling"
+    with pytest.raises(ValueError):
+        AdaptiveThrottle(actions=["reboot"])
+
+
+def test_self_monitor_measures_own_cpu_and_memory():
+    monitor = SelfMonitor()
+    monitor.sample()
+    started = time.time()
+    while time.time() - started < 0.2:
+        sum(range(10000))
+    sample = monitor.sample()
+    assert sample["cpu_seconds"] > 0.05
+    assert 20 < sample["cpu_percent"] <= 150
+    assert sample["rss_mb"] > 1
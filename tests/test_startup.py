@@ -0,0 +1,25 @@
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "benchmarks"))
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from startup import check_budget, parse_importtime  # noqa: E402
+
+
+def test_version_stays_within_startup_budget():
+    entries = parse_importtime("import time: self [us] | cumulative | imported package\n"
+                               "import time:       120 |        120 |   _json\n"
+                               "import time:       300 |        420 | json\n")
+    assert entries == [("_json", 1, 0.00012), ("json", 0, 0.00042)]
+
+    measured, violations = check_budget("version")
+    assert violations == []
+    assert "analyzer_config" in measured["modules"] and "boto3" not in measured["modules"]
+
+
+def test_no_s3_run_does_not_load_s3_stack():
+    measured, violations = check_budget("no_s3_run", repeat=1)
+    assert violations == []
+    assert {"yaml", "psutil"} <= measured["modules"]
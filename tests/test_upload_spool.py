@@ -0,0 +1,73 @@
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from upload_spool import UploadSpool, backoff_delay  # noqa: E402
+
+
+def test_failed_upload_is_retried_with_backoff_and_survives_restart(tmp_path):
+    report = tmp_path / "report.yaml"
+    report.write_text("measurements: 1\n", encoding="utf-8")
+
+    def unreachable(files):
+        raise ConnectionError("Could not connect to the endpoint URL")
+
+    spool_dir = str(tmp_path / "spool")
+    first = UploadSpool(spool_dir, unreachable, base_delay=0.05, max_delay=0.2)
+    first.enqueue([(str(report), "report.yaml", "YAML report")])
+    # Снимок: следующее измерение перезаписывает отчет, в очереди остается поставленное содержимое
+    report.write_text("measurements: 2\n", encoding="utf-8")
+    assert first.run_once() is False and first.run_once() is None
+    (_, entry), = first._entries()
+    assert entry["attempts"] == 1 and entry["not_before"] > time.time()
+
+    uploaded = {}
+
+    def reachable(files):
+        uploaded.update({key: Path(path).read_text(encoding="utf-8") for path, key, _ in files})
+        return True
+
+    # Перезапуск: новый процесс подхватывает запись и выгружает ее фоновым потоком
+    second = UploadSpool(spool_dir, reachable, base_delay=0.05, max_delay=0.2).start()
+    assert second.close(timeout=5) is True
+    assert uploaded == {"report.yaml": "measurements: 1\n"} and second.pending() == 0
+
+    delays = [backoff_delay(attempts, 5, 60) for attempts in range(1, 8)]
+    assert 2.5 <= delays[0] <= 5 and 30 <= delays[-1] <= 60
+
+
+def test_enqueue_supersedes_pending_reports_and_bounds_the_spool(tmp_path):
+    spool = UploadSpool(str(tmp_path / "spool"), lambda files: False, max_entries=2, base_delay=60)
+    report = tmp_path / "report.yaml"
+    html = tmp_path / "report.html"
+    html.write_text("<html></html>", encoding="utf-8")
+
+    for measurement in range(5):
+        report.write_text(f"measurements: {measurement}\n", encoding="utf-8")
+        spool.enqueue([(str(report), "report.yaml", "YAML"), (str(html), "report.html", "HTML")], delay=60)
+    (name, entry), = spool._entries()
+    assert spool.stats["superseded"] == 4 and [item["key"] for item in entry["files"]] == ["report.yaml", "report.html"]
+    assert (tmp_path / "spool" / name / entry["files"][0]["file"]).read_text(encoding="utf-8") == "measurements: 4\n"
+
+    for key in ("a.yaml", "b.yaml", "c.yaml"):
+        (tmp_path / key).write_text(key, encoding="utf-8")
+        spool.enqueue([(str(tmp_path / key), key, key)])
+    assert [entry["files"][0]["key"] for _, entry in spool._entries()] == ["b.yaml", "c.yaml"]
+    assert spool.stats["dropped"] == 2
+    assert spool.enqueue([(str(tmp_path / "absent.yaml"), "absent.yaml", "absent")]) is None
+
+    # Запись, замененная во время неудачной выгрузки, не повторяется поверх новой
+    report.write_text("measurements: 5\n", encoding="utf-8")
+
+    def outage_during_enqueue(files):
+        spool.enqueue([(str(report), "report.yaml", "YAML"), (str(html), "report.html", "HTML")], delay=60)
+        return False
+
+    spool = UploadSpool(str(tmp_path / "spool-2"), outage_during_enqueue, base_delay=60)
+    first = spool.enqueue([(str(report), "report.yaml", "YAML")])
+    assert spool.run_once() is False
+    (name, entry), = spool._entries()
+    assert name != first and entry["attempts"] == 0 and spool.stats["superseded"] == 1
@@ -0,0 +1,97 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR / "src"))
+sys.path.insert(0, str(ROOT_DIR / "grafana" / "yaml-processor"))
+
+pytest.importorskip("psycopg2")
+import yaml_processor  # noqa: E402
+
+
+class RecordingConnection:
+    """Соединение PostgreSQL, записывающее команды: COPY потоки разбираются обратно в строки"""
+
+    def __init__(self, fail_on=None):
+        self.copies, self.statements, self.events = {}, [], []
+        self.fail_on = fail_on
+
+    def cursor(self):
+        return RecordingCursor(self)
+
+    def commit(self):
+        self.events.append("commit")
+
+    def rollback(self):
+        self.events.append("rollback")
+
+    def close(self):
+        self.events.append("close")
+
+
+class RecordingCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def copy_expert(self, sql, file, size=8192):
+        table = sql.split()[1]
+        if table == self.connection.fail_on:
+            raise RuntimeError(f"COPY {table} failed")
+        self.connection.copies[table] = [line.split("\t") for line in file.read().splitlines()]
+
+    def execute(self, sql, params=None):
+        self.connection.statements.append(sql.split()[2])
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    monkeypatch.setenv("YAML_WATCH_DIR", str(tmp_path / "watch"))
+    monkeypatch.setenv("PROCESSED_DIR", str(tmp_path / "processed"))
+    monkeypatch.delenv("S3_ENDPOINT_URL", raising=False)
+    return yaml_processor.YAMLProcessor()
+
+
+def write_report(path, flows):
+    lines = ["netflow_message:", "  flows:"]
+    for index, (port, process, *counters) in enumerate(flows):
+        packets, byte_count = counters or (3, 1200)
+        lines += ["  - source_address: 10.0.0.5", f"    destination_address: 52.1.1.{index % 200}",
+                  f"    source_port: {port}", "    destination_port: 443", "    protocol_name: TCP",
+                  f"    packet_count: {packets}", f"    byte_count: {byte_count}",
+                  f"    meta: {{process: \"{process}\", direction: outgoing}}"]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def test_report_is_copied_in_one_transaction(processor, tmp_path, monkeypatch):
+    connection = RecordingConnection()
+    requested = []
+    monkeypatch.setattr(processor, "connect_db", lambda autocommit=True: requested.append(autocommit) or connection)
+    report = tmp_path / "report.yaml"
+    write_report(report, [(40000 + i, "nginx") for i in range(500)] + [("bad", "nginx"), (41000, "tab\\there")]
+                 # Пустой счетчик считается нулем, нечисловой пропускает запись, а не весь отчёт
+                 + [(41001, "nginx", "null", 1200), (41002, "nginx", 3, "abc")])
+
+    assert processor.process_yaml_file(report, "web01")
+    assert requested == [False] and connection.events == ["commit", "close"]
+    rows = connection.copies["connections"]
+    assert len(rows) == 502 and rows[0][1] == "web01" and rows[0][4] == "40000"
+    assert rows[-1][8] == "0" and connection.copies["protocol_stats"][0][2:] == ["tcp", "502", "1503", "602400"]
+    assert rows[-2][11] == "tab\\there" and "\\N" not in rows[0]
+    assert {"protocol_stats", "top_destinations", "process_stats"} <= set(connection.copies)
+    assert connection.statements == ["system_metrics"]
+    assert yaml_processor.copy_value(None) == "\\N" and yaml_processor.copy_value("a\\b\n") == "a\\\\b\\n"
+
+
+def test_failed_copy_rolls_back_the_whole_report(processor, tmp_path, monkeypatch):
+    connection = RecordingConnection(fail_on="process_stats")
+    monkeypatch.setattr(processor, "connect_db", lambda autocommit=True: connection)
+    report = tmp_path / "report.yaml"
+    write_report(report, [(40000, "nginx")])
+
+    assert processor.process_yaml_file(report) is False
+    assert "connections" in connection.copies and connection.events == ["rollback", "close"]